@@ -0,0 +1,92 @@
+-- デスクトップ版（SQLite）と Supabase のデータ照合用のビューと関数
+-- python/supabase_reconcile.py が使う。ID の範囲ごとのハッシュだけを返し、
+-- 食い違う範囲の行だけを取り寄せて比較する
+--
+-- 行のハッシュは比較する列を chr(31) で連結した文字列の md5（NULL は空文字）。
+-- supabase_reconcile.py の canonical_text と同じ形にすること
+-- 総合判定は旧形式（良好/要注意/要修理/異常）を新形式（A/B/C）に揃えて比べる
+-- ビューは security_invoker にして、呼び出したユーザーの RLS をそのまま適用する
+
+-- プレス機（id はデスクトップ版の db_id）
+create or replace view reconcile_press_machines with (security_invoker = true) as
+select
+  id,
+  org_id,
+  machine_number,
+  equipment_number,
+  manufacturer,
+  model_type,
+  serial_number,
+  machine_type,
+  production_group,
+  tonnage,
+  md5(concat_ws(chr(31),
+    coalesce(machine_number, ''),
+    coalesce(equipment_number, ''),
+    coalesce(manufacturer, ''),
+    coalesce(model_type, ''),
+    coalesce(serial_number, ''),
+    coalesce(machine_type, ''),
+    coalesce(production_group::text, ''),
+    coalesce(tonnage::text, '')
+  )) as row_hash
+from press_machines;
+
+-- メンテナンス記録（id はデスクトップ版の maintenance_id、press_id は db_id。日時は日付単位で比べる）
+create or replace view reconcile_maintenance_records with (security_invoker = true) as
+select
+  id,
+  org_id,
+  press_id,
+  to_char(maintenance_date, 'YYYY-MM-DD') as maintenance_date,
+  judgment as overall_judgment,
+  clutch_valve_replacement,
+  brake_valve_replacement,
+  remarks,
+  md5(concat_ws(chr(31),
+    press_id::text,
+    coalesce(to_char(maintenance_date, 'YYYY-MM-DD'), ''),
+    coalesce(judgment, ''),
+    coalesce(clutch_valve_replacement, ''),
+    coalesce(brake_valve_replacement, ''),
+    coalesce(remarks, '')
+  )) as row_hash
+from (
+  select m.*,
+    case m.overall_judgment
+      when '良好' then 'A:良好'
+      when '要注意' then 'B:一部修理'
+      when '要修理' then 'C:至急修理を要す'
+      when '異常' then 'C:至急修理を要す'
+      else m.overall_judgment
+    end as judgment
+  from maintenance_records m
+) normalized;
+
+-- [p_lo, p_hi) を幅 p_step で区切った区間ごとの 件数・最小ID・最大ID・ハッシュ（ID順に連結した行ハッシュの md5）
+-- 行のない区間は返さない
+create or replace function reconcile_ranges(p_table text, p_org uuid, p_lo bigint, p_hi bigint, p_step bigint)
+returns table(bucket bigint, row_count bigint, min_id bigint, max_id bigint, digest text)
+language plpgsql stable as $$
+begin
+  if p_table not in ('press_machines', 'maintenance_records') then
+    raise exception 'reconcile_ranges: unsupported table %', p_table;
+  end if;
+  return query execute format(
+    'select (id - $2) / $4 as bucket, count(*), min(id), max(id), md5(string_agg(row_hash, '''' order by id))
+       from %I
+      where org_id = $1 and id >= $2 and id < $3
+      group by 1
+      order by 1',
+    'reconcile_' || p_table)
+  using p_org, p_lo, p_hi, p_step;
+end;
+$$;
+
+-- 照合でIDを指定して追加した後、id の採番を最大値の次に合わせる（fix_sequence.sql と同じ処理）
+create or replace function reconcile_fix_sequences()
+returns void
+language sql as $$
+  select setval(pg_get_serial_sequence('press_machines', 'id'), (select coalesce(max(id), 0) + 1 from press_machines), false);
+  select setval(pg_get_serial_sequence('maintenance_records', 'id'), (select coalesce(max(id), 0) + 1 from maintenance_records), false);
+$$;
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+メンテナンス記録・プレス機・テレメトリに対するアラートルールの差分評価
+宣言的に定義したルールを、change_log で検知した変更行とテレメトリのバッチだけで評価する
+（定期的な全件走査はしない）。ルールの状態は機械ごとに持ち、期限系のルールは期限順のヒープで管理する
+
+発生したアラートは alert_outbox テーブルに重複なく記録し、ファイル（JSON Lines）にも追記する
+
+使い方:
+  python alert_rules.py run --db press_machine.db --file alerts.jsonl
+  python alert_rules.py list --db press_machine.db
+  python telemetry.py serve --db press_machine.db --alerts alerts.jsonl
+"""
+import argparse
+import heapq
+import json
+import sys
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from shared_db import ChangeWatcher, connect, ensure_schema, write_transaction
+
+Rule = namedtuple('Rule', ['name', 'kind', 'params', 'message'])
+
+# kind ごとの params
+#   overdue:   days（最後のメンテナンスからの日数。記録がなければ登録日から）
+#   repeat:    any_of（(列, 値) のいずれかに一致する記録）, count, days（days 日以内に count 件以上）
+#   threshold: metric（テレメトリの項目）, limit_column（press_machines の上限値の列）
+RULES = (
+    Rule('inspection_overdue', 'overdue', {'days': 90},
+         "{machine_number}: {days}日以上メンテナンスが記録されていません（最終: {last}）"),
+    Rule('repeated_valve_replacement', 'repeat',
+         {'any_of': (('clutch_valve_replacement', '実施'), ('brake_valve_replacement', '実施')),
+          'count': 2, 'days': 30},
+         "{machine_number}: {days}日以内に電磁弁交換が{count}回あります"),
+    Rule('repeated_repair', 'repeat',
+         {'any_of': (('overall_judgment', '要修理'),), 'count': 2, 'days': 180},
+         "{machine_number}: {days}日以内に要修理の判定が{count}回あります"),
+    Rule('spm_over_max', 'threshold', {'metric': 'spm', 'limit_column': 'stroke_spm_max'},
+         "{machine_number}: SPM {value:.1f} が機種の最大SPM {limit:.1f} を超えています"),
+)
+
+# テレメトリイベントの列位置（telemetry.TELEMETRY_COLUMNS）
+TELEMETRY_POSITIONS = {'stroke_count': 2, 'spm': 3, 'cycle_time_ms': 4,
+                       'clutch_response_ms': 5, 'brake_response_ms': 6, 'stop_time_ms': 7}
+
+POLL_INTERVAL_SECONDS = 5.0
+
+
+def ensure_alert_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS alert_outbox (
+        alert_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        rule TEXT NOT NULL,
+        db_id INTEGER NOT NULL,
+        dedup_key TEXT NOT NULL UNIQUE,
+        message TEXT NOT NULL,
+        details TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        delivered_at DATETIME
+    )
+    """)
+
+
+def parse_datetime(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+class FileSink:
+    """アラートを1行1件のJSONで追記"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, alerts):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for alert in alerts:
+                f.write(json.dumps(alert, ensure_ascii=False) + '\n')
+
+
+def print_alerts(alerts):
+    for alert in alerts:
+        print(f"[{alert['rule']}] {alert['message']}")
+
+
+class AlertEngine:
+    """ルールの状態を機械ごとに保持し、変更行・テレメトリごとに該当機械のルールだけを評価する"""
+
+    def __init__(self, db_file, rules=RULES, sinks=()):
+        self.db_file = db_file
+        self.rules = rules
+        self.sinks = list(sinks)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # change_log とトリガー（アプリで一度も開いていない DB にはない）
+        ensure_schema(db_file)
+        with write_transaction(db_file) as conn:
+            ensure_alert_schema(conn)
+
+        # 起動後の変更を取りこぼさないよう、初回読み込みより先に監視を始める
+        # （読み込みと重複した変更は同じ行の上書きになるだけ）。poll は監視スレッドから self.lock の中で呼ぶ
+        self.watcher = ChangeWatcher(db_file, check_same_thread=False)
+
+        self.machines = {}        # db_id -> {'machine_number', 'created', 'limits'}
+        self.last_maintenance = {}  # db_id -> 最終メンテナンス日時
+        self.records = {}         # maintenance_id -> (db_id, 日時, 一致した repeat ルール名のタプル)
+        self.matches = {}         # (ルール名, db_id) -> {maintenance_id: 日時}
+        self.deadlines = []       # (期限, db_id) のヒープ。古くなった要素は取り出し時に捨てる
+        self.current_deadline = {}  # db_id -> 現在の期限
+        self.fired = set()        # outbox に記録済みの dedup_key（DBの UNIQUE 制約と二重に確認）
+        self.pending = set()      # 評価中（未記録）の dedup_key。同じ評価で重複して出さない
+        self.errors = 0           # 監視スレッドで評価に失敗した回数
+
+        self.repeat_columns = sorted({column for rule in rules if rule.kind == 'repeat'
+                                      for column, _ in rule.params['any_of']})
+        self.maintenance_select = ("SELECT " + ', '.join(['maintenance_id', 'db_id', 'maintenance_datetime']
+                                                         + self.repeat_columns) + " FROM maintenance_records")
+
+        self._load()
+
+    # ---- 状態の構築と更新 ----
+
+    def _limit_columns(self, conn):
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(press_machines)")}
+        return [rule.params['limit_column'] for rule in self.rules
+                if rule.kind == 'threshold' and rule.params['limit_column'] in columns]
+
+    def _load(self):
+        conn = connect(self.db_file)
+        try:
+            self.limit_columns = self._limit_columns(conn)
+            self.machine_select = ("SELECT " + ', '.join(['db_id', 'machine_number', 'created_at']
+                                                         + self.limit_columns) + " FROM press_machines")
+            for row in conn.execute(self.machine_select):
+                self._apply_machine(row)
+            for row in conn.execute(self.maintenance_select):
+                self._apply_maintenance(row)
+            self.fired = {key for (key,) in conn.execute("SELECT dedup_key FROM alert_outbox")}
+        finally:
+            conn.close()
+
+    def _apply_machine(self, row):
+        db_id = row[0]
+        self.machines[db_id] = {
+            'machine_number': row[1],
+            'created': parse_datetime(row[2]),
+            'limits': dict(zip(self.limit_columns, row[3:])),
+        }
+        self._schedule(db_id)
+
+    def _remove_machine(self, db_id):
+        self.machines.pop(db_id, None)
+        self.current_deadline.pop(db_id, None)
+
+    def _apply_maintenance(self, row):
+        maintenance_id, db_id, when = row[0], row[1], parse_datetime(row[2])
+        values = dict(zip(self.repeat_columns, row[3:]))
+        previous_db_id = self._remove_maintenance(maintenance_id, reschedule=False)
+        # 別の機械に付け替えられた記録は、元の機械の期限も計算し直す
+        if previous_db_id is not None and previous_db_id != db_id:
+            self._schedule(previous_db_id)
+
+        matched = []
+        for rule in self.rules:
+            if rule.kind != 'repeat' or when is None:
+                continue
+            if any(values.get(column) == value for column, value in rule.params['any_of']):
+                self.matches.setdefault((rule.name, db_id), {})[maintenance_id] = when
+                matched.append(rule.name)
+        self.records[maintenance_id] = (db_id, when, tuple(matched))
+
+        if when is not None and (self.last_maintenance.get(db_id) is None or when > self.last_maintenance[db_id]):
+            self.last_maintenance[db_id] = when
+        self._schedule(db_id)
+
+    def _remove_maintenance(self, maintenance_id, reschedule=True):
+        """記録を状態から除く -> 記録が付いていた機械の db_id（知らない記録は None）"""
+        record = self.records.pop(maintenance_id, None)
+        if record is None:
+            return None
+        db_id, when, matched = record
+        for name in matched:
+            self.matches.get((name, db_id), {}).pop(maintenance_id, None)
+
+        # 最終メンテナンスが消えた場合はその機械だけ再取得する
+        if when is not None and when == self.last_maintenance.get(db_id):
+            conn = connect(self.db_file)
+            try:
+                latest = conn.execute("SELECT MAX(maintenance_datetime) FROM maintenance_records WHERE db_id=?",
+                                      (db_id,)).fetchone()[0]
+            finally:
+                conn.close()
+            self.last_maintenance[db_id] = parse_datetime(latest)
+        if reschedule:
+            self._schedule(db_id)
+        return db_id
+
+    def _schedule(self, db_id):
+        """overdue ルールの期限をヒープに登録"""
+        machine = self.machines.get(db_id)
+        if machine is None:
+            return
+        base = self.last_maintenance.get(db_id) or machine['created']
+        if base is None:
+            return
+        for rule in self.rules:
+            if rule.kind == 'overdue':
+                deadline = base + timedelta(days=rule.params['days'])
+                if self.current_deadline.get(db_id) != deadline:
+                    self.current_deadline[db_id] = deadline
+                    heapq.heappush(self.deadlines, (deadline, db_id))
+
+    # ---- ルール評価 ----
+
+    def _alert(self, rule, db_id, episode, details, **fields):
+        dedup_key = f"{rule.name}:{db_id}:{episode}"
+        if dedup_key in self.fired or dedup_key in self.pending:
+            return None
+        self.pending.add(dedup_key)
+        machine = self.machines.get(db_id, {})
+        message = rule.message.format(machine_number=machine.get('machine_number', db_id), **rule.params, **fields)
+        return {'rule': rule.name, 'db_id': db_id, 'dedup_key': dedup_key, 'message': message,
+                'details': details, 'created_at': datetime.now().isoformat(timespec='seconds')}
+
+    def _check_repeat(self, db_id, maintenance_id):
+        alerts = []
+        record = self.records.get(maintenance_id)
+        if record is None:
+            return alerts
+        _, when, matched = record
+        for rule in self.rules:
+            if rule.name not in matched:
+                continue
+            window = timedelta(days=rule.params['days'])
+            # 機械1台分の一致記録だけを見るので台数が増えてもコストは変わらない
+            nearby = sorted(other_id for other_id, other in self.matches[(rule.name, db_id)].items()
+                            if abs(other - when) <= window)
+            if len(nearby) >= rule.params['count']:
+                alert = self._alert(rule, db_id, '-'.join(map(str, nearby)), {'maintenance_ids': nearby})
+                if alert:
+                    alerts.append(alert)
+        return alerts
+
+    def check_deadlines(self, now=None, popped=None):
+        """期限を過ぎた機械の overdue アラートを返す（ヒープの先頭だけを見る）
+
+        popped にリストを渡すと取り出した (期限, db_id) を追加する（記録に失敗したら戻せるように）
+        """
+        now = now or datetime.now()
+        alerts = []
+        overdue_rules = [rule for rule in self.rules if rule.kind == 'overdue']
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, db_id = heapq.heappop(self.deadlines)
+            if popped is not None:
+                popped.append((deadline, db_id))
+            if self.current_deadline.get(db_id) != deadline:
+                continue
+            last = self.last_maintenance.get(db_id)
+            for rule in overdue_rules:
+                alert = self._alert(rule, db_id, deadline.date().isoformat(),
+                                    {'deadline': deadline.isoformat(), 'last_maintenance': last and last.isoformat()},
+                                    last=last.strftime('%Y-%m-%d') if last else 'なし')
+                if alert:
+                    alerts.append(alert)
+        return alerts
+
+    def process_changes(self, changes):
+        """ChangeWatcher.poll() の差分を状態に反映し、発生したアラートを返す"""
+        alerts = []
+        conn = connect(self.db_file)
+        try:
+            for db_id, operation in changes.get('press_machines', {}).items():
+                if operation == 'DELETE':
+                    self._remove_machine(db_id)
+                    continue
+                row = conn.execute(f"{self.machine_select} WHERE db_id=?", (db_id,)).fetchone()
+                if row:
+                    self._apply_machine(row)
+
+            for maintenance_id, operation in changes.get('maintenance_records', {}).items():
+                if operation == 'DELETE':
+                    self._remove_maintenance(maintenance_id)
+                    continue
+                row = conn.execute(f"{self.maintenance_select} WHERE maintenance_id=?", (maintenance_id,)).fetchone()
+                if row:
+                    self._apply_maintenance(row)
+                    alerts.extend(self._check_repeat(row[1], maintenance_id))
+        finally:
+            conn.close()
+        return alerts
+
+    def process_telemetry(self, events):
+        """テレメトリのバッチに threshold ルールを適用（ingestor の listener）"""
+        alerts = []
+        today = datetime.now().date().isoformat()
+        with self.lock:
+            for rule in self.rules:
+                if rule.kind != 'threshold' or rule.params['limit_column'] not in self.limit_columns:
+                    continue
+                position = TELEMETRY_POSITIONS[rule.params['metric']]
+                limit_column = rule.params['limit_column']
+                worst = {}
+                for event in events:
+                    value = event[position]
+                    machine = self.machines.get(event[0])
+                    if value is None or machine is None:
+                        continue
+                    limit = machine['limits'].get(limit_column)
+                    if limit is not None and value > limit and value > worst.get(event[0], (0,))[0]:
+                        worst[event[0]] = (value, limit, event[1])
+                # 1台につき1日1件
+                for db_id, (value, limit, ts) in worst.items():
+                    alert = self._alert(rule, db_id, today, {'value': value, 'limit': limit, 'ts': ts},
+                                        value=value, limit=limit)
+                    if alert:
+                        alerts.append(alert)
+            try:
+                self.emit(alerts)
+            finally:
+                self.pending.clear()
+        return alerts
+
+    def poll(self, now=None):
+        """変更行と期限を評価してアラートを出力
+
+        出力までに失敗した場合は ChangeWatcher の読み取り位置と取り出した期限を元に戻し、
+        次の poll で同じ変更・期限をもう一度評価する（状態への反映は同じ行の上書きになるだけ）
+        """
+        with self.lock:
+            watermark = (self.watcher.last_seq, self.watcher.data_version, self.watcher.versions)
+            popped = []
+            try:
+                alerts = self.process_changes(self.watcher.poll()) + self.check_deadlines(now, popped)
+                self.emit(alerts)
+            except Exception:
+                self.watcher.last_seq, self.watcher.data_version, self.watcher.versions = watermark
+                for entry in popped:
+                    heapq.heappush(self.deadlines, entry)
+                raise
+            finally:
+                self.pending.clear()
+        return alerts
+
+    def emit(self, alerts):
+        """outbox に記録し、新規分だけをシンクに渡す（他のインスタンスが記録済みのものは除く）
+
+        dedup_key は記録がコミットされてから発生済みにする（失敗したアラートは次の評価で再度出る）
+        """
+        if not alerts:
+            return
+        stored = []
+        with write_transaction(self.db_file) as conn:
+            for alert in alerts:
+                cursor = conn.execute("""
+                INSERT OR IGNORE INTO alert_outbox (rule, db_id, dedup_key, message, details)
+                VALUES (?, ?, ?, ?, ?)
+                """, (alert['rule'], alert['db_id'], alert['dedup_key'], alert['message'],
+                      json.dumps(alert['details'], ensure_ascii=False)))
+                if cursor.rowcount:
+                    stored.append(alert)
+        self.fired.update(alert['dedup_key'] for alert in alerts)
+        for sink in self.sinks:
+            sink(stored)
+
+    # ---- 実行 ----
+
+    def attach(self, ingestor):
+        ingestor.listeners.append(self.process_telemetry)
+
+    def _try_poll(self):
+        """poll して、失敗は記録するだけにする（共有フォルダのロックなどでも監視は止めず、次の間隔で評価し直す）"""
+        try:
+            self.poll()
+        except Exception as e:
+            self.errors += 1
+            print(f"アラートの評価に失敗しました（次回再試行）: {e!r}", file=sys.stderr)
+
+    def _run(self, interval):
+        while not self.stop_event.wait(interval):
+            self._try_poll()
+
+    def start(self, interval=POLL_INTERVAL_SECONDS):
+        self._try_poll()
+        self.thread = threading.Thread(target=self._run, args=(interval,), name='alert-rules', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        self.watcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="アラートルールの評価")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help="変更を監視してアラートを出力")
+    run.add_argument('--db', default='press_machine.db')
+    run.add_argument('--file', default='alerts.jsonl', help="アラートを追記するファイル")
+    run.add_argument('--interval', type=float, default=POLL_INTERVAL_SECONDS)
+
+    list_parser = subparsers.add_parser('list', help="outbox のアラートを表示")
+    list_parser.add_argument('--db', default='press_machine.db')
+    list_parser.add_argument('--limit', type=int, default=50)
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        engine = AlertEngine(args.db, sinks=[FileSink(args.file), print_alerts])
+        print(f"アラート監視開始（{len(engine.machines)}台）")
+        engine.start(args.interval)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            engine.stop()
+    else:
+        conn = connect(args.db)
+        try:
+            ensure_alert_schema(conn)
+            rows = conn.execute("SELECT alert_id, created_at, rule, message FROM alert_outbox "
+                                "ORDER BY alert_id DESC LIMIT ?", (args.limit,)).fetchall()
+        finally:
+            conn.close()
+        for alert_id, created_at, rule, message in rows:
+            print(f"#{alert_id} {created_at} [{rule}] {message}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+クラッチ/ブレーキ応答時間・停止時間のストリーミング異常検知
+機械ごとのリングバッファ（NumPy配列）で移動平均・標準偏差を保持し、
+zスコア・EWMA・CUSUM で応答時間の悪化を検知したらメンテナンス記録の下書きを作成する
+
+1イベントあたりの処理は定数時間で、バッチ内のイベントは機械ごとに出現順に BLOCK 件ずつ、
+全機械分をまとめてベクトル演算（累積和・累積積）で更新する
+
+使い方:
+  python telemetry.py serve --db press_machine.db --rollup --detect
+  python anomaly_detector.py drafts --db press_machine.db
+  python anomaly_detector.py promote --db press_machine.db --draft 3
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+
+import numpy as np
+
+from shared_db import connect, write_transaction
+
+# 監視する指標（テレメトリイベントの列位置, 表示名）
+WATCHED_METRICS = {
+    'clutch_response_ms': (5, 'クラッチ応答時間'),
+    'brake_response_ms': (6, 'ブレーキ応答時間'),
+    'stop_time_ms': (7, '停止時間'),
+}
+
+WINDOW = 4096              # 基準値を求める直近サンプル数（ゆっくりした劣化にも追従しすぎない長さ）
+MIN_SAMPLES = 256          # 判定を始めるまでに必要なサンプル数
+MIN_STD_MS = 0.5           # 標準偏差の下限（ばらつきがほぼない機械での誤検知防止）
+Z_THRESHOLD = 6.0          # 単発の外れ値
+EWMA_LAMBDA = 0.05
+EWMA_THRESHOLD = 5.0       # EWMA の管理限界（σ単位）
+CUSUM_K = 0.5              # CUSUM の許容ずれ（σ単位）
+CUSUM_H = 25.0             # CUSUM の判定しきい値
+EWMA_LIMIT = EWMA_THRESHOLD * np.sqrt(EWMA_LAMBDA / (2 - EWMA_LAMBDA))
+BLOCK = 128                # 1機械あたりまとめて処理するイベント数（この間は基準値を固定）
+EVIDENCE_SAMPLES = 32      # 下書きに添付する直近の値の数
+
+
+def ensure_draft_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS maintenance_drafts (
+        draft_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        db_id INTEGER NOT NULL,
+        metric TEXT NOT NULL,
+        detector TEXT NOT NULL,
+        evidence TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'open',
+        maintenance_id INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_maintenance_drafts_status ON maintenance_drafts (status, db_id)")
+
+
+class ResponseTimeDetector:
+    """機械×指標ごとの移動統計と EWMA/CUSUM をまとめて保持する検知器"""
+
+    def __init__(self, db_file, capacity=128):
+        self.db_file = db_file
+        self.metrics = list(WATCHED_METRICS)
+        self.columns = [WATCHED_METRICS[metric][0] for metric in self.metrics]
+        self.slots = {}
+        self.machine_ids = []
+        self._allocate(capacity)
+
+        with write_transaction(db_file) as conn:
+            ensure_draft_schema(conn)
+            # 未処理の下書きがある機械×指標は重複して作らない
+            self.open_drafts = {
+                (db_id, metric)
+                for db_id, metric in conn.execute("SELECT db_id, metric FROM maintenance_drafts WHERE status='open'")
+            }
+
+    STATE_ARRAYS = ('buffer', 'position', 'count', 'written', 'sum', 'sum_sq', 'ewma', 'cusum')
+
+    def _allocate(self, capacity):
+        """状態配列を確保（機械数が増えたら倍の大きさで確保し直して既存分をコピー）"""
+        metrics = len(self.metrics)
+        old = {name: getattr(self, name) for name in self.STATE_ARRAYS if hasattr(self, name)}
+
+        self.capacity = capacity
+        self.buffer = np.zeros((capacity, metrics, WINDOW))
+        self.position = np.zeros((capacity, metrics), dtype=np.int64)
+        self.count = np.zeros((capacity, metrics), dtype=np.int64)
+        # 移動和を最後にバッファから計算し直してから書き込んだ数
+        self.written = np.zeros((capacity, metrics), dtype=np.int64)
+        self.sum = np.zeros((capacity, metrics))
+        self.sum_sq = np.zeros((capacity, metrics))
+        self.ewma = np.zeros((capacity, metrics))
+        self.cusum = np.zeros((capacity, metrics))
+
+        used = len(self.machine_ids)
+        for name, array in old.items():
+            getattr(self, name)[:used] = array[:used]
+
+    def _slot(self, db_id):
+        slot = self.slots.get(db_id)
+        if slot is None:
+            slot = len(self.machine_ids)
+            if slot >= self.capacity:
+                self._allocate(self.capacity * 2)
+            self.slots[db_id] = slot
+            self.machine_ids.append(db_id)
+        return slot
+
+    def process(self, events):
+        """テレメトリイベントのバッチを処理し、作成した下書きのリストを返す"""
+        if not events:
+            return []
+
+        slots = np.fromiter((self._slot(event[0]) for event in events), dtype=np.int64, count=len(events))
+        values = np.array([[event[column] for column in self.columns] for event in events], dtype=float)
+
+        # 機械ごとにイベントを出現順に並べ、先頭から BLOCK 件ずつ全機械分をまとめて処理する
+        order = np.argsort(slots, kind='stable')
+        sorted_slots = slots[order]
+        group_start = np.r_[0, np.flatnonzero(np.diff(sorted_slots)) + 1]
+        group_sizes = np.diff(np.r_[group_start, len(sorted_slots)])
+        group_slots = sorted_slots[group_start]
+
+        alarms = {}
+        largest = int(group_sizes.max())
+        for first in range(0, largest, BLOCK):
+            offsets = np.arange(min(BLOCK, largest - first))
+            active = np.flatnonzero(group_sizes > first)
+            sizes = group_sizes[active][:, None]
+            valid = first + offsets < sizes
+            event_index = order[group_start[active][:, None] + np.minimum(first + offsets, sizes - 1)]
+            block_values = np.where(valid[:, :, None], values[event_index], np.nan)
+            self._step(group_slots[active], block_values, valid, event_index, alarms)
+
+        # 丸め誤差が溜まらないよう、バッファを一周書き換えた機械×指標だけ移動和をバッファから再計算
+        stale = np.nonzero(self.written[:len(self.machine_ids)] >= WINDOW)
+        if stale[0].size:
+            self.sum[stale] = self.buffer[stale].sum(axis=-1)
+            self.sum_sq[stale] = (self.buffer[stale] ** 2).sum(axis=-1)
+            self.written[stale] = 0
+
+        return self._open_drafts(alarms, events)
+
+    def _step(self, slots, values, valid, event_index, alarms):
+        """機械ごとに最大 BLOCK 件のイベントで状態を更新（配列は 機械×イベント×指標、欠損と詰め物は NaN）
+
+        ブロック内の基準値（平均・標準偏差）はブロック開始時点のものを使う
+        """
+        missing = np.isnan(values)
+        values = np.where(missing, 0.0, values)
+
+        samples = np.minimum(self.count[slots], WINDOW)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.sum[slots] / samples
+            std = np.sqrt(np.maximum(self.sum_sq[slots] / samples - mean ** 2, MIN_STD_MS ** 2))
+        ready = (samples >= MIN_SAMPLES)[:, None, :] & ~missing
+        z = np.where(ready, (values - mean[:, None, :]) / std[:, None, :], 0.0)
+
+        # 応答時間の増加（悪化）方向だけを監視する。検知した時点で EWMA/CUSUM を 0 に戻すので、
+        # zスコアの検知（基準値だけで決まる）を戻す位置として計算し、EWMA/CUSUM の検知は
+        # 1件ずつ前から順に戻す位置に加えて計算し直す（回数は1機械×指標あたりの検知数）
+        triggered = ready & (z > Z_THRESHOLD)
+        while True:
+            ewma, cusum = self._detectors(slots, z, ready, triggered)
+            crossed = ready & ~triggered & ((ewma > EWMA_LIMIT) | (cusum > CUSUM_H))
+            if not crossed.any():
+                break
+            triggered |= crossed & (np.cumsum(crossed, axis=1) == 1)
+        self.ewma[slots] = np.where(triggered[:, -1], 0.0, ewma[:, -1])
+        self.cusum[slots] = np.where(triggered[:, -1], 0.0, cusum[:, -1])
+
+        # 機械×指標ごとに最初の検知を記録
+        first = triggered & (np.cumsum(triggered, axis=1) == 1)
+        for row, position, column in zip(*np.nonzero(first)):
+            key = (int(slots[row]), column)
+            if key in alarms:
+                continue
+            for detector, score, limit in (('zscore', z, Z_THRESHOLD), ('ewma', ewma, EWMA_LIMIT),
+                                           ('cusum', cusum, CUSUM_H)):
+                if score[row, position, column] > limit:
+                    break
+            alarms[key] = {
+                'detector': detector,
+                'event_index': int(event_index[row, position]),
+                'value': float(values[row, position, column]),
+                'baseline_mean': float(mean[row, column]),
+                'baseline_std': float(std[row, column]),
+                'z': float(z[row, position, column]),
+                'score': float(score[row, position, column]),
+            }
+
+        # リングバッファに追加。欠損値と検知したサンプルは、悪化後の値で基準値が汚れないよう平均で埋める
+        # （履歴がまだない機械×指標の欠損値は追加しない）
+        accepted = valid[:, :, None] & ~(missing & (samples == 0)[:, None, :])
+        new_values = np.where(missing | triggered, mean[:, None, :], values)
+        offset = np.cumsum(accepted, axis=1) - 1
+        write = (self.position[slots][:, None, :] + offset) % WINDOW
+        overwrite = self.count[slots][:, None, :] + offset >= WINDOW
+
+        rows, positions, columns = np.nonzero(accepted)
+        target = (slots[rows], columns, write[rows, positions, columns])
+        added = new_values[rows, positions, columns]
+        removed = np.where(overwrite[rows, positions, columns], self.buffer[target], 0.0)
+        self.buffer[target] = added
+        delta = np.zeros(accepted.shape)
+        delta_sq = np.zeros(accepted.shape)
+        delta[rows, positions, columns] = added - removed
+        delta_sq[rows, positions, columns] = added ** 2 - removed ** 2
+        self.sum[slots] += delta.sum(axis=1)
+        self.sum_sq[slots] += delta_sq.sum(axis=1)
+
+        added_count = accepted.sum(axis=1)
+        self.position[slots] = (self.position[slots] + added_count) % WINDOW
+        self.count[slots] += added_count
+        self.written[slots] += added_count
+
+    def _detectors(self, slots, z, ready, resets):
+        """ブロック内の EWMA と CUSUM（resets の位置で検知後に 0 に戻す）"""
+        positions = np.arange(z.shape[1])[None, :, None]
+        # 各位置の直前に戻した位置（なければ -1 でブロック開始時点の状態から続ける）
+        last_reset = np.maximum.accumulate(np.where(resets, positions, -1), axis=1)
+        previous = np.concatenate([np.full_like(last_reset[:, :1], -1), last_reset[:, :-1]], axis=1)
+        continued = previous < 0
+        before = np.maximum(previous, 0)
+
+        # EWMA: e_t = a_t e_{t-1} + b_t を累積積 P と累積和 Q で e_t = P_t (e_p + Q_t - Q_p) として求める
+        decay = np.where(ready, 1 - EWMA_LAMBDA, 1.0)
+        product = np.cumprod(decay, axis=1)
+        accumulated = np.cumsum(np.where(ready, EWMA_LAMBDA * z, 0.0) / product, axis=1)
+        accumulated_before = np.where(continued, 0.0, np.take_along_axis(accumulated, before, axis=1))
+        initial = np.where(continued, self.ewma[slots][:, None, :], 0.0)
+        ewma = product * (initial + accumulated - accumulated_before)
+
+        # CUSUM: c_t = max(0, c_{t-1} + d_t) は累積和 S で c_t = S_t - min(S_p - c_p, min_{p<j<=t} S_j)
+        totals = np.cumsum(np.where(ready, z - CUSUM_K, 0.0), axis=1)
+        # 区間ごとの累積最小値（区間が進むごとに大きく下げて、前の区間の値を引き継がないようにする）
+        segment = np.cumsum(resets, axis=1) - resets
+        spread = 2 * np.abs(totals).max() + 1
+        running_min = np.minimum.accumulate(totals - segment * spread, axis=1) + segment * spread
+        totals_before = np.where(continued, 0.0, np.take_along_axis(totals, before, axis=1))
+        initial = np.where(continued, self.cusum[slots][:, None, :], 0.0)
+        cusum = totals - np.minimum(totals_before - initial, running_min)
+        return ewma, cusum
+
+    def _open_drafts(self, alarms, events):
+        """検知内容を根拠として添付したメンテナンス記録の下書きを作成"""
+        drafts = []
+        for (slot, column), alarm in alarms.items():
+            db_id = self.machine_ids[slot]
+            metric = self.metrics[column]
+            if (db_id, metric) in self.open_drafts:
+                continue
+
+            # 直近の値（古い順）
+            position = self.position[slot, column]
+            stored = min(self.count[slot, column], WINDOW, EVIDENCE_SAMPLES)
+            recent = np.roll(self.buffer[slot, column], -position)[WINDOW - stored:]
+            event = events[alarm.pop('event_index')]
+            evidence = dict(alarm, metric=metric, ts=event[1], stroke_count=event[2],
+                            recent_values=[round(float(value), 2) for value in recent])
+            drafts.append((db_id, metric, alarm['detector'], json.dumps(evidence, ensure_ascii=False)))
+            self.open_drafts.add((db_id, metric))
+
+        if drafts:
+            with write_transaction(self.db_file) as conn:
+                conn.executemany("""
+                INSERT INTO maintenance_drafts (db_id, metric, detector, evidence) VALUES (?, ?, ?, ?)
+                """, drafts)
+        return drafts
+
+    def attach(self, ingestor):
+        """取り込みの書き込みごとに検知を実行"""
+        ingestor.listeners.append(self.process)
+
+
+def promote_draft(db_file, draft_id):
+    """下書きを総合判定「要注意」のメンテナンス記録として登録し、記録IDを返す"""
+    with write_transaction(db_file) as conn:
+        draft = conn.execute("""
+        SELECT db_id, metric, detector, evidence FROM maintenance_drafts WHERE draft_id=? AND status='open'
+        """, (draft_id,)).fetchone()
+        if draft is None:
+            raise ValueError(f"未処理の下書きが見つかりません: {draft_id}")
+
+        evidence = json.loads(draft['evidence'])
+        label = WATCHED_METRICS[draft['metric']][1]
+        remarks = (f"[自動検知] {label}の悪化を検知（{draft['detector']}）。"
+                   f"測定値 {evidence['value']:.1f}ms / 基準 {evidence['baseline_mean']:.1f}±"
+                   f"{evidence['baseline_std']:.1f}ms")
+        cursor = conn.execute("""
+        INSERT INTO maintenance_records
+        (db_id, maintenance_datetime, overall_judgment, clutch_valve_replacement, brake_valve_replacement, remarks)
+        VALUES (?, ?, '要注意', '未実施', '未実施', ?)
+        """, (draft['db_id'], datetime.fromtimestamp(evidence['ts']).strftime('%Y-%m-%d %H:%M'), remarks))
+        conn.execute("UPDATE maintenance_drafts SET status='promoted', maintenance_id=? WHERE draft_id=?",
+                     (cursor.lastrowid, draft_id))
+        return cursor.lastrowid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="応答時間の異常検知で作成された下書きの確認")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    drafts = subparsers.add_parser('drafts', help="未処理の下書きを表示")
+    drafts.add_argument('--db', default='press_machine.db')
+
+    promote = subparsers.add_parser('promote', help="下書きをメンテナンス記録として登録")
+    promote.add_argument('--db', default='press_machine.db')
+    promote.add_argument('--draft', type=int, required=True)
+
+    dismiss = subparsers.add_parser('dismiss', help="下書きを却下")
+    dismiss.add_argument('--db', default='press_machine.db')
+    dismiss.add_argument('--draft', type=int, required=True)
+
+    args = parser.parse_args()
+
+    if args.command == 'drafts':
+        conn = connect(args.db)
+        try:
+            ensure_draft_schema(conn)
+            rows = conn.execute("""
+            SELECT draft_id, db_id, metric, detector, evidence, created_at FROM maintenance_drafts
+            WHERE status='open' ORDER BY draft_id
+            """).fetchall()
+        finally:
+            conn.close()
+        print(f"=== 未処理の下書き: {len(rows)}件 ===")
+        for draft_id, db_id, metric, detector, evidence, created_at in rows:
+            evidence = json.loads(evidence)
+            print(f"  #{draft_id} 機械ID {db_id} {WATCHED_METRICS[metric][1]} ({detector}) "
+                  f"測定値 {evidence['value']:.1f}ms 基準 {evidence['baseline_mean']:.1f}ms  {created_at}")
+    elif args.command == 'promote':
+        maintenance_id = promote_draft(args.db, args.draft)
+        print(f"メンテナンス記録 {maintenance_id} を登録しました")
+    else:
+        with write_transaction(args.db) as conn:
+            conn.execute("UPDATE maintenance_drafts SET status='dismissed' WHERE draft_id=?", (args.draft,))
+        print(f"下書き {args.draft} を却下しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+プレス機・メンテナンス記録の変更履歴（監査用）
+トリガーで変更を audit_history に記録する。1件の履歴は行の1つの版で、変更された列の値だけを
+JSON で持ち、有効期間 [valid_from, valid_to) を付ける（valid_to が NULL なら現在の版）
+
+ある日時時点の状態は、(table_name, row_id, valid_to) のインデックスでその時点の版を特定し、
+その行の版だけを重ねて復元する（ログ全体の再生はしない）。時刻は created_at と同じく UTC
+
+使い方:
+  python audit_history.py as-of --db press_machine.db --table press_machines --id 3 --at "2026-10-01 12:00"
+  python audit_history.py history --db press_machine.db --table press_machines --id 3
+  python audit_history.py changes --db press_machine.db --from 2026-10-01 --to 2026-10-31
+"""
+import argparse
+import json
+
+from shared_db import TRACKED_TABLES, connect, write_transaction
+
+# 履歴に残さない列（版管理用・更新日時は valid_from で分かる）
+EXCLUDED_COLUMNS = {'row_version', 'updated_at'}
+
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def audit_triggers(conn, table, key):
+    """({トリガー名: CREATE TRIGGER 文}, 履歴に残す列)（現在の列構成から作る）"""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")
+               if row[1] not in EXCLUDED_COLUMNS]
+
+    def changed_json(row, only_changed):
+        parts = [f"SELECT '{column}' AS k, {row}.{column} AS v"
+                 + (f" WHERE NEW.{column} IS NOT OLD.{column}" if only_changed else "")
+                 for column in columns]
+        return f"(SELECT json_group_object(k, v) FROM ({' UNION ALL '.join(parts)}))"
+
+    close_current = f"""
+            UPDATE audit_history SET valid_to = {NOW}
+            WHERE table_name = '{table}' AND row_id = OLD.{key} AND valid_to IS NULL;
+        """
+
+    return {
+        f'{table}_audit_insert': f"""CREATE TRIGGER {table}_audit_insert AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO audit_history (table_name, row_id, operation, changes, valid_from)
+            VALUES ('{table}', NEW.{key}, 'INSERT', {changed_json('NEW', False)}, {NOW});
+        END""",
+        f'{table}_audit_update': f"""CREATE TRIGGER {table}_audit_update AFTER UPDATE ON {table}
+        WHEN {' OR '.join(f'NEW.{column} IS NOT OLD.{column}' for column in columns)}
+        BEGIN
+            {close_current}
+            INSERT INTO audit_history (table_name, row_id, operation, changes, valid_from)
+            VALUES ('{table}', NEW.{key}, 'UPDATE', {changed_json('NEW', True)}, {NOW});
+        END""",
+        f'{table}_audit_delete': f"""CREATE TRIGGER {table}_audit_delete AFTER DELETE ON {table}
+        BEGIN
+            {close_current}
+            INSERT INTO audit_history (table_name, row_id, operation, changes, valid_from)
+            VALUES ('{table}', OLD.{key}, 'DELETE', NULL, {NOW});
+        END""",
+    }, columns
+
+
+def outdated_audit_tables(conn):
+    """監査用トリガーが無い・列構成が変わって作り直しが必要なテーブルのリスト"""
+    existing = dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'"))
+    return [table for table, key in TRACKED_TABLES.items()
+            if any(existing.get(name) != sql for name, sql in audit_triggers(conn, table, key)[0].items())]
+
+
+def ensure_audit_schema(conn):
+    """履歴テーブルとトリガーを作成（トリガーは無いか列構成が変わったテーブルの分だけ作り直す）
+
+    conn は write_transaction で取得した接続を渡す
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS audit_history (
+        history_id INTEGER PRIMARY KEY,
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        operation TEXT NOT NULL,
+        changes TEXT,
+        valid_from TEXT NOT NULL,
+        valid_to TEXT
+    )
+    """)
+    # 時点指定の検索（行ごとに有効期間の終わりで引く）と期間指定の変更一覧
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_history_row ON audit_history (table_name, row_id, valid_to)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_history_valid_from ON audit_history (valid_from)")
+
+    for table in outdated_audit_tables(conn):
+        key = TRACKED_TABLES[table]
+        triggers, columns = audit_triggers(conn, table, key)
+        for name, sql in triggers.items():
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+            conn.execute(sql)
+
+        # 履歴導入前からある行は現在の状態を最初の版として登録する。それ以前の状態は分からないので、
+        # 有効期間は導入時点から（作成日時からにすると、編集前の時点でも編集後の値を返してしまう）
+        conn.execute(f"""
+        INSERT INTO audit_history (table_name, row_id, operation, changes, valid_from)
+        SELECT '{table}', t.{key}, 'INSERT',
+               json_object({', '.join(f"'{column}', t.{column}" for column in columns)}),
+               {NOW}
+        FROM {table} t
+        WHERE NOT EXISTS (SELECT 1 FROM audit_history h
+                          WHERE h.table_name = '{table}' AND h.row_id = t.{key})
+        """)
+
+
+def ensure_audit(db_file):
+    """履歴の準備（準備済みで列構成も変わっていなければ読み取りだけで終わり、書き込みロックを取らない）"""
+    conn = connect(db_file)
+    try:
+        ready = (conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'audit_history'").fetchone()
+                 is not None and not outdated_audit_tables(conn))
+    finally:
+        conn.close()
+    if ready:
+        return
+    with write_transaction(db_file) as conn:
+        ensure_audit_schema(conn)
+
+
+def row_as_of(conn, table, row_id, as_of):
+    """as_of（'YYYY-MM-DD HH:MM[:SS]'）時点の行を辞書で返す（存在しなければ None）"""
+    version = conn.execute("""
+    SELECT history_id, operation, valid_from FROM audit_history
+    WHERE table_name = ? AND row_id = ? AND (valid_to > ? OR valid_to IS NULL) AND valid_from <= ?
+    ORDER BY valid_to IS NULL, valid_to LIMIT 1
+    """, (table, row_id, as_of, as_of)).fetchone()
+    if version is None or version[1] == 'DELETE':
+        return None
+
+    # 直近の INSERT からその版までの差分を重ねる（同じ行の版だけを読む）
+    versions = conn.execute("""
+    SELECT operation, changes FROM audit_history
+    WHERE table_name = ? AND row_id = ? AND history_id <= ?
+    ORDER BY history_id
+    """, (table, row_id, version[0])).fetchall()
+    state = {}
+    for operation, changes in versions:
+        if operation == 'INSERT':
+            state = {}
+        if changes:
+            state.update(json.loads(changes))
+    return state
+
+
+def row_history(conn, table, row_id):
+    """行の全ての版（古い順）"""
+    return [
+        {'operation': operation, 'changes': json.loads(changes) if changes else None,
+         'valid_from': valid_from, 'valid_to': valid_to}
+        for operation, changes, valid_from, valid_to in conn.execute("""
+        SELECT operation, changes, valid_from, valid_to FROM audit_history
+        WHERE table_name = ? AND row_id = ? ORDER BY history_id
+        """, (table, row_id))
+    ]
+
+
+def changes_between(conn, start, end, table=None):
+    """期間 [start, end) の変更を古い順に返す"""
+    sql = """
+    SELECT table_name, row_id, operation, changes, valid_from FROM audit_history
+    WHERE valid_from >= ? AND valid_from < ?
+    """
+    params = [start, end]
+    if table:
+        sql += " AND table_name = ?"
+        params.append(table)
+    return [
+        {'table': table_name, 'row_id': row_id, 'operation': operation,
+         'changes': json.loads(changes) if changes else None, 'at': valid_from}
+        for table_name, row_id, operation, changes, valid_from in conn.execute(sql + " ORDER BY valid_from", params)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="変更履歴の参照")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    as_of = subparsers.add_parser('as-of', help="指定日時時点の行")
+    as_of.add_argument('--table', choices=list(TRACKED_TABLES), default='press_machines')
+    as_of.add_argument('--id', type=int, required=True)
+    as_of.add_argument('--at', required=True)
+
+    history = subparsers.add_parser('history', help="行の全ての版")
+    history.add_argument('--table', choices=list(TRACKED_TABLES), default='press_machines')
+    history.add_argument('--id', type=int, required=True)
+
+    changes = subparsers.add_parser('changes', help="期間内の変更一覧")
+    changes.add_argument('--from', dest='start', required=True)
+    changes.add_argument('--to', dest='end', required=True)
+    changes.add_argument('--table', choices=list(TRACKED_TABLES))
+
+    for subparser in (as_of, history, changes):
+        subparser.add_argument('--db', default='press_machine.db')
+    args = parser.parse_args()
+
+    ensure_audit(args.db)
+    conn = connect(args.db)
+    try:
+        if args.command == 'as-of':
+            result = row_as_of(conn, args.table, args.id, args.at)
+        elif args.command == 'history':
+            result = row_history(conn, args.table, args.id)
+        else:
+            result = changes_between(conn, args.start, args.end, args.table)
+    finally:
+        conn.close()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
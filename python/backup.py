@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+press_machine.db のオンラインバックアップとスナップショットからの復元
+SQLite のオンラインバックアップAPIで少しずつ（ページ単位で）コピーするため、アプリが書き込み中でも
+止めずに取得できる。コピーは gzip 圧縮し、SHA-256 とともにマニフェスト（.json）に記録する
+
+使い方:
+  python backup.py backup --db press_machine.db --dir backups --keep 14
+  python backup.py list --dir backups
+  python backup.py verify --dir backups
+  python backup.py restore --dir backups --at "2026-10-01 12:00" --output restored.db
+"""
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from shared_db import connect
+
+PAGES_PER_STEP = 256          # 1ステップでコピーするページ数（既定のページサイズで1MB）
+MAX_PAGES_PER_STEP = 4096     # 試し直すたびにステップを大きくする上限（ロックを握るのは1ステップの間だけ）
+STEP_PAUSE_SECONDS = 0.005    # ステップ間の待ち時間（書き込み側にロックを譲る）
+MAX_RESTARTS = 3              # 1回のコピーで書き込みによるやり直しを許す回数
+MAX_ROUNDS = 4                # やり直しが多すぎたときにコピー全体を試し直す回数
+ROUND_BACKOFF_SECONDS = 5.0   # 試し直す前の待ち時間（回ごとに倍）
+CHUNK_BYTES = 1024 * 1024
+DEFAULT_KEEP = 14
+TIMESTAMP_FORMAT = '%Y%m%d-%H%M%S'
+
+
+def default_backup_dir(db_file):
+    return os.path.join(os.path.dirname(os.path.abspath(db_file)), 'backups')
+
+
+def _manifest_path(snapshot_path):
+    return snapshot_path[:-len('.db.gz')] + '.json'
+
+
+def list_snapshots(backup_dir):
+    """マニフェストのリスト（古い順）"""
+    manifests = []
+    for path in glob.glob(os.path.join(backup_dir, '*.json')):
+        try:
+            with open(path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            continue
+        manifest['path'] = os.path.join(backup_dir, manifest['file'])
+        manifests.append(manifest)
+    return sorted(manifests, key=lambda manifest: manifest['created_at'])
+
+
+def find_snapshot(backup_dir, at=None):
+    """at（datetime）時点で最新のスナップショット。at が None なら最新"""
+    candidates = [manifest for manifest in list_snapshots(backup_dir)
+                  if at is None or datetime.fromisoformat(manifest['created_at']) <= at]
+    if not candidates:
+        raise FileNotFoundError(f"該当するスナップショットがありません: {backup_dir}")
+    return candidates[-1]
+
+
+class BackupBusyError(Exception):
+    """書き込みが途切れず、ロックを長く握らずにはコピーできなかった"""
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _copy_online(db_file, target, progress=None, pages=PAGES_PER_STEP, pause=STEP_PAUSE_SECONDS,
+                 max_restarts=MAX_RESTARTS, rounds=MAX_ROUNDS, backoff=ROUND_BACKOFF_SECONDS):
+    """オンラインバックアップAPIで target にコピーし、ページ数を返す
+
+    ロックはステップ中しか保持しないので、その間も他の接続は書き込める。ただしステップの合間に
+    他の接続が書き込むと SQLite はコピーを最初からやり直すため、max_restarts 回やり直したら
+    いったん止めて待ち、ステップを大きくして（MAX_PAGES_PER_STEP まで）最初から試し直す。
+    rounds 回試してもコピーできなければ BackupBusyError（読み取りロックを取ったままの一括コピーはしない）
+    """
+    source = connect(db_file)
+    try:
+        for attempt in range(rounds):
+            last_remaining = None
+            restarts = 0
+
+            def on_step(status, remaining, total):
+                nonlocal last_remaining, restarts
+                if last_remaining is not None and remaining > last_remaining:
+                    restarts += 1
+                    if restarts > max_restarts:
+                        raise _TooManyRestarts()
+                last_remaining = remaining
+                if progress:
+                    progress(total - remaining, total)
+                if pause:
+                    time.sleep(pause)
+
+            destination = sqlite3.connect(target)
+            try:
+                source.backup(destination, pages=min(pages << attempt, MAX_PAGES_PER_STEP), progress=on_step)
+                break
+            except _TooManyRestarts:
+                destination.close()
+                if attempt == rounds - 1:
+                    raise BackupBusyError("書き込みが続いているためバックアップを中止しました。"
+                                          "時間をおいて再実行してください")
+                time.sleep(backoff * 2 ** attempt)
+        try:
+            result = destination.execute("PRAGMA quick_check").fetchone()[0]
+            if result != 'ok':
+                raise RuntimeError(f"バックアップの整合性チェックに失敗しました: {result}")
+            return destination.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            destination.close()
+    finally:
+        source.close()
+
+
+def _compress(source_path, target_path):
+    """gzip 圧縮しながら元データの SHA-256 を計算"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(source_path, 'rb') as src, gzip.open(target_path, 'wb', compresslevel=6) as dst:
+        while True:
+            chunk = src.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+            dst.write(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _decompress(snapshot_path, target_path=None):
+    """展開しながら SHA-256 を計算（target_path が None なら検証のみ）"""
+    digest = hashlib.sha256()
+    dst = open(target_path, 'wb') if target_path else None
+    try:
+        with gzip.open(snapshot_path, 'rb') as src:
+            while True:
+                chunk = src.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                if dst:
+                    dst.write(chunk)
+    finally:
+        if dst:
+            dst.close()
+    return digest.hexdigest()
+
+
+def create_snapshot(db_file, backup_dir=None, keep=DEFAULT_KEEP, progress=None):
+    """スナップショットを作成して古いものを削除し、マニフェストを返す"""
+    backup_dir = backup_dir or default_backup_dir(db_file)
+    os.makedirs(backup_dir, exist_ok=True)
+
+    created_at = datetime.now()
+    stem = os.path.splitext(os.path.basename(db_file))[0]
+    name = f"{stem}-{created_at.strftime(TIMESTAMP_FORMAT)}"
+    snapshot_path = os.path.join(backup_dir, name + '.db.gz')
+
+    # 作業用のコピーと圧縮途中のファイルは完成するまで別名にしておく
+    fd, work_path = tempfile.mkstemp(suffix='.db', dir=backup_dir)
+    os.close(fd)
+    partial_path = snapshot_path + '.partial'
+    try:
+        started = time.perf_counter()
+        page_count = _copy_online(db_file, work_path, progress)
+        sha256, size = _compress(work_path, partial_path)
+        os.replace(partial_path, snapshot_path)
+    finally:
+        for path in (work_path, partial_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    manifest = {
+        'file': os.path.basename(snapshot_path),
+        'source': os.path.abspath(db_file),
+        'created_at': created_at.isoformat(timespec='seconds'),
+        'size': size,
+        'compressed_size': os.path.getsize(snapshot_path),
+        'page_count': page_count,
+        'sha256': sha256,
+        'elapsed_seconds': round(time.perf_counter() - started, 2),
+    }
+    with open(_manifest_path(snapshot_path), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    rotate(backup_dir, keep)
+    manifest['path'] = snapshot_path
+    return manifest
+
+
+def rotate(backup_dir, keep=DEFAULT_KEEP):
+    """新しい順に keep 個を残して削除"""
+    snapshots = list_snapshots(backup_dir)
+    for manifest in snapshots[:max(0, len(snapshots) - keep)]:
+        for path in (manifest['path'], _manifest_path(manifest['path'])):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def verify_snapshot(manifest, integrity=True):
+    """チェックサムを照合し、integrity=True なら作業ファイルに展開して integrity_check も行う"""
+    fd, scratch = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        if not integrity:
+            return _decompress(manifest['path']) == manifest['sha256']
+        return restore_snapshot(manifest, scratch) is not None
+    except (ValueError, OSError, EOFError, zlib.error):
+        # チェックサム不一致・整合性エラー・圧縮データの破損や欠損
+        return False
+    finally:
+        os.remove(scratch)
+
+
+def restore_snapshot(manifest, target):
+    """スナップショットを target に展開して検証する（運用中のDBには書き込まない）"""
+    if os.path.exists(target) and os.path.exists(manifest['source']) and os.path.samefile(target, manifest['source']):
+        raise ValueError("運用中のデータベースには直接復元できません。別のファイルに復元してください")
+
+    sha256 = _decompress(manifest['path'], target)
+    if sha256 != manifest['sha256']:
+        raise ValueError(f"チェックサムが一致しません: {manifest['file']}")
+
+    conn = sqlite3.connect(target)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != 'ok':
+        raise ValueError(f"整合性チェックに失敗しました: {result}")
+    return target
+
+
+class BackupService:
+    """バックアップをバックグラウンドスレッドで実行（画面側は完了を after で確認する）"""
+
+    def __init__(self, db_file, backup_dir=None, keep=DEFAULT_KEEP):
+        self.db_file = db_file
+        self.backup_dir = backup_dir or default_backup_dir(db_file)
+        self.keep = keep
+        self.thread = None
+        self.copied_pages = 0
+        self.total_pages = 0
+        self.result = None
+        self.error = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _progress(self, copied, total):
+        self.copied_pages = copied
+        self.total_pages = total
+
+    def _run(self):
+        try:
+            self.result = create_snapshot(self.db_file, self.backup_dir, self.keep, self._progress)
+        except Exception as e:
+            self.error = e
+
+    def start(self):
+        if self.running:
+            return False
+        self.result = None
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='backup', daemon=True)
+        self.thread.start()
+        return True
+
+
+def _print_manifest(manifest):
+    print(f"  {manifest['created_at']}  {manifest['file']}  "
+          f"{manifest['size'] / 1024 / 1024:.1f}MB -> {manifest['compressed_size'] / 1024 / 1024:.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="データベースのオンラインバックアップと復元")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backup = subparsers.add_parser('backup', help="スナップショットを作成")
+    backup.add_argument('--db', default='press_machine.db')
+    backup.add_argument('--dir', help="保存先（既定はDBと同じ場所の backups）")
+    backup.add_argument('--keep', type=int, default=DEFAULT_KEEP, help="残すスナップショット数")
+
+    list_parser = subparsers.add_parser('list', help="スナップショットの一覧")
+    list_parser.add_argument('--dir', default='backups')
+
+    verify = subparsers.add_parser('verify', help="スナップショットを検証")
+    verify.add_argument('--dir', default='backups')
+    verify.add_argument('--all', action='store_true', help="最新だけでなく全件を検証")
+    verify.add_argument('--checksum-only', action='store_true', help="integrity_check を省略")
+
+    restore = subparsers.add_parser('restore', help="スナップショットを別ファイルに復元")
+    restore.add_argument('--dir', default='backups')
+    restore.add_argument('--at', help="この日時以前で最新のスナップショットを使う（例: 2026-10-01 12:00）")
+    restore.add_argument('--output', required=True)
+
+    args = parser.parse_args()
+
+    if args.command == 'backup':
+        def progress(copied, total):
+            print(f"\r{copied:,} / {total:,}ページ", end='', flush=True)
+        try:
+            manifest = create_snapshot(args.db, args.dir, args.keep, progress)
+        except BackupBusyError as e:
+            print(f"\n{e}")
+            raise SystemExit(1)
+        print(f"\nバックアップを作成しました（{manifest['elapsed_seconds']}秒）")
+        _print_manifest(manifest)
+    elif args.command == 'list':
+        for manifest in list_snapshots(args.dir):
+            _print_manifest(manifest)
+    elif args.command == 'verify':
+        snapshots = list_snapshots(args.dir) if args.all else [find_snapshot(args.dir)]
+        failed = 0
+        for manifest in snapshots:
+            ok = verify_snapshot(manifest, integrity=not args.checksum_only)
+            failed += not ok
+            print(f"  {'OK ' if ok else 'NG '} {manifest['file']}")
+        raise SystemExit(1 if failed else 0)
+    else:
+        manifest = find_snapshot(args.dir, datetime.fromisoformat(args.at) if args.at else None)
+        restore_snapshot(manifest, args.output)
+        print(f"{manifest['file']}（{manifest['created_at']}）を {args.output} に復元しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,8 @@ import os
 import json
 from supabase import create_client, Client
 
+from data_quality import QualityScanner
+
 def check_detailed_data():
     # 環境変数からSupabaseの設定を取得
     url = os.environ.get('SUPABASE_URL')
@@ -27,6 +29,10 @@ def check_detailed_data():
         if response.data:
             print(f"=== プレス機データ一覧 ({len(response.data)}件) ===")
             
+            # 入力数と矛盾・重複は全件まとめて評価する
+            scanner = QualityScanner.from_records(response.data)
+            scorecards = {card[0]: card for card in scanner.machine_scorecards()}
+            
             for machine in response.data:
                 print(f"\n--- 機械ID: {machine.get('id')}, 機械番号: {machine.get('machine_number')} ---")
                 
@@ -54,21 +60,17 @@ def check_detailed_data():
                 print(f"  スライド調整(mm): {machine.get('slide_adjust_mm') or '未設定'}")
                 print(f"  スライド寸法 LR×FB: {machine.get('slide_size_lr_mm')}×{machine.get('slide_size_fb_mm')}")
                 
-                # 詳細項目のうち、データが入っているもの数をカウント
-                detailed_fields = [
-                    'capacity_kn', 'capacity_ton', 'stroke_spm_min', 'stroke_spm_max',
-                    'stroke_length_mm', 'die_height_mm', 'slide_adjust_mm', 
-                    'slide_size_lr_mm', 'slide_size_fb_mm', 'bolster_size_lr_mm',
-                    'bolster_size_fb_mm', 'bolster_thickness_mm', 'max_down_speed_mm_s',
-                    'stop_time_emergency_ms', 'inertia_drop_mm', 'motor_power_kw',
-                    'air_pressure_mpa', 'ambient_temp_min_c', 'ambient_temp_max_c'
-                ]
-                
-                filled_count = sum(1 for field in detailed_fields if machine.get(field) is not None)
-                print(f"【詳細項目】{filled_count}/{len(detailed_fields)}項目に値が設定済み")
+                _, _, filled_count, field_count, issues = scorecards[machine.get('id')]
+                print(f"【詳細項目】{filled_count}/{field_count}項目に値が設定済み")
+                for issue in issues:
+                    print(f"【要確認】{issue}")
                 
                 if machine.get('notes'):
                     print(f"【メモ】{machine.get('notes')}")
+            
+            print(f"\n=== 項目別の入力状況 ({len(scanner)}台) ===")
+            for field, label, filled, out_of_range, cross in scanner.field_scorecards():
+                print(f"  {label}: {filled}台入力済み, 範囲外 {out_of_range}台, 項目間の不一致 {cross}台")
                 
         else:
             print("プレス機データが見つかりませんでした")
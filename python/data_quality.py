@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+"""
+プレス機の仕様データの品質チェック
+仕様の数値を NumPy の配列（機械×項目、未入力は NaN）に読み込み、次のルールを項目単位のベクトル演算で評価する
+- 入力    : 詳細仕様の各項目が入力されているか
+- 範囲    : 明らかな入力ミス（負の値や、単位・桁の取り違えと思われる値）
+- 項目間  : kN と ton の換算、最小 spm ≦ 最大 spm、使用温度の最小 ≦ 最大 など
+- 重複    : 同じメーカーの製造番号、機械番号（全角/半角・大文字/小文字・空白の違いは同じとみなす）
+
+結果は機械ごと・項目ごとのスコアカードで出力する。評価した配列をローカルに保存しておき、
+次回は change_log で変更されたプレス機だけを読み直して評価し直す（重複は変わったキーの行だけ）
+
+使い方:
+  python data_quality.py --db press_machine.db
+  python data_quality.py --db press_machine.db --machines --format json --output quality.json
+  python data_quality.py --db press_machine.db --full   # 保存した結果を使わずに全件を評価
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import unicodedata
+from collections import Counter, namedtuple
+
+import numpy as np
+
+from shared_db import connect, current_seq, fetch_by_ids, local_data_dir
+
+# 入力率を数える詳細仕様（add_detailed_specifications.sql のカラム）
+DETAILED_FIELDS = {
+    'capacity_kn': '圧力能力(kN)',
+    'capacity_ton': '圧力能力(ton)',
+    'stroke_spm_min': '最小spm',
+    'stroke_spm_max': '最大spm',
+    'stroke_length_mm': 'ストローク長(mm)',
+    'die_height_mm': 'ダイハイト(mm)',
+    'slide_adjust_mm': 'スライド調整量(mm)',
+    'slide_size_lr_mm': 'スライド寸法 左右(mm)',
+    'slide_size_fb_mm': 'スライド寸法 前後(mm)',
+    'bolster_size_lr_mm': 'ボルスタ寸法 左右(mm)',
+    'bolster_size_fb_mm': 'ボルスタ寸法 前後(mm)',
+    'bolster_thickness_mm': 'ボルスタ厚み(mm)',
+    'max_down_speed_mm_s': '最大下降速度(mm/s)',
+    'stop_time_emergency_ms': '急停止時間(ms)',
+    'inertia_drop_mm': '慣性下降(mm)',
+    'motor_power_kw': 'モーター出力(kW)',
+    'air_pressure_mpa': 'エア圧力(MPa)',
+    'ambient_temp_min_c': '使用環境温度 最小(℃)',
+    'ambient_temp_max_c': '使用環境温度 最大(℃)',
+}
+
+# 項目間のルールだけに使う項目
+RULE_FIELDS = {
+    'air_pressure_kgf_cm2': 'エア圧力(kgf/cm²)',
+    'overrun_angle_min_deg': 'オーバーラン監視角度 最小(度)',
+    'overrun_angle_max_deg': 'オーバーラン監視角度 最大(度)',
+}
+
+FIELD_LABELS = {**DETAILED_FIELDS, **RULE_FIELDS}
+FIELDS = tuple(FIELD_LABELS)
+
+# これを外れる値は入力ミスとみなす範囲（下限, 上限）
+RANGES = {
+    'capacity_kn': (1, 50000),
+    'capacity_ton': (0.1, 5000),
+    'stroke_spm_min': (1, 2000),
+    'stroke_spm_max': (1, 2000),
+    'stroke_length_mm': (1, 2000),
+    'die_height_mm': (1, 3000),
+    'slide_adjust_mm': (0, 1000),
+    'slide_size_lr_mm': (1, 10000),
+    'slide_size_fb_mm': (1, 10000),
+    'bolster_size_lr_mm': (1, 10000),
+    'bolster_size_fb_mm': (1, 10000),
+    'bolster_thickness_mm': (1, 1000),
+    'max_down_speed_mm_s': (1, 3000),
+    'stop_time_emergency_ms': (1, 2000),
+    'inertia_drop_mm': (0, 500),
+    'motor_power_kw': (0.1, 2000),
+    'air_pressure_mpa': (0.05, 2),
+    'air_pressure_kgf_cm2': (0.5, 20),
+    'ambient_temp_min_c': (-40, 60),
+    'ambient_temp_max_c': (-40, 60),
+    'overrun_angle_min_deg': (0, 360),
+    'overrun_angle_max_deg': (0, 360),
+}
+
+KN_PER_TON = 9.80665
+KGF_CM2_PER_MPA = 10.19716
+CONVERSION_TOLERANCE = 0.05   # 単位換算の一致を許す誤差（大きい方の値に対する割合）
+
+
+def _conversion_mismatch(factor):
+    def violated(base, converted):
+        expected = base * factor
+        return np.abs(converted - expected) > CONVERSION_TOLERANCE * np.maximum(np.abs(converted), np.abs(expected))
+    return violated
+
+
+# 項目間のルール。violated は項目の列（NaN を含む配列）を受け取り、違反の行を True で返す
+# （NaN との比較は False になるので、どちらかが未入力の行は違反にならない）
+CrossRule = namedtuple('CrossRule', 'name label fields violated')
+
+CROSS_RULES = (
+    CrossRule('capacity_unit', "圧力能力の kN と ton が一致しない", ('capacity_ton', 'capacity_kn'),
+              _conversion_mismatch(KN_PER_TON)),
+    CrossRule('spm_order', "最小spm が最大spm より大きい", ('stroke_spm_min', 'stroke_spm_max'), np.greater),
+    CrossRule('ambient_order', "使用環境温度の最小が最大より高い", ('ambient_temp_min_c', 'ambient_temp_max_c'),
+              np.greater),
+    CrossRule('slide_bolster_lr', "スライド左右がボルスタ左右より大きい", ('slide_size_lr_mm', 'bolster_size_lr_mm'),
+              np.greater),
+    CrossRule('slide_bolster_fb', "スライド前後がボルスタ前後より大きい", ('slide_size_fb_mm', 'bolster_size_fb_mm'),
+              np.greater),
+    CrossRule('air_pressure_unit', "エア圧力の MPa と kgf/cm² が一致しない", ('air_pressure_mpa', 'air_pressure_kgf_cm2'),
+              _conversion_mismatch(KGF_CM2_PER_MPA)),
+    CrossRule('overrun_order', "オーバーラン監視角度の最小が最大より大きい",
+              ('overrun_angle_min_deg', 'overrun_angle_max_deg'), np.greater),
+)
+
+# 重複してはいけないキー（製造番号はメーカーごとに振られるのでメーカーと組にする）
+UNIQUE_KEYS = {
+    'serial': "製造番号",
+    'machine_number': "機械番号",
+}
+
+
+def normalize_key(*parts):
+    """重複判定用のキー（NFKC で全角/半角を揃え、大文字・空白を無視。空なら ''）"""
+    texts = [unicodedata.normalize('NFKC', str(part)).upper().replace(' ', '') if part is not None else ''
+             for part in parts]
+    return '|'.join(texts) if texts[-1] else ''
+
+
+def state_path(db_file):
+    """DB ごとの評価結果の保存先（利用者のローカル）"""
+    key = hashlib.sha1(os.path.abspath(db_file).encode('utf-8')).hexdigest()[:16]
+    return local_data_dir(f'quality_{key}.npz')
+
+
+class QualityScanner:
+    """仕様の配列と評価結果（行は機械。削除された機械の行は alive=False のまま残す）"""
+
+    def __init__(self, present=FIELDS):
+        # present: 読み込み元にある項目（ない項目は入力率の対象外）
+        self.present = [field for field in FIELDS if field in present]
+        self.column = {field: i for i, field in enumerate(FIELDS)}
+        self.detailed = np.array([self.column[field] for field in DETAILED_FIELDS if field in self.present], dtype=np.intp)
+        self.low = np.array([RANGES[field][0] for field in FIELDS])
+        self.high = np.array([RANGES[field][1] for field in FIELDS])
+        self.rules = [rule for rule in CROSS_RULES if all(field in self.present for field in rule.fields)]
+
+        self.ids = np.empty(0, dtype=np.int64)
+        self.labels = np.empty(0, dtype=object)
+        self.values = np.empty((0, len(FIELDS)))
+        self.keys = {name: np.empty(0, dtype=object) for name in UNIQUE_KEYS}
+        self.raw_keys = {name: np.empty(0, dtype=object) for name in UNIQUE_KEYS}
+        self.alive = np.empty(0, dtype=bool)
+        self.position = {}
+        self.key_counts = {name: Counter() for name in UNIQUE_KEYS}
+        # 次の evaluate で重複を判定し直すキー（変更前と変更後の値）
+        self.touched_keys = {name: set() for name in UNIQUE_KEYS}
+        # change_log の読み込み済みの位置（DB から読んだ場合）
+        self.seq = None
+
+        self.filled = np.empty((0, len(FIELDS)), dtype=bool)
+        self.out_of_range = np.empty((0, len(FIELDS)), dtype=bool)
+        self.cross = np.empty((0, len(self.rules)), dtype=bool)
+        self.duplicate = np.empty((0, len(UNIQUE_KEYS)), dtype=bool)
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def _grow(self, count):
+        """count 行を末尾に追加（値は NaN）"""
+        self.ids = np.concatenate([self.ids, np.zeros(count, dtype=np.int64)])
+        self.labels = np.concatenate([self.labels, np.full(count, '', dtype=object)])
+        self.values = np.vstack([self.values, np.full((count, len(FIELDS)), np.nan)])
+        for name in UNIQUE_KEYS:
+            self.keys[name] = np.concatenate([self.keys[name], np.full(count, '', dtype=object)])
+            self.raw_keys[name] = np.concatenate([self.raw_keys[name], np.full(count, '', dtype=object)])
+        self.alive = np.concatenate([self.alive, np.zeros(count, dtype=bool)])
+        self.filled = np.vstack([self.filled, np.zeros((count, len(FIELDS)), dtype=bool)])
+        self.out_of_range = np.vstack([self.out_of_range, np.zeros((count, len(FIELDS)), dtype=bool)])
+        self.cross = np.vstack([self.cross, np.zeros((count, len(self.rules)), dtype=bool)])
+        self.duplicate = np.vstack([self.duplicate, np.zeros((count, len(UNIQUE_KEYS)), dtype=bool)])
+
+    def _set_keys(self, name, rows, keys, raws):
+        """rows のキーを置き換え、件数表と判定し直すキーを更新する"""
+        old = self.keys[name][rows][self.alive[rows]]
+        self.key_counts[name].subtract(key for key in old if key)
+        self.key_counts[name].update(key for key in keys if key)
+        self.touched_keys[name].update(old)
+        self.touched_keys[name].update(keys)
+        self.touched_keys[name].discard('')
+        self.keys[name][rows] = keys
+        self.raw_keys[name][rows] = raws
+
+    def put(self, machines):
+        """機械を追加・更新する -> 変更した行の位置
+
+        machines は (ID, 機械番号, メーカー, 製造番号, FIELDS の順の値...) のタプル（ID は重複しないこと）
+        """
+        columns = list(zip(*machines))
+        if not columns:
+            return np.empty(0, dtype=np.intp)
+        ids = np.array(columns[0], dtype=np.int64)
+        rows = np.array([self.position.get(db_id, -1) for db_id in ids.tolist()], dtype=np.intp)
+        new = rows < 0
+        if new.any():
+            start = len(self.ids)
+            self._grow(int(new.sum()))
+            rows[new] = np.arange(start, len(self.ids))
+            self.position.update(zip(ids[new].tolist(), rows[new].tolist()))
+
+        self.ids[rows] = ids
+        self.labels[rows] = [label or '' for label in columns[1]]
+        # None は NaN になる
+        self.values[rows] = np.array(columns[4:], dtype=float).T
+        serials = [serial or '' for serial in columns[3]]
+        self._set_keys('serial', rows, [normalize_key(maker, serial) for maker, serial in zip(columns[2], serials)],
+                       serials)
+        self._set_keys('machine_number', rows, [normalize_key(label) for label in columns[1]], self.labels[rows])
+        self.alive[rows] = True
+        return rows
+
+    def remove(self, ids):
+        """削除された機械を外す -> 外した行の位置"""
+        rows = np.array([self.position.get(db_id, -1) for db_id in ids], dtype=np.intp)
+        rows = rows[rows >= 0]
+        rows = rows[self.alive[rows]]
+        for name in UNIQUE_KEYS:
+            self._set_keys(name, rows, [''] * len(rows), [''] * len(rows))
+        self.alive[rows] = False
+        return rows
+
+    def evaluate(self, rows=None):
+        """rows（None なら全行）の入力・範囲・項目間のルールと、変わったキーの重複を評価し直す"""
+        if rows is None:
+            rows = np.arange(len(self.ids))
+        values = self.values[rows]
+        self.filled[rows] = ~np.isnan(values)
+        self.out_of_range[rows] = (values < self.low) | (values > self.high)
+        for i, rule in enumerate(self.rules):
+            self.cross[rows, i] = rule.violated(*(values[:, self.column[field]] for field in rule.fields))
+
+        dead = rows[~self.alive[rows]]
+        self.filled[dead] = False
+        self.out_of_range[dead] = False
+        self.cross[dead] = False
+        self.duplicate[dead] = False
+
+        for i, name in enumerate(UNIQUE_KEYS):
+            keys = self.keys[name]
+            if len(rows) == len(self.ids):
+                # 全件は np.unique の件数で判定し、件数表も作り直す
+                unique, inverse = np.unique(keys.astype(str), return_inverse=True)
+                live = np.bincount(inverse, weights=self.alive, minlength=len(unique)).astype(int)
+                self.duplicate[:, i] = (live[inverse] > 1) & (keys != '') & self.alive
+                self.key_counts[name] = Counter({key: count for key, count in zip(unique, live) if key and count})
+            else:
+                # 変わったキー（古い値と新しい値）を持つ行だけ判定し直す
+                changed = list(self.touched_keys[name])
+                if changed:
+                    affected = np.flatnonzero(np.isin(keys, changed))
+                    counts = np.array([self.key_counts[name][key] for key in keys[affected]])
+                    self.duplicate[affected, i] = (counts > 1) & self.alive[affected]
+        self.touched_keys = {name: set() for name in UNIQUE_KEYS}
+
+    def machine_scorecards(self):
+        """機械ごとの [(ID, 機械番号, 入力済み項目数, 対象項目数, [問題, ...]), ...]（問題の多い順）"""
+        filled = self.filled[:, self.detailed].sum(axis=1)
+        problems = (self.out_of_range.sum(axis=1) + self.cross.sum(axis=1) + self.duplicate.sum(axis=1))
+        live = np.flatnonzero(self.alive)
+        order = live[np.lexsort((filled[live], -problems[live]))]
+        return [(int(self.ids[row]), self.labels[row], int(filled[row]), len(self.detailed), self.row_issues(row))
+                for row in order]
+
+    def row_issues(self, row):
+        """1行の問題の説明"""
+        issues = []
+        for column in np.flatnonzero(self.out_of_range[row]):
+            field = FIELDS[column]
+            issues.append(f"{FIELD_LABELS[field]}={self.values[row, column]:g}"
+                          f"（{RANGES[field][0]:g}〜{RANGES[field][1]:g} の範囲外）")
+        for i in np.flatnonzero(self.cross[row]):
+            rule = self.rules[i]
+            shown = ", ".join(f"{FIELD_LABELS[field]}={self.values[row, self.column[field]]:g}" for field in rule.fields)
+            issues.append(f"{rule.label}（{shown}）")
+        for i in np.flatnonzero(self.duplicate[row]):
+            name = list(UNIQUE_KEYS)[i]
+            issues.append(f"{UNIQUE_KEYS[name]} {self.raw_keys[name][row]} が "
+                          f"{self.key_counts[name][self.keys[name][row]]}台で重複")
+        return issues
+
+    def field_scorecards(self):
+        """項目ごとの [(項目, 表示名, 入力数, 範囲外の数, 項目間の不一致の数), ...]"""
+        live = self.alive
+        filled = self.filled[live].sum(axis=0)
+        out_of_range = self.out_of_range[live].sum(axis=0)
+        cross = np.zeros(len(FIELDS), dtype=int)
+        for i, rule in enumerate(self.rules):
+            for field in rule.fields:
+                cross[self.column[field]] += int(self.cross[live, i].sum())
+        return [(field, FIELD_LABELS[field], int(filled[self.column[field]]), int(out_of_range[self.column[field]]),
+                 int(cross[self.column[field]]))
+                for field in self.present]
+
+    def summary(self):
+        live = self.alive
+        total = len(self)
+        detailed_cells = total * len(self.detailed)
+        return {
+            'machines': total,
+            'completeness': float(self.filled[live][:, self.detailed].sum() / detailed_cells) if detailed_cells else None,
+            'out_of_range': int(self.out_of_range[live].sum()),
+            'cross_field': {rule.name: int(self.cross[live, i].sum()) for i, rule in enumerate(self.rules)},
+            'duplicates': {name: int(self.duplicate[live, i].sum()) for i, name in enumerate(UNIQUE_KEYS)},
+            'machines_with_issues': int((self.out_of_range[live].any(axis=1) | self.cross[live].any(axis=1)
+                                         | self.duplicate[live].any(axis=1)).sum()),
+        }
+
+    def save(self, path):
+        """評価に使った配列と判定結果を保存（次回は変更された行だけ評価し直す）"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {
+            'ids': self.ids, 'labels': self.labels.astype(str), 'values': self.values, 'alive': self.alive,
+            'filled': self.filled, 'out_of_range': self.out_of_range, 'cross': self.cross, 'duplicate': self.duplicate,
+            'meta': np.array(json.dumps({'present': self.present, 'seq': self.seq,
+                                         'rules': [rule.name for rule in self.rules], 'fields': FIELDS})),
+        }
+        for name in UNIQUE_KEYS:
+            arrays[f'key_{name}'] = self.keys[name].astype(str)
+            arrays[f'raw_{name}'] = self.raw_keys[name].astype(str)
+        partial = path + '.partial.npz'
+        np.savez(partial, **arrays)
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path):
+        """保存した結果（ない・形式が違う場合は None）"""
+        try:
+            with np.load(path) as data:
+                meta = json.loads(str(data['meta']))
+                scanner = cls(meta['present'])
+                if meta['fields'] != list(FIELDS) or meta['rules'] != [rule.name for rule in scanner.rules]:
+                    return None
+                scanner.seq = meta['seq']
+                scanner.ids = data['ids']
+                scanner.labels = data['labels'].astype(object)
+                scanner.values = data['values']
+                scanner.alive = data['alive']
+                scanner.filled = data['filled']
+                scanner.out_of_range = data['out_of_range']
+                scanner.cross = data['cross']
+                scanner.duplicate = data['duplicate']
+                for name in UNIQUE_KEYS:
+                    scanner.keys[name] = data[f'key_{name}'].astype(object)
+                    scanner.raw_keys[name] = data[f'raw_{name}'].astype(object)
+        except (OSError, ValueError, KeyError):
+            return None
+        scanner.position = {int(db_id): row for row, db_id in enumerate(scanner.ids)}
+        for name in UNIQUE_KEYS:
+            scanner.key_counts[name] = Counter(key for key in scanner.keys[name][scanner.alive] if key)
+        return scanner
+
+    @classmethod
+    def from_records(cls, records):
+        """Supabase から取得した行（dict）を全件評価"""
+        records = list(records)
+        present = set().union(*records) if records else set()
+        scanner = cls(present)
+        scanner.put(_machine_from_record(record) for record in records)
+        scanner.evaluate()
+        return scanner
+
+
+def _machine_from_record(record):
+    return (record.get('id', record.get('db_id')), record.get('machine_number'),
+            record.get('maker') or record.get('manufacturer'), record.get('serial_no') or record.get('serial_number'),
+            *(record.get(field) for field in FIELDS))
+
+
+def _machine_select(conn):
+    """press_machines から put に渡す形で読む SELECT と、実際にある項目（スキーマの違いを吸収する）"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(press_machines)")}
+
+    def first_of(*candidates):
+        available = [column for column in candidates if column in columns]
+        if len(available) > 1:
+            return f"COALESCE({', '.join(available)})"
+        return available[0] if available else 'NULL'
+
+    present = [field for field in FIELDS if field in columns]
+    select = [field if field in columns else 'NULL' for field in FIELDS]
+    # デスクトップ版DBは capacity_ton の代わりに tonnage を持つ
+    if 'capacity_ton' not in columns and 'tonnage' in columns:
+        select[FIELDS.index('capacity_ton')] = 'tonnage'
+        present.append('capacity_ton')
+    key = 'db_id' if 'db_id' in columns else 'id'
+    sql = (f"SELECT {key}, machine_number, {first_of('maker', 'manufacturer')}, "
+           f"{first_of('serial_no', 'serial_number')}, {', '.join(select)} FROM press_machines")
+    return key, sql, present
+
+
+def _read_machines(conn, ids=None):
+    key, sql, present = _machine_select(conn)
+    if ids is None:
+        return conn.execute(sql).fetchall(), present
+    return fetch_by_ids(conn, sql, key, list(ids)), present
+
+
+def scan_database(db_file, path=None, full=False):
+    """SQLite の press_machines を評価する -> (scanner, 評価し直した機械の数)
+
+    前回の結果があり、その後の変更が change_log に全て残っていれば変更された機械だけを評価し直す
+    """
+    path = path or state_path(db_file)
+    conn = connect(db_file)
+    try:
+        seq = current_seq(conn)
+        scanner = None if full or seq is None else QualityScanner.load(path)
+        if scanner is not None and scanner.seq is not None:
+            if scanner.seq == seq:
+                return scanner, 0
+            # 古い change_log は整理されるので、前回以降の記録が残っている場合だけ差分で済ませる
+            oldest = conn.execute("SELECT MIN(seq) FROM change_log").fetchone()[0]
+            if oldest is not None and oldest <= scanner.seq + 1:
+                ids = [row[0] for row in conn.execute(
+                    "SELECT DISTINCT row_id FROM change_log WHERE table_name = 'press_machines' AND seq > ? AND seq <= ?",
+                    (scanner.seq, seq))]
+                machines, _ = _read_machines(conn, ids)
+                rows = scanner.put(machines)
+                found = {machine[0] for machine in machines}
+                removed = scanner.remove([db_id for db_id in ids if db_id not in found])
+                scanner.evaluate(np.concatenate([rows, removed]))
+                scanner.seq = seq
+                scanner.save(path)
+                return scanner, len(ids)
+
+        machines, present = _read_machines(conn)
+        scanner = QualityScanner(present)
+        scanner.put(machines)
+        scanner.evaluate()
+        scanner.seq = seq
+        if seq is not None:
+            scanner.save(path)
+        return scanner, len(machines)
+    finally:
+        conn.close()
+
+
+def format_text(scanner, show_machines=False):
+    summary = scanner.summary()
+    lines = [f"=== 仕様データの品質: {summary['machines']:,}台 ==="]
+    if summary['completeness'] is not None:
+        lines.append(f"詳細仕様の入力率: {summary['completeness'] * 100:.1f}%")
+    lines.append(f"問題のある機械: {summary['machines_with_issues']:,}台")
+
+    lines.append("\n【項目別】 入力率 / 範囲外 / 項目間の不一致 / 項目")
+    total = max(summary['machines'], 1)
+    for field, label, filled, out_of_range, cross in scanner.field_scorecards():
+        completeness = f"{filled * 100 / total:5.1f}%" if field in DETAILED_FIELDS else "   - "
+        lines.append(f"  {completeness}  {out_of_range:6,}  {cross:6,}  {label}")
+
+    lines.append("\n【ルール別】")
+    for rule in scanner.rules:
+        lines.append(f"  {rule.label}: {summary['cross_field'][rule.name]:,}台")
+    for name, label in UNIQUE_KEYS.items():
+        lines.append(f"  {label}の重複: {summary['duplicates'][name]:,}台")
+
+    cards = scanner.machine_scorecards()
+    issues = [card for card in cards if card[4]]
+    if issues or show_machines:
+        lines.append("\n【機械別】" + ("" if show_machines else "（問題のある機械）"))
+    for db_id, machine_number, filled, fields, problems in (cards if show_machines else issues):
+        lines.append(f"  {machine_number} (ID: {db_id})  入力 {filled}/{fields}")
+        lines.extend(f"    - {problem}" for problem in problems)
+    return "\n".join(lines) + "\n"
+
+
+def format_json(scanner):
+    return {
+        'summary': scanner.summary(),
+        'fields': [{'field': field, 'label': label, 'filled': filled, 'out_of_range': out_of_range, 'cross_field': cross}
+                   for field, label, filled, out_of_range, cross in scanner.field_scorecards()],
+        'machines': [{'id': db_id, 'machine_number': machine_number, 'filled': filled, 'fields': fields,
+                      'issues': problems}
+                     for db_id, machine_number, filled, fields, problems in scanner.machine_scorecards()],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="プレス機の仕様データの品質チェック")
+    parser.add_argument('--db', default='press_machine.db')
+    parser.add_argument('--full', action='store_true', help="保存した結果を使わずに全件を評価")
+    parser.add_argument('--machines', action='store_true', help="問題のない機械も含めて機械別に出力")
+    parser.add_argument('--format', choices=('text', 'json'), default='text')
+    parser.add_argument('--output', help="出力先（省略時は標準出力）")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    scanner, rescanned = scan_database(args.db, full=args.full)
+    elapsed = time.perf_counter() - started
+
+    if args.format == 'json':
+        content = json.dumps(format_json(scanner), ensure_ascii=False, indent=2) + "\n"
+    else:
+        content = format_text(scanner, args.machines)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(content)
+    else:
+        sys.stdout.write(content)
+    print(f"（評価し直した機械 {rescanned:,}台 / {len(scanner):,}台、{elapsed:.2f}秒）", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+アイドル時のデータベース保守
+利用者の操作や他のインスタンスの書き込みがない間に、次の作業を少しずつ行う
+- optimize  : PRAGMA optimize（analysis_limit で調べる行数を抑える）
+- analyze   : 前回の ANALYZE から変更の多いテーブルだけ ANALYZE（変更数は table_versions で数える）
+- vacuum    : 削除で空いたページを PRAGMA incremental_vacuum で少しずつ返す（auto_vacuum=INCREMENTAL の DB のみ）
+- checkpoint: WAL モードの DB なら PRAGMA wal_checkpoint(PASSIVE)（共有ドライブの DELETE モードでは何もしない）
+- integrity : テーブルを1つずつ順番に PRAGMA quick_check
+
+各作業には時間の上限があり、超えたら progress handler で中断する（書き込み中ならロールバックされる）。
+実際に作業した結果（所要時間・状態）は db_maintenance_log に記録し、他のインスタンスと共有する
+（同じ作業を複数のインスタンスで繰り返さない）。DB 全体を止める VACUUM は enable-incremental でだけ行う
+
+使い方:
+  python db_maintenance.py run --db press_machine.db
+  python db_maintenance.py watch --db press_machine.db --idle-seconds 120
+  python db_maintenance.py status --db press_machine.db
+  python db_maintenance.py enable-incremental --db press_machine.db   # 一度だけ。全員が終了している時に実行
+"""
+import argparse
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from shared_db import TRACKED_TABLES, connect, ensure_schema, is_busy_error, table_versions
+
+# budget_seconds: 1回の時間の上限 / interval_seconds: 前回の実施（または確認）から次に確認するまでの間隔
+Task = namedtuple('Task', 'name run budget_seconds interval_seconds')
+
+BUSY_TIMEOUT_SECONDS = 0.5    # 保守用の接続のビジータイムアウト（使用中なら待たずに次の機会に回す）
+PROGRESS_STEPS = 1000         # progress handler を呼ぶ間隔（VM の命令数）
+ANALYSIS_LIMIT = 1000         # ANALYZE でインデックスごとに調べる行数の上限
+ANALYZE_MIN_CHANGES = 500     # 前回の ANALYZE からこの件数以上、かつ
+ANALYZE_CHANGE_RATIO = 0.1    # 行数のこの割合以上変更されたテーブルを ANALYZE する
+VACUUM_PAGES_PER_STEP = 256   # 1回の書き込みロックで返すページ数
+VACUUM_MIN_FREE_PAGES = 64    # 空きページがこれより少なければ何もしない
+LOG_RETENTION_DAYS = 30
+
+IDLE_SECONDS = 60             # アプリで最後の操作からこの秒数が経ったらアイドルとみなす
+WATCH_IDLE_SECONDS = 120      # watch で書き込みがこの秒数なければアイドルとみなす
+WATCH_CHECK_SECONDS = 10
+
+STOPPED_DETAIL = {
+    'timeout': "上限の{budget}秒を超えたため中断",
+    'interrupted': "操作が再開されたため中断",
+}
+
+
+def ensure_maintenance_schema(conn):
+    """保守の記録用テーブルを作成（db_maintenance_state は作業ごとの進み具合）"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS db_maintenance_log (
+        id INTEGER PRIMARY KEY,
+        task TEXT NOT NULL,
+        started_at DATETIME NOT NULL,
+        elapsed_ms REAL NOT NULL,
+        status TEXT NOT NULL,
+        detail TEXT
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_db_maintenance_log_task ON db_maintenance_log (task, started_at)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS db_maintenance_state (
+        name TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """)
+
+
+def _get_state(conn, name):
+    row = conn.execute("SELECT value FROM db_maintenance_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_state(conn, name, value):
+    conn.execute("INSERT OR REPLACE INTO db_maintenance_state (name, value) VALUES (?, ?)", (name, str(value)))
+
+
+def _analyzed_rows(conn, table):
+    """前回の ANALYZE 時点の行数（sqlite_stat1 の件数。未実施なら None）"""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        return None
+    return conn.execute("SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 WHERE tbl = ?", (table,)).fetchone()[0]
+
+
+def run_optimize(conn, deadline):
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    conn.execute("PRAGMA optimize").fetchall()
+    return 'ok', ''
+
+
+def run_analyze(conn, deadline):
+    versions = table_versions(conn)
+    analyzed = []
+    for table in TRACKED_TABLES:
+        baseline = _get_state(conn, f'analyze:{table}')
+        changes = versions.get(table, 0) - int(baseline) if baseline is not None else None
+        rows = _analyzed_rows(conn, table)
+        if changes is not None and rows is not None and changes < max(ANALYZE_MIN_CHANGES, rows * ANALYZE_CHANGE_RATIO):
+            continue
+        if time.monotonic() > deadline:
+            return 'partial', ', '.join(analyzed)
+
+        conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"ANALYZE {table}")
+            # 読んだ後に他の接続で変更されていてもロック中なので、このカウンタが ANALYZE の時点
+            _set_state(conn, f'analyze:{table}', table_versions(conn).get(table, 0))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        analyzed.append(table)
+    return ('ok', ', '.join(analyzed)) if analyzed else None
+
+
+def run_vacuum(conn, deadline):
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return None
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if free < VACUUM_MIN_FREE_PAGES:
+        return None
+
+    remaining = free
+    while remaining and time.monotonic() < deadline:
+        # 1ステップごとにコミットしてロックを手放す（他のインスタンスの書き込みを止め続けない）
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP})").fetchall()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return ('ok' if not remaining else 'partial'), f"{free - remaining}ページを解放（残り{remaining}）"
+
+
+def run_checkpoint(conn, deadline):
+    if conn.execute("PRAGMA journal_mode").fetchone()[0].lower() != 'wal':
+        return None
+    busy, log_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+    return ('ok' if not busy else 'partial'), f"{checkpointed}/{log_pages}ページ"
+
+
+def run_integrity(conn, deadline):
+    """次のテーブルを quick_check（時間内に終わらなくても次回は次のテーブルに進む）"""
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+    if not tables:
+        return None
+    previous = _get_state(conn, 'integrity:last')
+    table = next((name for name in tables if previous is None or name > previous), tables[0])
+    _set_state(conn, 'integrity:last', table)
+
+    problems = [row[0] for row in conn.execute(f'PRAGMA quick_check("{table}")')]
+    if problems == ['ok']:
+        return 'ok', table
+    return 'error', f"{table}: {'; '.join(problems[:5])}"
+
+
+TASKS = (
+    Task('checkpoint', run_checkpoint, 0.5, 5 * 60),
+    Task('analyze', run_analyze, 2.0, 10 * 60),
+    Task('vacuum', run_vacuum, 1.0, 10 * 60),
+    Task('optimize', run_optimize, 1.0, 6 * 3600),
+    Task('integrity', run_integrity, 2.0, 6 * 3600),
+)
+
+
+class DatabaseMaintenance:
+    """期限の来た保守作業を順に実行する"""
+
+    def __init__(self, db_file, tasks=TASKS):
+        self.db_file = db_file
+        self.tasks = tasks
+        # 作業名 -> このプロセスで最後に確認した時刻（何もしなかった作業はログに残さないため）
+        self.checked = {}
+
+    def _last_runs(self, conn):
+        last = {name: datetime.fromisoformat(started_at).timestamp() for name, started_at in conn.execute(
+            "SELECT task, MAX(started_at) FROM db_maintenance_log GROUP BY task")}
+        for name, checked in self.checked.items():
+            last[name] = max(last.get(name, 0), checked)
+        return last
+
+    def due_tasks(self, conn):
+        last = self._last_runs(conn)
+        now = time.time()
+        return [task for task in self.tasks if now - last.get(task.name, 0) >= task.interval_seconds]
+
+    def _record(self, conn, started_at, task, status, elapsed_ms, detail):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT INTO db_maintenance_log (task, started_at, elapsed_ms, status, detail) "
+                         "VALUES (?, ?, ?, ?, ?)", (task, started_at, elapsed_ms, status, detail))
+            conn.execute("DELETE FROM db_maintenance_log WHERE started_at < datetime('now', 'localtime', ?)",
+                         (f'-{LOG_RETENTION_DAYS} days',))
+            conn.execute("COMMIT")
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if not is_busy_error(e):
+                raise
+
+    def run(self, should_continue=None, force=False, only=None):
+        """期限の来た作業（force なら全て）を実行し、[(作業名, 状態, 所要ミリ秒, 詳細), ...] を返す
+
+        should_continue() が False を返したら（利用者が操作を再開したら）実行中の作業も中断して終える
+        """
+        conn = connect(self.db_file, timeout=BUSY_TIMEOUT_SECONDS)
+        # トランザクションは各作業で明示する
+        conn.isolation_level = None
+        results = []
+        try:
+            try:
+                if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'db_maintenance_state'").fetchone():
+                    ensure_maintenance_schema(conn)
+                tasks = self.tasks if force else self.due_tasks(conn)
+            except sqlite3.OperationalError as e:
+                # 他のインスタンスが書き込み中なら次の機会に回す
+                if is_busy_error(e):
+                    return results
+                raise
+            for task in tasks:
+                if only and task.name not in only:
+                    continue
+                if should_continue is not None and not should_continue():
+                    break
+                outcome = self._run_task(conn, task, should_continue)
+                self.checked[task.name] = time.time()
+                if outcome is None:
+                    continue
+                started_at, result = outcome
+                self._record(conn, started_at, *result)
+                results.append(result)
+                if result[1] == 'interrupted':
+                    break
+        finally:
+            conn.close()
+        return results
+
+    def _run_task(self, conn, task, should_continue):
+        started = time.monotonic()
+        started_at = datetime.now().isoformat(sep=' ', timespec='seconds')
+        deadline = started + task.budget_seconds
+        stopped = []
+
+        def progress():
+            if time.monotonic() > deadline:
+                stopped.append('timeout')
+                return 1
+            if should_continue is not None and not should_continue():
+                stopped.append('interrupted')
+                return 1
+            return 0
+
+        conn.set_progress_handler(progress, PROGRESS_STEPS)
+        try:
+            outcome = task.run(conn, deadline)
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if stopped:
+                outcome = stopped[0], STOPPED_DETAIL[stopped[0]].format(budget=task.budget_seconds)
+            elif is_busy_error(e):
+                # 他のインスタンスが書き込み中。記録せずに次の機会に回す
+                return None
+            else:
+                outcome = 'error', str(e)
+        finally:
+            conn.set_progress_handler(None, 0)
+        if outcome is None:
+            return None
+        status, detail = outcome
+        return started_at, (task.name, status, round((time.monotonic() - started) * 1000, 1), detail)
+
+
+class IdleMaintenanceService:
+    """アプリ用。最後の操作から IDLE_SECONDS 経ったら保守をバックグラウンドスレッドで実行する
+
+    画面側は操作のたびに touch() を呼び、定期的に poll() で開始と完了を確認する
+    """
+
+    def __init__(self, db_file, idle_seconds=IDLE_SECONDS):
+        self.maintenance = DatabaseMaintenance(db_file)
+        self.idle_seconds = idle_seconds
+        self.last_activity = time.monotonic()
+        self.thread = None
+        self.started = None
+        self.results = []
+        self.error = None
+        # 次に期限を確認する時刻（最も短い間隔ごとにしか確認しない）
+        self.next_check = 0
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def touch(self, event=None):
+        self.last_activity = time.monotonic()
+
+    def _user_idle(self):
+        return self.last_activity < self.started
+
+    def _run(self):
+        try:
+            self.results = self.maintenance.run(should_continue=self._user_idle)
+        except Exception as e:
+            self.error = e
+
+    def poll(self, busy=False):
+        """アイドルなら保守を開始する（開始したら True）"""
+        now = time.monotonic()
+        if self.running or busy or now - self.last_activity < self.idle_seconds or now < self.next_check:
+            return False
+        # 期限の確認もスレッドで行う（期限の来た作業がなければ何もせずに終わる）
+        self.next_check = now + min(task.interval_seconds for task in self.maintenance.tasks)
+        self.started = now
+        self.results = []
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='db-maintenance', daemon=True)
+        self.thread.start()
+        return True
+
+
+def _activity(conn):
+    """他のインスタンスの書き込みの目安（保守自身の書き込みは含まない）"""
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+
+
+def watch(db_file, idle_seconds=WATCH_IDLE_SECONDS, check_seconds=WATCH_CHECK_SECONDS):
+    """常駐して、書き込みが idle_seconds なければ保守を実行する（Ctrl+C で終了）"""
+    maintenance = DatabaseMaintenance(db_file)
+    conn = connect(db_file)
+    try:
+        seen = _activity(conn)
+        quiet_since = time.monotonic()
+        while True:
+            time.sleep(check_seconds)
+            try:
+                current = _activity(conn)
+            except sqlite3.OperationalError as e:
+                if is_busy_error(e):
+                    continue
+                raise
+            if current != seen:
+                seen = current
+                quiet_since = time.monotonic()
+            elif time.monotonic() - quiet_since >= idle_seconds:
+                for result in maintenance.run():
+                    print_result(result)
+    finally:
+        conn.close()
+
+
+def enable_incremental_vacuum(db_file):
+    """auto_vacuum を INCREMENTAL に切り替える（VACUUM で DB 全体を作り直すので、誰も使っていない時に実行）"""
+    conn = connect(db_file)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+
+def print_result(result):
+    task, status, elapsed_ms, detail = result
+    print(f"  {task:10s} {status:11s} {elapsed_ms:8.1f}ms  {detail}")
+
+
+def print_status(db_file):
+    conn = connect(db_file)
+    try:
+        auto_vacuum = {0: 'NONE', 1: 'FULL', 2: 'INCREMENTAL'}[conn.execute("PRAGMA auto_vacuum").fetchone()[0]]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        print(f"ジャーナル: {conn.execute('PRAGMA journal_mode').fetchone()[0]}  auto_vacuum: {auto_vacuum}")
+        print(f"サイズ: {page_count * page_size / 1024 / 1024:.1f}MB（空き {free:,}ページ / {page_count:,}ページ）")
+        if auto_vacuum != 'INCREMENTAL':
+            print("  空きページを返すには enable-incremental を一度実行してください")
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'db_maintenance_log'").fetchone():
+            print("保守の記録はありません")
+            return
+        print("最後の実施:")
+        for row in conn.execute("""
+        SELECT task, started_at, elapsed_ms, status, detail FROM db_maintenance_log l
+        WHERE id = (SELECT MAX(id) FROM db_maintenance_log WHERE task = l.task)
+        ORDER BY task
+        """):
+            print(f"  {row[0]:10s} {row[1]}  {row[3]:11s} {row[2]:8.1f}ms  {row[4] or ''}")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="アイドル時のデータベース保守")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help="期限の来た保守作業を一度だけ実行")
+    run.add_argument('--force', action='store_true', help="期限に関係なく全ての作業を実行")
+    run.add_argument('--only', action='append', choices=[task.name for task in TASKS], help="実行する作業")
+
+    watch_parser = subparsers.add_parser('watch', help="常駐して、書き込みがない間に保守を実行")
+    watch_parser.add_argument('--idle-seconds', type=float, default=WATCH_IDLE_SECONDS)
+    watch_parser.add_argument('--check-seconds', type=float, default=WATCH_CHECK_SECONDS)
+
+    subparsers.add_parser('status', help="DB のサイズ・空きページと最後の保守の結果")
+    subparsers.add_parser('enable-incremental', help="auto_vacuum を INCREMENTAL にする（一度だけ。DB 全体を VACUUM する）")
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument('--db', default='press_machine.db')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        ensure_schema(args.db)
+        results = DatabaseMaintenance(args.db).run(force=args.force, only=args.only)
+        for result in results:
+            print_result(result)
+        if not results:
+            print("実施する作業はありませんでした")
+        raise SystemExit(1 if any(result[1] == 'error' for result in results) else 0)
+    elif args.command == 'watch':
+        ensure_schema(args.db)
+        try:
+            watch(args.db, args.idle_seconds, args.check_seconds)
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'status':
+        print_status(args.db)
+    else:
+        started = time.monotonic()
+        if enable_incremental_vacuum(args.db):
+            print(f"auto_vacuum を INCREMENTAL にしました（{time.monotonic() - started:.1f}秒）")
+        else:
+            print("auto_vacuum はすでに INCREMENTAL です")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+プレス機一覧・メンテナンス記録・統計の CSV / Excel 出力
+カーソルから一定件数ずつ読み出して書き込むため、件数が多くてもメモリ使用量は一定
+（Excel は openpyxl の write_only モードで行ごとに書き出す。openpyxl は requirements.txt を参照）
+
+使い方:
+  python export_data.py machines --db press_machine.db --output machines.xlsx --search アイダ
+  python export_data.py maintenance --db press_machine.db --output maintenance.csv
+  python export_data.py statistics --db press_machine.db --output stats.xlsx
+"""
+import argparse
+import csv
+import importlib.util
+import os
+from datetime import datetime
+from itertools import islice
+
+from reporting import (
+    LATEST_MAINTENANCE_SELECT, MACHINE_ORDER_BY, machine_search_filter, machine_stats, maintenance_count, valve_counts,
+)
+from shared_db import connect
+
+FETCH_ROWS = 1000
+
+# 出力列（SQL式, 見出し, 型）。型は 'int' / 'float' / 'datetime' / 'text'
+MACHINE_COLUMNS = [
+    ('db_id', 'ID', 'int'),
+    ('machine_number', '製造番号', 'text'),
+    ('equipment_number', '設備番号', 'text'),
+    ('manufacturer', 'メーカー', 'text'),
+    ('model_type', '型式', 'text'),
+    ('serial_number', 'シリアル番号', 'text'),
+    ('machine_type', '種別', 'text'),
+    ('production_group', '生産グループ', 'int'),
+    ('tonnage', 'トン数', 'int'),
+    ('created_at', '登録日時', 'datetime'),
+]
+
+MAINTENANCE_COLUMNS = [
+    ('m.maintenance_id', '記録ID', 'int'),
+    ('p.machine_number', '製造番号', 'text'),
+    ('m.maintenance_datetime', 'メンテナンス日時', 'datetime'),
+    ('m.overall_judgment', '総合判定', 'text'),
+    ('m.clutch_valve_replacement', 'クラッチ弁交換', 'text'),
+    ('m.brake_valve_replacement', 'ブレーキ弁交換', 'text'),
+    ('m.remarks', '備考', 'text'),
+]
+
+
+def statistics_sections(conn):
+    """分析タブと同じ集計（reporting の関数）を (見出し, 列の定義, 行) のリストで返す
+
+    機械ごとの最新メンテナンスは台数分あるのでカーソルのまま返す
+    """
+    stats = machine_stats(conn)
+    valves = valve_counts(conn)
+    return [
+        ('種別別集計', [('種別', 'text'), ('台数', 'int')], stats['by_type']),
+        ('生産グループ別集計', [('生産グループ', 'int'), ('台数', 'int')], stats['by_group']),
+        ('最新メンテナンス', [('製造番号', 'text'), ('最新メンテナンス日時', 'datetime')],
+         conn.execute(LATEST_MAINTENANCE_SELECT)),
+        ('件数', [('項目', 'text'), ('件数', 'int')], [
+            ('総プレス機台数', stats['total']),
+            ('総メンテナンス記録数', maintenance_count(conn)),
+            ('クラッチ弁交換', valves['clutch']),
+            ('ブレーキ弁交換', valves['brake']),
+        ]),
+    ]
+
+
+def xlsx_available():
+    """Excel 出力に使う openpyxl が入っているか"""
+    return importlib.util.find_spec('openpyxl') is not None
+
+
+class ExportCancelled(Exception):
+    """出力が中止された"""
+
+
+def convert_value(value, value_type):
+    """DBの値を Excel 用の型に変換（変換できない値はそのまま）"""
+    if value is None or value == '':
+        return None
+    try:
+        if value_type == 'int':
+            return int(value)
+        if value_type == 'float':
+            return float(value)
+        if value_type == 'datetime':
+            return datetime.fromisoformat(str(value))
+    except ValueError:
+        pass
+    return value
+
+
+class CsvWriter:
+    """CSV 出力（Excel で文字化けしないよう BOM 付き UTF-8）"""
+
+    def __init__(self, path, sectioned=False):
+        self.file = open(path, 'w', newline='', encoding='utf-8-sig')
+        self.writer = csv.writer(self.file)
+        # 統計のように複数の表を1ファイルに出す場合は表題の行と空行で区切る
+        self.sectioned = sectioned
+        self.sections = 0
+
+    def begin_section(self, title, headers):
+        if self.sectioned:
+            if self.sections:
+                self.writer.writerow([])
+            self.writer.writerow([title])
+        self.writer.writerow(headers)
+        self.sections += 1
+
+    def write_rows(self, rows, types):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class XlsxWriter:
+    """Excel 出力（write_only モード。表ごとにシートを分ける）"""
+
+    DATETIME_FORMAT = 'yyyy-mm-dd hh:mm'
+
+    def __init__(self, path):
+        try:
+            from openpyxl import Workbook
+            from openpyxl.cell import WriteOnlyCell
+        except ImportError:
+            raise RuntimeError("Excel 出力には openpyxl が必要です（pip install openpyxl）")
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.cell_class = WriteOnlyCell
+        self.sheet = None
+
+    def begin_section(self, title, headers):
+        self.sheet = self.workbook.create_sheet(title=title[:31])
+        self.sheet.append(headers)
+
+    def write_rows(self, rows, types):
+        for row in rows:
+            values = []
+            for value, value_type in zip(row, types):
+                value = convert_value(value, value_type)
+                if value_type == 'datetime' and isinstance(value, datetime):
+                    cell = self.cell_class(self.sheet, value=value)
+                    cell.number_format = self.DATETIME_FORMAT
+                    value = cell
+                values.append(value)
+            self.sheet.append(values)
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+def open_writer(path, sectioned=False):
+    if os.path.splitext(path)[1].lower() == '.xlsx':
+        return XlsxWriter(path)
+    return CsvWriter(path, sectioned)
+
+
+def _stream(writer, title, columns, rows, total, progress, cancel_event, done=0):
+    """行（カーソルまたはリスト）を FETCH_ROWS 件ずつ書き出し、書き出した累計件数を返す
+
+    columns は (見出し, 型) のリスト
+    """
+    writer.begin_section(title, [label for label, _ in columns])
+    types = [value_type for _, value_type in columns]
+    rows_iter = iter(rows)
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            raise ExportCancelled()
+        rows = list(islice(rows_iter, FETCH_ROWS))
+        if not rows:
+            return done
+        writer.write_rows(rows, types)
+        done += len(rows)
+        if progress:
+            progress(done, total)
+
+
+def export(db_file, kind, path, search_text='', progress=None, cancel_event=None):
+    """kind（'machines' / 'maintenance' / 'statistics'）を path に出力し、出力行数を返す
+
+    progress(出力済み件数, 全件数) は FETCH_ROWS 件ごとに呼ばれる。cancel_event がセットされると
+    ExportCancelled を送出し、途中まで書いたファイルは削除する
+    """
+    writer = open_writer(path, sectioned=(kind == 'statistics'))
+    conn = connect(db_file)
+    try:
+        if kind == 'machines':
+            where, params = machine_search_filter(search_text, conn=conn)
+            total = conn.execute(f"SELECT COUNT(*) FROM press_machines {where}", params).fetchone()[0]
+            sql = (f"SELECT {', '.join(column for column, _, _ in MACHINE_COLUMNS)} "
+                   f"FROM press_machines {where} {MACHINE_ORDER_BY}")
+            done = _stream(writer, 'プレス機一覧', [column[1:] for column in MACHINE_COLUMNS],
+                           conn.execute(sql, params), total, progress, cancel_event)
+        elif kind == 'maintenance':
+            total = conn.execute("""
+            SELECT COUNT(*) FROM maintenance_records m JOIN press_machines p ON m.db_id = p.db_id
+            """).fetchone()[0]
+            sql = (f"SELECT {', '.join(column for column, _, _ in MAINTENANCE_COLUMNS)} "
+                   f"FROM maintenance_records m JOIN press_machines p ON m.db_id = p.db_id "
+                   f"ORDER BY m.maintenance_datetime DESC")
+            done = _stream(writer, 'メンテナンス記録', [column[1:] for column in MAINTENANCE_COLUMNS],
+                           conn.execute(sql), total, progress, cancel_event)
+        elif kind == 'statistics':
+            done = 0
+            for title, columns, rows in statistics_sections(conn):
+                done = _stream(writer, title, columns, rows, None, progress, cancel_event, done)
+        else:
+            raise ValueError(f"不明な出力対象: {kind}")
+        writer.close()
+    except BaseException:
+        try:
+            writer.close()
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        conn.close()
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="一覧・統計の CSV / Excel 出力")
+    parser.add_argument('kind', choices=['machines', 'maintenance', 'statistics'])
+    parser.add_argument('--db', default='press_machine.db')
+    parser.add_argument('--output', required=True, help="出力ファイル（拡張子 .xlsx なら Excel、それ以外は CSV）")
+    parser.add_argument('--search', default='', help="プレス機一覧の検索文字列（画面の検索欄と同じ条件）")
+    args = parser.parse_args()
+
+    def progress(done, total):
+        if total:
+            print(f"\r{done:,} / {total:,}件", end='', flush=True)
+
+    count = export(args.db, args.kind, args.output, args.search, progress)
+    print(f"\n{count:,}行を出力しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+共有 press_machine.db の同時書き込み負荷テスト
+アプリと同じSQL（メンテナンス記録追加・プレス機編集・一覧/統計の読み込み）を
+N プロセスから同時に実行し、ジャーナルモード・同期設定ごとにスループット、
+ロック待ち、SQLITE_BUSY 発生率、レイテンシのパーセンタイルを出力する
+
+使い方:
+  python load_test.py --db press_machine.db --processes 1 2 4 8 --duration 10
+  python load_test.py --db /mnt/share/copy.db --journal-modes delete wal --synchronous full normal
+
+対象DBはコピーに対して実行すること（テストデータが追加される）
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+
+import shared_db
+from reporting.queries import MAINTENANCE_SELECT, statistics
+from shared_db import connect, ensure_schema, is_busy_error, write_transaction
+
+# 1操作あたりの構成比（メンテナンス記録追加 / プレス機編集 / 一覧読み込み / 統計読み込み）
+DEFAULT_MIX = {'add_maintenance': 0.2, 'edit_machine': 0.1, 'load_maintenance': 0.4, 'update_analysis': 0.3}
+
+
+# 各操作はロック待ち時間（BEGIN IMMEDIATE で書き込みロックを取得するまでの秒数。接続の時間は含まない）を返す
+def add_maintenance(db_file, machine_ids, rng):
+    timings = {}
+    with write_transaction(db_file, timings) as conn:
+        conn.execute("""
+        INSERT INTO maintenance_records
+        (db_id, maintenance_datetime, overall_judgment, clutch_valve_replacement, brake_valve_replacement, remarks)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, (rng.choice(machine_ids), datetime.now().strftime('%Y-%m-%d %H:%M'),
+              rng.choice(['良好', '要注意', '要修理']), rng.choice(['未実施', '実施']),
+              rng.choice(['未実施', '実施']), '負荷テスト'))
+    return timings['lock_wait']
+
+
+def edit_machine(db_file, machine_ids, rng):
+    timings = {}
+    with write_transaction(db_file, timings) as conn:
+        conn.execute("""
+        UPDATE press_machines SET production_group=?, updated_at=? WHERE db_id=?
+        """, (rng.choice([1, 2, 3]), datetime.now().strftime('%Y-%m-%d %H:%M:%S'), rng.choice(machine_ids)))
+    return timings['lock_wait']
+
+
+def load_maintenance(db_file, machine_ids, rng):
+    conn = connect(db_file)
+    try:
+        conn.execute(f"{MAINTENANCE_SELECT} ORDER BY m.maintenance_datetime DESC").fetchall()
+    finally:
+        conn.close()
+    return 0.0
+
+
+def update_analysis(db_file, machine_ids, rng):
+    # 分析タブと同じ集計（reporting.queries）
+    conn = connect(db_file)
+    try:
+        statistics(conn)
+    finally:
+        conn.close()
+    return 0.0
+
+
+OPERATIONS = {
+    'add_maintenance': add_maintenance,
+    'edit_machine': edit_machine,
+    'load_maintenance': load_maintenance,
+    'update_analysis': update_analysis,
+}
+
+
+def worker(db_file, duration, mix, seed, synchronous, busy_timeout, result_queue):
+    """指定時間のあいだ操作を繰り返し、操作ごとのレイテンシとエラーを返す"""
+    shared_db.SYNCHRONOUS = synchronous
+    shared_db.BUSY_TIMEOUT_SECONDS = busy_timeout
+    rng = random.Random(seed)
+    conn = connect(db_file)
+    machine_ids = [row[0] for row in conn.execute("SELECT db_id FROM press_machines")]
+    conn.close()
+
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    stats = {name: {'latencies': [], 'lock_waits': [], 'busy': 0, 'errors': 0} for name in names}
+
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            lock_wait = OPERATIONS[name](db_file, machine_ids, rng)
+        except sqlite3.OperationalError as e:
+            if is_busy_error(e):
+                stats[name]['busy'] += 1
+            else:
+                stats[name]['errors'] += 1
+            continue
+        stats[name]['latencies'].append(time.perf_counter() - started)
+        stats[name]['lock_waits'].append(lock_wait)
+
+    result_queue.put(stats)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def run_scenario(db_file, processes, duration, journal_mode, synchronous, busy_timeout, mix):
+    """1条件（プロセス数・ジャーナルモード・同期設定）を実行して集計"""
+    # journal_mode はDBファイルに記録される。synchronous は接続ごとの設定なので各プロセスで設定する
+    conn = sqlite3.connect(db_file)
+    conn.execute(f"PRAGMA journal_mode={journal_mode}")
+    conn.close()
+
+    result_queue = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=worker,
+                                args=(db_file, duration, mix, seed, synchronous, busy_timeout, result_queue))
+        for seed in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    results = [result_queue.get() for _ in workers]
+    for process in workers:
+        process.join()
+
+    summary = {
+        'processes': processes,
+        'journal_mode': journal_mode,
+        'synchronous': synchronous,
+        'operations': {},
+    }
+    total_ok = 0
+    total_busy = 0
+    total_lock_wait = 0.0
+    for name in mix:
+        latencies = sorted(latency for result in results for latency in result[name]['latencies'])
+        lock_waits = sorted(wait for result in results for wait in result[name]['lock_waits'])
+        total_lock_wait += sum(lock_waits)
+        busy = sum(result[name]['busy'] for result in results)
+        errors = sum(result[name]['errors'] for result in results)
+        attempts = len(latencies) + busy + errors
+        total_ok += len(latencies)
+        total_busy += busy
+        summary['operations'][name] = {
+            'count': len(latencies),
+            'busy_rate': busy / attempts if attempts else 0.0,
+            'errors': errors,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+            'lock_wait_p95_ms': percentile(lock_waits, 0.95) * 1000,
+        }
+    summary['throughput_ops'] = total_ok / duration
+    summary['busy_rate'] = total_busy / (total_ok + total_busy) if total_ok + total_busy else 0.0
+    # 全プロセスの稼働時間のうちロック待ちに費やした割合
+    summary['lock_wait_ratio'] = total_lock_wait / (duration * processes)
+    return summary
+
+
+def print_summary(summary):
+    print(f"\n=== {summary['processes']}プロセス / journal_mode={summary['journal_mode']} "
+          f"/ synchronous={summary['synchronous']} ===")
+    print(f"  スループット: {summary['throughput_ops']:.1f} ops/s   SQLITE_BUSY率: {summary['busy_rate']:.2%}"
+          f"   ロック待ち割合: {summary['lock_wait_ratio']:.2%}")
+    print(f"  {'操作':18s} {'件数':>7s} {'BUSY率':>8s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'最大':>9s} {'ロック待ちp95':>9s}")
+    for name, op in summary['operations'].items():
+        print(f"  {name:18s} {op['count']:7d} {op['busy_rate']:8.2%} {op['p50_ms']:7.1f}ms "
+              f"{op['p95_ms']:7.1f}ms {op['p99_ms']:7.1f}ms {op['max_ms']:7.1f}ms {op['lock_wait_p95_ms']:7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="共有DBの同時書き込み負荷テスト")
+    parser.add_argument('--db', default='press_machine.db', help="元にするDB（コピーして使う）")
+    parser.add_argument('--workdir', help="コピー先ディレクトリ（共有ドライブ上で測る場合に指定）")
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--duration', type=float, default=10.0, help="1条件あたりの秒数")
+    parser.add_argument('--journal-modes', nargs='+', default=['delete'])
+    parser.add_argument('--synchronous', nargs='+', default=['full'])
+    parser.add_argument('--busy-timeout', type=float, default=shared_db.BUSY_TIMEOUT_SECONDS,
+                        help="ビジータイムアウト（秒）。小さくすると SQLITE_BUSY が表面化しやすい")
+    parser.add_argument('--mix', type=json.loads, default=DEFAULT_MIX, help="操作の構成比（JSON）")
+    parser.add_argument('--json', help="結果をJSONで保存するファイル")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='press_load_')
+    results = []
+    for journal_mode in args.journal_modes:
+        for synchronous in args.synchronous:
+            for processes in args.processes:
+                # 条件ごとに元DBのコピーから始める
+                db_file = os.path.join(workdir, 'load_test.db')
+                for suffix in ('', '-wal', '-shm', '-journal'):
+                    if os.path.exists(db_file + suffix):
+                        os.remove(db_file + suffix)
+                shutil.copyfile(args.db, db_file)
+                ensure_schema(db_file)
+
+                summary = run_scenario(db_file, processes, args.duration, journal_mode, synchronous,
+                                       args.busy_timeout, args.mix)
+                print_summary(summary)
+                results.append(summary)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+プレス機ディレクトリのキャッシュ
+メンテナンス記録ダイアログのプレス機選択で使う一覧と前方一致検索インデックスを保持する
+"""
+from shared_db import connect
+
+
+class _TrieNode:
+    __slots__ = ('children', 'ids')
+
+    def __init__(self):
+        self.children = {}
+        self.ids = []
+
+
+class MachineDirectory:
+    """プレス機一覧のキャッシュ（機械番号・設備番号・型式で前方一致検索）"""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._machines = None
+        self._order = None
+        self._root = None
+
+    def invalidate(self):
+        """キャッシュを破棄（プレス機の追加・編集・削除時に呼ぶ）"""
+        self._machines = None
+        self._order = None
+        self._root = None
+
+    def _ensure_loaded(self):
+        if self._machines is not None:
+            return
+
+        conn = connect(self.db_file)
+        try:
+            rows = conn.execute("""
+            SELECT db_id, machine_number, equipment_number, model_type
+            FROM press_machines ORDER BY machine_number, db_id
+            """).fetchall()
+        finally:
+            conn.close()
+
+        machines = {}
+        order = []
+        root = _TrieNode()
+        for db_id, machine_number, equipment_number, model_type in rows:
+            machines[db_id] = (machine_number, equipment_number, model_type)
+            order.append(db_id)
+
+            # 各検索キーの経路上のノードにIDを積む（一覧順を保つ）
+            keys = {str(key).strip().lower() for key in (machine_number, equipment_number, model_type) if key}
+            for key in keys:
+                node = root
+                for char in key:
+                    node = node.children.setdefault(char, _TrieNode())
+                    # 同じ機械の複数キーが経路を共有する場合の重複を防ぐ
+                    if not node.ids or node.ids[-1] != db_id:
+                        node.ids.append(db_id)
+
+        self._machines = machines
+        self._order = order
+        self._root = root
+
+    def get(self, db_id):
+        """db_id から (機械番号, 設備番号, 型式) を取得"""
+        self._ensure_loaded()
+        return self._machines.get(db_id)
+
+    def label(self, db_id):
+        """選択肢の表示文字列"""
+        machine_number, equipment_number, model_type = self.get(db_id)
+        return f"{machine_number} / {equipment_number or '-'} / {model_type or '-'}"
+
+    def search(self, text, limit=100):
+        """機械番号・設備番号・型式の前方一致で db_id のリストを返す"""
+        self._ensure_loaded()
+        prefix = text.strip().lower()
+        if not prefix:
+            return self._order[:limit]
+
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+
+        return node.ids[:limit]
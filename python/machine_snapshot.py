@@ -0,0 +1,145 @@
+"""
+プレス機一覧のローカルスナップショット
+共有ドライブ上の DB を開いて一覧を読むまで画面が空にならないよう、一覧の行（最終点検日を含む）を
+ローカルのファイルに保存しておき、起動時はメモリマップで読んですぐに表示する。
+DB との差分はバックグラウンドで table_versions を比べて確認する
+
+ファイル形式（リトルエンディアン）
+  ヘッダー  : マジック(8) 行数(u32) 列数(u32) バージョン数(u32)
+  バージョン: (テーブル名の長さ u16, テーブル名, 変更カウンタ i64) × バージョン数
+  オフセット: データ部の各行の開始位置 u32 × (行数 + 1)
+  データ部  : 各行の列を 型(1) + 値 で並べる（None / 整数 i64 / 実数 f64 / 文字列 u32長さ + UTF-8）
+行の位置が引けるので、必要な行だけを取り出すこともできる
+"""
+import hashlib
+import mmap
+import os
+import struct
+
+from shared_db import local_data_dir
+
+MAGIC = b'PMSNAP01'
+HEADER = struct.Struct('<8sIII')
+NAME_LENGTH = struct.Struct('<H')
+VERSION = struct.Struct('<q')
+OFFSET = struct.Struct('<I')
+TAG = struct.Struct('<B')
+INTEGER = struct.Struct('<q')
+REAL = struct.Struct('<d')
+LENGTH = struct.Struct('<I')
+
+NONE, INT, FLOAT, TEXT = range(4)
+
+
+def snapshot_path(db_file):
+    """DB ごとのスナップショットのパス（共有ドライブではなく利用者のローカルに置く）"""
+    key = hashlib.sha1(os.path.abspath(db_file).encode('utf-8')).hexdigest()[:16]
+    return local_data_dir(f'machines_{key}.snapshot')
+
+
+def _encode_value(value):
+    if value is None:
+        return TAG.pack(NONE)
+    if isinstance(value, int):
+        return TAG.pack(INT) + INTEGER.pack(value)
+    if isinstance(value, float):
+        return TAG.pack(FLOAT) + REAL.pack(value)
+    data = str(value).encode('utf-8')
+    return TAG.pack(TEXT) + LENGTH.pack(len(data)) + data
+
+
+def write_snapshot(path, versions, rows):
+    """rows（同じ列数のタプルのリスト）と取得時点の table_versions を保存（一時ファイルから置き換え）"""
+    rows = list(rows)
+    columns = len(rows[0]) if rows else 0
+    parts = [HEADER.pack(MAGIC, len(rows), columns, len(versions))]
+    for table, version in sorted(versions.items()):
+        name = table.encode('utf-8')
+        parts.append(NAME_LENGTH.pack(len(name)) + name + VERSION.pack(version))
+
+    data = []
+    offsets = [0]
+    for row in rows:
+        encoded = b''.join(_encode_value(value) for value in row)
+        data.append(encoded)
+        offsets.append(offsets[-1] + len(encoded))
+    parts.append(b''.join(OFFSET.pack(offset) for offset in offsets))
+    parts.extend(data)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + '.partial'
+    with open(partial, 'wb') as f:
+        f.write(b''.join(parts))
+    os.replace(partial, path)
+
+
+class MachineSnapshot:
+    """メモリマップしたスナップショット（with で使い、終わったら閉じる）"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, self.row_count, self.column_count, version_count = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC:
+                raise ValueError(f"スナップショットの形式が違います: {path}")
+            position = HEADER.size
+            self.versions = {}
+            for _ in range(version_count):
+                length, = NAME_LENGTH.unpack_from(self.map, position)
+                position += NAME_LENGTH.size
+                table = self.map[position:position + length].decode('utf-8')
+                position += length
+                self.versions[table], = VERSION.unpack_from(self.map, position)
+                position += VERSION.size
+            self.offsets_at = position
+            self.data_at = position + OFFSET.size * (self.row_count + 1)
+        except Exception:
+            self.map.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.map.close()
+
+    def __len__(self):
+        return self.row_count
+
+    def row(self, index):
+        """index 番目の行をタプルで返す"""
+        position = self.data_at + OFFSET.unpack_from(self.map, self.offsets_at + OFFSET.size * index)[0]
+        values = []
+        for _ in range(self.column_count):
+            tag, = TAG.unpack_from(self.map, position)
+            position += TAG.size
+            if tag == INT:
+                values.append(INTEGER.unpack_from(self.map, position)[0])
+                position += INTEGER.size
+            elif tag == FLOAT:
+                values.append(REAL.unpack_from(self.map, position)[0])
+                position += REAL.size
+            elif tag == TEXT:
+                length, = LENGTH.unpack_from(self.map, position)
+                position += LENGTH.size
+                values.append(self.map[position:position + length].decode('utf-8'))
+                position += length
+            else:
+                values.append(None)
+        return tuple(values)
+
+    def rows(self):
+        return [self.row(i) for i in range(self.row_count)]
+
+
+def read_snapshot(path):
+    """-> (table_versions, 行のリスト)。ファイルがない・壊れている場合は None"""
+    try:
+        with MachineSnapshot(path) as snapshot:
+            return snapshot.versions, snapshot.rows()
+    except (OSError, ValueError, struct.error, UnicodeDecodeError):
+        return None
@@ -0,0 +1,169 @@
+"""
+データ分析タブのピボット集計ウィンドウ
+行（2つまで）・列・値を選ぶと reporting.pivot.MaintenanceCube で集計して表に表示する。
+キューブはアプリが1つ持ち続け、表示のたびに change_log の差分だけを反映する。
+DB の読み込み（初回は全件）はバックグラウンドスレッドで行い、その間キューブには触れない
+"""
+import sqlite3
+import threading
+import time
+import tkinter as tk
+from tkinter import ttk
+
+from reporting.pivot import DIMENSIONS, MEASURES
+from shared_db import connect
+
+NONE_LABEL = "（なし）"
+DIMENSION_CHOICES = [NONE_LABEL] + [label for label, _ in DIMENSIONS.values()]
+DIMENSION_BY_LABEL = {label: name for name, (label, _) in DIMENSIONS.items()}
+MEASURE_BY_LABEL = {label: name for name, label in MEASURES.items()}
+SOURCE_LABELS = {'cube': "キューブ", 'records': "記録の明細"}
+
+TOTAL_LABEL = "合計"
+# バックグラウンドの読み込みの完了を確認する間隔
+LOAD_POLL_INTERVAL_MS = 50
+LABEL_COLUMN_WIDTH = 140
+VALUE_COLUMN_WIDTH = 90
+
+
+class PivotDialog:
+    """ピボット集計（1つのウィンドウを使い回す。閉じても隠すだけなので、読み込み中のスレッドは1つだけ）"""
+
+    def __init__(self, parent, db_file, cube):
+        self.db_file = db_file
+        self.cube = cube
+        self.loader = None
+        self.load_error = None
+        self.load_started = None
+        # 読み込み中に依頼された反映（終わってからもう一度反映する）
+        self.refresh_pending = False
+
+        self.window = tk.Toplevel(parent)
+        self.window.title("ピボット集計")
+        self.window.geometry("960x560")
+        self.window.protocol("WM_DELETE_WINDOW", self.window.withdraw)
+
+        controls = tk.Frame(self.window, padx=16, pady=12)
+        controls.pack(fill=tk.X)
+        self.row_vars = [tk.StringVar(value=DIMENSIONS['manufacturer'][0]), tk.StringVar(value=NONE_LABEL)]
+        self.column_var = tk.StringVar(value=DIMENSIONS['judgment'][0])
+        self.measure_var = tk.StringVar(value=MEASURES['records'])
+        for label, variable, values in (("行", self.row_vars[0], DIMENSION_CHOICES[1:]),
+                                        ("行2", self.row_vars[1], DIMENSION_CHOICES),
+                                        ("列", self.column_var, DIMENSION_CHOICES),
+                                        ("値", self.measure_var, list(MEASURES.values()))):
+            tk.Label(controls, text=f"{label}:", font=('Segoe UI', 10)).pack(side=tk.LEFT, padx=(0, 4))
+            combo = ttk.Combobox(controls, textvariable=variable, values=values, state='readonly', width=14)
+            combo.pack(side=tk.LEFT, padx=(0, 12))
+            combo.bind('<<ComboboxSelected>>', lambda event: self.show_pivot())
+        self.status_var = tk.StringVar()
+        tk.Label(controls, textvariable=self.status_var, font=('Segoe UI', 9), fg='#64748b').pack(side=tk.RIGHT)
+
+        table_frame = tk.Frame(self.window, padx=16)
+        table_frame.pack(fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(table_frame, show='headings')
+        v_scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        h_scrollbar = ttk.Scrollbar(table_frame, orient=tk.HORIZONTAL, command=self.tree.xview)
+        self.tree.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
+        v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        h_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.tree.tag_configure('total', background='#f1f5f9')
+
+        tk.Button(self.window, text="閉じる", command=self.window.withdraw,
+                 bg='#95a5a6', fg='white', font=('Arial', 10, 'bold')).pack(pady=10)
+
+    def exists(self):
+        return bool(self.window.winfo_exists())
+
+    def is_open(self):
+        return self.exists() and self.window.state() != 'withdrawn'
+
+    def show(self):
+        self.window.deiconify()
+        self.window.lift()
+        self.refresh()
+
+    @property
+    def loading(self):
+        return self.loader is not None and self.loader.is_alive()
+
+    def selection(self):
+        rows = [DIMENSION_BY_LABEL[variable.get()] for variable in self.row_vars if variable.get() != NONE_LABEL]
+        columns = [DIMENSION_BY_LABEL[self.column_var.get()]] if self.column_var.get() != NONE_LABEL else []
+        return tuple(dict.fromkeys(rows)), tuple(column for column in columns if column not in rows), \
+            MEASURE_BY_LABEL[self.measure_var.get()]
+
+    def refresh(self):
+        """変更をバックグラウンドで反映してから集計し直す（読み込み中なら、終わってからもう一度反映する）"""
+        if self.loading:
+            self.refresh_pending = True
+            return
+        self.refresh_pending = False
+        self.load_error = None
+        self.load_started = time.perf_counter()
+        if self.cube.seq is None:
+            self.status_var.set("記録を読み込んでいます...")
+        self.loader = threading.Thread(target=self._load, name='pivot-load', daemon=True)
+        self.loader.start()
+        self.window.after(LOAD_POLL_INTERVAL_MS, self._poll_load)
+
+    def _load(self):
+        """キューブに change_log の差分（初回は全件）を反映する（バックグラウンドスレッド）"""
+        try:
+            conn = connect(self.db_file)
+            try:
+                self.cube.refresh(conn)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self.load_error = e
+
+    def _poll_load(self):
+        if not self.exists():
+            return
+        if self.loading:
+            self.window.after(LOAD_POLL_INTERVAL_MS, self._poll_load)
+            return
+        if self.load_error is not None:
+            self.status_var.set(f"⚠ 読み込めませんでした: {self.load_error}")
+            return
+        load_ms = (time.perf_counter() - self.load_started) * 1000
+        self.show_pivot(load_ms)
+        if self.refresh_pending:
+            self.refresh()
+
+    def show_pivot(self, load_ms=None):
+        """選んだ項目で集計して表示（同じ版・同じ指定の集計はキューブのキャッシュを使う）"""
+        if self.loading:
+            # 読み込みが終わったら今の指定で表示する
+            return
+        started = time.perf_counter()
+        rows, columns, measure = self.selection()
+        table = self.cube.pivot(rows, columns, measure)
+        self.show_table(rows, table)
+        status = (f"{SOURCE_LABELS[table.source]}から集計  記録 {len(self.cube):,}件  "
+                  f"{(time.perf_counter() - started) * 1000:.0f}ms")
+        if load_ms is not None:
+            status += f"（読み込み {load_ms:.0f}ms）"
+        self.status_var.set(status)
+
+    def show_table(self, rows, table):
+        label_headings = [DIMENSIONS[dimension][0] for dimension in rows]
+        value_headings = [" / ".join(labels) for labels in table.column_labels]
+        headings = label_headings + value_headings + ([TOTAL_LABEL] if len(value_headings) > 1 else [])
+        identifiers = [f'c{i}' for i in range(len(headings))]
+
+        self.tree.delete(*self.tree.get_children())
+        self.tree.configure(columns=identifiers)
+        for i, (identifier, heading) in enumerate(zip(identifiers, headings)):
+            is_label = i < len(label_headings)
+            self.tree.heading(identifier, text=heading)
+            self.tree.column(identifier, width=LABEL_COLUMN_WIDTH if is_label else VALUE_COLUMN_WIDTH,
+                             anchor='w' if is_label else 'e', stretch=False)
+
+        with_total = len(value_headings) > 1
+        for labels, values, total in zip(table.row_labels, table.values.tolist(), table.row_totals.tolist()):
+            self.tree.insert('', tk.END, values=list(labels) + values + ([total] if with_total else []))
+        totals = table.column_totals.tolist() + ([table.total] if with_total else [])
+        self.tree.insert('', tk.END, values=[TOTAL_LABEL] + [''] * (len(rows) - 1) + totals, tags=('total',))
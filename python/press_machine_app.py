@@ -1,10 +1,61 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
+from tkinter import ttk, messagebox, simpledialog, filedialog
 import sqlite3
 from datetime import datetime
 import os
+import threading
 from tkinter import font as tkFont
 
+from audit_history import ensure_audit
+from backup import BackupService
+from db_maintenance import IdleMaintenanceService
+from export_data import ExportCancelled, export, xlsx_available
+from machine_directory import MachineDirectory
+from machine_snapshot import read_snapshot, snapshot_path, write_snapshot
+from print_spooler import BACKEND_LABELS, STATUS_LABELS, PrintSpooler, default_backend
+from reporting import (
+    MACHINE_LIST_SELECT, MACHINE_ORDER_BY, MACHINE_SELECT, MAINTENANCE_COLUMNS, MAINTENANCE_LIST_SELECT,
+    MAINTENANCE_SELECT, group_type_counts,
+    latest_maintenance, latest_maintenance_text, machine_count, machine_list_text, machine_print_stats_text,
+    machine_search_filter, machine_stats, machine_stats_text, maintenance_count, maintenance_list_text,
+    maintenance_order_by, maintenance_stats_text, statistics_header, valve_counts, valve_stats_text,
+)
+from pivot_view import PivotDialog
+from reporting.pivot import MaintenanceCube
+from result_cache import ResultCache
+from shared_db import (
+    ChangeWatcher, ConflictError, connect, ensure_schema, fetch_by_ids, table_versions, update_with_version,
+    write_transaction,
+)
+from spec_index import SPEC_FIELDS, SpecIndex
+from trend_chart import TrendPanel
+from tree_sort import CachedSort, SortOrder, bind_heading_sort
+
+# 他のインスタンスの変更を確認する間隔
+CHANGE_POLL_INTERVAL_MS = 2000
+
+# 起動時の DB の準備（バックグラウンド）の完了を確認する間隔
+STARTUP_POLL_INTERVAL_MS = 50
+
+# 操作がない間の DB の保守の開始・完了を確認する間隔
+IDLE_MAINTENANCE_POLL_INTERVAL_MS = 5000
+
+# 印刷キューの状態を表示する間隔
+PRINT_QUEUE_POLL_INTERVAL_MS = 1000
+
+# メンテナンス記録の印刷プレビューに表示する件数の上限（超える場合、印刷する本文は印刷キューで作成する）
+PRINT_PREVIEW_MAX_RECORDS = 5000
+
+# プレス機一覧の列 -> MACHINE_SELECT の列（row_version は表示しない）
+MACHINE_VIEW_COLUMNS = tuple(range(10)) + (11,)
+
+# 編集ダイアログの結果に対応するカラム
+MACHINE_EDIT_COLUMNS = ('machine_number', 'equipment_number', 'manufacturer', 'model_type',
+                        'serial_number', 'machine_type', 'production_group')
+MAINTENANCE_EDIT_COLUMNS = ('db_id', 'maintenance_datetime', 'overall_judgment',
+                            'clutch_valve_replacement', 'brake_valve_replacement', 'remarks')
+
+
 class PressManagementApp:
     def __init__(self, root):
         self.root = root
@@ -14,14 +65,132 @@ class PressManagementApp:
         self.root.state('zoomed')  # Windows で最大化
         
         self.db_file = 'press_machine.db'
+        self.machine_directory = MachineDirectory(self.db_file)
+        self.spec_index = None
+        self.machine_versions = {}
+        self.maintenance_versions = {}
+        # 一覧の並べ替え（プレス機は読み込み済みの行を並べ替え、メンテナンス記録は SQL で並べ替える）
+        self.machine_sort = SortOrder()
+        self.machine_rows = CachedSort()
+        self.maintenance_sort = SortOrder()
+        
+        self.watcher = None
         
         # データベース接続確認
         if not os.path.exists(self.db_file):
             messagebox.showerror("エラー", "データベースファイルが見つかりません。\nsetup_database.py を実行してください。")
             return
         
+        self.result_cache = ResultCache(self.db_file)
+        # ピボット集計のキューブ（ウィンドウを閉じても残し、次回は差分だけ反映する）
+        self.maintenance_cube = MaintenanceCube()
+        self.pivot_dialog = None
+        self.backup_service = BackupService(self.db_file)
+        self.idle_maintenance = IdleMaintenanceService(self.db_file)
+        self.idle_maintenance_running = False
+        self.print_spooler = PrintSpooler()
+        self.print_preview = None
+        self.print_queue_dialog = None
+        # ジョブID -> 前回表示した時点の状態（完了・失敗を知らせるため）
+        self.print_job_states = {}
+        self.print_message = ""
+        self.snapshot_file = snapshot_path(self.db_file)
+        self.snapshot_versions = None
+        
         self.create_widgets()
-        self.refresh_data()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        # 操作があれば保守の開始を遅らせ、実行中の保守は中断する
+        for sequence in ('<Any-KeyPress>', '<Any-ButtonPress>', '<MouseWheel>', '<Motion>'):
+            self.root.bind_all(sequence, self.idle_maintenance.touch, add='+')
+        
+        # 前回までに登録された未完了の印刷ジョブもここから出力する
+        self.print_spooler.start()
+        self.root.after(PRINT_QUEUE_POLL_INTERVAL_MS, self.poll_print_queue)
+        
+        # 前回のスナップショットで一覧をすぐに表示し、DB の準備と差分の確認はバックグラウンドで行う
+        snapshot = read_snapshot(self.snapshot_file)
+        if snapshot is not None:
+            self.snapshot_versions, rows = snapshot
+            self.show_machines(rows)
+        self.startup_result = None
+        self.startup_thread = threading.Thread(target=self.prepare_database, daemon=True)
+        self.startup_thread.start()
+        self.root.after(STARTUP_POLL_INTERVAL_MS, self.poll_startup)
+    
+    def prepare_database(self):
+        """スキーマの準備とスナップショットの確認（バックグラウンドスレッド）
+        
+        結果は startup_result に (table_versions, change_log の seq, 行 または None) で置く。
+        カウンタ・seq・行は1つの読み取りトランザクションで読むので、同じ時点の内容がそろう
+        （途中で他のインスタンスがコミットしても、カウンタだけ古い・seq だけ新しいということがない）
+        """
+        try:
+            # 楽観的排他制御・変更通知用のカラムとトリガー、監査用の変更履歴を用意
+            ensure_schema(self.db_file)
+            ensure_audit(self.db_file)
+            
+            conn = connect(self.db_file)
+            try:
+                conn.execute("BEGIN")
+                versions = table_versions(conn)
+                seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+                rows = None
+                if versions != self.snapshot_versions:
+                    rows = conn.execute(f"{MACHINE_SELECT} ORDER BY db_id").fetchall()
+                conn.commit()
+            finally:
+                conn.close()
+            self.startup_result = (versions, seq, rows)
+        except Exception as e:
+            # スナップショット・履歴の準備での OSError なども、結果を置かないと監視が始まらない
+            self.startup_result = e
+    
+    def poll_startup(self):
+        """DB の準備が終わったら一覧を最新にし、変更の監視を始める"""
+        if self.startup_thread.is_alive():
+            self.root.after(STARTUP_POLL_INTERVAL_MS, self.poll_startup)
+            return
+        
+        if isinstance(self.startup_result, Exception):
+            messagebox.showerror("エラー", f"データベースを開けません: {self.startup_result}")
+            return
+        
+        versions, seq, rows = self.startup_result
+        if rows is not None and not self.search_var.get():
+            self.show_machines(rows)
+            self.save_snapshot(versions)
+        elif rows is not None:
+            self.on_search_change()
+        self.load_maintenance()
+        self.update_analysis()
+        
+        # 他のインスタンスの変更を監視（DB を読んだ時点以降の変更から）
+        self.watcher = ChangeWatcher(self.db_file, since=seq)
+        self.root.after(CHANGE_POLL_INTERVAL_MS, self.poll_changes)
+        self.root.after(IDLE_MAINTENANCE_POLL_INTERVAL_MS, self.poll_idle_maintenance)
+    
+    def save_snapshot(self, versions):
+        """表示中のプレス機一覧をスナップショットに保存（検索中は一部の行しかないので保存しない）"""
+        if versions is None or self.search_var.get():
+            return
+        try:
+            write_snapshot(self.snapshot_file, versions, self.machine_rows.rows())
+            self.snapshot_versions = versions
+        except OSError:
+            # スナップショットは起動を速くするためだけのものなので、保存できなくても続行
+            pass
+    
+    def on_close(self):
+        """終了時にスナップショットを保存"""
+        # 実行中の保守があれば中断させる
+        self.idle_maintenance.touch()
+        # 未完了の印刷ジョブはキューに残り、次の起動時に出力する
+        self.print_spooler.stop()
+        if self.watcher is not None:
+            self.save_snapshot(self.snapshot_versions)
+            self.watcher.close()
+        self.result_cache.close()
+        self.root.destroy()
     
     def create_widgets(self):
         # メインフレーム - 画面サイズに応じた適応的な余白を設定
@@ -42,6 +211,17 @@ class PressManagementApp:
                                 font=('Yu Gothic UI', 14), bg='#ffffff', fg='#64748b')
         subtitle_label.pack(anchor='w', pady=(4, 0))
         
+        # 印刷キューの状態 - タイトルの右側
+        queue_frame = tk.Frame(title_frame, bg='#ffffff')
+        queue_frame.place(relx=1.0, rely=0.0, anchor='ne')
+        self.print_status_var = tk.StringVar()
+        tk.Label(queue_frame, textvariable=self.print_status_var, font=('Segoe UI', 10),
+                bg='#ffffff', fg='#64748b').pack(side=tk.LEFT, padx=(0, 8))
+        tk.Button(queue_frame, text="印刷キュー", command=self.show_print_queue,
+                 font=('Segoe UI', 10), relief=tk.FLAT, bd=1, padx=12, pady=6,
+                 bg='#ffffff', fg='#374151', activebackground='#f9fafb',
+                 activeforeground='#374151').pack(side=tk.LEFT)
+        
         # ノートブック（タブ）スタイル設定 - shadcn/UI: クリーンなタブ（左寄せ）
         self.style = ttk.Style()
         self.style.theme_use('clam')
@@ -133,10 +313,14 @@ class PressManagementApp:
                  **button_config_secondary).pack(side=tk.LEFT, padx=(0, 8))
         tk.Button(button_frame, text="削除", command=self.delete_machine,
                  **button_config_secondary).pack(side=tk.LEFT, padx=(0, 8))
-        tk.Button(button_frame, text="更新", command=self.refresh_data,
+        tk.Button(button_frame, text="更新", command=self.reload_data,
                  **button_config_secondary).pack(side=tk.LEFT, padx=(0, 8))
         tk.Button(button_frame, text="印刷", command=self.print_machine_list,
                  **button_config_secondary).pack(side=tk.LEFT, padx=(0, 8))
+        tk.Button(button_frame, text="能力検索", command=self.search_by_spec,
+                 **button_config_secondary).pack(side=tk.LEFT, padx=(0, 8))
+        tk.Button(button_frame, text="エクスポート", command=lambda: self.export_data('machines'),
+                 **button_config_secondary).pack(side=tk.LEFT, padx=(0, 8))
         
         # 右側: 検索エリア
         search_frame = tk.Frame(action_frame, bg='#ffffff')
@@ -170,8 +354,10 @@ class PressManagementApp:
         list_frame = tk.Frame(table_container, bg='#f8fafc', relief=tk.SOLID, bd=1)
         list_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 8))
         
-        columns = ('ID', '製造番号', '設備番号', 'メーカー', '型式', 'シリアル番号', '種別', 'グループ', 'トン数', '登録日')
-        self.machine_tree = ttk.Treeview(list_frame, columns=columns, show='headings', height=22)
+        columns = ('ID', '製造番号', '設備番号', 'メーカー', '型式', 'シリアル番号', '種別', 'グループ', 'トン数', '登録日',
+                   '最終点検')
+        self.machine_tree = ttk.Treeview(list_frame, columns=columns, show='headings',
+                                         selectmode='extended', height=22)
         
         # shadcn/UI: Treeviewスタイル - 交互行背景色とクリーンなデザイン
         self.style.configure('Treeview', 
@@ -206,7 +392,8 @@ class PressManagementApp:
             '種別': {'width': 40, 'minwidth': 35, 'maxwidth': 55},
             'グループ': {'width': 50, 'minwidth': 40, 'maxwidth': 65},
             'トン数': {'width': 45, 'minwidth': 40, 'maxwidth': 60},
-            '登録日': {'width': 90, 'minwidth': 80, 'maxwidth': 120}
+            '登録日': {'width': 90, 'minwidth': 80, 'maxwidth': 120},
+            '最終点検': {'width': 90, 'minwidth': 80, 'maxwidth': 120}
         }
         
         for col in columns:
@@ -218,6 +405,10 @@ class PressManagementApp:
                                    anchor='w',
                                    stretch=True)
         
+        # 見出しのクリックで並べ替え（Shift+クリックで第2キー以降に追加）
+        self.machine_columns = columns
+        bind_heading_sort(self.machine_tree, self.sort_machines)
+        
         # 縦スクロールバーのみ - スタイリング改善
         scrollbar_v = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.machine_tree.yview)
         self.machine_tree.configure(yscrollcommand=scrollbar_v.set)
@@ -285,6 +476,8 @@ class PressManagementApp:
                  **button_config_secondary).pack(side=tk.LEFT, padx=(0, 8))
         tk.Button(action_frame, text="印刷", command=self.print_maintenance_list,
                  **button_config_secondary).pack(side=tk.LEFT, padx=(0, 8))
+        tk.Button(action_frame, text="エクスポート", command=lambda: self.export_data('maintenance'),
+                 **button_config_secondary).pack(side=tk.LEFT, padx=(0, 8))
         
         # テーブルコンテナ - コンテンツ内余白調整
         table_container = tk.Frame(maintenance_frame, bg='#ffffff')
@@ -297,7 +490,8 @@ class PressManagementApp:
         maintenance_list_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 8))
         
         m_columns = ('記録ID', '機械番号', 'メンテナンス日時', '総合判定', 'クラッチ弁', 'ブレーキ弁', '備考')
-        self.maintenance_tree = ttk.Treeview(maintenance_list_frame, columns=m_columns, show='headings', height=18)
+        self.maintenance_tree = ttk.Treeview(maintenance_list_frame, columns=m_columns, show='headings',
+                                             selectmode='extended', height=18)
         
         # カラム設定 - レスポンシブ対応で最小・最大幅を設定
         m_column_config = {
@@ -319,6 +513,9 @@ class PressManagementApp:
                                        anchor='w',
                                        stretch=True)
         
+        self.maintenance_columns = m_columns
+        bind_heading_sort(self.maintenance_tree, self.sort_maintenance)
+        
         # 交互行の背景色設定
         self.maintenance_tree.tag_configure('oddrow', background='#ffffff')
         self.maintenance_tree.tag_configure('evenrow', background='#f8fafc')
@@ -348,6 +545,28 @@ class PressManagementApp:
                  font=('Segoe UI', 10), relief=tk.FLAT, bd=0, padx=16, pady=8,
                  bg='#0f172a', fg='#ffffff', activebackground='#1e293b',
                  activeforeground='#ffffff').pack(side=tk.LEFT)
+        tk.Button(action_frame, text="ピボット集計", command=self.show_pivot,
+                 font=('Segoe UI', 10), relief=tk.FLAT, bd=1, padx=16, pady=8,
+                 bg='#ffffff', fg='#374151', activebackground='#f9fafb',
+                 activeforeground='#374151').pack(side=tk.LEFT, padx=(8, 0))
+        tk.Button(action_frame, text="エクスポート", command=lambda: self.export_data('statistics'),
+                 font=('Segoe UI', 10), relief=tk.FLAT, bd=1, padx=16, pady=8,
+                 bg='#ffffff', fg='#374151', activebackground='#f9fafb',
+                 activeforeground='#374151').pack(side=tk.LEFT, padx=(8, 0))
+        tk.Button(action_frame, text="バックアップ", command=self.start_backup,
+                 font=('Segoe UI', 10), relief=tk.FLAT, bd=1, padx=16, pady=8,
+                 bg='#ffffff', fg='#374151', activebackground='#f9fafb',
+                 activeforeground='#374151').pack(side=tk.LEFT, padx=(8, 0))
+        self.backup_status_var = tk.StringVar()
+        tk.Label(action_frame, textvariable=self.backup_status_var, font=('Segoe UI', 10),
+                bg='#ffffff', fg='#64748b').pack(side=tk.LEFT, padx=(12, 0))
+        self.maintenance_status_var = tk.StringVar()
+        tk.Label(action_frame, textvariable=self.maintenance_status_var, font=('Segoe UI', 10),
+                bg='#ffffff', fg='#64748b').pack(side=tk.RIGHT)
+        
+        # 推移グラフ
+        self.trend_panel = TrendPanel(analysis_frame, self.db_file, self.result_cache, height=280)
+        self.trend_panel.pack(fill=tk.X, padx=40, pady=(8, 8))
         
         # 統計情報コンテナ - コンテンツ内余白調整
         stats_container = tk.Frame(analysis_frame, bg='#ffffff')
@@ -360,7 +579,7 @@ class PressManagementApp:
         stats_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 8))
         
         self.stats_text = tk.Text(stats_frame, font=('Segoe UI', 11), 
-                                 bg='#ffffff', fg='#0f172a', height=25,
+                                 bg='#ffffff', fg='#0f172a', height=12,
                                  relief=tk.FLAT, bd=0, padx=16, pady=16)
         
         # 縦スクロールバーのみ
@@ -376,141 +595,282 @@ class PressManagementApp:
         self.load_maintenance()
         self.update_analysis()
     
+    def reload_data(self):
+        """キャッシュを破棄してデータを再読み込み"""
+        self.invalidate_machine_caches()
+        self.refresh_data()
+    
+    def invalidate_machine_caches(self):
+        """プレス機に関するキャッシュを破棄"""
+        self.machine_directory.invalidate()
+        self.spec_index = None
+    
     def load_machines(self):
         """プレス機データを読み込み"""
-        for item in self.machine_tree.get_children():
-            self.machine_tree.delete(item)
-        
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         cursor = conn.cursor()
         
-        cursor.execute("""
-        SELECT db_id, machine_number, equipment_number, manufacturer, model_type, 
-               serial_number, machine_type, production_group, tonnage, created_at 
-        FROM press_machines ORDER BY db_id
-        """)
+        versions = table_versions(conn)
+        cursor.execute(f"{MACHINE_SELECT} ORDER BY db_id")
+        rows = cursor.fetchall()
         
-        for i, row in enumerate(cursor.fetchall()):
-            # 日付フォーマット調整
-            created_at = row[9][:16] if row[9] else ""
-            tonnage_str = f"{row[8]}t" if row[8] else ""
-            formatted_row = row[:8] + (tonnage_str,) + (created_at,)
-            
+        conn.close()
+        
+        self.show_machines(rows)
+        self.save_snapshot(versions)
+    
+    def show_machines(self, rows):
+        """プレス機一覧を rows（MACHINE_SELECT の行）で置き換える"""
+        for item in self.machine_tree.get_children():
+            self.machine_tree.delete(item)
+        self.machine_versions.clear()
+        self.machine_rows.clear()
+        
+        for i, row in enumerate(rows):
             # 交互行の背景色タグを設定
             tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-            self.machine_tree.insert('', tk.END, values=formatted_row, tags=(tag,))
+            self.show_machine_row(row, tag)
         
-        conn.close()
+        if self.machine_sort.keys:
+            self.apply_machine_sort()
+    
+    def show_machine_row(self, row, tag='evenrow'):
+        """プレス機の行を一覧に表示（既にあれば差し替え）し、row_version を記録"""
+        # 日付フォーマット調整
+        created_at = row[9][:16] if row[9] else ""
+        tonnage_str = f"{row[8]}t" if row[8] else ""
+        last_maintenance = row[11][:10] if row[11] else ""
+        formatted_row = tuple(row[:8]) + (tonnage_str,) + (created_at,) + (last_maintenance,)
+        
+        self.machine_versions[row[0]] = row[10]
+        iid = str(row[0])
+        self.machine_rows.put(iid, tuple(row))
+        if self.machine_tree.exists(iid):
+            self.machine_tree.item(iid, values=formatted_row)
+        else:
+            self.machine_tree.insert('', tk.END, iid=iid, values=formatted_row, tags=(tag,))
     
     def load_maintenance(self):
         """メンテナンス記録を読み込み"""
         for item in self.maintenance_tree.get_children():
             self.maintenance_tree.delete(item)
+        self.maintenance_versions.clear()
         
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         cursor = conn.cursor()
         
-        cursor.execute("""
-        SELECT m.maintenance_id, p.machine_number, m.maintenance_datetime,
-               m.overall_judgment, m.clutch_valve_replacement, m.brake_valve_replacement, m.remarks
-        FROM maintenance_records m
-        JOIN press_machines p ON m.db_id = p.db_id
-        ORDER BY m.maintenance_datetime DESC
-        """)
+        order_by = maintenance_order_by([(MAINTENANCE_COLUMNS[column], descending)
+                                         for column, descending in self.maintenance_sort.keys])
+        cursor.execute(f"{MAINTENANCE_SELECT} {order_by}")
         
         for i, row in enumerate(cursor.fetchall()):
-            # 日時フォーマット調整
-            datetime_str = row[2][:16] if row[2] else ""
-            formatted_row = (row[0], row[1], datetime_str, row[3], row[4], row[5], row[6] or "")
-            
             # 交互行の背景色タグを設定
             tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-            self.maintenance_tree.insert('', tk.END, values=formatted_row, tags=(tag,))
+            self.show_maintenance_row(row, tag)
         
         conn.close()
     
-    def update_analysis(self):
-        """統計情報を更新"""
-        self.stats_text.delete(1.0, tk.END)
+    def maintenance_row_values(self, row):
+        """MAINTENANCE_SELECT の行 -> 一覧の表示値（MAINTENANCE_COLUMNS の順）"""
+        # 日時フォーマット調整
+        datetime_str = row[2][:16] if row[2] else ""
+        return (row[0], row[1], datetime_str, row[3], row[4], row[5], row[6] or "")
+    
+    def maintenance_sort_changed(self, iid, row):
+        """表示中の行 iid の並べ替えの列の値が row で変わるか"""
+        shown = self.maintenance_tree.item(iid, 'values')
+        values = self.maintenance_row_values(row)
+        return any(str(shown[column]) != str(values[column]) for column, _ in self.maintenance_sort.keys)
+    
+    def show_maintenance_row(self, row, tag='evenrow', index=tk.END):
+        """メンテナンス記録の行を一覧に表示（既にあれば差し替え）し、row_version を記録"""
+        formatted_row = self.maintenance_row_values(row)
+        
+        self.maintenance_versions[row[0]] = row[8]
+        iid = str(row[0])
+        # 機械単位のタグは機械削除時・機械番号変更時の行特定に使う
+        tags = (tag, f'machine_{row[7]}')
+        if self.maintenance_tree.exists(iid):
+            stripe = self.maintenance_tree.item(iid, 'tags')[0]
+            self.maintenance_tree.item(iid, values=formatted_row, tags=(stripe, f'machine_{row[7]}'))
+        else:
+            self.maintenance_tree.insert('', index, iid=iid, values=formatted_row, tags=tags)
+    
+    def poll_changes(self):
+        """他のインスタンスによる変更を定期的に取り込む"""
+        try:
+            self.sync_changes()
+        finally:
+            self.root.after(CHANGE_POLL_INTERVAL_MS, self.poll_changes)
+    
+    def sync_changes(self):
+        """前回以降に変更された行だけを一覧に反映"""
+        if self.watcher is None:
+            # 起動時の DB の準備が終わっていない（終わった時点の内容を読み直す）
+            return
+        changes = self.watcher.poll()
+        if not changes:
+            return
         
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+        reload_maintenance = False
+        conn = connect(self.db_file)
+        try:
+            machine_ids = list(changes.get('press_machines', {}))
+            if machine_ids:
+                self.invalidate_machine_caches()
+                rows = fetch_by_ids(conn, MACHINE_SELECT, 'db_id', machine_ids)
+                
+                if self.search_var.get():
+                    # 検索中は絞り込み条件を再評価
+                    self.on_search_change()
+                else:
+                    for row in rows:
+                        self.show_machine_row(row)
+                
+                found = {row[0] for row in rows}
+                for db_id in machine_ids:
+                    if db_id not in found:
+                        self.machine_versions.pop(db_id, None)
+                        self.machine_rows.discard(str(db_id))
+                        if self.machine_tree.exists(str(db_id)):
+                            self.machine_tree.delete(str(db_id))
+                
+                # 機械番号の変更をメンテナンス一覧にも反映
+                for row in rows:
+                    for iid in self.maintenance_tree.tag_has(f'machine_{row[0]}'):
+                        values = list(self.maintenance_tree.item(iid)['values'])
+                        values[1] = row[1]
+                        self.maintenance_tree.item(iid, values=values)
+            
+            maintenance_ids = list(changes.get('maintenance_records', {}))
+            if maintenance_ids:
+                rows = fetch_by_ids(conn, MAINTENANCE_SELECT, 'm.maintenance_id', maintenance_ids)
+                # 最終点検日を更新する機械（削除された記録は一覧の行のタグから特定）
+                touched = {row[7] for row in rows}
+                for row in rows:
+                    iid = str(row[0])
+                    if not self.maintenance_sort.keys:
+                        # 新しい記録は先頭に追加（既定の並びは日時の降順）
+                        self.show_maintenance_row(row, index=0)
+                    elif self.maintenance_tree.exists(iid) and not self.maintenance_sort_changed(iid, row):
+                        self.show_maintenance_row(row)
+                    else:
+                        # 見出しで並べ替えている間は、新しい記録や並べ替えの列が変わった記録の位置を
+                        # 一覧の表示値からは決められないので、ORDER BY を付けて読み直す
+                        reload_maintenance = True
+                
+                found = {row[0] for row in rows}
+                for maintenance_id in maintenance_ids:
+                    if maintenance_id not in found:
+                        self.maintenance_versions.pop(maintenance_id, None)
+                        if self.maintenance_tree.exists(str(maintenance_id)):
+                            touched.update(int(tag[len('machine_'):])
+                                           for tag in self.maintenance_tree.item(str(maintenance_id), 'tags')
+                                           if tag.startswith('machine_'))
+                            self.maintenance_tree.delete(str(maintenance_id))
+                
+                for row in fetch_by_ids(conn, MACHINE_SELECT, 'db_id', list(touched)):
+                    if self.machine_tree.exists(str(row[0])):
+                        self.show_machine_row(row)
+        finally:
+            conn.close()
         
-        stats_text = "=" * 60 + "\n"
-        stats_text += "プレス機管理システム - 統計情報\n"
-        stats_text += "=" * 60 + "\n\n"
-        
-        # 総台数
-        cursor.execute("SELECT COUNT(*) FROM press_machines")
-        total_machines = cursor.fetchone()[0]
-        stats_text += f"📊 総プレス機台数: {total_machines}台\n\n"
-        
-        # 種別別集計
-        stats_text += "🏭 種別別集計\n"
-        stats_text += "-" * 30 + "\n"
-        cursor.execute("SELECT machine_type, COUNT(*) FROM press_machines GROUP BY machine_type")
-        for row in cursor.fetchall():
-            stats_text += f"  {row[0]}: {row[1]}台\n"
-        
-        # グループ別集計
-        stats_text += "\n👥 生産グループ別集計\n"
-        stats_text += "-" * 30 + "\n"
-        cursor.execute("SELECT production_group, COUNT(*) FROM press_machines GROUP BY production_group ORDER BY production_group")
-        for row in cursor.fetchall():
-            stats_text += f"  グループ{row[0]}: {row[1]}台\n"
-        
-        # メンテナンス記録統計
-        cursor.execute("SELECT COUNT(*) FROM maintenance_records")
-        total_maintenance = cursor.fetchone()[0]
-        stats_text += f"\n🔧 総メンテナンス記録数: {total_maintenance}件\n\n"
-        
-        # 最新メンテナンス状況
-        stats_text += "🔍 最新メンテナンス実施状況\n"
-        stats_text += "-" * 50 + "\n"
-        cursor.execute("""
-        SELECT p.machine_number, MAX(m.maintenance_datetime) as latest
-        FROM press_machines p
-        LEFT JOIN maintenance_records m ON p.db_id = m.db_id
-        GROUP BY p.db_id, p.machine_number
-        ORDER BY p.machine_number
-        """)
-        
-        for row in cursor.fetchall():
-            latest = row[1][:16] if row[1] else "未実施"
-            stats_text += f"  {row[0]:>8s}: {latest}\n"
-        
-        # 電磁弁交換統計
-        stats_text += "\n⚙️ 電磁弁交換統計\n"
-        stats_text += "-" * 30 + "\n"
-        cursor.execute("SELECT COUNT(*) FROM maintenance_records WHERE clutch_valve_replacement = '実施'")
-        clutch_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM maintenance_records WHERE brake_valve_replacement = '実施'")
-        brake_count = cursor.fetchone()[0]
-        
-        stats_text += f"  クラッチ弁交換: {clutch_count}件\n"
-        stats_text += f"  ブレーキ弁交換: {brake_count}件\n"
+        if reload_maintenance:
+            self.load_maintenance()
+        if self.machine_sort.keys:
+            self.apply_machine_sort()
+        self.restripe_tree(self.machine_tree)
+        self.restripe_tree(self.maintenance_tree)
+        self.save_snapshot(self.watcher.versions)
+        self.update_analysis()
+    
+    def sort_machines(self, column, extend):
+        """プレス機一覧の見出しクリック（読み込み済みの行を並べ替える）"""
+        self.machine_sort.click(column, extend)
+        self.update_sort_headings(self.machine_tree, self.machine_columns, self.machine_sort)
+        self.apply_machine_sort()
+    
+    def apply_machine_sort(self):
+        """キャッシュした並び順に一覧の行を移動（並び順は行が変わるまで再計算しない）"""
+        keys = [(MACHINE_VIEW_COLUMNS[column], descending) for column, descending in self.machine_sort.keys]
+        for index, iid in enumerate(self.machine_rows.order(keys)):
+            self.machine_tree.move(iid, '', index)
+        self.restripe_tree(self.machine_tree)
+    
+    def sort_maintenance(self, column, extend):
+        """メンテナンス記録一覧の見出しクリック（件数が多いため ORDER BY を付けて読み直す）"""
+        self.maintenance_sort.click(column, extend)
+        self.update_sort_headings(self.maintenance_tree, self.maintenance_columns, self.maintenance_sort)
+        self.load_maintenance()
+    
+    def update_sort_headings(self, tree, columns, order):
+        """見出しに並べ替えの向きを表示"""
+        for i, label in enumerate(columns):
+            tree.heading(label, text=order.heading_text(i, label))
+    
+    def update_analysis(self):
+        """統計情報を更新（依存テーブルが変わっていないブロックはキャッシュを使う）"""
+        stats_text = statistics_header()
+        
+        stats_text += self.result_cache.get('analysis_machines', ('press_machines',),
+                                            self.generate_machine_stats)
+        stats_text += self.result_cache.get('analysis_maintenance', ('maintenance_records',),
+                                            self.generate_maintenance_stats)
+        stats_text += self.result_cache.get('analysis_latest', ('press_machines', 'maintenance_records'),
+                                            self.generate_latest_maintenance_stats)
+        stats_text += self.result_cache.get('analysis_valves', ('maintenance_records',),
+                                            self.generate_valve_stats)
         
+        self.stats_text.delete(1.0, tk.END)
         self.stats_text.insert(1.0, stats_text)
-        conn.close()
+        self.trend_panel.refresh()
+        if self.pivot_dialog is not None and self.pivot_dialog.is_open():
+            self.pivot_dialog.refresh()
+    
+    def show_pivot(self):
+        """ピボット集計のウィンドウを表示（開いていれば前面に出す）"""
+        if self.pivot_dialog is None or not self.pivot_dialog.exists():
+            self.pivot_dialog = PivotDialog(self.root, self.db_file, self.maintenance_cube)
+        self.pivot_dialog.show()
+    
+    def run_report_query(self, query, *args):
+        """reporting の集計関数を新しい接続で実行"""
+        conn = connect(self.db_file)
+        try:
+            return query(conn, *args)
+        finally:
+            conn.close()
+    
+    def generate_machine_stats(self):
+        """総台数・種別別・グループ別の集計ブロック"""
+        return machine_stats_text(self.run_report_query(machine_stats))
+    
+    def generate_maintenance_stats(self):
+        """メンテナンス記録数のブロック"""
+        return maintenance_stats_text(self.run_report_query(maintenance_count))
+    
+    def generate_latest_maintenance_stats(self):
+        """機械ごとの最新メンテナンス日時のブロック"""
+        return latest_maintenance_text(self.run_report_query(latest_maintenance))
+    
+    def generate_valve_stats(self):
+        """電磁弁交換件数のブロック"""
+        return valve_stats_text(self.run_report_query(valve_counts))
     
     # CRUD操作メソッドは次のメッセージで続きます...
     def add_machine(self):
         """プレス機を新規追加"""
         dialog = MachineDialog(self.root, "新規プレス機登録")
         if dialog.result:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+            with write_transaction(self.db_file) as conn:
+                conn.execute("""
+                INSERT INTO press_machines 
+                (machine_number, equipment_number, manufacturer, model_type, serial_number, machine_type, production_group)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, dialog.result)
             
-            cursor.execute("""
-            INSERT INTO press_machines 
-            (machine_number, equipment_number, manufacturer, model_type, serial_number, machine_type, production_group)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, dialog.result)
-            
-            conn.commit()
-            conn.close()
             messagebox.showinfo("成功", "プレス機を登録しました")
-            self.refresh_data()
+            self.sync_changes()
     
     def edit_machine(self):
         """プレス機情報を編集"""
@@ -519,66 +879,120 @@ class PressManagementApp:
             messagebox.showwarning("警告", "編集する機械を選択してください")
             return
         
+        # 複数選択時は共通項目の一括編集
+        if len(selection) > 1:
+            self.bulk_edit_machines(selection)
+            return
+        
         item = self.machine_tree.item(selection[0])
         values = item['values']
         
         dialog = MachineDialog(self.root, "プレス機情報編集", values[1:8])
         if dialog.result:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+            changes = dict(zip(MACHINE_EDIT_COLUMNS, dialog.result))
+            changes['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             
-            cursor.execute("""
-            UPDATE press_machines SET
-            machine_number=?, equipment_number=?, manufacturer=?, model_type=?, 
-            serial_number=?, machine_type=?, production_group=?, updated_at=?
-            WHERE db_id=?
-            """, dialog.result + (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), values[0]))
-            
-            conn.commit()
-            conn.close()
-            messagebox.showinfo("成功", "プレス機情報を更新しました")
-            self.refresh_data()
+            if self.save_with_version('press_machines', values[0], self.machine_versions.get(values[0]), changes):
+                messagebox.showinfo("成功", "プレス機情報を更新しました")
+    
+    def save_with_version(self, table, key, version, changes):
+        """楽観的排他制御で1行を更新（競合時は上書きするか確認）"""
+        while True:
+            try:
+                with write_transaction(self.db_file) as conn:
+                    update_with_version(conn, table, key, version, changes)
+                break
+            except ConflictError as e:
+                if e.current is None:
+                    messagebox.showwarning("競合", "この行は他のユーザーによって削除されています")
+                    self.sync_changes()
+                    return False
+                
+                # 自分の変更と異なる現在の値を表示
+                differences = "\n".join(
+                    f"  {column}: {e.current[column]} → {value}"
+                    for column, value in changes.items()
+                    if column != 'updated_at' and e.current[column] != value
+                )
+                if not messagebox.askyesno(
+                        "競合",
+                        "他のユーザーが先にこの行を更新しました。\n\n"
+                        f"現在の値 → あなたの変更:\n{differences or '  （差分なし）'}\n\n"
+                        "あなたの変更で上書きしますか？"):
+                    self.sync_changes()
+                    return False
+                version = e.current['row_version']
+        
+        self.sync_changes()
+        return True
+    
+    def bulk_edit_machines(self, selection):
+        """選択した複数のプレス機の共通項目を一括編集"""
+        dialog = BulkEditDialog(self.root, f"プレス機一括編集（{len(selection)}台）", [
+            ("種別", "machine_type", ['圧造', '汎用']),
+            ("生産グループ", "production_group", ['1', '2', '3']),
+        ])
+        if not dialog.result:
+            return
+        
+        changes = dialog.result
+        if 'production_group' in changes:
+            changes['production_group'] = int(changes['production_group'])
+        
+        columns = list(changes.keys())
+        set_clause = ", ".join(f"{column}=?" for column in columns)
+        updated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        params = [
+            tuple(changes[column] for column in columns) + (updated_at, int(iid))
+            for iid in selection
+        ]
+        
+        # 1トランザクションでまとめて更新（指定項目だけを書き換えるため版チェックはしない）
+        with write_transaction(self.db_file) as conn:
+            conn.executemany(f"UPDATE press_machines SET {set_clause}, updated_at=? WHERE db_id=?", params)
+        
+        # 画面は変更された行のみ差し替え
+        self.sync_changes()
+        messagebox.showinfo("成功", f"{len(selection)}台のプレス機情報を更新しました")
     
     def delete_machine(self):
-        """プレス機を削除"""
+        """プレス機を削除（複数選択時は一括削除）"""
         selection = self.machine_tree.selection()
         if not selection:
             messagebox.showwarning("警告", "削除する機械を選択してください")
             return
         
-        item = self.machine_tree.item(selection[0])
-        machine_id = item['values'][0]
-        machine_number = item['values'][1]
+        if len(selection) == 1:
+            machine_number = self.machine_tree.item(selection[0])['values'][1]
+            message = f"機械番号 {machine_number} を削除しますか？\n関連するメンテナンス記録も削除されます。"
+        else:
+            message = f"選択した{len(selection)}台のプレス機を削除しますか？\n関連するメンテナンス記録も削除されます。"
         
-        if messagebox.askyesno("確認", f"機械番号 {machine_number} を削除しますか？\n関連するメンテナンス記録も削除されます。"):
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+        if messagebox.askyesno("確認", message):
+            params = [(int(iid),) for iid in selection]
             
-            cursor.execute("DELETE FROM maintenance_records WHERE db_id=?", (machine_id,))
-            cursor.execute("DELETE FROM press_machines WHERE db_id=?", (machine_id,))
+            # 1トランザクションでまとめて削除
+            with write_transaction(self.db_file) as conn:
+                conn.executemany("DELETE FROM maintenance_records WHERE db_id=?", params)
+                conn.executemany("DELETE FROM press_machines WHERE db_id=?", params)
             
-            conn.commit()
-            conn.close()
-            messagebox.showinfo("成功", "プレス機を削除しました")
-            self.refresh_data()
+            # 画面は該当行と関連メンテナンス行のみ削除
+            self.sync_changes()
+            messagebox.showinfo("成功", f"{len(selection)}台のプレス機を削除しました")
     
     def add_maintenance(self):
         """メンテナンス記録を追加"""
-        dialog = MaintenanceDialog(self.root, self.db_file, "メンテナンス記録追加")
+        dialog = MaintenanceDialog(self.root, self.machine_directory, "メンテナンス記録追加")
         if dialog.result:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-            INSERT INTO maintenance_records 
-            (db_id, maintenance_datetime, overall_judgment, clutch_valve_replacement, brake_valve_replacement, remarks)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """, dialog.result)
+            with write_transaction(self.db_file) as conn:
+                conn.execute("""
+                INSERT INTO maintenance_records 
+                (db_id, maintenance_datetime, overall_judgment, clutch_valve_replacement, brake_valve_replacement, remarks)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """, dialog.result)
             
-            conn.commit()
-            conn.close()
             messagebox.showinfo("成功", "メンテナンス記録を追加しました")
-            self.refresh_data()
+            self.sync_changes()
     
     def edit_maintenance(self):
         """メンテナンス記録を編集"""
@@ -587,273 +1001,247 @@ class PressManagementApp:
             messagebox.showwarning("警告", "編集する記録を選択してください")
             return
         
+        # 複数選択時は共通項目の一括編集
+        if len(selection) > 1:
+            self.bulk_edit_maintenance(selection)
+            return
+        
         item = self.maintenance_tree.item(selection[0])
         values = item['values']
         maintenance_id = values[0]
+        machine_id = next(int(tag[len('machine_'):]) for tag in item['tags'] if str(tag).startswith('machine_'))
         
-        dialog = MaintenanceDialog(self.root, self.db_file, "メンテナンス記録編集", values[1:])
+        dialog = MaintenanceDialog(self.root, self.machine_directory, "メンテナンス記録編集", values[1:],
+                                   machine_id=machine_id)
         if dialog.result:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-            UPDATE maintenance_records SET
-            db_id=?, maintenance_datetime=?, overall_judgment=?, 
-            clutch_valve_replacement=?, brake_valve_replacement=?, remarks=?
-            WHERE maintenance_id=?
-            """, dialog.result + (maintenance_id,))
+            changes = dict(zip(MAINTENANCE_EDIT_COLUMNS, dialog.result))
             
-            conn.commit()
-            conn.close()
-            messagebox.showinfo("成功", "メンテナンス記録を更新しました")
-            self.refresh_data()
+            if self.save_with_version('maintenance_records', maintenance_id,
+                                      self.maintenance_versions.get(maintenance_id), changes):
+                messagebox.showinfo("成功", "メンテナンス記録を更新しました")
+    
+    def bulk_edit_maintenance(self, selection):
+        """選択した複数のメンテナンス記録の共通項目を一括編集"""
+        dialog = BulkEditDialog(self.root, f"メンテナンス記録一括編集（{len(selection)}件）", [
+            ("総合判定", "overall_judgment", ['良好', '要注意', '要修理', '異常']),
+            ("クラッチ弁交換", "clutch_valve_replacement", ['未実施', '実施', '不要']),
+            ("ブレーキ弁交換", "brake_valve_replacement", ['未実施', '実施', '不要']),
+        ])
+        if not dialog.result:
+            return
+        
+        changes = dialog.result
+        columns = list(changes.keys())
+        set_clause = ", ".join(f"{column}=?" for column in columns)
+        params = [
+            tuple(changes[column] for column in columns) + (int(iid),)
+            for iid in selection
+        ]
+        
+        # 1トランザクションでまとめて更新（指定項目だけを書き換えるため版チェックはしない）
+        with write_transaction(self.db_file) as conn:
+            conn.executemany(f"UPDATE maintenance_records SET {set_clause} WHERE maintenance_id=?", params)
+        
+        # 画面は変更された行のみ差し替え
+        self.sync_changes()
+        messagebox.showinfo("成功", f"{len(selection)}件のメンテナンス記録を更新しました")
     
     def delete_maintenance(self):
-        """メンテナンス記録を削除"""
+        """メンテナンス記録を削除（複数選択時は一括削除）"""
         selection = self.maintenance_tree.selection()
         if not selection:
             messagebox.showwarning("警告", "削除する記録を選択してください")
             return
         
-        item = self.maintenance_tree.item(selection[0])
-        maintenance_id = item['values'][0]
-        machine_number = item['values'][1]
-        maintenance_date = item['values'][2]
+        if len(selection) == 1:
+            item = self.maintenance_tree.item(selection[0])
+            machine_number = item['values'][1]
+            maintenance_date = item['values'][2]
+            message = f"機械番号 {machine_number} の\n{maintenance_date} のメンテナンス記録を削除しますか？"
+        else:
+            message = f"選択した{len(selection)}件のメンテナンス記録を削除しますか？"
         
-        if messagebox.askyesno("確認", f"機械番号 {machine_number} の\n{maintenance_date} のメンテナンス記録を削除しますか？"):
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+        if messagebox.askyesno("確認", message):
+            # 1トランザクションでまとめて削除
+            with write_transaction(self.db_file) as conn:
+                conn.executemany("DELETE FROM maintenance_records WHERE maintenance_id=?",
+                                 [(int(iid),) for iid in selection])
             
-            cursor.execute("DELETE FROM maintenance_records WHERE maintenance_id=?", (maintenance_id,))
-            
-            conn.commit()
-            conn.close()
-            messagebox.showinfo("成功", "メンテナンス記録を削除しました")
-            self.refresh_data()
+            # 画面は該当行のみ削除
+            self.sync_changes()
+            messagebox.showinfo("成功", f"{len(selection)}件のメンテナンス記録を削除しました")
+    
+    def restripe_tree(self, tree):
+        """行の追加・削除後に交互行の背景色タグを振り直す"""
+        for i, iid in enumerate(tree.get_children()):
+            tags = [t for t in tree.item(iid, 'tags') if t not in ('evenrow', 'oddrow')]
+            tree.item(iid, tags=['evenrow' if i % 2 == 0 else 'oddrow'] + tags)
+    
+    def search_by_spec(self):
+        """仕様条件に合うプレス機を検索"""
+        if self.spec_index is None:
+            self.spec_index = SpecIndex.from_sqlite(self.db_file)
+        SpecSearchDialog(self.root, self.spec_index)
     
     def print_machine_list(self):
-        """プレス機一覧を印刷"""
+        """プレス機一覧の印刷プレビュー"""
         try:
-            # 印刷用ウィンドウを作成
-            print_window = tk.Toplevel(self.root)
-            print_window.title("プレス機一覧印刷プレビュー")
-            print_window.geometry("800x600")
-            print_window.grab_set()
-            
-            # スクロールバー付きテキストエリア
-            text_frame = tk.Frame(print_window)
-            text_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-            
-            text_widget = tk.Text(text_frame, font=('Courier', 9), wrap=tk.NONE)
-            v_scrollbar = ttk.Scrollbar(text_frame, orient=tk.VERTICAL, command=text_widget.yview)
-            h_scrollbar = ttk.Scrollbar(text_frame, orient=tk.HORIZONTAL, command=text_widget.xview)
-            text_widget.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
-            
-            text_widget.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-            v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-            h_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
-            
-            # データベースからデータ取得
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-            SELECT db_id, machine_number, equipment_number, manufacturer, model_type, 
-                   serial_number, machine_type, production_group, tonnage, created_at 
-            FROM press_machines 
-            ORDER BY 
-            CASE 
-                WHEN machine_number LIKE 'R-%' THEN 9999
-                WHEN machine_number = '-' THEN 10000
-                WHEN machine_number = '514' THEN 514
-                ELSE CAST(machine_number AS INTEGER)
-            END
-            """)
-            
-            machines = cursor.fetchall()
-            conn.close()
+            # データベースからデータ取得（プレス機が変更されていなければキャッシュを使う）
+            machines = self.result_cache.query(f"{MACHINE_LIST_SELECT} {MACHINE_ORDER_BY}",
+                                               tables=('press_machines',))
             
             # 印刷内容を生成
-            print_content = self.generate_machine_print_content(machines)
-            text_widget.insert(1.0, print_content)
-            text_widget.configure(state='disabled')  # 読み取り専用
-            
-            # 印刷ボタン
-            button_frame = tk.Frame(print_window)
-            button_frame.pack(pady=10)
-            
-            tk.Button(button_frame, text="印刷実行", command=lambda: self.execute_print(text_widget),
-                     bg='#3498db', fg='white', font=('Arial', 10, 'bold')).pack(side=tk.LEFT, padx=5)
-            tk.Button(button_frame, text="閉じる", command=print_window.destroy,
-                     bg='#95a5a6', fg='white', font=('Arial', 10, 'bold')).pack(side=tk.LEFT, padx=5)
+            self.show_print_preview("プレス機一覧", self.generate_machine_print_content(machines))
             
         except Exception as e:
             messagebox.showerror("エラー", f"印刷プレビューの生成に失敗しました: {e}")
     
     def generate_machine_print_content(self, machines):
         """プレス機一覧の印刷内容を生成"""
-        content = "=" * 100 + "\n"
-        content += "プレス機管理システム - プレス機一覧\n"
-        content += f"出力日時: {datetime.now().strftime('%Y年%m月%d日 %H:%M')}\n"
-        content += "=" * 100 + "\n\n"
-        
-        # ヘッダー
-        content += "ID | 製造番号 | 設備番号 | メーカー           | 型式              | シリアル番号      | 種別 | G  | トン数 | 登録日\n"
-        content += "-" * 100 + "\n"
-        
-        # データ行
-        for machine in machines:
-            db_id, machine_number, equipment_number, manufacturer, model_type, serial_number, machine_type, production_group, tonnage, created_at = machine
-            
-            equipment_str = equipment_number[:8] if equipment_number else "未設定"
-            manufacturer_str = manufacturer[:18] if manufacturer else "未設定"
-            model_str = model_type[:16] if model_type else "未設定"
-            serial_str = serial_number[:16] if serial_number else "未設定"
-            tonnage_str = f"{tonnage}t" if tonnage else "未設定"
-            created_str = created_at[:10] if created_at else "未設定"
-            
-            content += f"{db_id:2d} | {machine_number:8s} | {equipment_str:8s} | {manufacturer_str:18s} | {model_str:16s} | {serial_str:16s} | {machine_type:4s} | {production_group:2d} | {tonnage_str:6s} | {created_str}\n"
-        
-        # 統計情報
-        content += "\n" + "=" * 100 + "\n"
-        content += "統計情報\n"
-        content += "=" * 100 + "\n"
-        
-        # グループ別・種別別集計
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-        SELECT production_group, machine_type, COUNT(*) as count
-        FROM press_machines 
-        GROUP BY production_group, machine_type
-        ORDER BY production_group, machine_type
-        """)
-        
-        group_stats = cursor.fetchall()
-        
-        content += "\n【グループ別・種別別集計】\n"
-        for stat in group_stats:
-            content += f"  グループ{stat[0]} {stat[1]}: {stat[2]}台\n"
-        
-        # 総台数
-        cursor.execute("SELECT COUNT(*) FROM press_machines")
-        total_count = cursor.fetchone()[0]
-        content += f"\n総台数: {total_count}台\n"
-        
-        conn.close()
-        
-        content += "\n" + "=" * 100 + "\n"
-        
-        return content
+        stats = self.result_cache.get('print_machine_stats', ('press_machines',),
+                                      self.generate_machine_print_stats)
+        return machine_list_text(machines, stats)
+    
+    def generate_machine_print_stats(self):
+        """印刷用のグループ別・種別別集計と総台数"""
+        return machine_print_stats_text(self.run_report_query(group_type_counts),
+                                        self.run_report_query(machine_count))
     
     def print_maintenance_list(self):
-        """メンテナンス記録を印刷"""
+        """メンテナンス記録の印刷プレビュー（件数が多い場合は先頭だけを表示し、全件の本文は印刷キューで作成）"""
         try:
-            # 印刷用ウィンドウを作成
-            print_window = tk.Toplevel(self.root)
-            print_window.title("メンテナンス記録印刷プレビュー")
-            print_window.geometry("800x600")
-            print_window.grab_set()
-            
-            # スクロールバー付きテキストエリア
-            text_frame = tk.Frame(print_window)
-            text_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-            
-            text_widget = tk.Text(text_frame, font=('Courier', 9), wrap=tk.NONE)
-            v_scrollbar = ttk.Scrollbar(text_frame, orient=tk.VERTICAL, command=text_widget.yview)
-            h_scrollbar = ttk.Scrollbar(text_frame, orient=tk.HORIZONTAL, command=text_widget.xview)
-            text_widget.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
+            tables = ('press_machines', 'maintenance_records')
+            total = self.result_cache.query("SELECT COUNT(*) FROM maintenance_records",
+                                            tables=('maintenance_records',))[0][0]
             
-            text_widget.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-            v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-            h_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
-            
-            # データベースからデータ取得
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-            SELECT m.maintenance_id, p.machine_number, m.maintenance_datetime,
-                   m.overall_judgment, m.clutch_valve_replacement, m.brake_valve_replacement, m.remarks
-            FROM maintenance_records m
-            JOIN press_machines p ON m.db_id = p.db_id
-            ORDER BY m.maintenance_datetime DESC
-            """)
-            
-            records = cursor.fetchall()
-            conn.close()
-            
-            # 印刷内容を生成
-            print_content = self.generate_maintenance_print_content(records)
-            text_widget.insert(1.0, print_content)
-            text_widget.configure(state='disabled')  # 読み取り専用
-            
-            # 印刷ボタン
-            button_frame = tk.Frame(print_window)
-            button_frame.pack(pady=10)
-            
-            tk.Button(button_frame, text="印刷実行", command=lambda: self.execute_print(text_widget),
-                     bg='#3498db', fg='white', font=('Arial', 10, 'bold')).pack(side=tk.LEFT, padx=5)
-            tk.Button(button_frame, text="閉じる", command=print_window.destroy,
-                     bg='#95a5a6', fg='white', font=('Arial', 10, 'bold')).pack(side=tk.LEFT, padx=5)
+            # データベースからデータ取得（機械番号を結合するので両テーブルに依存）
+            if total > PRINT_PREVIEW_MAX_RECORDS:
+                records = self.result_cache.query(
+                    f"{MAINTENANCE_LIST_SELECT} ORDER BY m.maintenance_datetime DESC LIMIT {PRINT_PREVIEW_MAX_RECORDS}",
+                    tables=tables)
+                print_content = (f"※ 全{total:,}件のうち先頭{PRINT_PREVIEW_MAX_RECORDS:,}件を表示しています。"
+                                 f"印刷では全件を出力します\n\n" + self.generate_maintenance_print_content(records))
+                self.show_print_preview("メンテナンス記録一覧", print_content, report='maintenance')
+            else:
+                records = self.result_cache.query(f"{MAINTENANCE_LIST_SELECT} ORDER BY m.maintenance_datetime DESC",
+                                                  tables=tables)
+                self.show_print_preview("メンテナンス記録一覧", self.generate_maintenance_print_content(records))
             
         except Exception as e:
             messagebox.showerror("エラー", f"印刷プレビューの生成に失敗しました: {e}")
     
     def generate_maintenance_print_content(self, records):
         """メンテナンス記録の印刷内容を生成"""
-        content = "=" * 100 + "\n"
-        content += "プレス機管理システム - メンテナンス記録一覧\n"
-        content += f"出力日時: {datetime.now().strftime('%Y年%m月%d日 %H:%M')}\n"
-        content += "=" * 100 + "\n\n"
-        
-        # ヘッダー
-        content += "記録ID | 製造番号 | メンテナンス日時    | 総合判定 | クラッチ弁 | ブレーキ弁 | 備考\n"
-        content += "-" * 100 + "\n"
-        
-        # データ行
-        for record in records:
-            maintenance_id, machine_number, maintenance_datetime, overall_judgment, clutch_valve, brake_valve, remarks = record
-            
-            datetime_str = maintenance_datetime[:16] if maintenance_datetime else "未設定"
-            judgment_str = overall_judgment[:8] if overall_judgment else "未設定"
-            clutch_str = clutch_valve[:10] if clutch_valve else "未設定"
-            brake_str = brake_valve[:10] if brake_valve else "未設定"
-            remarks_str = remarks[:20] if remarks else ""
-            
-            content += f"{maintenance_id:6d} | {machine_number:8s} | {datetime_str:19s} | {judgment_str:8s} | {clutch_str:10s} | {brake_str:10s} | {remarks_str}\n"
-        
-        content += f"\n総メンテナンス記録数: {len(records)}件\n"
-        content += "=" * 100 + "\n"
-        
-        return content
+        return maintenance_list_text(records)
     
-    def execute_print(self, text_widget):
-        """印刷を実行"""
+    def export_data(self, kind):
+        """一覧・統計を CSV / Excel に出力（プレス機一覧は検索欄の条件で絞り込む）"""
+        names = {'machines': 'プレス機一覧', 'maintenance': 'メンテナンス記録', 'statistics': '統計情報'}
+        # Excel 出力は openpyxl が必要（入っていなければ CSV だけにする）
+        filetypes = [("CSV (カンマ区切り)", "*.csv")]
+        if xlsx_available():
+            filetypes.insert(0, ("Excel ブック", "*.xlsx"))
+        extension = filetypes[0][1][1:]
+        path = filedialog.asksaveasfilename(
+            parent=self.root, title=f"{names[kind]}のエクスポート", defaultextension=extension,
+            initialfile=f"{names[kind]}_{datetime.now().strftime('%Y%m%d')}{extension}",
+            filetypes=filetypes)
+        if not path:
+            return
+        search_text = self.search_var.get() if kind == 'machines' else ''
+        ExportProgressDialog(self.root, self.db_file, kind, path, search_text)
+    
+    def start_backup(self):
+        """オンラインバックアップをバックグラウンドで開始"""
+        if not self.backup_service.start():
+            return
+        self.backup_status_var.set("バックアップ中...")
+        self.root.after(500, self.poll_backup)
+    
+    def poll_backup(self):
+        """バックアップの進捗を表示し、完了したら結果を通知"""
+        service = self.backup_service
+        if service.running:
+            if service.total_pages:
+                self.backup_status_var.set(
+                    f"バックアップ中... {service.copied_pages * 100 // service.total_pages}%")
+            self.root.after(500, self.poll_backup)
+        elif service.error is not None:
+            self.backup_status_var.set("")
+            messagebox.showerror("エラー", f"バックアップに失敗しました: {service.error}")
+        else:
+            self.backup_status_var.set(f"最終バックアップ: {service.result['created_at'].replace('T', ' ')}")
+    
+    def poll_idle_maintenance(self):
+        """操作がない間に DB の保守（ANALYZE・空きページの解放など）を始め、終わったら結果を表示"""
+        service = self.idle_maintenance
         try:
-            # Windows の場合、notepad で印刷
-            import tempfile
-            import subprocess
-            
-            # 一時ファイルを作成
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8') as f:
-                content = text_widget.get(1.0, tk.END)
-                f.write(content)
-                temp_file = f.name
-            
-            # notepad で開いて印刷ダイアログを表示
-            subprocess.run(['notepad', '/p', temp_file], check=True)
-            
-            # 印刷完了後に一時ファイルを削除
-            os.unlink(temp_file)
-            
-            messagebox.showinfo("印刷", "印刷ジョブを送信しました")
-            
-        except subprocess.CalledProcessError:
-            messagebox.showerror("エラー", "印刷に失敗しました")
-        except Exception as e:
-            messagebox.showerror("エラー", f"印刷実行エラー: {e}")
+            if self.idle_maintenance_running and not service.running:
+                self.idle_maintenance_running = False
+                problems = [f"{task}: {detail}" for task, status, _, detail in service.results if status == 'error']
+                if service.error is not None:
+                    problems.append(str(service.error))
+                if problems:
+                    self.maintenance_status_var.set(f"⚠ DB保守でエラー（{'; '.join(problems)}）")
+                elif service.results:
+                    done = ', '.join(f"{task} {elapsed_ms:.0f}ms" for task, _, elapsed_ms, _ in service.results)
+                    self.maintenance_status_var.set(f"DB保守 {datetime.now():%H:%M}: {done}")
+            elif service.poll(busy=self.backup_service.running):
+                self.idle_maintenance_running = True
+        finally:
+            self.root.after(IDLE_MAINTENANCE_POLL_INTERVAL_MS, self.poll_idle_maintenance)
+    
+    def show_print_preview(self, title, content, report=None):
+        """印刷プレビューを表示（開いているプレビューがあればその内容を置き換える）"""
+        if self.print_preview is None or not self.print_preview.exists():
+            self.print_preview = PrintPreviewWindow(self.root, self.submit_print)
+        self.print_preview.show(title, content, report)
+    
+    def submit_print(self, title, content, report, backend):
+        """印刷キューに登録（出力はバックグラウンドで行う）。report を指定した場合は本文もキューで作成"""
+        try:
+            if report is not None:
+                self.print_spooler.submit_report(title, self.db_file, report, backend=backend)
+            else:
+                self.print_spooler.submit_text(title, content, backend)
+        except OSError as e:
+            messagebox.showerror("エラー", f"印刷キューに登録できません: {e}")
+            return False
+        self.update_print_status()
+        return True
+    
+    def show_print_queue(self):
+        if self.print_queue_dialog is None or not self.print_queue_dialog.exists():
+            self.print_queue_dialog = PrintQueueDialog(self.root, self.print_spooler)
+        else:
+            self.print_queue_dialog.dialog.lift()
+    
+    def poll_print_queue(self):
+        """印刷キューの状態を定期的に表示"""
+        try:
+            self.update_print_status()
+        finally:
+            self.root.after(PRINT_QUEUE_POLL_INTERVAL_MS, self.poll_print_queue)
+    
+    def update_print_status(self):
+        """待ち・失敗の件数と、直近に完了・失敗したジョブを表示"""
+        jobs = self.print_spooler.snapshot()
+        for job in jobs:
+            if self.print_job_states.get(job['id']) in ('queued', 'printing'):
+                if job['status'] == 'done':
+                    self.print_message = f"「{job['title']}」を出力しました"
+                elif job['status'] == 'failed':
+                    self.print_message = f"⚠「{job['title']}」を出力できませんでした"
+        self.print_job_states = {job['id']: job['status'] for job in jobs}
+        
+        pending = sum(job['status'] in ('queued', 'printing') for job in jobs)
+        failed = sum(job['status'] == 'failed' for job in jobs)
+        parts = [self.print_message] if self.print_message else []
+        if pending:
+            parts.append(f"印刷待ち {pending}件")
+        if failed:
+            parts.append(f"失敗 {failed}件")
+        self.print_status_var.set("  ".join(parts))
     
     def on_search_change(self, *args):
         """検索テキストが変更された時の処理"""
@@ -862,52 +1250,211 @@ class PressManagementApp:
         # 既存のアイテムをクリア
         for item in self.machine_tree.get_children():
             self.machine_tree.delete(item)
+        self.machine_rows.clear()
         
         # データベースから検索して表示
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         cursor = conn.cursor()
         
-        if search_text:
-            cursor.execute("""
-            SELECT db_id, machine_number, equipment_number, manufacturer, model_type, 
-                   serial_number, machine_type, production_group, tonnage, created_at 
-            FROM press_machines 
-            WHERE LOWER(machine_number) LIKE ? OR 
-                  LOWER(manufacturer) LIKE ? OR 
-                  LOWER(model_type) LIKE ?
-            ORDER BY 
-            CASE 
-                WHEN machine_number LIKE 'R-%' THEN 9999
-                WHEN machine_number = '-' THEN 10000
-                WHEN machine_number = '514' THEN 514
-                ELSE CAST(machine_number AS INTEGER)
-            END
-            """, (f'%{search_text}%', f'%{search_text}%', f'%{search_text}%'))
-        else:
-            cursor.execute("""
-            SELECT db_id, machine_number, equipment_number, manufacturer, model_type, 
-                   serial_number, machine_type, production_group, tonnage, created_at 
-            FROM press_machines 
-            ORDER BY 
-            CASE 
-                WHEN machine_number LIKE 'R-%' THEN 9999
-                WHEN machine_number = '-' THEN 10000
-                WHEN machine_number = '514' THEN 514
-                ELSE CAST(machine_number AS INTEGER)
-            END
-            """)
+        where, params = machine_search_filter(search_text)
+        cursor.execute(f"{MACHINE_SELECT} {where} {MACHINE_ORDER_BY}", params)
         
         for i, row in enumerate(cursor.fetchall()):
-            # 日付フォーマット調整
-            created_at = row[9][:16] if row[9] else ""
-            tonnage_str = f"{row[8]}t" if row[8] else ""
-            formatted_row = row[:8] + (tonnage_str,) + (created_at,)
-            
             # 交互行の背景色タグを設定
             tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-            self.machine_tree.insert('', tk.END, values=formatted_row, tags=(tag,))
+            self.show_machine_row(row, tag)
         
         conn.close()
+        
+        if self.machine_sort.keys:
+            self.apply_machine_sort()
+
+
+class PrintPreviewWindow:
+    """印刷プレビュー（1つのウィンドウを使い回す）。印刷実行は印刷キューに登録してすぐに閉じる"""
+    def __init__(self, parent, on_print):
+        self.on_print = on_print
+        self.title = None
+        self.content = None
+        self.report = None
+        
+        self.window = tk.Toplevel(parent)
+        self.window.geometry("800x600")
+        
+        # スクロールバー付きテキストエリア
+        text_frame = tk.Frame(self.window)
+        text_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        self.text_widget = tk.Text(text_frame, font=('Courier', 9), wrap=tk.NONE)
+        v_scrollbar = ttk.Scrollbar(text_frame, orient=tk.VERTICAL, command=self.text_widget.yview)
+        h_scrollbar = ttk.Scrollbar(text_frame, orient=tk.HORIZONTAL, command=self.text_widget.xview)
+        self.text_widget.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
+        
+        self.text_widget.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        h_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
+        
+        # 出力先と印刷ボタン
+        button_frame = tk.Frame(self.window)
+        button_frame.pack(pady=10)
+        
+        tk.Label(button_frame, text="出力先:", font=('Arial', 10)).pack(side=tk.LEFT, padx=5)
+        self.backend_var = tk.StringVar(value=BACKEND_LABELS[default_backend()])
+        ttk.Combobox(button_frame, textvariable=self.backend_var, values=list(BACKEND_LABELS.values()),
+                     state='readonly', width=14).pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="印刷実行", command=self.print_clicked,
+                 bg='#3498db', fg='white', font=('Arial', 10, 'bold')).pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="閉じる", command=self.window.destroy,
+                 bg='#95a5a6', fg='white', font=('Arial', 10, 'bold')).pack(side=tk.LEFT, padx=5)
+    
+    def exists(self):
+        return bool(self.window.winfo_exists())
+    
+    def show(self, title, content, report=None):
+        self.title = title
+        self.content = content
+        self.report = report
+        self.window.title(f"{title}印刷プレビュー")
+        self.text_widget.configure(state='normal')
+        self.text_widget.delete(1.0, tk.END)
+        self.text_widget.insert(1.0, content)
+        self.text_widget.configure(state='disabled')  # 読み取り専用
+        self.window.deiconify()
+        self.window.lift()
+    
+    def print_clicked(self):
+        backend = next(key for key, label in BACKEND_LABELS.items() if label == self.backend_var.get())
+        if self.on_print(self.title, self.content, self.report, backend):
+            self.window.destroy()
+
+
+class PrintQueueDialog:
+    """印刷キューのジョブの一覧（失敗したジョブの再試行・削除）"""
+    REFRESH_INTERVAL_MS = 1000
+    
+    def __init__(self, parent, spooler):
+        self.spooler = spooler
+        
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("印刷キュー")
+        self.dialog.geometry("860x360")
+        self.dialog.transient(parent)
+        
+        main_frame = tk.Frame(self.dialog, padx=16, pady=16)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        columns = ('受付日時', '内容', '出力先', '状態', '回数', '結果')
+        self.tree = ttk.Treeview(main_frame, columns=columns, show='headings', height=10)
+        for col, width in zip(columns, (140, 160, 90, 60, 50, 320)):
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=width, anchor='w')
+        self.tree.pack(fill=tk.BOTH, expand=True)
+        
+        button_frame = tk.Frame(main_frame)
+        button_frame.pack(pady=(12, 0))
+        tk.Button(button_frame, text="再試行", command=self.retry_clicked,
+                 bg='#3498db', fg='white', font=('Arial', 10, 'bold'), width=10).pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="削除", command=self.remove_clicked,
+                 bg='#e74c3c', fg='white', font=('Arial', 10, 'bold'), width=10).pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="閉じる", command=self.dialog.destroy,
+                 bg='#95a5a6', fg='white', font=('Arial', 10, 'bold'), width=10).pack(side=tk.LEFT, padx=5)
+        
+        self.refresh()
+    
+    def exists(self):
+        return bool(self.dialog.winfo_exists())
+    
+    def refresh(self):
+        """ジョブの状態を表示し直す（新しいジョブが上）"""
+        if not self.exists():
+            return
+        jobs = self.spooler.snapshot()
+        ids = {job['id'] for job in jobs}
+        for iid in self.tree.get_children():
+            if iid not in ids:
+                self.tree.delete(iid)
+        for index, job in enumerate(reversed(jobs)):
+            values = (job['created_at'], job['title'], BACKEND_LABELS[job['backend']], STATUS_LABELS[job['status']],
+                      job['attempts'], job['output'] or job['error'] or '')
+            if self.tree.exists(job['id']):
+                self.tree.item(job['id'], values=values)
+                self.tree.move(job['id'], '', index)
+            else:
+                self.tree.insert('', index, iid=job['id'], values=values)
+        self.dialog.after(self.REFRESH_INTERVAL_MS, self.refresh)
+    
+    def retry_clicked(self):
+        for iid in self.tree.selection():
+            self.spooler.retry(iid)
+    
+    def remove_clicked(self):
+        for iid in self.tree.selection():
+            if not self.spooler.remove(iid):
+                messagebox.showwarning("警告", "出力中のジョブは削除できません", parent=self.dialog)
+
+
+class ExportProgressDialog:
+    """バックグラウンドスレッドで出力し、進捗を表示する"""
+    
+    POLL_INTERVAL_MS = 100
+    
+    def __init__(self, parent, db_file, kind, path, search_text=''):
+        self.path = path
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("エクスポート")
+        self.dialog.geometry("420x140")
+        self.dialog.transient(parent)
+        self.dialog.protocol("WM_DELETE_WINDOW", self.cancel_event.set)
+        
+        self.status_var = tk.StringVar(value="出力中...")
+        tk.Label(self.dialog, textvariable=self.status_var, font=('Segoe UI', 10)).pack(pady=(16, 8))
+        self.progress = ttk.Progressbar(self.dialog, length=360, mode='indeterminate')
+        self.progress.pack(pady=4)
+        self.progress.start()
+        tk.Button(self.dialog, text="中止", command=self.cancel_event.set, width=10).pack(pady=8)
+        
+        # Tk はスレッドから操作できないため、進捗は属性に書いて after で読み取る
+        self.thread = threading.Thread(target=self.run, args=(db_file, kind, path, search_text), daemon=True)
+        self.thread.start()
+        self.dialog.after(self.POLL_INTERVAL_MS, self.poll)
+    
+    def run(self, db_file, kind, path, search_text):
+        try:
+            self.result = export(db_file, kind, path, search_text,
+                                 progress=self.on_progress, cancel_event=self.cancel_event)
+        except ExportCancelled:
+            pass
+        except Exception as e:
+            self.error = e
+    
+    def on_progress(self, done, total):
+        self.done = done
+        self.total = total
+    
+    def poll(self):
+        if self.thread.is_alive():
+            if self.total:
+                if str(self.progress['mode']) != 'determinate':
+                    self.progress.stop()
+                    self.progress.configure(mode='determinate', maximum=self.total)
+                self.progress['value'] = self.done
+                self.status_var.set(f"出力中... {self.done:,} / {self.total:,}件")
+            elif self.done:
+                self.status_var.set(f"出力中... {self.done:,}件")
+            self.dialog.after(self.POLL_INTERVAL_MS, self.poll)
+            return
+        
+        self.dialog.destroy()
+        if self.error is not None:
+            messagebox.showerror("エラー", f"エクスポートに失敗しました: {self.error}")
+        elif self.result is not None:
+            messagebox.showinfo("エクスポート", f"{self.result:,}行を出力しました\n{self.path}")
 
 
 class MachineDialog:
@@ -1016,10 +1563,149 @@ class MachineDialog:
         self.dialog.destroy()
 
 
+class BulkEditDialog:
+    """複数行の共通項目を一括編集するダイアログ"""
+    def __init__(self, parent, title, fields):
+        self.result = None
+        
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title(title)
+        self.dialog.resizable(False, False)
+        self.dialog.grab_set()
+        
+        # 中央配置
+        self.dialog.transient(parent)
+        self.dialog.geometry("+%d+%d" % (parent.winfo_rootx() + 50, parent.winfo_rooty() + 50))
+        
+        self.create_widgets(fields)
+        self.dialog.wait_window()
+    
+    def create_widgets(self, fields):
+        main_frame = tk.Frame(self.dialog, padx=20, pady=20)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        tk.Label(main_frame, text="変更する項目にチェックを入れてください", 
+                font=('Arial', 10)).grid(row=0, column=0, columnspan=3, sticky='w', pady=(0, 10))
+        
+        # 項目ごとに「変更する」チェックと選択肢を配置
+        self.fields = {}
+        for i, (label_text, column, values) in enumerate(fields, start=1):
+            enabled_var = tk.BooleanVar(value=False)
+            value_var = tk.StringVar(value=values[0])
+            tk.Checkbutton(main_frame, variable=enabled_var).grid(row=i, column=0, pady=5)
+            tk.Label(main_frame, text=label_text + ":", font=('Arial', 10)).grid(row=i, column=1, sticky='w', pady=5)
+            ttk.Combobox(main_frame, textvariable=value_var, values=values,
+                         state='readonly', width=22).grid(row=i, column=2, padx=(10, 0), pady=5)
+            self.fields[column] = (enabled_var, value_var)
+        
+        # ボタンフレーム
+        button_frame = tk.Frame(main_frame)
+        button_frame.grid(row=len(fields) + 1, column=0, columnspan=3, pady=20)
+        
+        tk.Button(button_frame, text="OK", command=self.ok_clicked,
+                 bg='#3498db', fg='white', font=('Arial', 10, 'bold'), width=10).pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="キャンセル", command=self.cancel_clicked,
+                 bg='#95a5a6', fg='white', font=('Arial', 10, 'bold'), width=10).pack(side=tk.LEFT, padx=5)
+    
+    def ok_clicked(self):
+        changes = {column: value_var.get()
+                   for column, (enabled_var, value_var) in self.fields.items() if enabled_var.get()}
+        if not changes:
+            messagebox.showerror("エラー", "変更する項目を選択してください")
+            return
+        
+        self.result = changes
+        self.dialog.destroy()
+    
+    def cancel_clicked(self):
+        self.dialog.destroy()
+
+
+class SpecSearchDialog:
+    """仕様条件（下限・上限）で能力を満たすプレス機を検索するダイアログ"""
+    def __init__(self, parent, spec_index):
+        self.spec_index = spec_index
+        
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("能力検索")
+        self.dialog.geometry("640x640")
+        
+        # 中央配置
+        self.dialog.transient(parent)
+        self.dialog.geometry("+%d+%d" % (parent.winfo_rootx() + 50, parent.winfo_rooty() + 50))
+        
+        self.create_widgets()
+    
+    def create_widgets(self):
+        main_frame = tk.Frame(self.dialog, padx=20, pady=20)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        # 条件入力（仕様ごとに下限・上限）
+        condition_frame = tk.Frame(main_frame)
+        condition_frame.pack(fill=tk.X)
+        tk.Label(condition_frame, text="下限", font=('Arial', 10, 'bold')).grid(row=0, column=1)
+        tk.Label(condition_frame, text="上限", font=('Arial', 10, 'bold')).grid(row=0, column=2)
+        
+        # DB にある仕様項目だけを出す（デスクトップ版DBはトン数のみ）
+        self.entries = {}
+        for i, field in enumerate(self.spec_index.fields, start=1):
+            tk.Label(condition_frame, text=SPEC_FIELDS[field] + ":", font=('Arial', 10)).grid(row=i, column=0, sticky='w', pady=2)
+            low_entry = tk.Entry(condition_frame, font=('Arial', 10), width=12)
+            low_entry.grid(row=i, column=1, padx=(10, 0), pady=2)
+            high_entry = tk.Entry(condition_frame, font=('Arial', 10), width=12)
+            high_entry.grid(row=i, column=2, padx=(10, 0), pady=2)
+            self.entries[field] = (low_entry, high_entry)
+        if not self.entries:
+            tk.Label(condition_frame, text="このデータベースには検索できる仕様項目がありません",
+                    font=('Arial', 10), fg='#7f8c8d').grid(row=1, column=0, columnspan=3, sticky='w', pady=2)
+        
+        tk.Button(main_frame, text="検索", command=self.search_clicked,
+                 bg='#3498db', fg='white', font=('Arial', 10, 'bold'), width=10).pack(pady=10)
+        
+        # 検索結果（余裕度の小さい順）
+        columns = ('機械番号', '余裕度', '条件値')
+        self.result_tree = ttk.Treeview(main_frame, columns=columns, show='headings', height=10)
+        for col, width in zip(columns, (100, 80, 380)):
+            self.result_tree.heading(col, text=col)
+            self.result_tree.column(col, width=width, anchor='w')
+        self.result_tree.pack(fill=tk.BOTH, expand=True)
+        
+        self.status_label = tk.Label(main_frame, text=f"対象: {len(self.spec_index)}台", font=('Arial', 9))
+        self.status_label.pack(anchor='w', pady=(5, 0))
+    
+    def search_clicked(self):
+        conditions = {}
+        try:
+            for field, (low_entry, high_entry) in self.entries.items():
+                low = low_entry.get().strip()
+                high = high_entry.get().strip()
+                if low or high:
+                    conditions[field] = (float(low) if low else None, float(high) if high else None)
+        except ValueError:
+            messagebox.showerror("エラー", "条件には数値を入力してください", parent=self.dialog)
+            return
+        
+        if not conditions:
+            messagebox.showwarning("警告", "検索条件を1つ以上入力してください", parent=self.dialog)
+            return
+        
+        candidates = self.spec_index.query(conditions)
+        
+        for item in self.result_tree.get_children():
+            self.result_tree.delete(item)
+        for candidate in candidates:
+            details = ", ".join(f"{SPEC_FIELDS[field]}={self.spec_index.values[field][candidate.db_id]:g}"
+                                for field in conditions)
+            self.result_tree.insert('', tk.END, values=(candidate.machine_number, f"{candidate.score:.3f}", details))
+        
+        self.status_label.configure(text=f"該当: {len(candidates)}台 / 対象: {len(self.spec_index)}台")
+
+
 class MaintenanceDialog:
-    def __init__(self, parent, db_file, title, initial_values=None):
+    def __init__(self, parent, machine_directory, title, initial_values=None, machine_id=None):
         self.result = None
-        self.db_file = db_file
+        self.machine_directory = machine_directory
+        self.candidate_ids = []
         
         self.dialog = tk.Toplevel(parent)
         self.dialog.title(title)
@@ -1031,35 +1717,28 @@ class MaintenanceDialog:
         self.dialog.transient(parent)
         self.dialog.geometry("+%d+%d" % (parent.winfo_rootx() + 50, parent.winfo_rooty() + 50))
         
-        self.create_widgets(initial_values)
+        self.create_widgets(initial_values, machine_id)
         self.dialog.wait_window()
     
-    def create_widgets(self, initial_values):
+    def create_widgets(self, initial_values, machine_id):
         main_frame = tk.Frame(self.dialog, padx=20, pady=20)
         main_frame.pack(fill=tk.BOTH, expand=True)
         
-        # プレス機選択
+        # プレス機選択（キャッシュ済みディレクトリから入力に応じて候補を絞り込む）
         tk.Label(main_frame, text="プレス機:", font=('Arial', 10)).grid(row=0, column=0, sticky='w', pady=5)
         self.machine_var = tk.StringVar()
         
-        # データベースからプレス機リストを取得
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute("SELECT db_id, machine_number FROM press_machines ORDER BY machine_number")
-        machines = cursor.fetchall()
-        conn.close()
+        self.machine_combo = ttk.Combobox(main_frame, textvariable=self.machine_var, width=30)
+        self.machine_combo.grid(row=0, column=1, padx=(10, 0), pady=5)
+        self.machine_combo.bind('<KeyRelease>', self.on_machine_typed)
+        self.set_machine_candidates(self.machine_directory.search(""))
         
-        machine_values = [f"{machine[1]} (ID: {machine[0]})" for machine in machines]
-        machine_combo = ttk.Combobox(main_frame, textvariable=self.machine_var,
-                                   values=machine_values, state='readonly', width=30)
-        machine_combo.grid(row=0, column=1, padx=(10, 0), pady=5)
-        
-        if initial_values and initial_values[0]:
-            # 編集時は機械番号から選択
-            for i, (machine_id, machine_number) in enumerate(machines):
-                if machine_number == initial_values[0]:
-                    machine_combo.current(i)
-                    break
+        if machine_id is not None and self.machine_directory.get(machine_id):
+            # 編集時は記録の機械IDから選択
+            self.machine_var.set(self.machine_directory.label(machine_id))
+            self.candidate_ids = [machine_id]
+            self.machine_combo.configure(values=[self.machine_var.get()])
+            self.machine_combo.current(0)
         
         # メンテナンス日時
         tk.Label(main_frame, text="メンテナンス日時:", font=('Arial', 10)).grid(row=1, column=0, sticky='w', pady=5)
@@ -1133,9 +1812,10 @@ class MaintenanceDialog:
             messagebox.showerror("エラー", "メンテナンス日時を入力してください")
             return
         
-        # 機械IDを抽出
-        machine_text = self.machine_var.get()
-        machine_id = int(machine_text.split("ID: ")[1].split(")")[0])
+        machine_id = self.selected_machine_id()
+        if machine_id is None:
+            messagebox.showerror("エラー", "候補一覧からプレス機を選択してください")
+            return
         
         self.result = (
             machine_id,
@@ -1147,6 +1827,27 @@ class MaintenanceDialog:
         )
         self.dialog.destroy()
     
+    def set_machine_candidates(self, machine_ids):
+        """選択肢と db_id の対応を更新"""
+        self.candidate_ids = machine_ids
+        self.machine_combo.configure(values=[self.machine_directory.label(db_id) for db_id in machine_ids])
+    
+    def on_machine_typed(self, event):
+        """入力された文字列で候補を前方一致検索"""
+        if event.keysym in ('Up', 'Down', 'Return', 'Escape', 'Tab'):
+            return
+        self.set_machine_candidates(self.machine_directory.search(self.machine_var.get()))
+    
+    def selected_machine_id(self):
+        """選択中のプレス機の db_id（未確定なら None）"""
+        index = self.machine_combo.current()
+        if 0 <= index < len(self.candidate_ids):
+            return self.candidate_ids[index]
+        
+        # 一意に絞り込まれていればそれを採用
+        matches = self.machine_directory.search(self.machine_var.get(), limit=2)
+        return matches[0] if len(matches) == 1 else None
+    
     def cancel_clicked(self):
         self.dialog.destroy()
 
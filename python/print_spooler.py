@@ -0,0 +1,571 @@
+#!/usr/bin/env python3
+"""
+印刷・出力のスプーラー
+印刷ジョブをローカルのキュー（ジョブごとの JSON と本文のテキスト）に保存し、バックグラウンドのスレッドが
+順に出力する。画面は登録するとすぐに操作に戻れ、アプリを終了しても未完了のジョブは次の起動時に出力する
+
+ジョブは本文のテキストか、レポート名と絞り込み（reporting.cli のレポート）のどちらか。
+レポートのジョブは本文の作成（DB の読み出し）もスレッドで行う
+
+出力先（バックエンド）
+- printer: 既定のプリンター（Windows は notepad /p、それ以外は lpr、なければ lp）
+- pdf    : PDF ファイルに保存（追加のライブラリは使わない。フォントは埋め込まずビューアの日本語フォントを使う）
+- text   : テキストファイルに保存
+
+失敗したジョブは間隔を空けて MAX_ATTEMPTS 回まで出力し直し、それでも失敗したら failed として残す（画面から再試行できる）
+
+同じ利用者のアプリを複数起動しても、キューを出力するのはキューのロックファイルを取得した1プロセスだけ。
+ほかのプロセスはジョブの登録・再試行・削除だけを行い、保存されたジョブを定期的に読み直して状態を表示する。
+ロックは出力するプロセスが終了すると OS が解放するので、出力中のまま残ったジョブは次にロックを取得した
+プロセスが待ちに戻す
+
+使い方（画面を起動せずに）:
+  python print_spooler.py submit --report maintenance --filter since=2026-10-01 --backend pdf
+  python print_spooler.py submit --file report.txt --title 月次報告 --backend printer
+  python print_spooler.py run
+  python print_spooler.py list
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+from shared_db import connect, local_data_dir
+
+BACKEND_LABELS = {
+    'printer': 'プリンター',
+    'pdf': 'PDF保存',
+    'text': 'テキスト保存',
+}
+
+STATUS_LABELS = {
+    'queued': '待ち',
+    'printing': '出力中',
+    'done': '完了',
+    'failed': '失敗',
+}
+
+MAX_ATTEMPTS = 3
+RETRY_DELAYS_SECONDS = (10, 60)   # 1回目・2回目の失敗の後の待ち時間
+PRINT_TIMEOUT_SECONDS = 120       # 印刷コマンドの上限
+DONE_RETENTION_DAYS = 7           # 完了したジョブの記録を残す日数
+POLL_SECONDS = 2.0                # 保存されたジョブを読み直す間隔（他のプロセスの登録・出力を反映する）
+
+# PDF の体裁（A4 縦、ポイント単位）。ASCII は半角幅に揃えて一覧の桁をそろえる
+PDF_PAGE_SIZE = (595, 842)
+PDF_MARGIN = 36
+PDF_FONT_SIZE = 8
+PDF_LEADING = 11
+PDF_FONT = 'HeiseiKakuGo-W5'
+
+
+class PrintError(Exception):
+    """出力先への出力に失敗した"""
+
+
+def spool_dir():
+    """キューの保存先（利用者のローカル）"""
+    return local_data_dir('print_queue')
+
+
+def output_dir():
+    """PDF・テキストの保存先"""
+    return os.path.join(os.path.expanduser('~'), 'Documents', 'press_machine_print')
+
+
+def _write_atomic(path, data):
+    partial = path + '.partial'
+    with open(partial, 'wb') as f:
+        f.write(data)
+    os.replace(partial, path)
+
+
+def _pdf_object(f, offsets, number, body):
+    offsets[number] = f.tell()
+    f.write(f"{number} 0 obj\n".encode('ascii') + body + b"\nendobj\n")
+
+
+def _pdf_string(text):
+    """UTF-16BE の16進文字列（UniJIS-UTF16-H のフォントで表示する）"""
+    return b'<' + text.encode('utf-16-be').hex().upper().encode('ascii') + b'>'
+
+
+def write_pdf(lines, path, title=''):
+    """テキストの行を PDF に書き出す（ページごとに書き出すので行数が多くてもメモリは一定）"""
+    width, height = PDF_PAGE_SIZE
+    lines_per_page = (height - 2 * PDF_MARGIN) // PDF_LEADING
+    offsets = {}
+    partial = path + '.partial'
+    with open(partial, 'wb') as f:
+        f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        _pdf_object(f, offsets, 1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        _pdf_object(f, offsets, 3, f"<< /Type /Font /Subtype /Type0 /BaseFont /{PDF_FONT} "
+                                   f"/Encoding /UniJIS-UTF16-H /DescendantFonts [4 0 R] >>".encode('ascii'))
+        _pdf_object(f, offsets, 4, f"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /{PDF_FONT} "
+                                   "/CIDSystemInfo << /Registry (Adobe) /Ordering (Japan1) /Supplement 5 >> "
+                                   "/FontDescriptor 5 0 R /DW 1000 /W [1 95 500 231 632 500] >>".encode('ascii'))
+        _pdf_object(f, offsets, 5, f"<< /Type /FontDescriptor /FontName /{PDF_FONT} /Flags 4 "
+                                   "/FontBBox [-92 -250 1010 922] /ItalicAngle 0 /Ascent 752 /Descent -221 "
+                                   "/CapHeight 737 /StemV 114 >>".encode('ascii'))
+        _pdf_object(f, offsets, 6, b"<< /Title <FEFF" + _pdf_string(title)[1:] + b" /Producer (press_machine) >>")
+
+        pages = []
+        number = 7
+        page_lines = []
+
+        def flush():
+            nonlocal number
+            stream = [f"BT /F1 {PDF_FONT_SIZE} Tf {PDF_LEADING} TL {PDF_MARGIN} {height - PDF_MARGIN} Td".encode('ascii')]
+            stream.extend(_pdf_string(line) + b" '" for line in page_lines)
+            stream.append(b"ET")
+            content = zlib.compress(b"\n".join(stream))
+            _pdf_object(f, offsets, number,
+                        f"<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n".encode('ascii')
+                        + content + b"\nendstream")
+            _pdf_object(f, offsets, number + 1,
+                        f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+                        f"/Resources << /Font << /F1 3 0 R >> >> /Contents {number} 0 R >>".encode('ascii'))
+            pages.append(number + 1)
+            number += 2
+            page_lines.clear()
+
+        for line in lines:
+            page_lines.append(line.rstrip('\r\n').replace('\t', '    '))
+            if len(page_lines) == lines_per_page:
+                flush()
+        if page_lines or not pages:
+            flush()
+
+        kids = ' '.join(f"{page} 0 R" for page in pages)
+        _pdf_object(f, offsets, 2, f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode('ascii'))
+
+        xref_at = f.tell()
+        f.write(f"xref\n0 {number}\n0000000000 65535 f \n".encode('ascii'))
+        f.write(b''.join(f"{offsets[i]:010d} 00000 n \n".encode('ascii') for i in range(1, number)))
+        f.write(f"trailer\n<< /Size {number} /Root 1 0 R /Info 6 0 R >>\nstartxref\n{xref_at}\n%%EOF\n"
+                .encode('ascii'))
+    os.replace(partial, path)
+    return len(pages)
+
+
+def default_backend():
+    """プリンターに送れる環境なら printer、なければ pdf"""
+    if os.name == 'nt' or shutil.which('lpr') or shutil.which('lp'):
+        return 'printer'
+    return 'pdf'
+
+
+def printer_command(path, title):
+    """既定のプリンターに送るコマンド"""
+    if os.name == 'nt':
+        return ['notepad', '/p', path]
+    if shutil.which('lpr'):
+        return ['lpr', '-T', title, path]
+    if shutil.which('lp'):
+        return ['lp', '-t', title, path]
+    raise PrintError("印刷コマンド（lpr / lp）が見つかりません。PDF保存かテキスト保存を選んでください")
+
+
+def print_to_printer(job, text_path):
+    try:
+        result = subprocess.run(printer_command(text_path, job['title']), capture_output=True,
+                                timeout=PRINT_TIMEOUT_SECONDS)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise PrintError(f"印刷コマンドを実行できません: {e}")
+    if result.returncode != 0:
+        message = result.stderr.decode(errors='replace').strip() or f"終了コード {result.returncode}"
+        raise PrintError(f"印刷に失敗しました: {message}")
+    return None
+
+
+def _output_path(job, suffix):
+    """保存先のパス（ジョブID は日時と乱数からなるので、同じ題名・同じ秒のジョブでも上書きしない）"""
+    os.makedirs(output_dir(), exist_ok=True)
+    name = ''.join(c if c not in '\\/:*?"<>|' else '_' for c in job['title'])
+    return os.path.join(output_dir(), f"{name}_{job['id']}{suffix}")
+
+
+def save_pdf(job, text_path):
+    path = _output_path(job, '.pdf')
+    with open(text_path, encoding='utf-8') as f:
+        write_pdf(f, path, job['title'])
+    return path
+
+
+def save_text(job, text_path):
+    path = _output_path(job, '.txt')
+    shutil.copyfile(text_path, path)
+    return path
+
+
+# 出力先 -> 出力する関数（保存したファイルのパスを返す。プリンターは None）
+BACKENDS = {
+    'printer': print_to_printer,
+    'pdf': save_pdf,
+    'text': save_text,
+}
+
+
+def render_report(db_file, report, filters):
+    """レポートのジョブの本文"""
+    from reporting.cli import REPORTS
+
+    conn = connect(db_file)
+    try:
+        return REPORTS[report](conn, 'text', filters)
+    finally:
+        conn.close()
+
+
+class QueueLock:
+    """キューを出力するプロセスの排他（ロックファイルのロック。プロセスが終了すると OS が解放する）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    @property
+    def held(self):
+        return self.file is not None
+
+    def acquire(self):
+        """ロックを取得できたか（取得済みなら True。待たない）"""
+        if self.file is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        f = open(self.path, 'a+b')
+        try:
+            if os.name == 'nt':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self.file = f
+        return True
+
+    def release(self):
+        if self.file is None:
+            return
+        try:
+            if os.name == 'nt':
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        except OSError:
+            pass
+        self.file.close()
+        self.file = None
+
+
+def _queue_order(job):
+    """受付順の並べ替えキー（seq は登録時のナノ秒。seq のない古いジョブは先に並べる）"""
+    return job.get('seq', 0), job['id']
+
+
+class PrintSpooler:
+    """印刷ジョブのキューと、順に出力するワーカースレッド
+
+    ワーカーはキューのロックを取得できた場合だけ出力し、取得できない間は保存されたジョブを読み直して待つ
+    """
+
+    def __init__(self, directory=None, backends=None):
+        self.directory = directory or spool_dir()
+        self.backends = backends or BACKENDS
+        self.jobs = {}
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopping = False
+        self.last_seq = 0
+        self.lock = QueueLock(os.path.join(self.directory, 'queue.lock'))
+        # このプロセスが出力中のジョブ（読み直しで置き換えない）
+        self.current = None
+
+    def _job_path(self, job_id, suffix='.json'):
+        return os.path.join(self.directory, job_id + suffix)
+
+    def _save(self, job):
+        _write_atomic(self._job_path(job['id']), json.dumps(job, ensure_ascii=False, indent=1).encode('utf-8'))
+
+    def load(self):
+        """保存されているジョブを読み直す（他のプロセスが登録・再試行・削除したジョブと、出力したプロセスの
+        状態を反映する。古い完了済みは削除）"""
+        os.makedirs(self.directory, exist_ok=True)
+        expired = (datetime.now() - timedelta(days=DONE_RETENTION_DAYS)).isoformat(sep=' ', timespec='seconds')
+        jobs = {}
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if job['status'] == 'done' and job['updated_at'] < expired:
+                self._delete_files(job['id'])
+                continue
+            jobs[job['id']] = job
+        with self.condition:
+            if self.current is not None:
+                jobs[self.current['id']] = self.current
+            self.jobs = jobs
+
+    def _recover(self):
+        """出力中のまま残ったジョブを待ちに戻す（ロックを取得したプロセスだけが呼ぶ。
+        ロックがあるので、出力中のジョブは終了したプロセスのもの）"""
+        self.load()
+        with self.condition:
+            for job in self.jobs.values():
+                if job['status'] == 'printing' and job is not self.current:
+                    job['status'] = 'queued'
+                    self._update(job)
+
+    def start(self):
+        self.load()
+        self.thread = threading.Thread(target=self._work, name='print-spooler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+
+    def _submit(self, title, backend, text=None, report=None):
+        if backend not in self.backends:
+            raise ValueError(f"出力先が不明です: {backend}")
+        now = datetime.now()
+        with self.condition:
+            # 同じ秒に登録したジョブも登録順に出力する（時計の分解能より速く登録しても順序を保つ）
+            self.last_seq = max(time.time_ns(), self.last_seq + 1)
+            seq = self.last_seq
+        job = {
+            'id': f"{now:%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}",
+            'seq': seq,
+            'title': title,
+            'backend': backend,
+            'report': report,
+            'status': 'queued',
+            'attempts': 0,
+            'retry_at': 0,
+            'error': None,
+            'output': None,
+            'created_at': now.isoformat(sep=' ', timespec='seconds'),
+            'updated_at': now.isoformat(sep=' ', timespec='seconds'),
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        if text is not None:
+            _write_atomic(self._job_path(job['id'], '.txt'), text.encode('utf-8'))
+        with self.condition:
+            self._save(job)
+            self.jobs[job['id']] = job
+            self.condition.notify_all()
+        return dict(job)
+
+    def submit_text(self, title, text, backend):
+        """本文のテキストを出力するジョブを登録"""
+        return self._submit(title, backend, text=text)
+
+    def submit_report(self, title, db_file, report, filters=(), backend='printer'):
+        """レポート（reporting.cli の machines / maintenance / stats）を作成して出力するジョブを登録"""
+        return self._submit(title, backend, report={'db': os.path.abspath(db_file), 'name': report,
+                                                     'filters': list(filters)})
+
+    def snapshot(self):
+        """全ジョブの写し（受付順）"""
+        with self.condition:
+            return [dict(job) for job in sorted(self.jobs.values(), key=_queue_order)]
+
+    def counts(self):
+        counts = dict.fromkeys(STATUS_LABELS, 0)
+        with self.condition:
+            for job in self.jobs.values():
+                counts[job['status']] += 1
+        return counts
+
+    def retry(self, job_id):
+        """失敗したジョブを待ちに戻す"""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job['status'] != 'failed':
+                return False
+            job.update(status='queued', attempts=0, retry_at=0, error=None)
+            self._update(job)
+            self.condition.notify_all()
+            return True
+
+    def remove(self, job_id):
+        """出力中でないジョブを削除（状態は最後に読み直した時点のもの）"""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job['status'] == 'printing':
+                return False
+            del self.jobs[job_id]
+            self._delete_files(job_id)
+            return True
+
+    def _delete_files(self, job_id):
+        for suffix in ('.json', '.txt'):
+            try:
+                os.remove(self._job_path(job_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _update(self, job):
+        job['updated_at'] = datetime.now().isoformat(sep=' ', timespec='seconds')
+        self._save(job)
+
+    def _next_job(self):
+        """出力できるジョブと、なければ次に再試行できるまでの秒数"""
+        now = time.time()
+        waiting = [job for job in self.jobs.values() if job['status'] == 'queued']
+        ready = [job for job in waiting if job['retry_at'] <= now]
+        if ready:
+            return min(ready, key=_queue_order), None
+        return None, (min(job['retry_at'] for job in waiting) - now if waiting else None)
+
+    def _work(self):
+        try:
+            while not self.stopping:
+                if not self.lock.held and self.lock.acquire():
+                    self._recover()
+                else:
+                    self.load()
+                with self.condition:
+                    job, wait = self._next_job() if self.lock.held else (None, None)
+                    if job is None:
+                        if not self.stopping:
+                            self.condition.wait(POLL_SECONDS if wait is None else min(wait, POLL_SECONDS))
+                        continue
+                    job['status'] = 'printing'
+                    self._update(job)
+                    self.current = job
+                try:
+                    self._process(job)
+                finally:
+                    with self.condition:
+                        self.current = None
+        finally:
+            self.lock.release()
+
+    def _process(self, job):
+        """1件を出力し、結果をジョブに記録"""
+        try:
+            text_path = self._job_path(job['id'], '.txt')
+            if not os.path.exists(text_path):
+                report = job['report']
+                text = render_report(report['db'], report['name'], report['filters'])
+                _write_atomic(text_path, text.encode('utf-8'))
+            output = self.backends[job['backend']](job, text_path)
+        except Exception as e:
+            with self.condition:
+                job['attempts'] += 1
+                job['error'] = str(e)
+                if job['attempts'] >= MAX_ATTEMPTS:
+                    job['status'] = 'failed'
+                else:
+                    job['status'] = 'queued'
+                    job['retry_at'] = time.time() + RETRY_DELAYS_SECONDS[job['attempts'] - 1]
+                if job['id'] in self.jobs:
+                    self._update(job)
+            return
+
+        with self.condition:
+            job.update(status='done', error=None, output=output)
+            job['attempts'] += 1
+            if job['id'] in self.jobs:
+                self._update(job)
+        try:
+            os.remove(text_path)
+        except OSError:
+            pass
+
+    def run_pending(self):
+        """待ちのジョブを（再試行の待ち時間は無視して）全て出力する。コマンドラインから使う
+
+        他のプロセス（起動中のアプリなど）がキューを出力している場合は何もせずに False を返す
+        """
+        if not self.lock.acquire():
+            self.load()
+            return False
+        try:
+            self._recover()
+            while True:
+                with self.condition:
+                    waiting = sorted((job for job in self.jobs.values() if job['status'] == 'queued'),
+                                     key=_queue_order)
+                    if not waiting:
+                        return True
+                    job = waiting[0]
+                    job['status'] = 'printing'
+                    self._update(job)
+                    self.current = job
+                try:
+                    self._process(job)
+                finally:
+                    self.current = None
+                if job['status'] == 'queued':
+                    time.sleep(RETRY_DELAYS_SECONDS[0])
+        finally:
+            self.lock.release()
+
+
+def describe(job):
+    status = STATUS_LABELS[job['status']]
+    detail = job['output'] or job['error'] or ''
+    return f"{job['created_at']}  {status:4s} {BACKEND_LABELS[job['backend']]:8s} {job['title']}  {detail}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="印刷・出力のキュー")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    submit = subparsers.add_parser('submit', help="ジョブを登録")
+    source = submit.add_mutually_exclusive_group(required=True)
+    source.add_argument('--report', choices=('machines', 'maintenance', 'stats'))
+    source.add_argument('--file', help="出力するテキストファイル")
+    submit.add_argument('--filter', action='append', default=[], help="レポートの絞り込み（report.py と同じ）")
+    submit.add_argument('--db', default='press_machine.db')
+    submit.add_argument('--title')
+    submit.add_argument('--backend', choices=list(BACKENDS), default='printer')
+
+    subparsers.add_parser('run', help="待ちのジョブを全て出力")
+    subparsers.add_parser('list', help="ジョブの一覧")
+
+    args = parser.parse_args()
+    spooler = PrintSpooler()
+
+    if args.command == 'submit':
+        if args.report:
+            job = spooler.submit_report(args.title or args.report, args.db, args.report, args.filter, args.backend)
+        else:
+            with open(args.file, encoding='utf-8') as f:
+                job = spooler.submit_text(args.title or os.path.basename(args.file), f.read(), args.backend)
+        print(f"登録しました: {job['id']}（python print_spooler.py run で出力）")
+    elif args.command == 'run':
+        if not spooler.run_pending():
+            print("他のプロセス（起動中のアプリなど）がキューを出力しています")
+        failed = [job for job in spooler.snapshot() if job['status'] == 'failed']
+        for job in spooler.snapshot():
+            print(describe(job))
+        raise SystemExit(1 if failed else 0)
+    else:
+        spooler.load()
+        for job in spooler.snapshot():
+            print(describe(job))
+
+
+if __name__ == "__main__":
+    main()
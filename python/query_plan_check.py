@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+アプリのクエリの実行計画と実行時間の確認
+大量データのDBを生成し、カタログの各処理を実際の関数・SQLで実行して、発行されたSQLを
+EXPLAIN QUERY PLAN で調べる。次の場合は失敗として終了コード 1 を返す（ビルドで実行する）
+- 想定したインデックスが使われていない
+- 許可していないテーブルの全件走査（SCAN <テーブル> でインデックスを使わないもの）
+- 許可していない一時B-tree（USE TEMP B-TREE）や自動インデックス（AUTOMATIC INDEX）
+- 実行時間（中央値）が予算を超えた
+
+使い方:
+  python query_plan_check.py
+  python query_plan_check.py --machines 2000 --records 500000 --budget-scale 2
+  python query_plan_check.py --db press_machine.db --only latest_maintenance
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import re
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import setup_database
+from audit_history import ensure_audit
+from reporting import queries, trends
+from reporting.queries import MACHINE_SELECT, MAINTENANCE_SELECT
+from reporting.pivot import MaintenanceCube
+from shared_db import connect, ensure_schema
+
+DEFAULT_MACHINES = 1000
+DEFAULT_RECORDS = 200000
+DEFAULT_REPEAT = 5
+
+# indexes: 使われていなければならないインデックス
+# scans: インデックスなしの全件走査を許すテーブル（計画に出る名前。別名なら別名）
+# temp: 一時B-tree（並べ替え・GROUP BY）を許すか
+# budget_ms: 実行時間の予算（既定のデータ量での中央値）
+Check = namedtuple('Check', 'name run indexes scans temp budget_ms note')
+
+
+def _first_machine(conn):
+    return conn.execute("SELECT MIN(db_id) FROM press_machines").fetchone()[0]
+
+
+def _rows(sql, params=()):
+    return lambda conn: conn.execute(sql, params).fetchall()
+
+
+def _write(sql, params_of):
+    """更新系は実行後にロールバックする（トリガーの処理時間も含めて測る）"""
+    return lambda conn: conn.execute(sql, params_of(conn))
+
+
+CATALOG = [
+    # プレス機一覧（load_machines・検索・印刷）
+    Check('machine_list', _rows(f"{MACHINE_SELECT} ORDER BY db_id"),
+          ('idx_maintenance_records_machine_date',), ('press_machines',), False, 50, "全件表示（最終点検日は索引の末尾）"),
+    Check('machine_search',
+          lambda conn: _rows(f"{MACHINE_SELECT} {queries.machine_search_filter('12')[0]} {queries.MACHINE_ORDER_BY}",
+                             queries.machine_search_filter('12')[1])(conn),
+          ('idx_machine_search_keys_number', 'idx_machine_search_keys_manufacturer', 'idx_machine_search_keys_model_type',
+           'idx_machine_search_keys_manufacturer_romaji', 'idx_machine_search_keys_model_type_romaji',
+           'idx_maintenance_records_machine_date'), (), True, 30,
+          "検索用キーの前方一致。一致した行だけを一時B-treeで並べ替える"),
+    Check('machine_print_list', lambda conn: queries.fetch_machines(conn),
+          ('idx_press_machines_sort_key',), (), False, 30, ""),
+    Check('machines_by_ids', _rows(f"{MACHINE_SELECT} WHERE db_id IN (1, 2, 3)"),
+          (), (), False, 5, "fetch_by_ids"),
+
+    # メンテナンス記録一覧
+    Check('maintenance_list', _rows(f"{MAINTENANCE_SELECT} ORDER BY m.maintenance_datetime DESC"),
+          ('idx_maintenance_records_datetime',), (), False, 2000, "全件表示（日時の降順はインデックス順）"),
+    Check('maintenance_print_list', lambda conn: queries.fetch_maintenance(conn),
+          ('idx_maintenance_records_datetime',), (), False, 2000, ""),
+    Check('maintenance_sort_id', _rows(f"{MAINTENANCE_SELECT} {queries.maintenance_order_by([('maintenance_id', True)])}"),
+          (), ('m',), False, 2000, "見出しクリック（記録IDは rowid の順に読む）"),
+    Check('maintenance_sort_judgment',
+          _rows(f"{MAINTENANCE_SELECT} {queries.maintenance_order_by([('overall_judgment', False)])}"),
+          ('idx_maintenance_records_judgment',), (), False, 2000, "見出しクリック"),
+    Check('maintenance_sort_machine',
+          _rows(f"{MAINTENANCE_SELECT} {queries.maintenance_order_by([('machine_number', False)])}"),
+          (), (), True, 2500, "見出しクリック。機械番号は結合先の列のため一時B-treeで並べ替える"),
+    Check('maintenance_since',
+          lambda conn: queries.fetch_maintenance(conn, *queries.build_filter('maintenance', ['since=2025-01-01'])),
+          ('idx_maintenance_records_datetime',), (), False, 400, "report.py --filter since="),
+    Check('maintenance_by_ids', _rows(f"{MAINTENANCE_SELECT} WHERE m.maintenance_id IN (1, 2, 3)"),
+          (), (), False, 5, "fetch_by_ids"),
+
+    # 分析タブ・report.py stats
+    Check('machine_stats', queries.machine_stats,
+          ('idx_press_machines_type', 'idx_press_machines_group_type'), (), False, 20, ""),
+    Check('group_type_counts', queries.group_type_counts,
+          ('idx_press_machines_group_type',), (), False, 20, ""),
+    Check('maintenance_count', queries.maintenance_count, (), (), False, 50, ""),
+    Check('latest_maintenance', queries.latest_maintenance,
+          ('idx_press_machines_machine_number', 'idx_maintenance_records_machine_date'), (), False, 50,
+          "機械ごとに (db_id, maintenance_datetime) の末尾を引く"),
+    Check('valve_counts', queries.valve_counts,
+          ('idx_maintenance_records_clutch', 'idx_maintenance_records_brake'), (), False, 50, "部分インデックス"),
+
+    # 推移グラフ（全期間の集計。結果は ResultCache に置く）
+    Check('trend_daily_summary', trends.daily_summary,
+          (), ('m',), True, 1500, "全期間を日単位に集計するため全件走査と一時B-treeを許す"),
+    Check('trend_machine_events', trends.machine_events,
+          ('idx_maintenance_records_machine_date',), (), False, 1500, "機械・日時の順はインデックス順"),
+
+    # ピボット集計（キューブを作るのは初回だけ。以降は change_log の差分を反映する）
+    Check('pivot_cube_load', lambda conn: MaintenanceCube().load(conn),
+          (), ('press_machines', 'maintenance_records', 'sqlite_master', 'sqlite_sequence'), False, 1500,
+          "全件を読んで配列とキューブを作る"),
+
+    # 他インスタンスの変更検知・アラート
+    Check('change_log_poll',
+          _rows("SELECT seq, table_name, row_id, operation FROM change_log WHERE seq > ? ORDER BY seq", (0,)),
+          (), (), False, 20, ""),
+    Check('machine_latest_maintenance',
+          lambda conn: conn.execute("SELECT MAX(maintenance_datetime) FROM maintenance_records WHERE db_id=?",
+                                    (_first_machine(conn),)).fetchone(),
+          ('idx_maintenance_records_machine_date',), (), False, 5, "alert_rules"),
+
+    # 更新（プレス機削除時のメンテナンス記録削除・編集）
+    Check('delete_machine_maintenance',
+          _write("DELETE FROM maintenance_records WHERE db_id=?", lambda conn: (_first_machine(conn),)),
+          ('idx_maintenance_records_machine_date',), (), False, 100, "delete_machine"),
+    Check('update_machine',
+          _write("UPDATE press_machines SET production_group=?, updated_at=? WHERE db_id=?",
+                 lambda conn: (2, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), _first_machine(conn))),
+          (), (), False, 20, "edit_machine"),
+]
+
+MANUFACTURERS = ['アイダエンジニアリング', 'コマツ産機', 'アミノ', 'ヤマダドビー', '小松製作所', 'JANOME']
+
+
+def generate_database(db_file, machines, records, seed=1):
+    """setup_database.py のスキーマに大量データを入れ、アプリと同じスキーマ更新を行う"""
+    rng = random.Random(seed)
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(db_file))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            setup_database.create_database()
+    finally:
+        os.chdir(cwd)
+    os.replace(os.path.join(os.path.dirname(db_file), 'press_machine.db'), db_file)
+
+    conn = sqlite3.connect(db_file)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(press_machines)")}
+    if 'tonnage' not in columns:
+        conn.execute("ALTER TABLE press_machines ADD COLUMN tonnage INTEGER")
+
+    numbers = [str(100 + i) for i in range(machines)]
+    for i in rng.sample(range(machines), machines // 20):
+        numbers[i] = f"R-{i}"
+    conn.executemany("""
+    INSERT INTO press_machines
+    (machine_number, equipment_number, manufacturer, model_type, serial_number, machine_type, production_group, tonnage)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(number, f"EQ-{i:05d}", rng.choice(MANUFACTURERS), f"NC1-{rng.randint(60, 300)}", f"S{i:08d}",
+           rng.choice(['圧造', '汎用']), rng.randint(1, 3), rng.choice([None, 110, 150, 200, 300]))
+          for i, number in enumerate(numbers)])
+    machine_ids = [row[0] for row in conn.execute("SELECT db_id FROM press_machines")]
+
+    start = datetime.now() - timedelta(days=365 * 12)
+    span_seconds = 365 * 12 * 24 * 3600
+
+    def maintenance_rows():
+        for _ in range(records):
+            replaced = rng.random() < 0.06
+            yield (rng.choice(machine_ids),
+                   (start + timedelta(seconds=rng.randrange(span_seconds))).strftime('%Y-%m-%d %H:%M:%S'),
+                   rng.choices(['良好', '要注意', '要修理', '異常'], [80, 12, 6, 2])[0],
+                   '実施' if replaced and rng.random() < 0.5 else '未実施',
+                   '実施' if replaced and rng.random() < 0.5 else '未実施',
+                   '定期点検')
+    conn.executemany("""
+    INSERT INTO maintenance_records
+    (db_id, maintenance_datetime, overall_judgment, clutch_valve_replacement, brake_valve_replacement, remarks)
+    VALUES (?, ?, ?, ?, ?, ?)
+    """, maintenance_rows())
+    conn.commit()
+    conn.close()
+
+    ensure_schema(db_file)
+    ensure_audit(db_file)
+
+
+def _is_statement(sql):
+    return re.match(r'\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b', sql, re.IGNORECASE) is not None
+
+
+def explain(conn, sql):
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def problems(check, plans):
+    """計画から想定外の点を列挙"""
+    found = []
+    details = [detail for _, plan in plans for detail in plan]
+    for index in check.indexes:
+        if not any(re.search(rf'\bINDEX {index}\b', detail) for detail in details):
+            found.append(f"インデックス {index} が使われていません")
+    for detail in details:
+        scan = re.match(r'SCAN (\S+)$', detail)
+        if scan and scan.group(1).split('.')[-1] not in check.scans and scan.group(1) != 'CONSTANT':
+            found.append(f"全件走査: {detail}")
+        if 'TEMP B-TREE' in detail and not check.temp:
+            found.append(f"一時B-tree: {detail}")
+        if 'AUTOMATIC' in detail:
+            found.append(f"自動インデックス（インデックス不足）: {detail}")
+    return found
+
+
+def run_check(conn, check, repeat, budget_scale):
+    """-> (中央値ms, [(SQL, 計画)], 問題のリスト)"""
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        check.run(conn)
+    finally:
+        conn.set_trace_callback(None)
+        conn.rollback()
+
+    # トリガー内の文（'-- TRIGGER' で始まる）は単独では EXPLAIN できないので除く
+    plans = [(sql, explain(conn, sql)) for sql in dict.fromkeys(statements) if _is_statement(sql)]
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        try:
+            check.run(conn)
+        finally:
+            conn.rollback()
+        timings.append((time.perf_counter() - started) * 1000)
+    elapsed = statistics.median(timings)
+
+    found = problems(check, plans)
+    budget = check.budget_ms * budget_scale
+    if elapsed > budget:
+        found.append(f"実行時間 {elapsed:.1f}ms が予算 {budget:.0f}ms を超えています")
+    return elapsed, plans, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="アプリのクエリの実行計画と実行時間の確認")
+    parser.add_argument('--db', help="既存のDBで確認する（省略時は大量データのDBを一時的に生成）")
+    parser.add_argument('--machines', type=int, default=DEFAULT_MACHINES)
+    parser.add_argument('--records', type=int, default=DEFAULT_RECORDS)
+    parser.add_argument('--keep', help="生成したDBをこのパスに残す")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="時間計測の繰り返し回数（中央値を使う）")
+    parser.add_argument('--budget-scale', type=float, default=1.0, help="予算の倍率（遅いマシン・大きいデータ用）")
+    parser.add_argument('--only', nargs='+', help="確認する項目名")
+    parser.add_argument('--verbose', action='store_true', help="全ての実行計画を表示")
+    args = parser.parse_args()
+
+    checks = [check for check in CATALOG if not args.only or check.name in args.only]
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_file = args.db
+        if db_file is None:
+            db_file = os.path.abspath(args.keep) if args.keep else os.path.join(work_dir, 'query_plan_check.db')
+            if os.path.exists(db_file):
+                os.remove(db_file)
+            started = time.perf_counter()
+            generate_database(db_file, args.machines, args.records)
+            print(f"DBを生成しました: プレス機 {args.machines:,}台 / メンテナンス記録 {args.records:,}件"
+                  f"（{time.perf_counter() - started:.1f}秒）\n")
+
+        conn = connect(db_file)
+        failures = 0
+        try:
+            for check in checks:
+                elapsed, plans, found = run_check(conn, check, args.repeat, args.budget_scale)
+                failures += bool(found)
+                print(f"{'NG' if found else 'OK'}  {check.name:28s} {elapsed:8.1f}ms"
+                      f" / {check.budget_ms * args.budget_scale:.0f}ms  {check.note}")
+                for problem in found:
+                    print(f"      - {problem}")
+                if found or args.verbose:
+                    for sql, plan in plans:
+                        print(f"      {' '.join(sql.split())[:100]}")
+                        for detail in plan:
+                            print(f"        {detail}")
+        finally:
+            conn.close()
+
+    print(f"\n{len(checks) - failures} / {len(checks)} 件 OK")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+"""
+レポート出力（reporting パッケージのコマンドライン。tkinter を読み込まないので画面のない環境でも動く）
+使い方は reporting/cli.py を参照
+"""
+from reporting.cli import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+"""
+プレス機一覧・メンテナンス記録・統計のレポート生成（tkinter に依存しない）
+画面の印刷プレビュー・分析タブと report.py（cron などからの出力）が同じ処理を使う
+"""
+from reporting.queries import (
+    LATEST_MAINTENANCE_SELECT, MACHINE_COLUMNS, MACHINE_LIST_SELECT, MACHINE_ORDER_BY, MACHINE_SELECT,
+    MACHINE_SORT_KEY, MAINTENANCE_COLUMNS, MAINTENANCE_LIST_SELECT, MAINTENANCE_ORDER_BY, MAINTENANCE_SELECT,
+    build_filter, fetch_machines, fetch_maintenance, group_type_counts, latest_maintenance, machine_count,
+    machine_list_select, machine_search_filter, machine_stats, maintenance_count, maintenance_list_select,
+    maintenance_order_by, statistics, valve_counts,
+)
+from reporting.text import (
+    latest_maintenance_text, machine_list_text, machine_print_stats_text, machine_stats_text,
+    maintenance_list_text, maintenance_stats_text, statistics_header, statistics_text, valve_stats_text,
+)
@@ -0,0 +1,5 @@
+from reporting.cli import main
+
+# 全社統計はプロセスプールを使うため、子プロセスでの再実行を防ぐ
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+レポートのコマンドライン出力（画面を起動せずに cron などから使う）
+
+使い方:
+  python report.py machines --db press_machine.db --format text
+  python report.py machines --filter production_group=1 --filter machine_type=圧造 --format csv --output machines.csv
+  python report.py maintenance --filter since=2026-10-01 --format json
+  python report.py stats --format text --output stats.txt
+  python report.py stats --registry plants.json --workers 8（工場ごとの DB をまとめた全社統計。reporting/fleet.py）
+"""
+import argparse
+import csv
+import json
+import sys
+
+from reporting import queries, text
+from shared_db import connect
+
+
+def machines_report(conn, fmt, filters):
+    where, params = queries.build_filter('machines', filters, conn=conn)
+    machines = queries.fetch_machines(conn, where, params)
+    if fmt == 'text':
+        stats = text.machine_print_stats_text(queries.group_type_counts(conn, where, params),
+                                              queries.machine_count(conn, where, params))
+        return text.machine_list_text(machines, stats)
+    return queries.MACHINE_COLUMNS, machines
+
+
+def maintenance_report(conn, fmt, filters):
+    where, params = queries.build_filter('maintenance', filters)
+    records = queries.fetch_maintenance(conn, where, params)
+    if fmt == 'text':
+        return text.maintenance_list_text(records)
+    return queries.MAINTENANCE_COLUMNS, records
+
+
+def format_statistics(stats, fmt):
+    """queries.statistics（または fleet.merge_statistics）の結果を出力形式に変換"""
+    if fmt == 'text':
+        return text.statistics_text(stats)
+    if fmt == 'json':
+        return {
+            'machines': {
+                'total': stats['machines']['total'],
+                'by_type': {machine_type: count for machine_type, count in stats['machines']['by_type']},
+                'by_group': {group: count for group, count in stats['machines']['by_group']},
+            },
+            'maintenance_total': stats['maintenance_total'],
+            'latest_maintenance': {machine_number: latest for machine_number, latest in stats['latest_maintenance']},
+            'valves': stats['valves'],
+        }
+    # CSV は 区分, 項目, 値 の縦持ち
+    rows = [('machines', 'total', stats['machines']['total'])]
+    rows += [('by_type', machine_type, count) for machine_type, count in stats['machines']['by_type']]
+    rows += [('by_group', group, count) for group, count in stats['machines']['by_group']]
+    rows.append(('maintenance', 'total', stats['maintenance_total']))
+    rows += [('latest_maintenance', machine_number, latest) for machine_number, latest in stats['latest_maintenance']]
+    rows += [('valves', valve, count) for valve, count in stats['valves'].items()]
+    return ('section', 'key', 'value'), rows
+
+
+def stats_report(conn, fmt, filters):
+    if filters:
+        raise ValueError("統計情報は絞り込みに対応していません")
+    return format_statistics(queries.statistics(conn), fmt)
+
+
+REPORTS = {
+    'machines': machines_report,
+    'maintenance': maintenance_report,
+    'stats': stats_report,
+}
+
+
+def write_report(result, fmt, out):
+    if fmt == 'text':
+        out.write(result)
+    elif fmt == 'json':
+        if isinstance(result, tuple):
+            columns, rows = result
+            result = [dict(zip(columns, row)) for row in rows]
+        json.dump(result, out, ensure_ascii=False, indent=2)
+        out.write("\n")
+    else:
+        columns, rows = result
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+
+def fleet_report(args):
+    """登録簿の工場をまとめた出力 -> (出力内容, {工場ID: エラー内容})"""
+    from reporting import fleet
+
+    registry = fleet.ShardRegistry(args.registry)
+    shards = registry.select(args.plant)
+    if not shards:
+        raise ValueError(f"工場が登録されていません: {args.registry}")
+
+    if args.report != 'stats':
+        if args.format == 'text':
+            raise ValueError("複数工場の一覧は --format json または csv で出力してください")
+        # 検索用キーはシャードごとのテーブルを引く（キーのないシャードは部分一致）
+        def where(conn, schema):
+            return queries.build_filter(args.report, args.filter, schema, conn)
+
+        if args.report == 'machines':
+            return (('plant',) + queries.MACHINE_COLUMNS, fleet.federated_machines(registry, shards, where)), {}
+        return (('plant',) + queries.MAINTENANCE_COLUMNS, fleet.federated_maintenance(registry, shards, where)), {}
+
+    if args.filter:
+        raise ValueError("統計情報は絞り込みに対応していません")
+    per_plant, errors = fleet.collect_statistics(registry, shards, args.workers, not args.no_cache)
+    merged = format_statistics(fleet.merge_statistics(per_plant), args.format)
+    if args.format == 'text':
+        return merged, errors
+    if args.format == 'json':
+        merged['plants'] = {plant_id: format_statistics(stats, 'json') for plant_id, stats in per_plant.items()}
+        merged['errors'] = errors
+        return merged, errors
+    # CSV は先頭に工場ID（全社合計は *）
+    columns, rows = merged
+    rows = [('*',) + row for row in rows]
+    for plant_id, stats in per_plant.items():
+        rows += [(plant_id,) + row for row in format_statistics(stats, 'csv')[1]]
+    return (('plant',) + columns, rows), errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='report', description="プレス機一覧・メンテナンス記録・統計情報の出力")
+    parser.add_argument('report', choices=list(REPORTS))
+    parser.add_argument('--db', default='press_machine.db')
+    parser.add_argument('--format', choices=['text', 'json', 'csv'], default='text')
+    parser.add_argument('--filter', action='append', default=[], metavar='列=値',
+                        help="絞り込み（複数指定は AND）。プレス機は '=' なしで検索欄と同じ部分一致検索")
+    parser.add_argument('--output', help="出力ファイル（省略時は標準出力）")
+    parser.add_argument('--registry', help="工場の登録簿（指定すると --db の代わりに登録された全工場を対象にする）")
+    parser.add_argument('--plant', action='append', metavar='工場ID', help="--registry の工場を絞り込む（複数指定可）")
+    parser.add_argument('--workers', type=int, help="全社統計の並列プロセス数（既定は CPU 数）")
+    parser.add_argument('--no-cache', action='store_true', help="工場ごとの集計キャッシュを使わない")
+    args = parser.parse_args(argv)
+
+    errors = {}
+    if args.registry:
+        try:
+            result, errors = fleet_report(args)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        conn = connect(args.db)
+        try:
+            result = REPORTS[args.report](conn, args.format, args.filter)
+        except ValueError as e:
+            parser.error(str(e))
+        finally:
+            conn.close()
+
+    if args.output:
+        # CSV は Excel で文字化けしないよう BOM 付き（export_data.py と同じ）
+        encoding = 'utf-8-sig' if args.format == 'csv' else 'utf-8'
+        with open(args.output, 'w', newline='' if args.format == 'csv' else None, encoding=encoding) as out:
+            write_report(result, args.format, out)
+    else:
+        write_report(result, args.format, sys.stdout)
+
+    # 集計できなかった工場があれば知らせて終了コード 1（cron で検知できるように）
+    for plant_id, error in errors.items():
+        print(f"集計できなかった工場: {plant_id}: {error}", file=sys.stderr)
+    if errors:
+        raise SystemExit(1)
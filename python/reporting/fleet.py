@@ -0,0 +1,272 @@
+"""
+工場ごとの press_machine.db（シャード）をまとめて扱う
+- 登録簿（JSON）: 工場ID・名称・DBのパス・Supabase 側の org_id
+- 少数の工場の一覧は、読み取り専用で ATTACH して1つのクエリで取得する
+- 全社の統計は工場ごとの集計をプロセスプールで並列に実行し、合算する。
+  工場ごとの集計結果は DB ファイルの更新日時とサイズをキーにキャッシュファイルへ保存し、
+  変わっていない工場は読み直さない
+
+使い方:
+  python -m reporting.fleet add --registry plants.json --id tokyo --name 東京工場 --db //fs01/tokyo/press_machine.db
+  python -m reporting.fleet list --registry plants.json
+  python report.py stats --registry plants.json --workers 8
+  python report.py machines --registry plants.json --plant tokyo --plant osaka --format csv
+"""
+import argparse
+import json
+import os
+import sqlite3
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from reporting import queries
+from shared_db import BUSY_TIMEOUT_SECONDS
+
+Shard = namedtuple('Shard', 'id name db org_id')
+
+
+class ShardRegistry:
+    """工場（シャード）の登録簿。DB のパスは登録簿からの相対パスでもよい"""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.shards = []
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for plant in json.load(f)['plants']:
+                    self.shards.append(Shard(plant['id'], plant.get('name') or plant['id'], plant['db'],
+                                             plant.get('org_id')))
+
+    @property
+    def cache_path(self):
+        return os.path.splitext(self.path)[0] + '.cache.json'
+
+    def db_path(self, shard):
+        return os.path.join(os.path.dirname(self.path), shard.db)
+
+    def select(self, ids=None):
+        """ids（工場IDのリスト）に該当するシャード。None なら全て"""
+        if not ids:
+            return list(self.shards)
+        known = {shard.id: shard for shard in self.shards}
+        unknown = [plant_id for plant_id in ids if plant_id not in known]
+        if unknown:
+            raise ValueError(f"登録されていない工場です: {', '.join(unknown)}")
+        return [known[plant_id] for plant_id in ids]
+
+    def add(self, shard):
+        if any(existing.id == shard.id for existing in self.shards):
+            raise ValueError(f"工場IDが重複しています: {shard.id}")
+        self.shards.append(shard)
+
+    def remove(self, plant_id):
+        self.select([plant_id])
+        self.shards = [shard for shard in self.shards if shard.id != plant_id]
+
+    def save(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'plants': [shard._asdict() for shard in self.shards]}, f, ensure_ascii=False, indent=2)
+
+
+def _readonly_uri(db_path):
+    return Path(db_path).resolve().as_uri() + '?mode=ro'
+
+
+def connect_readonly(db_path):
+    """シャードを読み取り専用で開く（存在しないパスでファイルを作らない）"""
+    return sqlite3.connect(_readonly_uri(db_path), uri=True, timeout=BUSY_TIMEOUT_SECONDS)
+
+
+# --- ATTACH による横断クエリ（少数の工場向け） ---
+
+def federated_query(registry, shards, select, where="", params=(), order_by=""):
+    """各シャードを ATTACH し、select(schema) の結果を UNION ALL でまとめる
+
+    結果の先頭列は工場ID。where と params は各シャードに同じものを適用する。where が関数の場合は
+    シャードごとに where(conn, schema) を呼び、返された (WHERE 句, パラメータ) を使う（params は使わない）。
+    一度に ATTACH できる数（SQLite の既定は10）を超える場合は ValueError
+    """
+    conn = sqlite3.connect(':memory:', uri=True, timeout=BUSY_TIMEOUT_SECONDS)
+    try:
+        limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        if len(shards) > limit:
+            raise ValueError(f"一度に横断検索できるのは {limit} 工場までです（--plant で絞り込んでください）")
+
+        parts = []
+        all_params = []
+        for i, shard in enumerate(shards):
+            try:
+                conn.execute(f"ATTACH DATABASE ? AS shard{i}", (_readonly_uri(registry.db_path(shard)),))
+            except sqlite3.OperationalError as e:
+                raise ValueError(f"工場 {shard.id} のDBを開けません: {e}")
+            schema = f"shard{i}"
+            shard_where, shard_params = where(conn, schema) if callable(where) else (where, params)
+            parts.append(select(schema).replace("SELECT", "SELECT ? AS plant,", 1) + f" {shard_where}")
+            all_params.append(shard.id)
+            all_params.extend(shard_params)
+        return conn.execute(f"SELECT * FROM ({' UNION ALL '.join(parts)}) {order_by}", all_params).fetchall()
+    finally:
+        conn.close()
+
+
+def federated_machines(registry, shards, where="", params=()):
+    return federated_query(registry, shards, queries.machine_list_select, where, params,
+                           queries.MACHINE_ORDER_BY.replace("ORDER BY", "ORDER BY plant,", 1))
+
+
+def federated_maintenance(registry, shards, where="", params=()):
+    return federated_query(registry, shards, queries.maintenance_list_select, where, params,
+                           "ORDER BY maintenance_datetime DESC")
+
+
+# --- 全社統計（プロセスプールで工場ごとに集計して合算） ---
+
+def shard_statistics(db_path):
+    """1工場分の集計（別プロセスで実行するため結果は JSON にできる形で返す）"""
+    conn = connect_readonly(db_path)
+    try:
+        stats = queries.statistics(conn)
+    finally:
+        conn.close()
+    return {
+        'machines': {
+            'total': stats['machines']['total'],
+            'by_type': [list(row) for row in stats['machines']['by_type']],
+            'by_group': [list(row) for row in stats['machines']['by_group']],
+        },
+        'maintenance_total': stats['maintenance_total'],
+        'latest_maintenance': [list(row) for row in stats['latest_maintenance']],
+        'valves': stats['valves'],
+    }
+
+
+def _fingerprint(db_path):
+    # DELETE ジャーナルモードではコミットのたびに DB ファイル本体が書き換わる
+    stat = os.stat(db_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _load_cache(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(path, cache):
+    partial = path + '.partial'
+    with open(partial, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(partial, path)
+
+
+def collect_statistics(registry, shards, workers=None, use_cache=True):
+    """工場ごとの集計を返す -> ({工場ID: 集計}, {工場ID: エラー内容})
+
+    変更のない工場はキャッシュを使い、残りを workers 個のプロセスで並列に集計する。
+    開けない工場（ネットワークドライブの切断など）はエラーとして記録し、他の工場は続行する
+    """
+    cache = _load_cache(registry.cache_path) if use_cache else {}
+    results = {}
+    errors = {}
+    pending = {}
+    for shard in shards:
+        db_path = registry.db_path(shard)
+        try:
+            fingerprint = _fingerprint(db_path)
+        except OSError as e:
+            errors[shard.id] = str(e)
+            continue
+        entry = cache.get(os.path.abspath(db_path))
+        if entry is not None and entry['fingerprint'] == fingerprint:
+            results[shard.id] = entry['stats']
+        else:
+            pending[shard.id] = (db_path, fingerprint)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(pending))) as executor:
+            futures = {plant_id: executor.submit(shard_statistics, db_path)
+                       for plant_id, (db_path, _) in pending.items()}
+            for plant_id, future in futures.items():
+                db_path, fingerprint = pending[plant_id]
+                try:
+                    results[plant_id] = future.result()
+                except (sqlite3.Error, OSError) as e:
+                    errors[plant_id] = str(e)
+                    continue
+                cache[os.path.abspath(db_path)] = {'fingerprint': fingerprint, 'stats': results[plant_id]}
+        if use_cache:
+            _save_cache(registry.cache_path, cache)
+
+    return {shard.id: results[shard.id] for shard in shards if shard.id in results}, errors
+
+
+def _sorted_counts(counter):
+    return sorted(counter.items(), key=lambda item: (item[0] is None, item[0]))
+
+
+def merge_statistics(per_plant):
+    """工場ごとの集計を queries.statistics と同じ形に合算（最新メンテナンスは '工場ID/製造番号'）"""
+    by_type = Counter()
+    by_group = Counter()
+    valves = Counter()
+    latest = []
+    for plant_id, stats in per_plant.items():
+        for machine_type, count in stats['machines']['by_type']:
+            by_type[machine_type] += count
+        for group, count in stats['machines']['by_group']:
+            by_group[group] += count
+        valves.update(stats['valves'])
+        latest.extend((f"{plant_id}/{machine_number}", value)
+                      for machine_number, value in stats['latest_maintenance'])
+    return {
+        'machines': {
+            'total': sum(stats['machines']['total'] for stats in per_plant.values()),
+            'by_type': _sorted_counts(by_type),
+            'by_group': _sorted_counts(by_group),
+        },
+        'maintenance_total': sum(stats['maintenance_total'] for stats in per_plant.values()),
+        'latest_maintenance': latest,
+        'valves': {'clutch': valves['clutch'], 'brake': valves['brake']},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="工場（シャード）登録簿の管理")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('list', help="登録されている工場")
+
+    add = subparsers.add_parser('add', help="工場を登録")
+    add.add_argument('--id', required=True)
+    add.add_argument('--name')
+    add.add_argument('--db', required=True, help="press_machine.db のパス（登録簿からの相対パスも可）")
+    add.add_argument('--org-id', help="Supabase 側の org_id")
+
+    remove = subparsers.add_parser('remove', help="工場の登録を削除")
+    remove.add_argument('--id', required=True)
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument('--registry', default='plants.json')
+    args = parser.parse_args()
+
+    registry = ShardRegistry(args.registry)
+    try:
+        if args.command == 'add':
+            registry.add(Shard(args.id, args.name or args.id, args.db, args.org_id))
+            registry.save()
+        elif args.command == 'remove':
+            registry.remove(args.id)
+            registry.save()
+    except ValueError as e:
+        parser.error(str(e))
+
+    for shard in registry.shards:
+        exists = "" if os.path.exists(registry.db_path(shard)) else "  （DBが見つかりません）"
+        print(f"  {shard.id:12s} {shard.name}  {shard.db}{exists}")
+
+
+if __name__ == "__main__":
+    main()
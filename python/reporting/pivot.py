@@ -0,0 +1,448 @@
+"""
+メンテナンス記録のピボット集計（tkinter に依存しない）
+行・列に選んだ項目（生産グループ・種別・メーカー・型式・機械・年/四半期/月・総合判定・電磁弁交換の有無）
+ごとに、選んだ値（記録数・電磁弁交換数・台数）を集計する
+
+- 記録と機械の属性は NumPy の配列（文字列は番号に置き換える）で持つ
+- 種類の少ない項目（型式・機械以外）の組み合わせごとの件数を「キューブ」として事前に集計しておき、
+  それらの項目だけのピボットはキューブ（数千セル程度）を集計し直すだけで求める
+- 型式・機械を含むピボットと台数（重複を除いた数）は記録の配列をベクトル演算で集計する
+- 変更は change_log で変わった記録・機械の分だけキューブから引いて足し直す（全件は読み直さない）
+- 集計結果はキューブの版ごとにキャッシュする（変更があれば版が進み、古い結果は使わない）
+
+月は 年*12 + 月 - 1 の番号で扱う（日時のない記録は -1）
+"""
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from reporting.trends import JUDGMENTS
+from shared_db import current_seq, fetch_by_ids
+
+# 項目名 -> (表示名, キューブで集計できるか)
+DIMENSIONS = OrderedDict([
+    ('production_group', ("生産グループ", True)),
+    ('machine_type', ("種別", True)),
+    ('manufacturer', ("メーカー", True)),
+    ('model_type', ("型式", False)),
+    ('machine', ("機械番号", False)),
+    ('year', ("年", True)),
+    ('quarter', ("四半期", True)),
+    ('month', ("月", True)),
+    ('judgment', ("総合判定", True)),
+    ('clutch', ("クラッチ弁交換", True)),
+    ('brake', ("ブレーキ弁交換", True)),
+])
+
+# 値の名前 -> 表示名
+MEASURES = OrderedDict([
+    ('records', "記録数"),
+    ('clutch_replacements', "クラッチ弁交換数"),
+    ('brake_replacements', "ブレーキ弁交換数"),
+    ('valve_replacements', "電磁弁交換数"),
+    ('machines', "台数"),
+])
+
+# 機械の属性（press_machines の列）
+MACHINE_ATTRIBUTES = OrderedDict([
+    ('production_group', 'production_group'),
+    ('machine_type', 'machine_type'),
+    ('manufacturer', 'manufacturer'),
+    ('model_type', 'model_type'),
+    ('machine', 'machine_number'),
+])
+
+# キューブのセルの番号のビット配置（項目名, ビット数）。機械の属性と判定は語彙の番号、月は +1 した番号
+CELL_LAYOUT = (('production_group', 8), ('machine_type', 8), ('manufacturer', 16), ('month', 16),
+               ('judgment', 8), ('clutch', 1), ('brake', 1))
+
+MONTH_SQL = ("CAST(strftime('%Y', maintenance_datetime) AS INTEGER) * 12"
+             " + CAST(strftime('%m', maintenance_datetime) AS INTEGER) - 1")
+
+RESULT_CACHE_SIZE = 64
+
+UNKNOWN_LABEL = "（未設定）"
+
+PivotTable = namedtuple('PivotTable', 'row_labels column_labels values row_totals column_totals total source version')
+
+
+class _Vocabulary:
+    """文字列などの値 <-> 番号（番号は追加順で変わらない）"""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, values):
+        codes = np.empty(len(values), dtype=np.int64)
+        for i, value in enumerate(values):
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.values)
+                self.values.append(value)
+            codes[i] = code
+        return codes
+
+
+def _sort_key(value):
+    """None は末尾、数値は数値順、文字列は文字列順"""
+    if value is None:
+        return (2, 0, '')
+    if isinstance(value, (int, float)):
+        return (0, value, '')
+    return (1, 0, str(value))
+
+
+def _month_label(code):
+    return UNKNOWN_LABEL if code < 0 else f"{code // 12}-{code % 12 + 1:02d}"
+
+
+def _quarter_label(code):
+    return UNKNOWN_LABEL if code < 0 else f"{code // 4} Q{code % 4 + 1}"
+
+
+def _year_label(code):
+    return UNKNOWN_LABEL if code < 0 else str(code)
+
+
+def _flag_label(code):
+    return "実施" if code else "未実施"
+
+
+def _unique_rows(columns, count):
+    """列（長さ count の整数の配列）の組み合わせ -> (組み合わせの配列, 各行の組の番号)"""
+    if count == 0:
+        return np.zeros((0, len(columns)), dtype=np.int64), np.zeros(0, dtype=np.intp)
+    if not columns:
+        return np.zeros((1, 0), dtype=np.int64), np.zeros(count, dtype=np.intp)
+    low = [int(column.min()) for column in columns]
+    sizes = [int(column.max()) - base + 1 for column, base in zip(columns, low)]
+    flat = np.ravel_multi_index([column - base for column, base in zip(columns, low)], sizes)
+    unique, inverse = np.unique(flat, return_inverse=True)
+    combos = np.stack(np.unravel_index(unique, sizes), axis=1) + np.array(low, dtype=np.int64)
+    return combos, inverse
+
+
+class MaintenanceCube:
+    """メンテナンス記録のピボット集計（記録・機械の配列と、種類の少ない項目のキューブ）"""
+
+    def __init__(self):
+        self.vocab = {attribute: _Vocabulary() for attribute in MACHINE_ATTRIBUTES}
+        self.vocab['judgment'] = _Vocabulary()
+
+        # 機械（行は db_id の登場順。削除された機械も行は残す）
+        self.machine_position = {}
+        self.machine_codes = {attribute: np.empty(0, dtype=np.int64) for attribute in MACHINE_ATTRIBUTES}
+
+        # 記録
+        self.record_position = {}
+        self.record_ids = np.empty(0, dtype=np.int64)
+        self.record_machine = np.empty(0, dtype=np.int64)
+        self.month = np.empty(0, dtype=np.int64)
+        self.judgment = np.empty(0, dtype=np.int64)
+        self.clutch = np.empty(0, dtype=bool)
+        self.brake = np.empty(0, dtype=bool)
+        self.alive = np.empty(0, dtype=bool)
+
+        # キューブ（セルの番号と、セルごとの 記録数・クラッチ弁交換数・ブレーキ弁交換数）
+        self.cells = np.empty(0, dtype=np.int64)
+        self.cell_counts = np.empty((0, 3), dtype=np.int64)
+
+        # 変更のたびに進める版と、版ごとの集計結果
+        self.version = 0
+        self.results = OrderedDict()
+        # change_log の読み込み済みの位置
+        self.seq = None
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    # --- 読み込み・更新 ---
+
+    def load(self, conn):
+        """全件を読み込んでキューブを作り直す（版は進める）"""
+        version = self.version
+        self.__init__()
+        self.version = version
+        self.seq = current_seq(conn)
+        self._put_machines(conn.execute(_machine_select()).fetchall())
+        self._put_records(conn.execute(_record_select()).fetchall())
+        self._touch()
+
+    def refresh(self, conn):
+        """前回以降の変更を反映する -> 変更があったか
+
+        change_log に前回以降の記録が残っていなければ（古い記録は整理される）全件を読み直す
+        """
+        seq = current_seq(conn)
+        if self.seq is None or seq is None:
+            self.load(conn)
+            return True
+        if seq == self.seq:
+            return False
+        oldest = conn.execute("SELECT MIN(seq) FROM change_log").fetchone()[0]
+        if oldest is None or oldest > self.seq + 1:
+            self.load(conn)
+            return True
+
+        changed = {}
+        for table, row_id in conn.execute(
+                "SELECT DISTINCT table_name, row_id FROM change_log WHERE seq > ? AND seq <= ?", (self.seq, seq)):
+            changed.setdefault(table, []).append(row_id)
+        self.seq = seq
+
+        machine_ids = changed.get('press_machines', [])
+        record_ids = changed.get('maintenance_records', [])
+        if machine_ids:
+            # 属性が変わった機械の記録はセルが移るので、いったんキューブから引いて属性を更新してから足し直す
+            positions = [self.machine_position[db_id] for db_id in machine_ids if db_id in self.machine_position]
+            moved = np.flatnonzero(self.alive & np.isin(self.record_machine, positions))
+            self._add_to_cube(moved, -1)
+            self._put_machines(fetch_by_ids(conn, _machine_select(), 'db_id', machine_ids))
+            self._add_to_cube(moved, 1)
+        if record_ids:
+            rows = fetch_by_ids(conn, _record_select(), 'maintenance_id', record_ids)
+            found = {row[0] for row in rows}
+            self._remove_records([record_id for record_id in record_ids if record_id not in found])
+            self._put_records(rows)
+        self._touch()
+        return True
+
+    def _touch(self):
+        self.version += 1
+        self.results.clear()
+
+    def _put_machines(self, rows):
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        positions = []
+        for db_id in columns[0]:
+            position = self.machine_position.get(db_id)
+            if position is None:
+                position = self.machine_position[db_id] = len(self.machine_position)
+            positions.append(position)
+        positions = np.array(positions, dtype=np.intp)
+        size = len(self.machine_position)
+        for i, attribute in enumerate(MACHINE_ATTRIBUTES, start=1):
+            codes = self.machine_codes[attribute]
+            if len(codes) < size:
+                codes = self.machine_codes[attribute] = np.concatenate([codes, np.zeros(size - len(codes), dtype=np.int64)])
+            codes[positions] = self.vocab[attribute].encode(columns[i])
+
+    def _put_records(self, rows):
+        """記録を追加・更新する（更新する記録は古い値をキューブから引いてから書き換える）"""
+        if not rows:
+            return
+        ids, machine_ids, months, judgments, clutch, brake = (list(column) for column in zip(*rows))
+        positions = np.array([self.record_position.get(record_id, -1) for record_id in ids], dtype=np.intp)
+        existing = positions[positions >= 0]
+        self._add_to_cube(existing[self.alive[existing]], -1)
+
+        new = positions < 0
+        if new.any():
+            start = len(self.record_ids)
+            count = int(new.sum())
+            self.record_ids = np.concatenate([self.record_ids, np.zeros(count, dtype=np.int64)])
+            self.record_machine = np.concatenate([self.record_machine, np.zeros(count, dtype=np.int64)])
+            self.month = np.concatenate([self.month, np.zeros(count, dtype=np.int64)])
+            self.judgment = np.concatenate([self.judgment, np.zeros(count, dtype=np.int64)])
+            self.clutch = np.concatenate([self.clutch, np.zeros(count, dtype=bool)])
+            self.brake = np.concatenate([self.brake, np.zeros(count, dtype=bool)])
+            self.alive = np.concatenate([self.alive, np.zeros(count, dtype=bool)])
+            positions[new] = np.arange(start, start + count)
+            self.record_position.update(zip(np.array(ids)[new].tolist(), positions[new].tolist()))
+
+        # 記録が先に届いた機械（同じ変更の中で機械も追加された場合など）は属性なしの行を作っておく
+        for db_id in set(machine_ids) - self.machine_position.keys():
+            self._put_machines([(db_id,) + (None,) * len(MACHINE_ATTRIBUTES)])
+
+        self.record_ids[positions] = ids
+        self.record_machine[positions] = [self.machine_position[db_id] for db_id in machine_ids]
+        self.month[positions] = [-1 if month is None else month for month in months]
+        self.judgment[positions] = self.vocab['judgment'].encode(judgments)
+        self.clutch[positions] = np.array(clutch, dtype=bool)
+        self.brake[positions] = np.array(brake, dtype=bool)
+        self.alive[positions] = True
+        self._add_to_cube(positions, 1)
+
+    def _remove_records(self, ids):
+        positions = np.array([self.record_position.get(record_id, -1) for record_id in ids], dtype=np.intp)
+        positions = positions[positions >= 0]
+        positions = positions[self.alive[positions]]
+        self._add_to_cube(positions, -1)
+        self.alive[positions] = False
+
+    def _cell_fields(self, positions):
+        """記録の行 -> キューブの項目ごとの番号"""
+        machines = self.record_machine[positions]
+        return {
+            'production_group': self.machine_codes['production_group'][machines],
+            'machine_type': self.machine_codes['machine_type'][machines],
+            'manufacturer': self.machine_codes['manufacturer'][machines],
+            'month': self.month[positions] + 1,
+            'judgment': self.judgment[positions],
+            'clutch': self.clutch[positions].astype(np.int64),
+            'brake': self.brake[positions].astype(np.int64),
+        }
+
+    def _add_to_cube(self, positions, sign):
+        """記録の行をキューブに足す（sign=-1 で引く）。件数が 0 になったセルは消す"""
+        if len(positions) == 0:
+            return
+        fields = self._cell_fields(positions)
+        cells = np.zeros(len(positions), dtype=np.int64)
+        for name, bits in CELL_LAYOUT:
+            values = fields[name]
+            if len(values) and values.max() >= (1 << bits):
+                raise ValueError(f"{name} の種類が多すぎてキューブに入りません")
+            cells = (cells << bits) | values
+        counts = np.stack([np.ones(len(positions), dtype=np.int64),
+                           fields['clutch'], fields['brake']], axis=1) * sign
+
+        merged, inverse = np.unique(np.concatenate([self.cells, cells]), return_inverse=True)
+        totals = np.zeros((len(merged), 3), dtype=np.int64)
+        np.add.at(totals, inverse, np.concatenate([self.cell_counts, counts]))
+        keep = totals[:, 0] != 0
+        self.cells = merged[keep]
+        self.cell_counts = totals[keep]
+
+    # --- 集計 ---
+
+    def pivot(self, rows, columns=(), measure='records'):
+        """行・列の項目と値を指定して集計する -> PivotTable
+
+        値の表は (行の数, 列の数)。列の項目を指定しない場合は1列（見出しは値の表示名）
+        """
+        rows, columns = tuple(rows), tuple(columns)
+        for dimension in rows + columns:
+            if dimension not in DIMENSIONS:
+                raise ValueError(f"集計できない項目です: {dimension}")
+        if measure not in MEASURES:
+            raise ValueError(f"集計できない値です: {measure}")
+
+        key = (rows, columns, measure)
+        cached = self.results.get(key)
+        if cached is not None:
+            self.results.move_to_end(key)
+            return cached
+
+        dimensions = rows + columns
+        use_cube = measure != 'machines' and all(DIMENSIONS[dimension][1] for dimension in dimensions)
+        fields, weights, machines = self._cube_source() if use_cube else self._record_source()
+        codes = [self._dimension_codes(dimension, fields) for dimension in dimensions]
+
+        count = len(fields['month'])
+
+        def aggregate(indices):
+            combos, inverse = _unique_rows([codes[i] for i in indices], count)
+            if measure == 'machines':
+                # (組, 機械) の重複を除いてから組ごとに数える
+                stride = len(self.machine_position) + 1
+                pairs = np.unique(inverse * stride + machines)
+                values = np.bincount(pairs // stride, minlength=len(combos))
+            else:
+                values = np.bincount(inverse, weights=weights[measure], minlength=len(combos))
+            return combos, values.astype(np.int64)
+
+        row_index = tuple(range(len(rows)))
+        column_index = tuple(range(len(rows), len(dimensions)))
+        row_combos, row_totals = self._ordered(rows, *aggregate(row_index))
+        column_combos, column_totals = self._ordered(columns, *aggregate(column_index))
+        cell_combos, cell_values = aggregate(row_index + column_index)
+        total = aggregate(())[1]
+
+        row_lookup = {tuple(combo): i for i, combo in enumerate(row_combos)}
+        column_lookup = {tuple(combo): i for i, combo in enumerate(column_combos)}
+        values = np.zeros((len(row_combos), len(column_combos)), dtype=np.int64)
+        for combo, value in zip(cell_combos.tolist(), cell_values.tolist()):
+            values[row_lookup[tuple(combo[:len(rows)])], column_lookup[tuple(combo[len(rows):])]] = value
+
+        table = PivotTable(
+            row_labels=[self._labels(rows, combo) for combo in row_combos],
+            column_labels=[self._labels(columns, combo) for combo in column_combos] if columns else [(MEASURES[measure],)],
+            values=values, row_totals=row_totals, column_totals=column_totals,
+            total=int(total[0]) if len(total) else 0,
+            source='cube' if use_cube else 'records', version=self.version)
+        self.results[key] = table
+        while len(self.results) > RESULT_CACHE_SIZE:
+            self.results.popitem(last=False)
+        return table
+
+    def _cube_source(self):
+        fields = {}
+        cells = self.cells
+        for name, bits in reversed(CELL_LAYOUT):
+            fields[name] = cells & ((1 << bits) - 1)
+            cells = cells >> bits
+        fields['month'] = fields['month'] - 1
+        counts = self.cell_counts
+        weights = {'records': counts[:, 0], 'clutch_replacements': counts[:, 1], 'brake_replacements': counts[:, 2],
+                   'valve_replacements': counts[:, 1] + counts[:, 2]}
+        return fields, weights, None
+
+    def _record_source(self):
+        live = np.flatnonzero(self.alive)
+        machines = self.record_machine[live]
+        fields = {attribute: self.machine_codes[attribute][machines] for attribute in MACHINE_ATTRIBUTES}
+        fields.update(month=self.month[live], judgment=self.judgment[live],
+                      clutch=self.clutch[live].astype(np.int64), brake=self.brake[live].astype(np.int64))
+        weights = {'records': np.ones(len(live)), 'clutch_replacements': fields['clutch'],
+                   'brake_replacements': fields['brake'], 'valve_replacements': fields['clutch'] + fields['brake']}
+        return fields, weights, machines
+
+    @staticmethod
+    def _dimension_codes(dimension, fields):
+        month = fields['month']
+        if dimension == 'year':
+            return np.where(month < 0, -1, month // 12)
+        if dimension == 'quarter':
+            return np.where(month < 0, -1, month // 3)
+        return fields[dimension]
+
+    def _label(self, dimension, code):
+        if dimension == 'month':
+            return _month_label(code)
+        if dimension == 'quarter':
+            return _quarter_label(code)
+        if dimension == 'year':
+            return _year_label(code)
+        if dimension in ('clutch', 'brake'):
+            return _flag_label(code)
+        value = self.vocab[dimension].values[code]
+        return UNKNOWN_LABEL if value is None or value == '' else str(value)
+
+    def _labels(self, dimensions, combo):
+        return tuple(self._label(dimension, int(code)) for dimension, code in zip(dimensions, combo))
+
+    def _order_key(self, dimension, code):
+        if dimension in ('month', 'quarter', 'year'):
+            return (int(code < 0), code, '')
+        if dimension in ('clutch', 'brake'):
+            return (0, -code, '')
+        value = self.vocab[dimension].values[code]
+        if dimension == 'judgment':
+            # 良好・要注意・要修理・異常の順、それ以外（新形式の判定など）は後ろ
+            if value in JUDGMENTS:
+                return (0, JUDGMENTS.index(value), '')
+            kind, number, text = _sort_key(value)
+            return (kind + 1, number, text)
+        return _sort_key(value)
+
+    def _ordered(self, dimensions, combos, values):
+        """組み合わせを表示順（項目ごとの自然な順）に並べ替える"""
+        order = sorted(range(len(combos)),
+                       key=lambda i: tuple(self._order_key(dimension, int(code))
+                                           for dimension, code in zip(dimensions, combos[i])))
+        return combos[order], values[order]
+
+
+def _machine_select():
+    return f"SELECT db_id, {', '.join(MACHINE_ATTRIBUTES.values())} FROM press_machines"
+
+
+def _record_select():
+    return f"""
+    SELECT maintenance_id, db_id, {MONTH_SQL}, overall_judgment,
+           clutch_valve_replacement = '実施', brake_valve_replacement = '実施'
+    FROM maintenance_records"""
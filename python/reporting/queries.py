@@ -0,0 +1,225 @@
+"""
+レポート用のSQLと集計
+接続（sqlite3.Connection）を受け取り、行や集計値をそのまま返す
+"""
+from search_keys import has_search_keys, search_condition
+
+# 製造番号順（R- で始まる番号と '-' は末尾）。shared_db で同じ式のインデックスを作る
+MACHINE_SORT_KEY = """
+CASE 
+    WHEN machine_number LIKE 'R-%' THEN 9999
+    WHEN machine_number = '-' THEN 10000
+    WHEN machine_number = '514' THEN 514
+    ELSE CAST(machine_number AS INTEGER)
+END
+"""
+
+MACHINE_ORDER_BY = f"""
+ORDER BY {MACHINE_SORT_KEY}"""
+
+MACHINE_COLUMNS = ('db_id', 'machine_number', 'equipment_number', 'manufacturer', 'model_type',
+                   'serial_number', 'machine_type', 'production_group', 'tonnage', 'created_at')
+
+MAINTENANCE_COLUMNS = ('maintenance_id', 'machine_number', 'maintenance_datetime', 'overall_judgment',
+                       'clutch_valve_replacement', 'brake_valve_replacement', 'remarks')
+
+
+def machine_list_select(schema='main'):
+    """一覧用の SELECT（schema は ATTACH したデータベース名）"""
+    return f"SELECT {', '.join(MACHINE_COLUMNS)} FROM {schema}.press_machines"
+
+
+def maintenance_list_select(schema='main'):
+    return f"""
+SELECT m.maintenance_id, p.machine_number, m.maintenance_datetime,
+       m.overall_judgment, m.clutch_valve_replacement, m.brake_valve_replacement, m.remarks
+FROM {schema}.maintenance_records m
+JOIN {schema}.press_machines p ON m.db_id = p.db_id
+"""
+
+
+MACHINE_LIST_SELECT = machine_list_select()
+
+MAINTENANCE_LIST_SELECT = maintenance_list_select()
+
+
+# 画面の一覧表示用のSELECT（row_version は楽観的排他制御に使う。最終点検日は機械・日時のインデックスの末尾を引く）
+MACHINE_SELECT = """
+SELECT db_id, machine_number, equipment_number, manufacturer, model_type, 
+       serial_number, machine_type, production_group, tonnage, created_at, row_version,
+       (SELECT MAX(m.maintenance_datetime) FROM maintenance_records m WHERE m.db_id = press_machines.db_id)
+FROM press_machines
+"""
+
+MAINTENANCE_SELECT = """
+SELECT m.maintenance_id, p.machine_number, m.maintenance_datetime,
+       m.overall_judgment, m.clutch_valve_replacement, m.brake_valve_replacement, m.remarks,
+       m.db_id, m.row_version
+FROM maintenance_records m
+JOIN press_machines p ON m.db_id = p.db_id
+"""
+
+
+# --filter 列=値 で絞り込める列（値はそのまま比較。since/until は日時の範囲）
+MACHINE_FILTERS = {
+    'machine_number': 'machine_number = ?',
+    'manufacturer': 'manufacturer = ?',
+    'model_type': 'model_type = ?',
+    'machine_type': 'machine_type = ?',
+    'production_group': 'production_group = ?',
+}
+
+MAINTENANCE_FILTERS = {
+    'machine_number': 'p.machine_number = ?',
+    'db_id': 'm.db_id = ?',
+    'overall_judgment': 'm.overall_judgment = ?',
+    'since': 'm.maintenance_datetime >= ?',
+    'until': 'm.maintenance_datetime < ?',
+}
+
+
+def machine_search_filter(search_text, schema='main', conn=None):
+    """プレス機一覧の検索欄に対応する WHERE 句とパラメータ（正規化したキーの前方一致。search_keys.py）
+
+    schema は ATTACH したデータベース名。conn を渡すと、検索用キーのテーブルがない DB
+    （アプリで一度も開いていない DB）では元の列の部分一致で探す
+    """
+    keyed = conn is None or has_search_keys(conn, schema)
+    condition = search_condition(search_text, schema, keyed)
+    if condition is None:
+        return "", ()
+    where, params = condition
+    return f"WHERE {where}", params
+
+
+def build_filter(kind, filters, schema='main', conn=None):
+    """--filter の指定から WHERE 句とパラメータを作る
+
+    '列=値' は等値（maintenance の since/until は範囲）、'=' を含まない指定は
+    プレス機一覧の検索欄と同じ検索として扱う（schema と conn は machine_search_filter と同じ）
+    """
+    allowed = MACHINE_FILTERS if kind == 'machines' else MAINTENANCE_FILTERS
+    conditions = []
+    params = []
+    for item in filters or ():
+        key, separator, value = item.partition('=')
+        if not separator:
+            if kind != 'machines':
+                raise ValueError(f"メンテナンス記録の絞り込みは 列=値 で指定してください: {item}")
+            where, search_params = machine_search_filter(item, schema, conn)
+            conditions.append(f"({where[len('WHERE '):]})")
+            params.extend(search_params)
+            continue
+        key = key.strip()
+        if key not in allowed:
+            raise ValueError(f"絞り込みに使えない項目です: {key}（使える項目: {', '.join(allowed)}）")
+        conditions.append(allowed[key])
+        params.append(value.strip())
+    return ("WHERE " + " AND ".join(conditions) if conditions else ""), tuple(params)
+
+
+# メンテナンス記録一覧の並べ替えに使う式（MAINTENANCE_COLUMNS の列名 -> SQL の並び）。
+# 製造番号はプレス機一覧と同じ順、同じ順位の中は番号の文字列順
+MAINTENANCE_SORT_EXPRESSIONS = {
+    'maintenance_id': ('m.maintenance_id',),
+    'machine_number': (MACHINE_SORT_KEY.replace('machine_number', 'p.machine_number').strip(), 'p.machine_number'),
+    'maintenance_datetime': ('m.maintenance_datetime',),
+    'overall_judgment': ('m.overall_judgment',),
+    'clutch_valve_replacement': ('m.clutch_valve_replacement',),
+    'brake_valve_replacement': ('m.brake_valve_replacement',),
+    'remarks': ('m.remarks',),
+}
+
+MAINTENANCE_ORDER_BY = "ORDER BY m.maintenance_datetime DESC"
+
+
+def maintenance_order_by(keys):
+    """[(列名, 降順か), ...] の ORDER BY 句
+
+    同じ値の記録は日時・記録IDで並べて順序を一意にする。日時・記録IDは先頭キーと同じ向きにし、
+    日時・総合判定の並べ替えではインデックスの順のまま読めるようにする
+    """
+    if not keys:
+        return MAINTENANCE_ORDER_BY
+    terms = []
+    for column, descending in keys:
+        terms += [f"{expression}{' DESC' if descending else ''}" for expression in MAINTENANCE_SORT_EXPRESSIONS[column]]
+    direction = " DESC" if keys[0][1] else ""
+    columns = [column for column, _ in keys]
+    if 'maintenance_datetime' not in columns:
+        terms.append(f"m.maintenance_datetime{direction}")
+    if 'maintenance_id' not in columns:
+        terms.append(f"m.maintenance_id{direction}")
+    return "ORDER BY " + ", ".join(terms)
+
+
+def fetch_machines(conn, where="", params=()):
+    return conn.execute(f"{MACHINE_LIST_SELECT} {where} {MACHINE_ORDER_BY}", params).fetchall()
+
+
+def fetch_maintenance(conn, where="", params=()):
+    return conn.execute(f"{MAINTENANCE_LIST_SELECT} {where} {MAINTENANCE_ORDER_BY}", params).fetchall()
+
+
+def machine_count(conn, where="", params=()):
+    return conn.execute(f"SELECT COUNT(*) FROM press_machines {where}", params).fetchone()[0]
+
+
+def machine_stats(conn):
+    """総台数・種別別・グループ別の台数"""
+    return {
+        'total': machine_count(conn),
+        'by_type': conn.execute(
+            "SELECT machine_type, COUNT(*) FROM press_machines GROUP BY machine_type").fetchall(),
+        'by_group': conn.execute(
+            "SELECT production_group, COUNT(*) FROM press_machines "
+            "GROUP BY production_group ORDER BY production_group").fetchall(),
+    }
+
+
+def group_type_counts(conn, where="", params=()):
+    """グループ別・種別別の台数（where はプレス機一覧と同じ絞り込み）"""
+    return conn.execute(f"""
+    SELECT production_group, machine_type, COUNT(*) as count
+    FROM press_machines {where}
+    GROUP BY production_group, machine_type
+    ORDER BY production_group, machine_type
+    """, params).fetchall()
+
+
+def maintenance_count(conn):
+    return conn.execute("SELECT COUNT(*) FROM maintenance_records").fetchone()[0]
+
+
+# 機械ごとの最新メンテナンス日時。機械ごとに (db_id, maintenance_datetime) のインデックスの末尾を引く
+LATEST_MAINTENANCE_SELECT = """
+SELECT p.machine_number,
+       (SELECT MAX(m.maintenance_datetime) FROM maintenance_records m WHERE m.db_id = p.db_id) as latest
+FROM press_machines p
+ORDER BY p.machine_number
+"""
+
+
+def latest_maintenance(conn):
+    """機械ごとの最新メンテナンス日時（未実施は None）"""
+    return conn.execute(LATEST_MAINTENANCE_SELECT).fetchall()
+
+
+def valve_counts(conn):
+    """電磁弁交換の件数"""
+    return {
+        'clutch': conn.execute(
+            "SELECT COUNT(*) FROM maintenance_records WHERE clutch_valve_replacement = '実施'").fetchone()[0],
+        'brake': conn.execute(
+            "SELECT COUNT(*) FROM maintenance_records WHERE brake_valve_replacement = '実施'").fetchone()[0],
+    }
+
+
+def statistics(conn):
+    """分析タブと同じ集計をまとめて返す"""
+    return {
+        'machines': machine_stats(conn),
+        'maintenance_total': maintenance_count(conn),
+        'latest_maintenance': latest_maintenance(conn),
+        'valves': valve_counts(conn),
+    }
@@ -0,0 +1,130 @@
+"""
+印刷・分析タブ用のテキスト整形
+"""
+from datetime import datetime
+
+RULE_WIDTH = 100
+
+
+def _header(title, printed_at):
+    content = "=" * RULE_WIDTH + "\n"
+    content += f"プレス機管理システム - {title}\n"
+    content += f"出力日時: {(printed_at or datetime.now()).strftime('%Y年%m月%d日 %H:%M')}\n"
+    content += "=" * RULE_WIDTH + "\n\n"
+    return content
+
+
+def machine_list_text(machines, stats_text, printed_at=None):
+    """プレス機一覧の印刷内容（stats_text は machine_print_stats_text の結果）"""
+    content = _header("プレス機一覧", printed_at)
+    
+    # ヘッダー
+    content += "ID | 製造番号 | 設備番号 | メーカー           | 型式              | シリアル番号      | 種別 | G  | トン数 | 登録日\n"
+    content += "-" * RULE_WIDTH + "\n"
+    
+    # データ行
+    for machine in machines:
+        db_id, machine_number, equipment_number, manufacturer, model_type, serial_number, machine_type, production_group, tonnage, created_at = machine
+        
+        equipment_str = equipment_number[:8] if equipment_number else "未設定"
+        manufacturer_str = manufacturer[:18] if manufacturer else "未設定"
+        model_str = model_type[:16] if model_type else "未設定"
+        serial_str = serial_number[:16] if serial_number else "未設定"
+        tonnage_str = f"{tonnage}t" if tonnage else "未設定"
+        created_str = created_at[:10] if created_at else "未設定"
+        
+        content += f"{db_id:2d} | {machine_number:8s} | {equipment_str:8s} | {manufacturer_str:18s} | {model_str:16s} | {serial_str:16s} | {machine_type or '':4s} | {production_group or 0:2d} | {tonnage_str:6s} | {created_str}\n"
+    
+    # 統計情報
+    content += "\n" + "=" * RULE_WIDTH + "\n"
+    content += "統計情報\n"
+    content += "=" * RULE_WIDTH + "\n"
+    content += stats_text
+    content += "\n" + "=" * RULE_WIDTH + "\n"
+    return content
+
+
+def machine_print_stats_text(group_stats, total_count):
+    """印刷用のグループ別・種別別集計と総台数"""
+    content = "\n【グループ別・種別別集計】\n"
+    for stat in group_stats:
+        content += f"  グループ{stat[0]} {stat[1]}: {stat[2]}台\n"
+    content += f"\n総台数: {total_count}台\n"
+    return content
+
+
+def maintenance_list_text(records, printed_at=None):
+    """メンテナンス記録一覧の印刷内容"""
+    content = _header("メンテナンス記録一覧", printed_at)
+    
+    # ヘッダー
+    content += "記録ID | 製造番号 | メンテナンス日時    | 総合判定 | クラッチ弁 | ブレーキ弁 | 備考\n"
+    content += "-" * RULE_WIDTH + "\n"
+    
+    # データ行
+    for record in records:
+        maintenance_id, machine_number, maintenance_datetime, overall_judgment, clutch_valve, brake_valve, remarks = record
+        
+        datetime_str = maintenance_datetime[:16] if maintenance_datetime else "未設定"
+        judgment_str = overall_judgment[:8] if overall_judgment else "未設定"
+        clutch_str = clutch_valve[:10] if clutch_valve else "未設定"
+        brake_str = brake_valve[:10] if brake_valve else "未設定"
+        remarks_str = remarks[:20] if remarks else ""
+        
+        content += f"{maintenance_id:6d} | {machine_number:8s} | {datetime_str:19s} | {judgment_str:8s} | {clutch_str:10s} | {brake_str:10s} | {remarks_str}\n"
+    
+    content += f"\n総メンテナンス記録数: {len(records)}件\n"
+    content += "=" * RULE_WIDTH + "\n"
+    return content
+
+
+def statistics_header():
+    return "=" * 60 + "\n" + "プレス機管理システム - 統計情報\n" + "=" * 60 + "\n\n"
+
+
+def machine_stats_text(stats):
+    """総台数・種別別・グループ別の集計ブロック（stats は queries.machine_stats の結果）"""
+    text = f"📊 総プレス機台数: {stats['total']}台\n\n"
+    
+    text += "🏭 種別別集計\n"
+    text += "-" * 30 + "\n"
+    for machine_type, count in stats['by_type']:
+        text += f"  {machine_type}: {count}台\n"
+    
+    text += "\n👥 生産グループ別集計\n"
+    text += "-" * 30 + "\n"
+    for group, count in stats['by_group']:
+        text += f"  グループ{group}: {count}台\n"
+    return text
+
+
+def maintenance_stats_text(total_maintenance):
+    return f"\n🔧 総メンテナンス記録数: {total_maintenance}件\n\n"
+
+
+def latest_maintenance_text(rows):
+    """機械ごとの最新メンテナンス日時のブロック"""
+    text = "🔍 最新メンテナンス実施状況\n"
+    text += "-" * 50 + "\n"
+    for machine_number, latest in rows:
+        latest = latest[:16] if latest else "未実施"
+        text += f"  {machine_number:>8s}: {latest}\n"
+    return text
+
+
+def valve_stats_text(counts):
+    """電磁弁交換件数のブロック"""
+    text = "\n⚙️ 電磁弁交換統計\n"
+    text += "-" * 30 + "\n"
+    text += f"  クラッチ弁交換: {counts['clutch']}件\n"
+    text += f"  ブレーキ弁交換: {counts['brake']}件\n"
+    return text
+
+
+def statistics_text(stats):
+    """分析タブと同じ統計情報（stats は queries.statistics の結果）"""
+    return (statistics_header()
+            + machine_stats_text(stats['machines'])
+            + maintenance_stats_text(stats['maintenance_total'])
+            + latest_maintenance_text(stats['latest_maintenance'])
+            + valve_stats_text(stats['valves']))
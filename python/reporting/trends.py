@@ -0,0 +1,191 @@
+"""
+メンテナンス記録の推移グラフ用の集計と間引き（tkinter に依存しない）
+SQL で日単位に集計したものを累積和で持ち、表示範囲・粒度が変わっても
+範囲の合計を二分探索だけで求める。折れ線は LTTB で表示幅の点数まで間引く
+
+日付は date.toordinal() の日数で扱う
+"""
+from bisect import bisect_left
+from datetime import date
+
+JUDGMENTS = ('良好', '要注意', '要修理', '異常')
+
+# 総合判定の重さ（タイムラインでは同じ区間の最も重い判定を表示する）
+SEVERITY_SQL = """
+CASE m.overall_judgment WHEN '異常' THEN 3 WHEN '要修理' THEN 2 WHEN '要注意' THEN 1 ELSE 0 END
+"""
+
+# date.toordinal() と同じ日数（0001-01-01 が 1）
+ORDINAL_SQL = "CAST(julianday(m.maintenance_datetime) - 1721424.5 AS INTEGER)"
+
+# 移動合計の期間（グループ別の電磁弁交換数）
+ROLLING_DAYS = 30
+
+
+def from_ordinal(ordinal):
+    return date.fromordinal(int(ordinal))
+
+
+class DailySeries:
+    """日ごとの件数の累積和（範囲の合計を O(log n) で求める）"""
+
+    def __init__(self, days, counts):
+        self.days = days
+        self.counts = counts
+        self.prefix = [0]
+        for count in counts:
+            self.prefix.append(self.prefix[-1] + count)
+
+    def total(self, start, end):
+        """[start, end) の合計"""
+        return self.prefix[bisect_left(self.days, end)] - self.prefix[bisect_left(self.days, start)]
+
+
+def _add(grouped, key, day, count):
+    days, counts = grouped.setdefault(key, ([], []))
+    if days and days[-1] == day:
+        counts[-1] += count
+    else:
+        days.append(day)
+        counts.append(count)
+
+
+def daily_summary(conn):
+    """総合判定ごと・生産グループごとの電磁弁交換数（クラッチ・ブレーキの合計）の DailySeries
+
+    1回の集計で両方を作る -> (判定ごと, グループごと)
+    """
+    judgments = {}
+    replacements = {}
+    for day, group, judgment, count, replaced in conn.execute(f"""
+    SELECT {ORDINAL_SQL} AS day, p.production_group, m.overall_judgment, COUNT(*),
+           SUM((m.clutch_valve_replacement = '実施') + (m.brake_valve_replacement = '実施'))
+    FROM maintenance_records m
+    JOIN press_machines p ON m.db_id = p.db_id
+    WHERE day IS NOT NULL
+    GROUP BY day, p.production_group, m.overall_judgment
+    ORDER BY day
+    """):
+        _add(judgments, judgment, day, count)
+        if replaced:
+            _add(replacements, group, day, replaced)
+    return ({key: DailySeries(days, counts) for key, (days, counts) in judgments.items()},
+            {key: DailySeries(days, counts) for key, (days, counts) in replacements.items()})
+
+
+def machine_events(conn):
+    """機械ごとの (日, 判定の重さ, 電磁弁交換の有無) のリスト（日付順。同じ日の記録はそのまま）"""
+    events = {}
+    for db_id, day, severity, replaced in conn.execute(f"""
+    SELECT m.db_id, {ORDINAL_SQL} AS day, {SEVERITY_SQL},
+           m.clutch_valve_replacement = '実施' OR m.brake_valve_replacement = '実施'
+    FROM maintenance_records m
+    WHERE day IS NOT NULL
+    ORDER BY m.db_id, m.maintenance_datetime
+    """):
+        events.setdefault(db_id, []).append((day, severity, replaced))
+    return events
+
+
+def day_range(series):
+    """DailySeries の辞書全体の (最初の日, 最後の日の翌日)。データがなければ None"""
+    days = [s.days for s in series.values() if s.days]
+    if not days:
+        return None
+    return min(d[0] for d in days), max(d[-1] for d in days) + 1
+
+
+# --- 集計単位と間引き ---
+
+# (単位名, 1区間のおおよその日数)。月単位は31日で数え、区切りは暦の月初にする
+BUCKET_UNITS = (('日', 1), ('週', 7), ('月', 31), ('四半期', 93), ('年', 372))
+
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def bucket_edges(start, end, max_buckets):
+    """[start, end) を max_buckets 個以下に区切る境界（日数）と単位名
+
+    日・週は固定幅、月・四半期・年は暦に合わせる
+    """
+    for name, days in BUCKET_UNITS:
+        if (end - start) / days <= max_buckets:
+            break
+    if days < 31:
+        first = int(start) - int(start) % days
+        return list(range(first, int(end) + days, days)), name
+
+    months = days // 31
+    first = from_ordinal(start).replace(day=1)
+    first = _add_months(first, -((first.month - 1) % months))
+    edges = [first.toordinal()]
+    while edges[-1] < end:
+        first = _add_months(first, months)
+        edges.append(first.toordinal())
+    return edges, name
+
+
+def rolling_points(series, start, end, window=ROLLING_DAYS):
+    """[start, end) の日ごとの window 日移動合計 [(日, 件数), ...]"""
+    start, end = int(start), int(end)
+    first = start - window + 1
+    daily = [0] * (end - first)
+    for i in range(bisect_left(series.days, first), bisect_left(series.days, end)):
+        daily[series.days[i] - first] += series.counts[i]
+
+    points = []
+    running = sum(daily[:window - 1])
+    for day in range(start, end):
+        running += daily[day - first]
+        points.append((day, running))
+        running -= daily[day - first - window + 1]
+    return points
+
+
+def lttb(points, threshold):
+    """Largest-Triangle-Three-Buckets で threshold 点まで間引く（形を保ったまま点数を減らす）"""
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # 次のバケットの平均点
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        span = points[next_start:next_end]
+        avg_x = sum(p[0] for p in span) / len(span)
+        avg_y = sum(p[1] for p in span) / len(span)
+
+        # 現在のバケットで、前に選んだ点・次の平均点と作る三角形が最大の点を選ぶ
+        ax, ay = points[a]
+        best = -1.0
+        for j in range(int(i * every) + 1, next_start):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best:
+                best = area
+                chosen = j
+        sampled.append(points[chosen])
+        a = chosen
+    sampled.append(points[-1])
+    return sampled
+
+
+def bin_events(events, start, end, width):
+    """[start, end) のイベントを width 個の区間にまとめる -> {区間: (最も重い判定, 交換の有無)}"""
+    binned = {}
+    scale = width / (end - start)
+    for day, severity, replaced in events[bisect_left(events, (start,)):bisect_left(events, (end,))]:
+        x = int((day - start) * scale)
+        previous = binned.get(x)
+        if previous is None:
+            binned[x] = (severity, replaced)
+        else:
+            binned[x] = (max(previous[0], severity), previous[1] or replaced)
+    return binned
@@ -0,0 +1,116 @@
+"""
+レポート・統計・クエリ結果のキャッシュ
+エントリはキー（クエリ名とパラメータ）と、依存するテーブルの変更カウンタ（table_versions）で管理する。
+メンテナンス記録を編集しても press_machines だけに依存するエントリはそのまま使える
+
+変更の有無はまず PRAGMA data_version で確認し、変わっていなければカウンタも読まない
+"""
+import sys
+from collections import OrderedDict
+
+from shared_db import connect, table_versions
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+# 要素数がこれより多いリスト・辞書は等間隔に抜き出した要素から全体を見積もる
+SIZE_SAMPLE = 64
+
+
+def estimate_size(value):
+    """おおよそのメモリ使用量（文字列・数値・行のリスト/タプル・辞書・属性を持つオブジェクトを想定）"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        items = list(value.items())
+    elif isinstance(value, (list, tuple)):
+        items = value
+    elif hasattr(value, '__dict__'):
+        return size + estimate_size(vars(value))
+    else:
+        return size
+    if len(items) > SIZE_SAMPLE:
+        sample = items[::len(items) // SIZE_SAMPLE]
+        return size + sum(estimate_size(item) for item in sample) * len(items) // len(sample)
+    return size + sum(estimate_size(item) for item in items)
+
+
+class ResultCache:
+    """テーブル単位で無効化される LRU キャッシュ（メモリ上限付き）"""
+
+    def __init__(self, db_file, max_bytes=DEFAULT_MAX_BYTES):
+        self.db_file = db_file
+        self.max_bytes = max_bytes
+        self._conn = None
+        self.data_version = None
+        self.versions = {}
+
+        # キー -> (依存テーブル, その時点のカウンタ, 値, サイズ)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def conn(self):
+        """接続は最初の問い合わせで開く（起動直後の表示を共有ドライブの応答で待たせない）"""
+        if self._conn is None:
+            self._conn = connect(self.db_file)
+        return self._conn
+
+    def _current_versions(self):
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self.data_version:
+            self.versions = table_versions(self.conn)
+            self.data_version = data_version
+            self._drop_stale()
+        return self.versions
+
+    def _drop_stale(self):
+        """変更されたテーブルに依存するエントリだけを破棄"""
+        for key in [key for key, (tables, versions, _, _) in self.entries.items()
+                    if versions != tuple(self.versions.get(table) for table in tables)]:
+            self._discard(key)
+
+    def _discard(self, key):
+        _, _, _, size = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def get(self, key, tables, compute):
+        """キャッシュがあれば返し、なければ compute() の結果を保存して返す
+
+        tables は結果が依存するテーブル名のタプル（TRACKED_TABLES のもの）
+        """
+        versions = self._current_versions()
+        expected = tuple(versions.get(table) for table in tables)
+
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] == expected:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+        self.misses += 1
+        value = compute()
+        if entry is not None:
+            self._discard(key)
+
+        size = estimate_size(value)
+        if size <= self.max_bytes:
+            self.entries[key] = (tuple(tables), expected, value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                self._discard(next(iter(self.entries)))
+        return value
+
+    def query(self, sql, params=(), tables=()):
+        """SELECT の結果（行のリスト）をキャッシュ"""
+        return self.get(('query', sql, tuple(params)), tables,
+                        lambda: self.conn.execute(sql, params).fetchall())
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
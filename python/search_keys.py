@@ -0,0 +1,215 @@
+"""
+プレス機一覧の検索用キー（machine_search_keys テーブル）
+機械番号・メーカー・型式を書き込み時に正規化して保存し、検索は正規化したキーの前方一致を
+インデックスで引く。正規化は次のとおり（検索語にも同じ処理をする）
+- NFKC（半角カナ・全角英数字を揃える）と小文字化
+- ひらがなをカタカナに揃える
+- 空白・ハイフン・中黒などの区切りを除く（'P-012' と 'p012' を同じにする）
+カナを含むメーカー・型式はローマ字（ヘボン式、長音は省略）のキーも持つ（'aida' で 'アイダ' を探せる）
+
+キーはアプリ（Python）で計算する。トリガーは SQL だけで書けるので、旧バージョンのアプリなど
+このモジュールを使わない書き込みでも、該当行のキーを NULL（未計算）に戻すことはできる。
+未計算の行は shared_db.write_transaction のコミット前に計算し、それまでの間は検索で元の列の
+部分一致を使う（未計算の行は machine_number_key のインデックスで引くので全件は読まない）
+"""
+import re
+import sqlite3
+import unicodedata
+
+# 正規化で取り除く区切り文字
+SEPARATORS = re.compile(r"[\s\-‐‑‒–—―−_/.・･,、。()\[\]（）]+")
+
+# 前方一致の上限（どの文字よりも後ろに並ぶ文字）
+PREFIX_END = '\U0010ffff'
+
+KEY_COLUMNS = ('machine_number_key', 'manufacturer_key', 'model_type_key', 'manufacturer_romaji', 'model_type_romaji')
+
+_ROMAJI = {
+    'ア': 'a', 'イ': 'i', 'ウ': 'u', 'エ': 'e', 'オ': 'o',
+    'カ': 'ka', 'キ': 'ki', 'ク': 'ku', 'ケ': 'ke', 'コ': 'ko',
+    'サ': 'sa', 'シ': 'shi', 'ス': 'su', 'セ': 'se', 'ソ': 'so',
+    'タ': 'ta', 'チ': 'chi', 'ツ': 'tsu', 'テ': 'te', 'ト': 'to',
+    'ナ': 'na', 'ニ': 'ni', 'ヌ': 'nu', 'ネ': 'ne', 'ノ': 'no',
+    'ハ': 'ha', 'ヒ': 'hi', 'フ': 'fu', 'ヘ': 'he', 'ホ': 'ho',
+    'マ': 'ma', 'ミ': 'mi', 'ム': 'mu', 'メ': 'me', 'モ': 'mo',
+    'ヤ': 'ya', 'ユ': 'yu', 'ヨ': 'yo',
+    'ラ': 'ra', 'リ': 'ri', 'ル': 'ru', 'レ': 're', 'ロ': 'ro',
+    'ワ': 'wa', 'ヰ': 'i', 'ヱ': 'e', 'ヲ': 'o', 'ン': 'n',
+    'ガ': 'ga', 'ギ': 'gi', 'グ': 'gu', 'ゲ': 'ge', 'ゴ': 'go',
+    'ザ': 'za', 'ジ': 'ji', 'ズ': 'zu', 'ゼ': 'ze', 'ゾ': 'zo',
+    'ダ': 'da', 'ヂ': 'ji', 'ヅ': 'zu', 'デ': 'de', 'ド': 'do',
+    'バ': 'ba', 'ビ': 'bi', 'ブ': 'bu', 'ベ': 'be', 'ボ': 'bo',
+    'パ': 'pa', 'ピ': 'pi', 'プ': 'pu', 'ペ': 'pe', 'ポ': 'po',
+    'ヴ': 'vu',
+    'ァ': 'a', 'ィ': 'i', 'ゥ': 'u', 'ェ': 'e', 'ォ': 'o', 'ャ': 'ya', 'ュ': 'yu', 'ョ': 'yo', 'ヮ': 'wa',
+    'ヵ': 'ka', 'ヶ': 'ke',
+}
+
+# 拗音・外来語の2文字の組
+_ROMAJI_PAIRS = {
+    'シャ': 'sha', 'シュ': 'shu', 'ショ': 'sho', 'シェ': 'she',
+    'チャ': 'cha', 'チュ': 'chu', 'チョ': 'cho', 'チェ': 'che',
+    'ジャ': 'ja', 'ジュ': 'ju', 'ジョ': 'jo', 'ジェ': 'je',
+    'ヂャ': 'ja', 'ヂュ': 'ju', 'ヂョ': 'jo',
+    'ティ': 'ti', 'ディ': 'di', 'トゥ': 'tu', 'ドゥ': 'du', 'デュ': 'dyu',
+    'ファ': 'fa', 'フィ': 'fi', 'フェ': 'fe', 'フォ': 'fo', 'フュ': 'fyu',
+    'ウィ': 'wi', 'ウェ': 'we', 'ウォ': 'wo',
+    'ヴァ': 'va', 'ヴィ': 'vi', 'ヴェ': 've', 'ヴォ': 'vo',
+    'ツァ': 'tsa', 'ツェ': 'tse', 'ツォ': 'tso',
+}
+for _kana, _consonant in (('キ', 'ky'), ('ニ', 'ny'), ('ヒ', 'hy'), ('ミ', 'my'), ('リ', 'ry'),
+                          ('ギ', 'gy'), ('ビ', 'by'), ('ピ', 'py')):
+    for _small, _vowel in (('ャ', 'a'), ('ュ', 'u'), ('ョ', 'o'), ('ェ', 'e')):
+        _ROMAJI_PAIRS[_kana + _small] = _consonant + _vowel
+
+
+def normalize(text):
+    """検索用に正規化した文字列（None は ''）"""
+    if text is None:
+        return ''
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    # ひらがな（ぁ〜ゖ）をカタカナに
+    text = ''.join(chr(ord(char) + 0x60) if 'ぁ' <= char <= 'ゖ' else char for char in text)
+    return SEPARATORS.sub('', text)
+
+
+def to_romaji(key):
+    """normalize 済みの文字列のカナをローマ字にする（カナ以外はそのまま）"""
+    result = []
+    double_next = False
+    i = 0
+    while i < len(key):
+        pair = key[i:i + 2]
+        if pair in _ROMAJI_PAIRS:
+            romaji = _ROMAJI_PAIRS[pair]
+            i += 2
+        elif key[i] == 'ッ':
+            double_next = True
+            i += 1
+            continue
+        elif key[i] == 'ー':
+            i += 1
+            continue
+        else:
+            romaji = _ROMAJI.get(key[i], key[i])
+            i += 1
+        if double_next:
+            # 促音は次の子音を重ねる（ッチ は tchi）
+            if romaji[0] not in 'aiueon' and romaji[0].isascii() and romaji[0].isalpha():
+                result.append('t' if romaji.startswith('ch') else romaji[0])
+            double_next = False
+        result.append(romaji)
+    return ''.join(result)
+
+
+def _romaji_key(key):
+    """カナを含む場合だけローマ字のキー（含まなければ NULL にしてインデックスを小さくする）"""
+    romaji = to_romaji(key)
+    return romaji if romaji != key else None
+
+
+def machine_keys(machine_number, manufacturer, model_type):
+    """1台分のキー（KEY_COLUMNS の順）"""
+    manufacturer_key = normalize(manufacturer)
+    model_type_key = normalize(model_type)
+    return (normalize(machine_number), manufacturer_key, model_type_key,
+            _romaji_key(manufacturer_key), _romaji_key(model_type_key))
+
+
+def create_search_keys(conn):
+    """検索用キーのテーブルとトリガーを作成（shared_db.ensure_schema から呼ぶ。インデックスは shared_db.INDEXES）
+
+    テーブルを新しく作った場合は全ての機械を未計算として登録し、キーを計算する
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'machine_search_keys'").fetchone()
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS machine_search_keys (
+        db_id INTEGER PRIMARY KEY,
+        machine_number_key TEXT,
+        manufacturer_key TEXT,
+        model_type_key TEXT,
+        manufacturer_romaji TEXT,
+        model_type_romaji TEXT
+    )
+    """)
+
+    # 追加・検索対象の列の更新はキーを未計算（NULL）に戻す
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS press_machines_search_insert
+    AFTER INSERT ON press_machines
+    BEGIN
+        INSERT OR REPLACE INTO machine_search_keys (db_id) VALUES (NEW.db_id);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS press_machines_search_update
+    AFTER UPDATE OF machine_number, manufacturer, model_type ON press_machines
+    BEGIN
+        INSERT OR REPLACE INTO machine_search_keys (db_id) VALUES (NEW.db_id);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS press_machines_search_delete
+    AFTER DELETE ON press_machines
+    BEGIN
+        DELETE FROM machine_search_keys WHERE db_id = OLD.db_id;
+    END
+    """)
+
+    if not exists:
+        conn.execute("INSERT OR IGNORE INTO machine_search_keys (db_id) SELECT db_id FROM press_machines")
+    refresh_search_keys(conn)
+
+
+def refresh_search_keys(conn):
+    """未計算のキーを計算する -> 計算した行数（テーブルがまだない DB では何もしない）"""
+    try:
+        rows = conn.execute("""
+        SELECT k.db_id, p.machine_number, p.manufacturer, p.model_type
+        FROM machine_search_keys k JOIN press_machines p ON p.db_id = k.db_id
+        WHERE k.machine_number_key IS NULL
+        """).fetchall()
+    except sqlite3.OperationalError as e:
+        if 'no such table' in str(e):
+            return 0
+        raise
+    if rows:
+        conn.executemany(f"""
+        UPDATE machine_search_keys SET {', '.join(f'{column}=?' for column in KEY_COLUMNS)} WHERE db_id=?
+        """, [machine_keys(*row[1:]) + (row[0],) for row in rows])
+    return len(rows)
+
+
+def has_search_keys(conn, schema='main'):
+    """検索用キーのテーブルがあるか（アプリで一度も開いていない DB にはない）"""
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'machine_search_keys'"
+                        ).fetchone() is not None
+
+
+def search_condition(search_text, schema='main', keyed=True):
+    """検索欄の文字列に一致する db_id の条件（'db_id IN (...)' とパラメータ。空なら None）
+
+    いずれかのキーの前方一致。キーが未計算の行は元の列の部分一致で探す。
+    schema は ATTACH したデータベース名。keyed=False（検索用キーのテーブルがない DB）は元の列の部分一致だけで探す
+    """
+    key = normalize(search_text)
+    if not key:
+        return None
+    pattern = f'%{search_text.strip().lower()}%'
+    if not keyed:
+        return ("(LOWER(machine_number) LIKE ? OR LOWER(manufacturer) LIKE ? OR LOWER(model_type) LIKE ?)",
+                (pattern, pattern, pattern))
+
+    romaji = to_romaji(key)
+    branches = []
+    params = []
+    for column in KEY_COLUMNS:
+        prefix = romaji if column.endswith('_romaji') else key
+        branches.append(f"SELECT db_id FROM {schema}.machine_search_keys WHERE {column} >= ? AND {column} < ?")
+        params.extend((prefix, prefix + PREFIX_END))
+
+    branches.append(f"""SELECT k.db_id FROM {schema}.machine_search_keys k JOIN {schema}.press_machines p ON p.db_id = k.db_id
+        WHERE k.machine_number_key IS NULL
+          AND (LOWER(p.machine_number) LIKE ? OR LOWER(p.manufacturer) LIKE ? OR LOWER(p.model_type) LIKE ?)""")
+    params.extend((pattern, pattern, pattern))
+    return f"db_id IN ({' UNION ALL '.join(branches)})", tuple(params)
@@ -7,6 +7,9 @@ def create_database():
     conn = sqlite3.connect('press_machine.db')
     cursor = conn.cursor()
     
+    # 削除で空いたページを db_maintenance.py が少しずつ返せるようにする（テーブル作成前のみ有効）
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    
     try:
         # プレス機マスタテーブル作成
         cursor.execute('''
@@ -0,0 +1,282 @@
+"""
+共有ドライブ上の press_machine.db を複数インスタンスで同時に使うための共通処理
+- ビジータイムアウトとリトライ付きの接続・書き込みトランザクション
+- row_version による楽観的排他制御
+- change_log と PRAGMA data_version による他インスタンスの変更検知
+- table_versions によるテーブル単位の変更カウンタ
+- 一覧・統計用のインデックス
+- 一覧の検索用キー（search_keys.py。未計算のキーは書き込みトランザクションのコミット前に計算する）
+- 利用者のローカルの保存先（一覧のスナップショット・印刷キューなど、共有ドライブに置かないファイル）
+
+ネットワークドライブでは WAL が使えない（共有メモリが必要）ため、ジャーナルモードは既定の DELETE のまま使う
+"""
+import os
+import random
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from reporting.queries import MACHINE_SORT_KEY
+from search_keys import create_search_keys, refresh_search_keys
+
+BUSY_TIMEOUT_SECONDS = 5.0
+RETRY_COUNT = 5
+RETRY_BASE_DELAY_SECONDS = 0.2
+
+# PRAGMA synchronous の設定（None は SQLite の既定値）。load_test.py の結果を見て決める
+SYNCHRONOUS = None
+
+# 楽観的排他制御と変更通知の対象テーブル（テーブル名: 主キー）
+TRACKED_TABLES = {
+    'press_machines': 'db_id',
+    'maintenance_records': 'maintenance_id',
+}
+
+CHANGE_LOG_RETENTION_DAYS = 7
+
+# 一覧・統計・検索のクエリが使うインデックス（使われていることは query_plan_check.py で確認する）
+INDEXES = {
+    'idx_press_machines_machine_number': "press_machines (machine_number)",
+    'idx_press_machines_sort_key': f"press_machines ({MACHINE_SORT_KEY})",
+    'idx_press_machines_type': "press_machines (machine_type)",
+    'idx_press_machines_group_type': "press_machines (production_group, machine_type)",
+    'idx_maintenance_records_datetime': "maintenance_records (maintenance_datetime)",
+    'idx_maintenance_records_machine_date': "maintenance_records (db_id, maintenance_datetime)",
+    'idx_maintenance_records_judgment': "maintenance_records (overall_judgment, maintenance_datetime)",
+    # 電磁弁交換の件数は該当する記録だけの部分インデックスで数える
+    'idx_maintenance_records_clutch': "maintenance_records (db_id) WHERE clutch_valve_replacement = '実施'",
+    'idx_maintenance_records_brake': "maintenance_records (db_id) WHERE brake_valve_replacement = '実施'",
+    # 一覧の検索（正規化したキーの前方一致。未計算の行は machine_number_key IS NULL で引く）
+    'idx_machine_search_keys_number': "machine_search_keys (machine_number_key)",
+    'idx_machine_search_keys_manufacturer': "machine_search_keys (manufacturer_key)",
+    'idx_machine_search_keys_model_type': "machine_search_keys (model_type_key)",
+    'idx_machine_search_keys_manufacturer_romaji': "machine_search_keys (manufacturer_romaji)",
+    'idx_machine_search_keys_model_type_romaji': "machine_search_keys (model_type_romaji)",
+}
+
+
+class ConflictError(Exception):
+    """他のユーザーが先に同じ行を更新・削除した"""
+
+    def __init__(self, table, key, current):
+        super().__init__(f"{table} の {key} は他のユーザーによって変更されています")
+        self.table = table
+        self.key = key
+        # 現在の行（sqlite3.Row）。削除済みなら None
+        self.current = current
+
+
+def local_data_dir(*parts):
+    """利用者のローカルの保存先（Windows は LOCALAPPDATA、それ以外は ~/.cache）の press_machine 以下のパス"""
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'press_machine', *parts)
+
+
+def connect(db_file, timeout=None, check_same_thread=True):
+    """ビジータイムアウトを設定して接続"""
+    conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_SECONDS if timeout is None else timeout,
+                           check_same_thread=check_same_thread)
+    if SYNCHRONOUS is not None:
+        conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+    return conn
+
+
+def is_busy_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def retry_on_busy(operation, retries=RETRY_COUNT, base_delay=RETRY_BASE_DELAY_SECONDS):
+    """database is locked の場合に指数バックオフ（ジッター付き）で再試行"""
+    for attempt in range(retries + 1):
+        try:
+            return operation()
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e) or attempt == retries:
+                raise
+            time.sleep(base_delay * (2 ** attempt) * (0.5 + random.random()))
+
+
+@contextmanager
+def write_transaction(db_file, timings=None):
+    """書き込み用トランザクション
+
+    BEGIN IMMEDIATE で最初に書き込みロックを取得するため、途中でのロック昇格による
+    デッドロックが起きない。ロック取得とコミットはビジー時に再試行する。
+    プレス機の追加・変更でトリガーが未計算に戻した検索用キーはコミット前に計算する。
+    timings に辞書を渡すと、書き込みロックの取得（再試行を含む）にかかった秒数を 'lock_wait' に入れる
+    """
+    conn = connect(db_file)
+    conn.row_factory = sqlite3.Row
+    try:
+        started = time.perf_counter()
+        retry_on_busy(lambda: conn.execute("BEGIN IMMEDIATE"))
+        if timings is not None:
+            timings['lock_wait'] = time.perf_counter() - started
+        yield conn
+        if conn.total_changes:
+            refresh_search_keys(conn)
+        retry_on_busy(conn.commit)
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def ensure_schema(db_file):
+    """row_version カラム・change_log・table_versions・検索用キーのテーブルとトリガー・インデックスを作成（何度実行してもよい）"""
+    with write_transaction(db_file) as conn:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            operation TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+
+        # テーブル単位の変更カウンタ（キャッシュのテーブル単位の無効化に使う）
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """)
+
+        for table, key in TRACKED_TABLES.items():
+            conn.execute("INSERT OR IGNORE INTO table_versions (table_name, version) VALUES (?, 0)", (table,))
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if 'row_version' not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN row_version INTEGER NOT NULL DEFAULT 1")
+
+            # row_version を更新しない書き込み（旧バージョンのアプリ等）でも版を進める
+            conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_bump_version
+            AFTER UPDATE ON {table}
+            WHEN NEW.row_version = OLD.row_version
+            BEGIN
+                UPDATE {table} SET row_version = OLD.row_version + 1 WHERE {key} = NEW.{key};
+            END
+            """)
+
+            for operation, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+                conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_log_{operation.lower()}
+                AFTER {operation} ON {table}
+                BEGIN
+                    INSERT INTO change_log (table_name, row_id, operation)
+                    VALUES ('{table}', {row}.{key}, '{operation}');
+                END
+                """)
+
+                conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_count_{operation.lower()}
+                AFTER {operation} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}';
+                END
+                """)
+
+        create_search_keys(conn)
+
+        for name, definition in INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+
+        # 古い変更履歴を整理
+        conn.execute("DELETE FROM change_log WHERE created_at < datetime('now', ?)",
+                     (f'-{CHANGE_LOG_RETENTION_DAYS} days',))
+
+
+def update_with_version(conn, table, key, expected_version, changes):
+    """row_version が一致する場合のみ更新し、一致しなければ ConflictError を送出
+
+    conn は write_transaction で取得した接続を渡す
+    """
+    key_column = TRACKED_TABLES[table]
+    columns = list(changes.keys())
+    set_clause = ", ".join(f"{column}=?" for column in columns)
+    cursor = conn.execute(
+        f"UPDATE {table} SET {set_clause}, row_version = row_version + 1 "
+        f"WHERE {key_column}=? AND row_version=?",
+        tuple(changes[column] for column in columns) + (key, expected_version))
+
+    if cursor.rowcount == 0:
+        current = conn.execute(f"SELECT * FROM {table} WHERE {key_column}=?", (key,)).fetchone()
+        raise ConflictError(table, key, current)
+
+
+class ChangeWatcher:
+    """他の接続・インスタンスによるコミットを検知して change_log の差分を返す"""
+
+    def __init__(self, db_file, since=None, check_same_thread=True):
+        """since を指定するとその seq より後の変更から返す（最初の poll で必ず change_log を読む）
+
+        作成したスレッド以外から poll する場合は check_same_thread=False にし、呼び出し側で排他する
+        """
+        self.conn = connect(db_file, check_same_thread=check_same_thread)
+        # 直近に読んだ change_log の時点以前の table_versions（一覧のスナップショットの版に使う）
+        self.versions = None
+        if since is None:
+            self.last_seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+            self.data_version = self._data_version()
+        else:
+            self.last_seq = since
+            self.data_version = None
+
+    def _data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def poll(self):
+        """前回以降の変更を {テーブル名: {行ID: 最後の操作}} で返す（変更がなければ空）"""
+        try:
+            data_version = self._data_version()
+            if data_version == self.data_version:
+                return {}
+
+            # カウンタを先に読む（返す変更はこのカウンタの時点以降のものを全て含む）
+            versions = table_versions(self.conn)
+            rows = self.conn.execute(
+                "SELECT seq, table_name, row_id, operation FROM change_log WHERE seq > ? ORDER BY seq",
+                (self.last_seq,)).fetchall()
+        except sqlite3.OperationalError as e:
+            # 書き込み中でロックされていれば次回に持ち越す
+            if is_busy_error(e):
+                return {}
+            raise
+
+        self.data_version = data_version
+        self.versions = versions
+        changes = {}
+        for seq, table, row_id, operation in rows:
+            changes.setdefault(table, {})[row_id] = operation
+            self.last_seq = seq
+        return changes
+
+    def close(self):
+        self.conn.close()
+
+
+def table_versions(conn):
+    """テーブル名 -> 変更カウンタ"""
+    return dict(conn.execute("SELECT table_name, version FROM table_versions"))
+
+
+def current_seq(conn):
+    """change_log の最新の seq（変更通知の仕組みがない DB は None。古い記録を整理しても番号は戻らない）"""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'change_log'").fetchone():
+        return None
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+
+def fetch_by_ids(conn, select, key_column, ids, chunk_size=500):
+    """ID のリストに該当する行をまとめて取得"""
+    rows = []
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i:i + chunk_size]
+        placeholders = ", ".join("?" * len(chunk))
+        rows.extend(conn.execute(f"{select} WHERE {key_column} IN ({placeholders})", chunk).fetchall())
+    return rows
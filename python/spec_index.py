@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+プレス機仕様の能力検索インデックス
+圧力能力・ダイハイト・ボルスタ寸法などの数値仕様ごとにソート済みインデックスを持ち、
+「800kN以上、ダイハイト350〜450mm、ボルスタ1200×800以上」のような条件に合う機械を
+余裕度（スラック）の小さい順に返す
+
+使い方:
+  python spec_index.py press_machine.db capacity_kn=800: die_height_mm=350:450 bolster_size_lr_mm=1200:
+"""
+import heapq
+import sys
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from shared_db import connect
+
+# 検索対象の数値仕様（add_detailed_specifications.sql のカラム）
+SPEC_FIELDS = {
+    'capacity_kn': '圧力能力(kN)',
+    'capacity_ton': '圧力能力(ton)',
+    'stroke_spm_min': '最小spm',
+    'stroke_spm_max': '最大spm',
+    'stroke_length_mm': 'ストローク長(mm)',
+    'die_height_mm': 'ダイハイト(mm)',
+    'slide_size_lr_mm': 'スライド寸法 左右(mm)',
+    'slide_size_fb_mm': 'スライド寸法 前後(mm)',
+    'bolster_size_lr_mm': 'ボルスタ寸法 左右(mm)',
+    'bolster_size_fb_mm': 'ボルスタ寸法 前後(mm)',
+    'motor_power_kw': 'モーター出力(kW)',
+}
+
+Candidate = namedtuple('Candidate', ['db_id', 'machine_number', 'score', 'slack'])
+
+
+class SpecIndex:
+    """数値仕様ごとのソート済みレンジインデックス"""
+
+    def __init__(self, machines, fields=None):
+        # machines: (db_id, machine_number, {仕様名: 値}) のイテラブル
+        # fields: データにある仕様項目（None は値が1つでもある項目）。検索画面はこの項目だけを出す
+        self.machine_numbers = {}
+        self.values = {field: {} for field in SPEC_FIELDS}
+
+        for db_id, machine_number, specs in machines:
+            self.machine_numbers[db_id] = machine_number
+            for field in SPEC_FIELDS:
+                value = specs.get(field)
+                if value is not None:
+                    self.values[field][db_id] = float(value)
+
+        available = set(fields) if fields is not None else {field for field, values in self.values.items() if values}
+        self.fields = [field for field in SPEC_FIELDS if field in available]
+
+        # 仕様ごとに (値の昇順リスト, 対応するIDリスト) を事前計算
+        self.sorted_index = {}
+        for field, field_values in self.values.items():
+            pairs = sorted((value, db_id) for db_id, value in field_values.items())
+            self.sorted_index[field] = ([value for value, _ in pairs], [db_id for _, db_id in pairs])
+
+    @classmethod
+    def from_sqlite(cls, db_file):
+        """SQLite（デスクトップ版DBまたはSupabaseのローカルミラー）から構築"""
+        conn = connect(db_file)
+        try:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(press_machines)")}
+            fields = [field for field in SPEC_FIELDS if field in columns]
+
+            # デスクトップ版DBは capacity_ton の代わりに tonnage を持つ
+            select = list(fields)
+            if 'capacity_ton' not in columns and 'tonnage' in columns:
+                select.append('tonnage AS capacity_ton')
+                fields.append('capacity_ton')
+
+            key = 'db_id' if 'db_id' in columns else 'id'
+            sql = f"SELECT {key}, machine_number{''.join(', ' + column for column in select)} FROM press_machines"
+            machines = [
+                (row[0], row[1], dict(zip(fields, row[2:])))
+                for row in conn.execute(sql)
+            ]
+        finally:
+            conn.close()
+        return cls(machines, fields)
+
+    @classmethod
+    def from_records(cls, records):
+        """Supabase から取得した行（dict）から構築"""
+        return cls(
+            (record.get('id', record.get('db_id')), record.get('machine_number'), record)
+            for record in records
+        )
+
+    def __len__(self):
+        return len(self.machine_numbers)
+
+    def _range(self, field, low, high):
+        """条件範囲に入る位置 (開始, 終了) を二分探索で求める"""
+        keys, _ = self.sorted_index[field]
+        start = 0 if low is None else bisect_left(keys, low)
+        end = len(keys) if high is None else bisect_right(keys, high)
+        return start, max(start, end)
+
+    def query(self, conditions, limit=None):
+        """条件 {仕様名: (下限, 上限)} に合う機械を余裕度の小さい順に返す（None は制限なし）"""
+        conditions = {field: bounds for field, bounds in conditions.items()
+                      if bounds[0] is not None or bounds[1] is not None}
+        if not conditions:
+            return []
+        for field in conditions:
+            if field not in SPEC_FIELDS:
+                raise ValueError(f"未対応の仕様項目です: {field}")
+
+        # 最も絞り込める仕様の範囲だけを走査し、他の条件は値の参照で判定する
+        ranges = {field: self._range(field, *bounds) for field, bounds in conditions.items()}
+        driver = min(ranges, key=lambda field: ranges[field][1] - ranges[field][0])
+        start, end = ranges[driver]
+        _, driver_ids = self.sorted_index[driver]
+
+        # 駆動側以外の条件で絞り込んでから、一致したものだけ余裕度を計算する
+        checks = [(self.values[field], low, high) for field, (low, high) in conditions.items() if field != driver]
+        matched = []
+        for db_id in driver_ids[start:end]:
+            for field_values, low, high in checks:
+                value = field_values.get(db_id)
+                if value is None or (low is not None and value < low) or (high is not None and value > high):
+                    break
+            else:
+                matched.append(db_id)
+
+        candidates = []
+        for db_id in matched:
+            slack = {field: _slack(self.values[field][db_id], low, high)
+                     for field, (low, high) in conditions.items()}
+            score = sum(slack.values()) / len(slack)
+            candidates.append(Candidate(db_id, self.machine_numbers[db_id], score, slack))
+
+        sort_key = lambda candidate: (candidate.score, str(candidate.machine_number))
+        if limit:
+            return heapq.nsmallest(limit, candidates, key=sort_key)
+        return sorted(candidates, key=sort_key)
+
+
+def _slack(value, low, high):
+    """条件に対する余裕度（0 がぴったり）"""
+    if low is not None and high is not None:
+        # 範囲指定は中央からのずれを半幅で正規化
+        half = (high - low) / 2 or 1
+        return abs(value - (low + high) / 2) / half
+    if low is not None:
+        return (value - low) / max(abs(low), 1)
+    return (high - value) / max(abs(high), 1)
+
+
+def parse_condition(text):
+    """'capacity_kn=800:' 形式の条件を (仕様名, (下限, 上限)) に変換"""
+    field, _, bounds = text.partition('=')
+    # 'capacity_kn=800' のようにコロンがなければ下限のみの指定とみなす
+    low, _, high = bounds.partition(':')
+    return field.strip(), (float(low) if low.strip() else None, float(high) if high.strip() else None)
+
+
+def main(argv):
+    if len(argv) < 2:
+        print(__doc__)
+        return 1
+
+    index = SpecIndex.from_sqlite(argv[0])
+    # 下限・上限とも空の条件は指定なし
+    conditions = {field: bounds for field, bounds in map(parse_condition, argv[1:]) if bounds != (None, None)}
+    missing = [field for field in conditions if field in SPEC_FIELDS and field not in index.fields]
+    if missing:
+        print(f"このDBにない仕様項目です: {', '.join(missing)}（検索できる項目: {', '.join(index.fields) or 'なし'}）")
+        return 1
+    candidates = index.query(conditions)
+
+    print(f"=== 能力検索結果: {len(candidates)}/{len(index)}台 ===")
+    for candidate in candidates:
+        details = ", ".join(f"{SPEC_FIELDS[field]}={index.values[field][candidate.db_id]:g}"
+                            for field in conditions)
+        print(f"  {candidate.machine_number} (ID: {candidate.db_id}) 余裕度 {candidate.score:.3f}  {details}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+デスクトップ版（SQLite）と Supabase のプレス機・メンテナンス記録の照合
+ID の範囲ごとのハッシュ（ハッシュ木）を両側で計算して上から比べ、食い違う範囲だけを細かく分けていく。
+一致する範囲は行を転送しないので、同じ内容の 100 万行どうしでも数 KB のやり取りで確認できる
+
+Supabase 側には database/reconcile_functions.sql のビューと関数が必要。
+接続は PostgREST（Supabase の REST API）か PostgreSQL への直接接続のどちらか。
+デスクトップ版を正として、Supabase 側の 追加・更新・削除 の修正計画を出力し、--apply でバッチに分けて適用する
+
+使い方:
+  python supabase_reconcile.py diff --db press_machine.db --org-id <UUID> --output plan.json
+  python supabase_reconcile.py diff --db press_machine.db --org-id <UUID> --dsn postgresql://localhost/press --apply
+  python supabase_reconcile.py apply plan.json --batch-size 500
+REST API の URL とキーは --rest-url / --key か、環境変数 SUPABASE_URL と
+SUPABASE_SERVICE_ROLE_KEY（なければ SUPABASE_ANON_KEY）から取る
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+from bisect import bisect_left
+from collections import namedtuple
+
+from shared_db import connect
+
+DEFAULT_FANOUT = 16
+DEFAULT_LEAF_SIZE = 256
+DEFAULT_BATCH_SIZE = 500
+
+# 全体を1区間として問い合わせるときの上限（PostgreSQL の bigint に収まる値）
+MAX_ID = 2 ** 62
+
+# key: デスクトップ版の ID の列。local_select: デスクトップ版の行（先頭は ID）。
+# columns: Supabase 側の列（ID 以外。local_select の順）
+Table = namedtuple('Table', 'name key local_select columns')
+
+TABLES = {
+    'press_machines': Table('press_machines', 'db_id', """
+        SELECT db_id, machine_number, equipment_number, manufacturer, model_type,
+               serial_number, machine_type, production_group, tonnage
+        FROM press_machines""",
+        ('machine_number', 'equipment_number', 'manufacturer', 'model_type',
+         'serial_number', 'machine_type', 'production_group', 'tonnage')),
+    'maintenance_records': Table('maintenance_records', 'maintenance_id', """
+        SELECT maintenance_id, db_id, substr(maintenance_datetime, 1, 10), overall_judgment,
+               clutch_valve_replacement, brake_valve_replacement, remarks
+        FROM maintenance_records""",
+        ('press_id', 'maintenance_date', 'overall_judgment',
+         'clutch_valve_replacement', 'brake_valve_replacement', 'remarks')),
+}
+
+# 追加・更新はプレス機を先に、削除はメンテナンス記録を先に行う
+APPLY_ORDER = (('press_machines', 'upsert'), ('maintenance_records', 'upsert'),
+               ('maintenance_records', 'delete'), ('press_machines', 'delete'))
+
+# デスクトップ版の総合判定 -> Supabase 側の形式（update_judgment_values.sql）
+JUDGMENT_TO_REMOTE = {
+    '良好': 'A:良好',
+    '要注意': 'B:一部修理',
+    '要修理': 'C:至急修理を要す',
+    '異常': 'C:至急修理を要す',
+}
+
+
+def remote_values(table, values):
+    """デスクトップ版の行（ID 以外）を Supabase 側の値にする"""
+    if table == 'maintenance_records':
+        values = list(values)
+        values[2] = JUDGMENT_TO_REMOTE.get(values[2], values[2])
+    return tuple(values)
+
+
+def canonical_text(values):
+    """行ハッシュの元になる文字列（reconcile_functions.sql のビューと同じ形）"""
+    return '\x1f'.join('' if value is None else str(value) for value in values)
+
+
+def row_hash(values):
+    return hashlib.md5(canonical_text(values).encode('utf-8')).hexdigest()
+
+
+def range_digest(hashes):
+    return hashlib.md5(''.join(hashes).encode('utf-8')).hexdigest()
+
+
+class LocalTable:
+    """デスクトップ版のテーブルの ID と行ハッシュ（ID 順）"""
+
+    def __init__(self, conn, table):
+        self.conn = conn
+        self.table = TABLES[table]
+        self.ids = []
+        self.hashes = []
+        for row in conn.execute(f"{self.table.local_select} ORDER BY 1"):
+            self.ids.append(row[0])
+            self.hashes.append(row_hash(remote_values(table, row[1:])))
+
+    def ranges(self, lo, hi, step):
+        """reconcile_ranges と同じ {区間番号: (件数, 最小ID, 最大ID, ハッシュ)}"""
+        buckets = {}
+        start = bisect_left(self.ids, lo)
+        end = bisect_left(self.ids, hi)
+        i = start
+        while i < end:
+            bucket = (self.ids[i] - lo) // step
+            j = bisect_left(self.ids, lo + (bucket + 1) * step, i, end)
+            buckets[bucket] = (j - i, self.ids[i], self.ids[j - 1], range_digest(self.hashes[i:j]))
+            i = j
+        return buckets
+
+    def row_hashes(self, lo, hi):
+        start = bisect_left(self.ids, lo)
+        end = bisect_left(self.ids, hi)
+        return dict(zip(self.ids[start:end], self.hashes[start:end]))
+
+    def rows(self, ids):
+        """{ID: Supabase 側の値のタプル}"""
+        rows = {}
+        ids = list(ids)
+        for i in range(0, len(ids), DEFAULT_BATCH_SIZE):
+            chunk = ids[i:i + DEFAULT_BATCH_SIZE]
+            for row in self.conn.execute(
+                    f"{self.table.local_select} WHERE {self.table.key} IN ({', '.join('?' * len(chunk))})", chunk):
+                rows[row[0]] = remote_values(self.table.name, row[1:])
+        return rows
+
+
+class RemoteError(Exception):
+    """Supabase 側の問い合わせ・更新の失敗"""
+
+
+class PostgrestRemote:
+    """PostgREST（Supabase の REST API）経由の Supabase 側"""
+
+    def __init__(self, url, key, org_id):
+        self.url = url.rstrip('/')
+        self.key = key
+        self.org_id = org_id
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    def _request(self, method, path, body=None, prefer=None):
+        data = None if body is None else json.dumps(body, ensure_ascii=False).encode('utf-8')
+        request = urllib.request.Request(f"{self.url}/{path}", data=data, method=method)
+        request.add_header('Content-Type', 'application/json')
+        if self.key:
+            request.add_header('apikey', self.key)
+            request.add_header('Authorization', f"Bearer {self.key}")
+        if prefer:
+            request.add_header('Prefer', prefer)
+        try:
+            with urllib.request.urlopen(request) as response:
+                payload = response.read()
+        except urllib.error.HTTPError as e:
+            raise RemoteError(f"{method} {path}: {e.code} {e.read().decode('utf-8', 'replace')}")
+        except urllib.error.URLError as e:
+            raise RemoteError(f"{method} {path}: {e.reason}")
+        self.bytes_sent += len(data or b'') + len(path)
+        self.bytes_received += len(payload)
+        return json.loads(payload) if payload else None
+
+    def _in(self, ids):
+        return f"in.({','.join(str(i) for i in ids)})"
+
+    def ranges(self, table, lo, hi, step):
+        rows = self._request('POST', 'rpc/reconcile_ranges', {
+            'p_table': table, 'p_org': self.org_id, 'p_lo': lo, 'p_hi': hi, 'p_step': step})
+        return {row['bucket']: (row['row_count'], row['min_id'], row['max_id'], row['digest']) for row in rows}
+
+    def row_hashes(self, table, lo, hi):
+        query = urllib.parse.urlencode([('select', 'id,row_hash'), ('org_id', f"eq.{self.org_id}"),
+                                        ('id', f"gte.{lo}"), ('id', f"lt.{hi}"), ('order', 'id')])
+        return {row['id']: row['row_hash'] for row in self._request('GET', f"reconcile_{table}?{query}")}
+
+    def rows(self, table, ids):
+        columns = TABLES[table].columns
+        rows = {}
+        ids = list(ids)
+        for i in range(0, len(ids), DEFAULT_BATCH_SIZE):
+            query = urllib.parse.urlencode([('select', ','.join(('id',) + columns)), ('org_id', f"eq.{self.org_id}"),
+                                            ('id', self._in(ids[i:i + DEFAULT_BATCH_SIZE]))])
+            for row in self._request('GET', f"reconcile_{table}?{query}"):
+                rows[row['id']] = tuple(row[column] for column in columns)
+        return rows
+
+    def other_org_ids(self, table, ids):
+        """ids のうち他の組織の行が使っている ID"""
+        found = []
+        ids = list(ids)
+        for i in range(0, len(ids), DEFAULT_BATCH_SIZE):
+            query = urllib.parse.urlencode([('select', 'id'), ('org_id', f"neq.{self.org_id}"),
+                                            ('id', self._in(ids[i:i + DEFAULT_BATCH_SIZE]))])
+            found.extend(row['id'] for row in self._request('GET', f"reconcile_{table}?{query}"))
+        return found
+
+    def upsert(self, table, records):
+        self._request('POST', f"{table}?on_conflict=id", records,
+                      prefer='resolution=merge-duplicates,return=minimal')
+
+    def delete(self, table, ids):
+        query = urllib.parse.urlencode([('org_id', f"eq.{self.org_id}"), ('id', self._in(ids))])
+        self._request('DELETE', f"{table}?{query}", prefer='return=minimal')
+
+    def fix_sequences(self):
+        self._request('POST', 'rpc/reconcile_fix_sequences', {})
+
+    def close(self):
+        pass
+
+
+class PostgresRemote:
+    """PostgreSQL への直接接続（ローカルの PostgreSQL での確認や、DB の接続文字列がある場合）"""
+
+    def __init__(self, dsn, org_id):
+        import psycopg2
+
+        self.conn = psycopg2.connect(dsn)
+        self.error = psycopg2.Error
+        self.org_id = org_id
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    def _query(self, sql, params):
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall() if cursor.description else []
+            self.conn.commit()
+        except self.error as e:
+            self.conn.rollback()
+            raise RemoteError(str(e).strip())
+        self.bytes_sent += len(sql) + sum(len(str(param)) for param in params)
+        self.bytes_received += sum(len(str(value)) for row in rows for value in row)
+        return rows
+
+    def ranges(self, table, lo, hi, step):
+        rows = self._query("SELECT * FROM reconcile_ranges(%s, %s, %s, %s, %s)",
+                           (table, self.org_id, lo, hi, step))
+        return {bucket: (count, min_id, max_id, digest) for bucket, count, min_id, max_id, digest in rows}
+
+    def row_hashes(self, table, lo, hi):
+        return dict(self._query(
+            f"SELECT id, row_hash FROM reconcile_{table} WHERE org_id = %s AND id >= %s AND id < %s ORDER BY id",
+            (self.org_id, lo, hi)))
+
+    def rows(self, table, ids):
+        columns = TABLES[table].columns
+        rows = self._query(f"SELECT id, {', '.join(columns)} FROM reconcile_{table} "
+                           "WHERE org_id = %s AND id = ANY(%s)", (self.org_id, list(ids)))
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def other_org_ids(self, table, ids):
+        return [row[0] for row in self._query(
+            f"SELECT id FROM {table} WHERE org_id <> %s AND id = ANY(%s)", (self.org_id, list(ids)))]
+
+    def upsert(self, table, records):
+        columns = list(records[0])
+        updates = ', '.join(f"{column} = excluded.{column}" for column in columns if column != 'id')
+        values = ', '.join(['(' + ', '.join(['%s'] * len(columns)) + ')'] * len(records))
+        self._query(f"INSERT INTO {table} ({', '.join(columns)}) VALUES {values} "
+                    f"ON CONFLICT (id) DO UPDATE SET {updates}",
+                    [record[column] for record in records for column in columns])
+
+    def delete(self, table, ids):
+        self._query(f"DELETE FROM {table} WHERE org_id = %s AND id = ANY(%s)", (self.org_id, list(ids)))
+
+    def fix_sequences(self):
+        self._query("SELECT reconcile_fix_sequences()", ())
+
+    def close(self):
+        self.conn.close()
+
+
+def diff_table(local, remote, table, fanout=DEFAULT_FANOUT, leaf_size=DEFAULT_LEAF_SIZE):
+    """食い違う ID を {'missing': [...], 'changed': [...], 'extra': [...]} で返す
+
+    missing: Supabase 側にない、changed: 内容が違う、extra: デスクトップ版にない
+    """
+    result = {'missing': [], 'changed': [], 'extra': []}
+
+    def compare_rows(lo, hi):
+        mine = local.row_hashes(lo, hi)
+        theirs = remote.row_hashes(table, lo, hi)
+        for row_id, digest in mine.items():
+            if row_id not in theirs:
+                result['missing'].append(row_id)
+            elif theirs[row_id] != digest:
+                result['changed'].append(row_id)
+        result['extra'].extend(row_id for row_id in theirs if row_id not in mine)
+
+    def descend(lo, hi, mine, theirs):
+        if mine == theirs:
+            return
+        if max(mine[0] if mine else 0, theirs[0] if theirs else 0) <= leaf_size or hi - lo <= leaf_size:
+            compare_rows(lo, hi)
+            return
+        # 両側の行がある範囲だけを fanout 個に分ける
+        lo = min(summary[1] for summary in (mine, theirs) if summary)
+        hi = max(summary[2] for summary in (mine, theirs) if summary) + 1
+        step = -(-(hi - lo) // fanout)
+        my_buckets = local.ranges(lo, hi, step)
+        their_buckets = remote.ranges(table, lo, hi, step)
+        for bucket in sorted(set(my_buckets) | set(their_buckets)):
+            start = lo + bucket * step
+            descend(start, min(start + step, hi), my_buckets.get(bucket), their_buckets.get(bucket))
+
+    descend(0, MAX_ID, local.ranges(0, MAX_ID, MAX_ID).get(0), remote.ranges(table, 0, MAX_ID, MAX_ID).get(0))
+    for ids in result.values():
+        ids.sort()
+    return result
+
+
+def build_plan(conn, remote, org_id, tables=tuple(TABLES), fanout=DEFAULT_FANOUT, leaf_size=DEFAULT_LEAF_SIZE):
+    """デスクトップ版に合わせるための Supabase 側の修正計画"""
+    operations = []
+    summary = {}
+    for table in tables:
+        local = LocalTable(conn, table)
+        diff = diff_table(local, remote, table, fanout, leaf_size)
+        columns = TABLES[table].columns
+        mine = local.rows(diff['missing'] + diff['changed'])
+        theirs = remote.rows(table, diff['changed'])
+
+        # Supabase の id は組織をまたいで一意なので、他の組織が使っている ID は追加できない（計画に残して適用しない）
+        conflicts = set(remote.other_org_ids(table, diff['missing'])) if diff['missing'] else set()
+        for row_id in diff['missing']:
+            operations.append({'table': table, 'action': 'conflict' if row_id in conflicts else 'insert',
+                               'id': row_id, 'values': dict(zip(columns, mine[row_id]))})
+        for row_id in diff['changed']:
+            changes = {column: [before, after]
+                       for column, before, after in zip(columns, theirs[row_id], mine[row_id])
+                       if canonical_text([before]) != canonical_text([after])}
+            operations.append({'table': table, 'action': 'update', 'id': row_id,
+                               'values': dict(zip(columns, mine[row_id])), 'changes': changes})
+        for row_id in diff['extra']:
+            operations.append({'table': table, 'action': 'delete', 'id': row_id})
+        summary[table] = {'rows': len(local.ids), **{key: len(ids) for key, ids in diff.items()},
+                          'conflict': len(conflicts)}
+    return {'org_id': org_id, 'summary': summary, 'operations': operations}
+
+
+def apply_plan(remote, plan, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """修正計画をバッチに分けて適用 -> 適用した操作の数"""
+    done = 0
+    total = sum(op['action'] != 'conflict' for op in plan['operations'])
+    for table, kind in APPLY_ORDER:
+        if kind == 'upsert':
+            targets = [{'id': op['id'], 'org_id': plan['org_id'], **op['values']}
+                       for op in plan['operations'] if op['table'] == table and op['action'] in ('insert', 'update')]
+        else:
+            targets = [op['id'] for op in plan['operations'] if op['table'] == table and op['action'] == 'delete']
+        for i in range(0, len(targets), batch_size):
+            batch = targets[i:i + batch_size]
+            if kind == 'upsert':
+                remote.upsert(table, batch)
+            else:
+                remote.delete(table, batch)
+            done += len(batch)
+            if progress:
+                progress(done, total)
+    # ID を指定して追加したので、Supabase 側の採番を合わせる
+    if any(op['action'] == 'insert' for op in plan['operations']):
+        remote.fix_sequences()
+    return done
+
+
+def format_plan(plan):
+    lines = []
+    for table, counts in plan['summary'].items():
+        lines.append(f"{table}: {counts['rows']:,}行  追加 {counts['missing'] - counts['conflict']:,}"
+                     f" / 更新 {counts['changed']:,} / 削除 {counts['extra']:,} / ID重複 {counts['conflict']:,}")
+    for op in plan['operations']:
+        if op['action'] == 'update':
+            detail = ', '.join(f"{column}: {before!r} -> {after!r}" for column, (before, after) in op['changes'].items())
+        elif op['action'] == 'conflict':
+            detail = "他の組織が同じ id を使っているため追加できません"
+        elif op['action'] == 'insert':
+            detail = ', '.join(f"{column}={value!r}" for column, value in op['values'].items())
+        else:
+            detail = ""
+        lines.append(f"  {op['action']:6s} {op['table']} id={op['id']}  {detail}".rstrip())
+    return "\n".join(lines)
+
+
+def open_remote(args, org_id):
+    if args.dsn:
+        return PostgresRemote(args.dsn, org_id)
+    url = args.rest_url or (os.environ.get('SUPABASE_URL', '').rstrip('/') + '/rest/v1'
+                            if os.environ.get('SUPABASE_URL') else None)
+    key = args.key or os.environ.get('SUPABASE_SERVICE_ROLE_KEY') or os.environ.get('SUPABASE_ANON_KEY')
+    if not url:
+        raise RemoteError("接続先がありません（--dsn か --rest-url、または環境変数 SUPABASE_URL を指定してください）")
+    return PostgrestRemote(url, key, org_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="デスクトップ版と Supabase のデータ照合")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    diff = subparsers.add_parser('diff', help="照合して修正計画を作る")
+    diff.add_argument('--db', default='press_machine.db')
+    diff.add_argument('--org-id', required=True, help="Supabase 側の org_id")
+    diff.add_argument('--table', action='append', choices=list(TABLES), help="照合するテーブル（省略時は両方）")
+    diff.add_argument('--output', help="修正計画の JSON の出力先")
+    diff.add_argument('--apply', action='store_true', help="修正計画をそのまま適用する")
+    diff.add_argument('--fanout', type=int, default=DEFAULT_FANOUT, help="食い違う範囲を分ける数")
+    diff.add_argument('--leaf-size', type=int, default=DEFAULT_LEAF_SIZE, help="この件数以下の範囲は行ハッシュで比べる")
+
+    apply = subparsers.add_parser('apply', help="保存した修正計画を適用する")
+    apply.add_argument('plan')
+
+    for subparser in (diff, apply):
+        subparser.add_argument('--dsn', help="PostgreSQL の接続文字列（指定すると REST API の代わりに直接接続）")
+        subparser.add_argument('--rest-url', help="PostgREST の URL（Supabase なら https://<project>.supabase.co/rest/v1）")
+        subparser.add_argument('--key', help="API キー")
+        subparser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.command == 'apply':
+        with open(args.plan, encoding='utf-8') as f:
+            plan = json.load(f)
+    try:
+        remote = open_remote(args, plan['org_id'] if args.command == 'apply' else args.org_id)
+    except RemoteError as e:
+        parser.error(str(e))
+
+    try:
+        if args.command == 'diff':
+            if not os.path.exists(args.db):
+                parser.error(f"データベースが見つかりません: {args.db}")
+            conn = connect(args.db)
+            try:
+                plan = build_plan(conn, remote, args.org_id, args.table or tuple(TABLES), args.fanout, args.leaf_size)
+            finally:
+                conn.close()
+            print(format_plan(plan))
+            print(f"転送量: 送信 {remote.bytes_sent / 1024:.1f}KB / 受信 {remote.bytes_received / 1024:.1f}KB")
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8') as f:
+                    json.dump(plan, f, ensure_ascii=False, indent=2)
+
+        if args.command == 'apply' or args.apply:
+            done = apply_plan(remote, plan, args.batch_size,
+                              lambda done, total: print(f"\r適用中... {done}/{total}", end='', flush=True))
+            print(f"\n{done}件の修正を適用しました")
+    except RemoteError as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        remote.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+プレス稼働テレメトリの取り込み
+ストローク単位・秒単位のイベント（ストローク数、SPM、サイクルタイム、クラッチ/ブレーキ応答時間）を
+ソケットまたはファイル追従で受け取り、メモリ上でバッファして press_telemetry テーブルに
+まとめて書き込む
+
+イベントの行形式（CSV、または同じ項目名を持つJSON）:
+  db_id,ts,stroke_count,spm,cycle_time_ms,clutch_response_ms,brake_response_ms,stop_time_ms
+
+使い方:
+  python telemetry.py serve --db press_machine.db --port 9500 --rollup --detect
+  python telemetry.py tail --db press_machine.db --file /var/log/press/events.csv
+  python telemetry.py simulate --db press_machine.db --presses 100 --rate 50000 --duration 10
+  python telemetry.py simulate --send localhost:9500 --presses 100 --rate 5000
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from shared_db import write_transaction
+
+TELEMETRY_COLUMNS = ('db_id', 'ts', 'stroke_count', 'spm', 'cycle_time_ms',
+                     'clutch_response_ms', 'brake_response_ms', 'stop_time_ms')
+
+INSERT_TELEMETRY = (f"INSERT INTO press_telemetry ({', '.join(TELEMETRY_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(TELEMETRY_COLUMNS))})")
+
+DEFAULT_PORT = 9500
+
+# 書き込みに失敗したときの再試行間隔の上限（秒）。失敗のたびに flush_interval から倍にしていく
+MAX_RETRY_INTERVAL = 30.0
+
+
+def ensure_telemetry_schema(conn):
+    """テレメトリ用テーブルを作成（ts はUNIX時刻の秒）
+
+    id はロールアップの処理済み位置に使う。AUTOINCREMENT なので、保持期間の削除で全行が消えても
+    番号は再利用されない
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS press_telemetry (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        db_id INTEGER NOT NULL,
+        ts REAL NOT NULL,
+        stroke_count INTEGER,
+        spm REAL,
+        cycle_time_ms REAL,
+        clutch_response_ms REAL,
+        brake_response_ms REAL,
+        stop_time_ms REAL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_press_telemetry_machine_ts ON press_telemetry (db_id, ts)")
+
+
+def parse_event(line):
+    """1行のイベントをタプルに変換（不正な行は None）"""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        if line.startswith('{'):
+            record = json.loads(line)
+            values = [record.get(column) for column in TELEMETRY_COLUMNS]
+        else:
+            values = line.split(',')
+            values += [None] * (len(TELEMETRY_COLUMNS) - len(values))
+        return (
+            int(values[0]),
+            float(values[1]) if values[1] not in (None, '') else time.time(),
+            int(values[2]) if values[2] not in (None, '') else None,
+        ) + tuple(float(value) if value not in (None, '') else None for value in values[3:len(TELEMETRY_COLUMNS)])
+    except (ValueError, TypeError, json.JSONDecodeError):
+        return None
+
+
+class TelemetryIngestor:
+    """イベントをメモリにためて、書き込みスレッドで一定間隔ごとに1トランザクションで保存
+
+    書き込みに失敗したバッチはバッファの先頭に戻し、間隔を広げながら再試行する。
+    listener の例外は記録だけして、書き込みと他の listener には影響させない
+    """
+
+    def __init__(self, db_file, flush_interval=0.5, max_buffered=1_000_000):
+        self.db_file = db_file
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        # 保存後のバッチを受け取るコールバック（ロールアップ・異常検知など）
+        self.listeners = []
+
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self.invalid = 0
+        self.write_errors = 0
+        self.listener_errors = 0
+        self.last_error = None
+
+        with write_transaction(db_file) as conn:
+            ensure_telemetry_schema(conn)
+
+    def add(self, event):
+        with self.lock:
+            if len(self.buffer) >= self.max_buffered:
+                self.dropped += 1
+                return
+            self.buffer.append(event)
+            self.received += 1
+
+    def add_many(self, events):
+        with self.lock:
+            room = self.max_buffered - len(self.buffer)
+            if room < len(events):
+                self.dropped += len(events) - max(room, 0)
+                events = events[:max(room, 0)]
+            self.buffer.extend(events)
+            self.received += len(events)
+
+    def add_line(self, line):
+        event = parse_event(line)
+        if event is None:
+            with self.lock:
+                self.invalid += 1
+        else:
+            self.add(event)
+
+    def flush(self):
+        """バッファ中のイベントを書き込み、書き込んだ件数を返す
+
+        書き込みに失敗した場合はバッチをバッファの先頭に戻してから例外を送出する
+        """
+        with self.lock:
+            batch, self.buffer = self.buffer, []
+        if not batch:
+            return 0
+
+        try:
+            with write_transaction(self.db_file) as conn:
+                conn.executemany(INSERT_TELEMETRY, batch)
+        except BaseException:
+            with self.lock:
+                self.buffer[:0] = batch
+            raise
+        self.written += len(batch)
+
+        for listener in self.listeners:
+            try:
+                listener(batch)
+            except Exception as e:
+                self.listener_errors += 1
+                self._report(f"テレメトリの後処理でエラー（{getattr(listener, '__qualname__', listener)}）", e)
+        return len(batch)
+
+    def _report(self, message, error):
+        self.last_error = error
+        print(f"{message}: {error!r}", file=sys.stderr)
+
+    def _try_flush(self):
+        """flush して成功したか（失敗は記録して、バッチはバッファに残す）"""
+        try:
+            self.flush()
+            return True
+        except Exception as e:
+            self.write_errors += 1
+            self._report(f"テレメトリの書き込みに失敗（{len(self.buffer)}件を保持して再試行）", e)
+            return False
+
+    def _run(self):
+        interval = self.flush_interval
+        while not self.stop_event.wait(interval):
+            if self._try_flush():
+                interval = self.flush_interval
+            else:
+                interval = min(interval * 2, MAX_RETRY_INTERVAL)
+        if not self._try_flush():
+            print(f"テレメトリ {len(self.buffer)}件を保存できずに終了しました", file=sys.stderr)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='telemetry-writer', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+
+class _LineHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for raw in self.rfile:
+            self.server.ingestor.add_line(raw.decode('utf-8', errors='replace'))
+
+
+class TelemetryServer(socketserver.ThreadingTCPServer):
+    """1行1イベントのTCP受信サーバー"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, ingestor, host='0.0.0.0', port=DEFAULT_PORT):
+        super().__init__((host, port), _LineHandler)
+        self.ingestor = ingestor
+
+
+def tail_file(path, ingestor, stop_event, poll_interval=0.2):
+    """ファイルの追記分を読み取り続ける（ローテーション・切り詰めにも追従）"""
+    f = None
+    inode = None
+    partial = ''
+    while not stop_event.is_set():
+        if f is None:
+            try:
+                f = open(path, 'r', encoding='utf-8', errors='replace')
+                inode = os.fstat(f.fileno()).st_ino
+                f.seek(0, os.SEEK_END)
+            except FileNotFoundError:
+                stop_event.wait(poll_interval)
+                continue
+
+        chunk = f.read()
+        if chunk:
+            lines = (partial + chunk).split('\n')
+            partial = lines.pop()
+            for line in lines:
+                ingestor.add_line(line)
+            continue
+
+        # ファイルが置き換えられた・切り詰められた場合は開き直す
+        try:
+            stat = os.stat(path)
+            if stat.st_ino != inode or stat.st_size < f.tell():
+                f.close()
+                f = open(path, 'r', encoding='utf-8', errors='replace')
+                inode = os.fstat(f.fileno()).st_ino
+                partial = ''
+                continue
+        except FileNotFoundError:
+            pass
+        stop_event.wait(poll_interval)
+
+    if f:
+        f.close()
+
+
+class PressSimulator:
+    """プレス群の稼働イベントを生成するシミュレーター"""
+
+    def __init__(self, machine_ids, seed=0, degrading_ratio=0.05):
+        rng = random.Random(seed)
+        self.rng = rng
+        self.machines = []
+        for db_id in machine_ids:
+            spm = rng.choice([20, 30, 40, 60, 80])
+            self.machines.append({
+                'db_id': db_id,
+                'spm': spm,
+                'strokes': rng.randint(0, 5_000_000),
+                'clutch_ms': rng.uniform(25, 40),
+                'brake_ms': rng.uniform(30, 50),
+                'stop_ms': rng.uniform(120, 200),
+                # 一部の機械はブレーキ応答が徐々に劣化する
+                'brake_drift_ms': rng.uniform(0.0005, 0.002) if rng.random() < degrading_ratio else 0.0,
+            })
+
+    def events(self, count, now=None):
+        """count 件のイベントを機械に順番に割り振って生成"""
+        rng = self.rng
+        now = time.time() if now is None else now
+        machines = self.machines
+        events = []
+        for i in range(count):
+            machine = machines[i % len(machines)]
+            machine['strokes'] += 1
+            machine['brake_ms'] += machine['brake_drift_ms']
+            spm = machine['spm'] * rng.uniform(0.97, 1.03)
+            events.append((
+                machine['db_id'],
+                now,
+                machine['strokes'],
+                spm,
+                60000.0 / spm,
+                rng.gauss(machine['clutch_ms'], 1.5),
+                rng.gauss(machine['brake_ms'], 2.0),
+                rng.gauss(machine['stop_ms'], 5.0),
+            ))
+        return events
+
+
+def run_simulation(args):
+    machine_ids = list(range(1, args.presses + 1))
+    simulator = PressSimulator(machine_ids, seed=args.seed)
+    batch_size = max(1, args.rate // 20)
+
+    if args.send:
+        host, _, port = args.send.partition(':')
+        sock = socket.create_connection((host, int(port or DEFAULT_PORT)))
+        sink = lambda events: sock.sendall(''.join(
+            ','.join('' if value is None else str(value) for value in event) + '\n' for event in events
+        ).encode('utf-8'))
+        ingestor = None
+    else:
+        ingestor = TelemetryIngestor(args.db)
+        ingestor.start()
+        sink = ingestor.add_many
+
+    started = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - started < args.duration:
+        events = simulator.events(batch_size)
+        sink(events)
+        sent += len(events)
+        # 指定レートを超えないように待つ
+        ahead = sent / args.rate - (time.perf_counter() - started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+    if ingestor:
+        ingestor.stop()
+        elapsed = time.perf_counter() - started
+        print(f"生成: {sent}件  書き込み: {ingestor.written}件  破棄: {ingestor.dropped}件")
+        print(f"書き込みスループット: {ingestor.written / elapsed:,.0f} events/s")
+    else:
+        sock.close()
+        print(f"送信: {sent}件")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="プレス稼働テレメトリの取り込み")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve = subparsers.add_parser('serve', help="TCPでイベントを受信")
+    serve.add_argument('--db', default='press_machine.db')
+    serve.add_argument('--host', default='0.0.0.0')
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve.add_argument('--rollup', action='store_true', help="書き込みごとにロールアップも更新")
+    serve.add_argument('--detect', action='store_true', help="応答時間の異常検知を実行")
+    serve.add_argument('--alerts', metavar='FILE', help="アラートルールを評価して FILE に追記")
+
+    tail = subparsers.add_parser('tail', help="ファイルの追記分を取り込み")
+    tail.add_argument('--db', default='press_machine.db')
+    tail.add_argument('--file', required=True)
+    tail.add_argument('--rollup', action='store_true', help="書き込みごとにロールアップも更新")
+    tail.add_argument('--detect', action='store_true', help="応答時間の異常検知を実行")
+    tail.add_argument('--alerts', metavar='FILE', help="アラートルールを評価して FILE に追記")
+
+    simulate = subparsers.add_parser('simulate', help="シミュレーターで負荷をかける")
+    simulate.add_argument('--db', default='press_machine.db')
+    simulate.add_argument('--send', help="送信先 host:port（省略時はプロセス内で直接取り込み）")
+    simulate.add_argument('--presses', type=int, default=100)
+    simulate.add_argument('--rate', type=int, default=50000, help="1秒あたりのイベント数")
+    simulate.add_argument('--duration', type=float, default=10.0)
+    simulate.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args()
+
+    if args.command == 'simulate':
+        run_simulation(args)
+        return
+
+    ingestor = TelemetryIngestor(args.db)
+    if args.rollup:
+        from telemetry_rollup import RollupEngine
+        RollupEngine(args.db).attach(ingestor)
+    if args.detect:
+        from anomaly_detector import ResponseTimeDetector
+        ResponseTimeDetector(args.db).attach(ingestor)
+    alert_engine = None
+    if args.alerts:
+        from alert_rules import AlertEngine, FileSink
+        alert_engine = AlertEngine(args.db, sinks=[FileSink(args.alerts)])
+        alert_engine.attach(ingestor)
+        alert_engine.start()
+    ingestor.start()
+    try:
+        if args.command == 'serve':
+            server = TelemetryServer(ingestor, args.host, args.port)
+            print(f"テレメトリ受信開始: {args.host}:{args.port}")
+            server.serve_forever()
+        else:
+            print(f"ファイル追従開始: {args.file}")
+            tail_file(args.file, ingestor, threading.Event())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ingestor.stop()
+        if alert_engine:
+            alert_engine.stop()
+        print(f"受信: {ingestor.received}件  書き込み: {ingestor.written}件  "
+              f"不正行: {ingestor.invalid}件  破棄: {ingestor.dropped}件  "
+              f"書き込みエラー: {ingestor.write_errors}回  後処理エラー: {ingestor.listener_errors}回")
+
+
+if __name__ == "__main__":
+    main()
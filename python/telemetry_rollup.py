@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+テレメトリの分・時・日ロールアップと保持期間管理
+press_telemetry に追加された行だけを読み（id の処理済み位置を記録）、機械・指標ごとに
+件数・合計・最小・最大と、マージ可能な対数ヒストグラム（パーセンタイル用）を集計する
+長期間の分析ではロールアップだけを読み、生データは保持期間を過ぎたら削除する
+
+使い方:
+  python telemetry_rollup.py catch-up --db press_machine.db
+  python telemetry_rollup.py prune --db press_machine.db --raw-days 7
+  python telemetry_rollup.py query --db press_machine.db --machine 1 --metric brake_response_ms --days 365
+"""
+import argparse
+import math
+import time
+from array import array
+from datetime import datetime
+
+from shared_db import connect, write_transaction
+from telemetry import ensure_telemetry_schema
+
+# 集計対象の指標
+ROLLUP_METRICS = ('spm', 'cycle_time_ms', 'clutch_response_ms', 'brake_response_ms', 'stop_time_ms')
+
+# 解像度ごとのバケット幅（秒）。時・日のバケットは現地時刻で区切る（bucket_start）
+RESOLUTIONS = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+
+# 保持期間（日）。None は無期限
+DEFAULT_RETENTION_DAYS = {
+    'raw': 7,
+    'minute': 30,
+    'hour': 400,
+    'day': None,
+}
+
+# ヒストグラムの相対誤差（パーセンタイルの精度）
+SKETCH_RELATIVE_ACCURACY = 0.01
+
+
+class LogHistogram:
+    """対数幅のバケットで値を数えるヒストグラム（足し合わせでマージできる）"""
+
+    gamma = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+    log_gamma = math.log(gamma)
+
+    def __init__(self, counts=None):
+        # バケット番号 -> 件数（0 以下の値はバケット番号 None）
+        self.counts = counts or {}
+
+    def add(self, value):
+        key = math.ceil(math.log(value) / self.log_gamma) if value > 0 else None
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def merge(self, other):
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+
+    def quantile(self, q):
+        total = sum(self.counts.values())
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = self.counts.get(None, 0)
+        if rank < seen:
+            return 0.0
+        for key in sorted(k for k in self.counts if k is not None):
+            seen += self.counts[key]
+            if seen > rank:
+                # バケット中央値（相対誤差 SKETCH_RELATIVE_ACCURACY 以内）
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return None
+
+    def to_bytes(self):
+        values = array('i')
+        for key, count in self.counts.items():
+            # 0 以下のバケットは番号 -2^31 で表す
+            values.append(-2 ** 31 if key is None else key)
+            values.append(count)
+        return values.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        values = array('i')
+        values.frombytes(data)
+        return cls({
+            (None if values[i] == -2 ** 31 else values[i]): values[i + 1]
+            for i in range(0, len(values), 2)
+        })
+
+
+class Aggregate:
+    """1バケット分の集計値"""
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'histogram')
+
+    def __init__(self, count=0, total=0.0, minimum=None, maximum=None, histogram=None):
+        self.count = count
+        self.total = total
+        self.minimum = minimum
+        self.maximum = maximum
+        self.histogram = histogram or LogHistogram()
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None or value < self.minimum else self.minimum
+        self.maximum = value if self.maximum is None or value > self.maximum else self.maximum
+        self.histogram.add(value)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        if other.minimum is not None:
+            self.minimum = other.minimum if self.minimum is None else min(self.minimum, other.minimum)
+            self.maximum = other.maximum if self.maximum is None else max(self.maximum, other.maximum)
+        self.histogram.merge(other.histogram)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+def ensure_rollup_schema(conn):
+    ensure_telemetry_schema(conn)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS telemetry_rollup (
+        resolution TEXT NOT NULL,
+        db_id INTEGER NOT NULL,
+        metric TEXT NOT NULL,
+        bucket_start INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        total REAL NOT NULL,
+        minimum REAL,
+        maximum REAL,
+        sketch BLOB NOT NULL,
+        max_stroke_count INTEGER,
+        PRIMARY KEY (resolution, db_id, metric, bucket_start)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS telemetry_rollup_state (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    """)
+
+
+def _last_id(conn):
+    """ロールアップに反映済みの press_telemetry.id"""
+    row = conn.execute("SELECT value FROM telemetry_rollup_state WHERE name = 'last_id'").fetchone()
+    return row[0] if row else 0
+
+
+def bucket_start(ts, resolution):
+    """ts を含むバケットの開始時刻（UNIX時刻の秒）
+
+    時・日は現地時刻で区切る（日は現地の0時から。UTC で区切ると JST では9時始まりになる）
+    """
+    width = RESOLUTIONS[resolution]
+    offset = time.localtime(ts).tm_gmtoff if resolution != 'minute' else 0
+    return int((ts + offset) // width * width - offset)
+
+
+class RollupEngine:
+    """press_telemetry の未処理行をロールアップに反映する"""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        with write_transaction(db_file) as conn:
+            ensure_rollup_schema(conn)
+
+    def catch_up(self, max_rows=200_000):
+        """未処理の生データを集計して反映し、処理した件数を返す"""
+        processed = 0
+        while True:
+            count = self._process_chunk(max_rows)
+            processed += count
+            if count < max_rows:
+                return processed
+
+    def _process_chunk(self, limit):
+        with write_transaction(self.db_file) as conn:
+            last_id = _last_id(conn)
+
+            rows = conn.execute(f"""
+            SELECT id, db_id, ts, stroke_count, {', '.join(ROLLUP_METRICS)}
+            FROM press_telemetry WHERE id > ? ORDER BY id LIMIT ?
+            """, (last_id, limit)).fetchall()
+            if not rows:
+                return 0
+
+            # 今回分をまず分単位で集計
+            minute_width = RESOLUTIONS['minute']
+            partials = {}
+            strokes = {}
+            for row in rows:
+                db_id, ts, stroke_count = row[1], row[2], row[3]
+                minute_start = int(ts // minute_width * minute_width)
+                if stroke_count is not None:
+                    key = ('minute', db_id, minute_start)
+                    strokes[key] = max(strokes.get(key, stroke_count), stroke_count)
+                for metric, value in zip(ROLLUP_METRICS, row[4:]):
+                    if value is None:
+                        continue
+                    key = ('minute', db_id, metric, minute_start)
+                    aggregate = partials.get(key)
+                    if aggregate is None:
+                        aggregate = partials[key] = Aggregate()
+                    aggregate.add(value)
+
+            # 時・日の集計は分の集計をマージして求める（生データを再走査しない）
+            for (_, db_id, metric, minute_start), minute_aggregate in list(partials.items()):
+                for resolution in ('hour', 'day'):
+                    key = (resolution, db_id, metric, bucket_start(minute_start, resolution))
+                    aggregate = partials.get(key)
+                    if aggregate is None:
+                        aggregate = partials[key] = Aggregate()
+                    aggregate.merge(minute_aggregate)
+            for (_, db_id, minute_start), stroke_count in list(strokes.items()):
+                for resolution in ('hour', 'day'):
+                    key = (resolution, db_id, bucket_start(minute_start, resolution))
+                    strokes[key] = max(strokes.get(key, stroke_count), stroke_count)
+
+            # 既存バケットとマージして保存
+            for (resolution, db_id, metric, start), aggregate in partials.items():
+                existing = conn.execute("""
+                SELECT count, total, minimum, maximum, sketch, max_stroke_count FROM telemetry_rollup
+                WHERE resolution=? AND db_id=? AND metric=? AND bucket_start=?
+                """, (resolution, db_id, metric, start)).fetchone()
+                max_stroke_count = strokes.get((resolution, db_id, start))
+                if existing:
+                    aggregate.merge(Aggregate(existing[0], existing[1], existing[2], existing[3],
+                                              LogHistogram.from_bytes(existing[4])))
+                    if existing[5] is not None:
+                        max_stroke_count = max(existing[5], max_stroke_count or existing[5])
+
+                conn.execute("""
+                INSERT OR REPLACE INTO telemetry_rollup
+                (resolution, db_id, metric, bucket_start, count, total, minimum, maximum, sketch, max_stroke_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (resolution, db_id, metric, start, aggregate.count, aggregate.total,
+                      aggregate.minimum, aggregate.maximum, aggregate.histogram.to_bytes(), max_stroke_count))
+
+            conn.execute("INSERT OR REPLACE INTO telemetry_rollup_state (name, value) VALUES ('last_id', ?)",
+                         (rows[-1][0],))
+            return len(rows)
+
+    def attach(self, ingestor):
+        """取り込みの書き込みごとにロールアップを進める"""
+        ingestor.listeners.append(lambda batch: self.catch_up())
+
+
+def prune(db_file, retention_days=None, now=None, chunk_size=50_000):
+    """保持期間を過ぎた生データとロールアップを削除（機械ごとに索引を使って削除）"""
+    retention_days = {**DEFAULT_RETENTION_DAYS, **(retention_days or {})}
+    now = time.time() if now is None else now
+    deleted = {}
+
+    conn = connect(db_file)
+    machine_ids = [row[0] for row in conn.execute("SELECT DISTINCT db_id FROM telemetry_rollup")]
+    # 未集計の生データを消さないよう、処理済み位置より前だけを対象にする
+    last_id = _last_id(conn)
+    conn.close()
+
+    if retention_days['raw'] is not None:
+        cutoff = now - retention_days['raw'] * 86400
+        deleted['raw'] = 0
+        for db_id in machine_ids:
+            # ロックを長く握らないよう一定件数ずつ削除
+            while True:
+                with write_transaction(db_file) as conn:
+                    count = conn.execute("""
+                    DELETE FROM press_telemetry WHERE id IN (
+                        SELECT id FROM press_telemetry WHERE db_id=? AND ts < ? AND id <= ? LIMIT ?
+                    )
+                    """, (db_id, cutoff, last_id, chunk_size)).rowcount
+                deleted['raw'] += count
+                if count < chunk_size:
+                    break
+
+    for resolution in RESOLUTIONS:
+        if retention_days[resolution] is None:
+            continue
+        cutoff = now - retention_days[resolution] * 86400
+        with write_transaction(db_file) as conn:
+            deleted[resolution] = conn.execute("DELETE FROM telemetry_rollup WHERE resolution=? AND bucket_start < ?",
+                                               (resolution, cutoff)).rowcount
+
+    return deleted
+
+
+def choose_resolution(start, end):
+    """期間に応じて読み込むロールアップの解像度を選ぶ（長期間ほど粗く）"""
+    span = end - start
+    if span > 30 * 86400:
+        return 'day'
+    if span > 86400:
+        return 'hour'
+    return 'minute'
+
+
+def query_rollup(db_file, db_id, metric, start, end, resolution=None):
+    """期間内のバケットごとの集計 (開始時刻, 件数, 平均, 最小, 最大, p50, p95, p99) を返す"""
+    resolution = resolution or choose_resolution(start, end)
+    conn = connect(db_file)
+    try:
+        rows = conn.execute("""
+        SELECT bucket_start, count, total, minimum, maximum, sketch FROM telemetry_rollup
+        WHERE resolution=? AND db_id=? AND metric=? AND bucket_start >= ? AND bucket_start < ?
+        ORDER BY bucket_start
+        """, (resolution, db_id, metric, bucket_start(start, resolution), end)).fetchall()
+    finally:
+        conn.close()
+
+    result = []
+    for bucket, count, total, minimum, maximum, sketch in rows:
+        histogram = LogHistogram.from_bytes(sketch)
+        result.append((bucket, count, total / count if count else None, minimum, maximum,
+                       histogram.quantile(0.5), histogram.quantile(0.95), histogram.quantile(0.99)))
+    return result
+
+
+def summarize_period(db_file, db_id, metric, start, end):
+    """期間全体の集計（バケットのヒストグラムをマージして求める）"""
+    resolution = choose_resolution(start, end)
+    conn = connect(db_file)
+    try:
+        rows = conn.execute("""
+        SELECT count, total, minimum, maximum, sketch FROM telemetry_rollup
+        WHERE resolution=? AND db_id=? AND metric=? AND bucket_start >= ? AND bucket_start < ?
+        """, (resolution, db_id, metric, bucket_start(start, resolution), end)).fetchall()
+    finally:
+        conn.close()
+
+    total = Aggregate()
+    for count, value_total, minimum, maximum, sketch in rows:
+        total.merge(Aggregate(count, value_total, minimum, maximum, LogHistogram.from_bytes(sketch)))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="テレメトリのロールアップと保持期間管理")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    catch_up = subparsers.add_parser('catch-up', help="未処理の生データをロールアップに反映")
+    catch_up.add_argument('--db', default='press_machine.db')
+
+    prune_parser = subparsers.add_parser('prune', help="保持期間を過ぎたデータを削除")
+    prune_parser.add_argument('--db', default='press_machine.db')
+    for name, days in DEFAULT_RETENTION_DAYS.items():
+        prune_parser.add_argument(f'--{name}-days', type=int, default=days)
+
+    query = subparsers.add_parser('query', help="ロールアップを表示")
+    query.add_argument('--db', default='press_machine.db')
+    query.add_argument('--machine', type=int, required=True)
+    query.add_argument('--metric', choices=ROLLUP_METRICS, default='brake_response_ms')
+    query.add_argument('--days', type=float, default=1.0)
+
+    args = parser.parse_args()
+
+    if args.command == 'catch-up':
+        processed = RollupEngine(args.db).catch_up()
+        print(f"ロールアップ反映: {processed}件")
+    elif args.command == 'prune':
+        RollupEngine(args.db)
+        deleted = prune(args.db, {name: getattr(args, f'{name}_days') for name in DEFAULT_RETENTION_DAYS})
+        for name, count in deleted.items():
+            print(f"  {name}: {count}件削除")
+    else:
+        end = time.time()
+        start = end - args.days * 86400
+        print(f"=== 機械ID {args.machine} / {args.metric} ({choose_resolution(start, end)}) ===")
+        for bucket, count, mean, minimum, maximum, p50, p95, p99 in query_rollup(
+                args.db, args.machine, args.metric, start, end):
+            label = datetime.fromtimestamp(bucket).strftime('%Y-%m-%d %H:%M')
+            print(f"  {label}  件数 {count:7d}  平均 {mean:8.2f}  最小 {minimum:8.2f}  最大 {maximum:8.2f}  "
+                  f"p50 {p50:8.2f}  p95 {p95:8.2f}  p99 {p99:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+一覧（Treeview）の列見出しクリックによる並べ替え
+- SortOrder: 並べ替えキー [(列番号, 降順か), ...] の状態。クリックで 昇順 -> 降順 -> 解除、
+  Shift+クリックで第2キー以降に追加（例: グループ順、その中で最終点検順）
+- CachedSort: 全行を保持している一覧用。列ごとの順位と並び順をキャッシュし、
+  行が変わるまでは並べ替えのたびに作り直したり DB を読み直したりしない
+
+SQL で並べ替える一覧（メンテナンス記録）は SortOrder のキーを reporting.queries.maintenance_order_by に渡す
+"""
+
+ARROWS = {False: '▲', True: '▼'}
+
+
+def sort_value(value):
+    """列の値の比較キー（数字だけの文字列は数値として比べ、空欄は最後）"""
+    if value is None or value == '':
+        return (2, '')
+    if isinstance(value, (int, float)):
+        return (0, value)
+    text = str(value)
+    if text.isdigit():
+        return (0, int(text))
+    return (1, text)
+
+
+class SortOrder:
+    """並べ替えキーの状態"""
+
+    def __init__(self, keys=()):
+        self.keys = list(keys)
+
+    def direction(self, column):
+        """column の並び（False: 昇順, True: 降順, None: キーでない）"""
+        for key_column, descending in self.keys:
+            if key_column == column:
+                return descending
+        return None
+
+    def click(self, column, extend=False):
+        """見出しのクリック。extend（Shift+クリック）なら他のキーを残す"""
+        current = self.direction(column)
+        following = {None: False, False: True, True: None}[current]
+        if not extend:
+            self.keys = [] if following is None else [(column, following)]
+        elif current is None:
+            self.keys.append((column, following))
+        elif following is None:
+            self.keys = [key for key in self.keys if key[0] != column]
+        else:
+            self.keys = [(key_column, following if key_column == column else descending)
+                         for key_column, descending in self.keys]
+
+    def heading_text(self, column, label):
+        """見出しの表示（並べ替えキーなら矢印。複数キーなら順番も付ける）"""
+        for i, (key_column, descending) in enumerate(self.keys):
+            if key_column == column:
+                number = str(i + 1) if len(self.keys) > 1 else ''
+                return f"{label} {ARROWS[descending]}{number}"
+        return label
+
+
+class CachedSort:
+    """全行の並べ替え用キャッシュ
+
+    列ごとの順位（同じ値は同じ順位）を一度だけ計算し、キーの組み合わせごとの並び順も保持する。
+    同じ順位の行は追加された順（読み込み時の並び）を保つ（安定ソート）
+    """
+
+    def __init__(self):
+        self._rows = {}
+        self._invalidate()
+
+    def _invalidate(self):
+        self._ids = None
+        self._ranks = {}
+        self._orders = {}
+
+    def clear(self):
+        self._rows = {}
+        self._invalidate()
+
+    def put(self, row_id, values):
+        """行を追加・更新（並べ替えのキーは values の位置で指定する）"""
+        self._rows[row_id] = values
+        self._invalidate()
+
+    def rows(self):
+        """全行の values（追加された順）"""
+        return list(self._rows.values())
+
+    def discard(self, row_id):
+        if self._rows.pop(row_id, None) is not None:
+            self._invalidate()
+
+    def _rank(self, column, descending):
+        """列の順位の配列（降順の場合も空欄は最後）"""
+        ranks = self._ranks.get((column, descending))
+        if ranks is not None:
+            return ranks
+
+        values = [sort_value(self._rows[row_id][column]) for row_id in self._ids]
+        ascending = [0] * len(values)
+        rank = -1
+        previous = None
+        for i in sorted(range(len(values)), key=values.__getitem__):
+            if values[i] != previous:
+                rank += 1
+                previous = values[i]
+            ascending[i] = rank
+        self._ranks[(column, False)] = ascending
+
+        # 降順は順位を反転し、空欄だけは最後に回す
+        empty = (2, '')
+        self._ranks[(column, True)] = [rank + 1 if values[i] == empty else rank - r
+                                       for i, r in enumerate(ascending)]
+        return self._ranks[(column, descending)]
+
+    def order(self, keys):
+        """keys（[(列番号, 降順か), ...]）の並びの行IDのリスト。keys が空なら追加された順"""
+        if self._ids is None:
+            self._ids = list(self._rows)
+        keys = tuple(keys)
+        if not keys:
+            return self._ids
+
+        order = self._orders.get(keys)
+        if order is None:
+            ranks = [self._rank(column, descending) for column, descending in keys]
+            if len(ranks) == 1:
+                positions = sorted(range(len(self._ids)), key=ranks[0].__getitem__)
+            else:
+                positions = sorted(range(len(self._ids)), key=lambda i: tuple(rank[i] for rank in ranks))
+            order = self._orders[keys] = [self._ids[i] for i in positions]
+        return order
+
+
+def bind_heading_sort(tree, on_click):
+    """列見出しのクリックで on_click(列番号, Shift が押されているか) を呼ぶ"""
+    def clicked(event):
+        if tree.identify_region(event.x, event.y) != 'heading':
+            return
+        column = tree.identify_column(event.x)
+        if column:
+            on_click(int(column[1:]) - 1, bool(event.state & 0x0001))
+
+    tree.bind('<ButtonRelease-1>', clicked, add='+')
@@ -0,0 +1,385 @@
+"""
+データ分析タブの推移グラフ（Tk Canvas）
+- 総合判定の内訳（期間ごとの積み上げ棒）
+- 生産グループ別の電磁弁交換数（30日移動合計の折れ線。LTTB で表示幅まで間引く）
+- 機械別のメンテナンスタイムライン（表示幅の区間ごとに最も重い判定を表示）
+
+集計は reporting.trends で日単位に行い ResultCache に置くので、拡大・移動では SQL を実行しない。
+ドラッグ中は描画済みの図形を動かすだけにし、再計算は操作が止まってから1回だけ行う。
+図形は作り直さず座標と色を差し替えて再利用する
+"""
+import time
+import tkinter as tk
+from tkinter import ttk
+
+from reporting import fetch_machines
+from reporting.trends import (
+    JUDGMENTS, ROLLING_DAYS, bin_events, bucket_edges, daily_summary, day_range, from_ordinal, lttb,
+    machine_events, rolling_points,
+)
+from shared_db import connect
+
+CHARTS = ('総合判定の推移', f'グループ別 電磁弁交換数（{ROLLING_DAYS}日移動合計）', '機械別タイムライン')
+
+JUDGMENT_COLORS = {'良好': '#22c55e', '要注意': '#f59e0b', '要修理': '#ef4444', '異常': '#7f1d1d'}
+SEVERITY_COLORS = [JUDGMENT_COLORS[judgment] for judgment in JUDGMENTS]
+OTHER_COLOR = '#94a3b8'
+GROUP_COLORS = ('#2563eb', '#db2777', '#0d9488', '#9333ea', '#ea580c', '#65a30d')
+
+MARGIN_LEFT = 64
+MARGIN_RIGHT = 16
+MARGIN_TOP = 28
+MARGIN_BOTTOM = 24
+MIN_BAR_PIXELS = 4        # 棒グラフの1本の最小幅（これより細くなる場合は集計単位を大きくする）
+TIMELINE_CELL_PIXELS = 3  # タイムラインの1区間の幅
+TIMELINE_MIN_ROW = 8      # タイムラインの1台あたりの最小の高さ
+MIN_SPAN_DAYS = 14
+REDRAW_DELAY_MS = 40      # 拡大・移動が止まってから再計算するまでの待ち時間
+
+
+class _ItemPool:
+    """Canvas の図形を種類ごとに使い回す（begin から end までに使わなかったものは隠す）"""
+
+    def __init__(self, canvas, tag):
+        self.canvas = canvas
+        self.tag = tag
+        self.items = {}
+        self.used = {}
+
+    def begin(self):
+        self.used = dict.fromkeys(self.items, 0)
+
+    def get(self, kind, coords, **options):
+        items = self.items.setdefault(kind, [])
+        index = self.used.get(kind, 0)
+        if index < len(items):
+            item = items[index]
+            self.canvas.coords(item, *coords)
+            self.canvas.itemconfigure(item, state='normal', **options)
+        else:
+            create = getattr(self.canvas, f'create_{kind}')
+            item = create(*coords, tags=(self.tag,), **options)
+            items.append(item)
+        self.used[kind] = index + 1
+        return item
+
+    def end(self):
+        for kind, items in self.items.items():
+            for item in items[self.used.get(kind, 0):]:
+                self.canvas.itemconfigure(item, state='hidden')
+
+
+class TrendPanel(tk.Frame):
+    """推移グラフのパネル（ホイールで拡大・縮小、ドラッグで移動）"""
+
+    def __init__(self, parent, db_file, result_cache, height=300):
+        super().__init__(parent, bg='#ffffff')
+        self.db_file = db_file
+        self.result_cache = result_cache
+        self.data = None
+        self.view = None          # 表示範囲 (開始日, 終了日)。None はデータ全体
+        self.drag_x = None
+        self.drag_offset = 0
+        self.redraw_job = None
+        self.row_offset = 0       # タイムラインの先頭に表示する機械の位置
+
+        controls = tk.Frame(self, bg='#ffffff')
+        controls.pack(fill=tk.X, pady=(0, 4))
+        self.chart_var = tk.StringVar(value=CHARTS[0])
+        chart_combo = ttk.Combobox(controls, textvariable=self.chart_var, values=CHARTS, state='readonly', width=36)
+        chart_combo.pack(side=tk.LEFT)
+        chart_combo.bind('<<ComboboxSelected>>', lambda event: self.redraw())
+        tk.Button(controls, text="全期間", command=self.reset_view,
+                 font=('Segoe UI', 9), relief=tk.FLAT, bd=1, padx=10, pady=2,
+                 bg='#ffffff', fg='#374151', activebackground='#f9fafb').pack(side=tk.LEFT, padx=(8, 0))
+        self.range_var = tk.StringVar()
+        tk.Label(controls, textvariable=self.range_var, font=('Segoe UI', 9),
+                bg='#ffffff', fg='#64748b').pack(side=tk.LEFT, padx=(12, 0))
+
+        self.canvas = tk.Canvas(self, height=height, bg='#ffffff', highlightthickness=1,
+                                highlightbackground='#e2e8f0')
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+        # 重なり順は グラフ < 左右の余白 < 軸・凡例
+        self.plot_items = _ItemPool(self.canvas, 'plot')
+        self.mask_items = _ItemPool(self.canvas, 'mask')
+        self.axis_items = _ItemPool(self.canvas, 'axis')
+        self.pools = (self.plot_items, self.mask_items, self.axis_items)
+
+        self.canvas.bind('<Configure>', lambda event: self.schedule_redraw())
+        self.canvas.bind('<MouseWheel>', self.on_wheel)
+        self.canvas.bind('<Button-4>', self.on_wheel)
+        self.canvas.bind('<Button-5>', self.on_wheel)
+        self.canvas.bind('<Shift-MouseWheel>', self.on_row_scroll)
+        self.canvas.bind('<Shift-Button-4>', self.on_row_scroll)
+        self.canvas.bind('<Shift-Button-5>', self.on_row_scroll)
+        self.canvas.bind('<ButtonPress-1>', self.on_drag_start)
+        self.canvas.bind('<B1-Motion>', self.on_drag)
+        self.canvas.bind('<ButtonRelease-1>', self.on_drag_end)
+
+    # --- データ ---
+
+    def _query(self, query):
+        conn = connect(self.db_file)
+        try:
+            return query(conn)
+        finally:
+            conn.close()
+
+    def refresh(self):
+        """集計を読み直して再描画（変更のないテーブルの集計はキャッシュを使う）"""
+        judgments, replacements = self.result_cache.get('trend_daily', ('press_machines', 'maintenance_records'),
+                                                        lambda: self._query(daily_summary))
+        self.data = {
+            'judgments': judgments,
+            'replacements': replacements,
+            'machines': self.result_cache.get('trend_machines', ('press_machines',),
+                                              lambda: [(row[0], row[1]) for row in self._query(fetch_machines)]),
+        }
+        self.redraw()
+
+    def full_range(self):
+        extent = day_range(self.data['judgments']) if self.data else None
+        if extent is None:
+            return None
+        start, end = extent
+        return start, max(end, start + MIN_SPAN_DAYS)
+
+    # --- 操作 ---
+
+    def reset_view(self):
+        self.view = None
+        self.row_offset = 0
+        self.redraw()
+
+    def schedule_redraw(self):
+        if self.redraw_job is not None:
+            self.after_cancel(self.redraw_job)
+        self.redraw_job = self.after(REDRAW_DELAY_MS, self.redraw)
+
+    def current_view(self):
+        return self.view or self.full_range()
+
+    def plot_width(self):
+        return max(self.canvas.winfo_width() - MARGIN_LEFT - MARGIN_RIGHT, 1)
+
+    def set_view(self, start, end):
+        """表示範囲をデータ全体の中に収めて設定"""
+        full_start, full_end = self.full_range()
+        span = min(max(end - start, MIN_SPAN_DAYS), full_end - full_start)
+        start = min(max(start, full_start), full_end - span)
+        self.view = None if span >= full_end - full_start else (start, start + span)
+
+    def on_wheel(self, event):
+        view = self.current_view()
+        if view is None:
+            return
+        zoom_in = event.num == 4 or event.delta > 0
+        factor = 0.8 if zoom_in else 1.25
+        start, end = view
+        # カーソル位置の日付を固定して拡大・縮小
+        ratio = min(max((event.x - MARGIN_LEFT) / self.plot_width(), 0.0), 1.0)
+        anchor = start + (end - start) * ratio
+        span = (end - start) * factor
+        self.set_view(anchor - span * ratio, anchor + span * (1 - ratio))
+        self.schedule_redraw()
+
+    def on_row_scroll(self, event):
+        up = event.num == 4 or event.delta > 0
+        self.row_offset = max(self.row_offset + (-1 if up else 1), 0)
+        self.schedule_redraw()
+
+    def on_drag_start(self, event):
+        self.drag_x = event.x
+        self.drag_offset = 0
+
+    def on_drag(self, event):
+        if self.drag_x is None or self.current_view() is None:
+            return
+        # 描画済みの図形を動かすだけにして、再計算は操作が止まってから
+        dx = event.x - self.drag_x
+        self.canvas.move('plot', dx, 0)
+        self.drag_x = event.x
+        self.drag_offset += dx
+        self.schedule_redraw()
+
+    def on_drag_end(self, event):
+        if self.drag_x is None:
+            return
+        self.drag_x = None
+        self.schedule_redraw()
+
+    def commit_drag(self):
+        """ドラッグで動かした分を表示範囲に反映"""
+        view = self.current_view()
+        if view is not None and self.drag_offset:
+            start, end = view
+            shift = -self.drag_offset * (end - start) / self.plot_width()
+            self.set_view(start + shift, end + shift)
+        self.drag_offset = 0
+
+    # --- 描画 ---
+
+    def redraw(self):
+        self.redraw_job = None
+        if self.data is None or self.canvas.winfo_width() <= MARGIN_LEFT + MARGIN_RIGHT:
+            return
+        self.commit_drag()
+
+        started = time.perf_counter()
+        for pool in self.pools:
+            pool.begin()
+        view = self.current_view()
+        if view is None:
+            self.axis_items.get('text', (self.canvas.winfo_width() / 2, 40), text="メンテナンス記録がありません",
+                                fill='#64748b', font=('Segoe UI', 10))
+            self.range_var.set("")
+        else:
+            chart = self.chart_var.get()
+            if chart == CHARTS[0]:
+                self.draw_judgments(*view)
+            elif chart == CHARTS[1]:
+                self.draw_replacements(*view)
+            else:
+                self.draw_timeline(*view)
+            self.draw_mask()
+            self.draw_time_axis(*view)
+        for pool in self.pools:
+            pool.end()
+        self.canvas.tag_raise('mask')
+        self.canvas.tag_raise('axis')
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if view is not None:
+            self.range_var.set(f"{from_ordinal(view[0]):%Y/%m/%d} 〜 {from_ordinal(view[1] - 1):%Y/%m/%d}"
+                               f"（描画 {elapsed_ms:.0f}ms）")
+
+    def _plot_box(self):
+        width = self.canvas.winfo_width()
+        height = self.canvas.winfo_height()
+        return MARGIN_LEFT, MARGIN_TOP, width - MARGIN_RIGHT, height - MARGIN_BOTTOM
+
+    def _x(self, day, start, end):
+        left, _, right, _ = self._plot_box()
+        return left + (day - start) * (right - left) / (end - start)
+
+    def draw_mask(self):
+        """移動中にはみ出した図形を左右の余白で隠す"""
+        left, _, right, bottom = self._plot_box()
+        width = self.canvas.winfo_width()
+        height = self.canvas.winfo_height()
+        self.mask_items.get('rectangle', (0, 0, left, height), fill='#ffffff', outline='')
+        self.mask_items.get('rectangle', (right, 0, width, height), fill='#ffffff', outline='')
+        self.axis_items.get('line', (left, bottom, right, bottom), fill='#cbd5e1')
+
+    def draw_time_axis(self, start, end):
+        """横軸の目盛り（ラベルが重ならない間隔の境界だけ表示）"""
+        left, _, right, bottom = self._plot_box()
+        edges, unit = bucket_edges(start, end, max((right - left) // 80, 1))
+        label_format = '%Y' if unit == '年' else '%Y/%m' if unit in ('月', '四半期') else '%m/%d'
+        for edge in edges:
+            if start <= edge < end:
+                x = self._x(edge, start, end)
+                self.axis_items.get('line', (x, bottom, x, bottom + 4), fill='#94a3b8')
+                self.axis_items.get('text', (x, bottom + 6), text=from_ordinal(edge).strftime(label_format),
+                                    anchor='n', fill='#64748b', font=('Segoe UI', 8))
+
+    def draw_value_axis(self, maximum):
+        """縦軸（0 と最大値と中間）"""
+        left, top, _, bottom = self._plot_box()
+        for value in sorted({0, maximum // 2, maximum}):
+            y = bottom - (bottom - top) * value / maximum
+            self.axis_items.get('text', (left - 6, y), text=f"{value:,}", anchor='e',
+                                fill='#64748b', font=('Segoe UI', 8))
+
+    def draw_legend(self, labels_colors):
+        x = MARGIN_LEFT
+        for label, color in labels_colors:
+            self.axis_items.get('rectangle', (x, 8, x + 10, 18), fill=color,
+                                outline='#0f172a' if color == '#ffffff' else '')
+            self.axis_items.get('text', (x + 14, 13), text=label, anchor='w', fill='#374151', font=('Segoe UI', 8))
+            x += 24 + len(label) * 12
+
+    def draw_judgments(self, start, end):
+        """総合判定の内訳を集計単位ごとの積み上げ棒で表示"""
+        left, top, right, bottom = self._plot_box()
+        series = self.data['judgments']
+        judgments = [judgment for judgment in JUDGMENTS if judgment in series]
+        judgments += sorted(judgment for judgment in series if judgment not in JUDGMENTS)
+        edges, unit = bucket_edges(start, end, max(int((right - left) // MIN_BAR_PIXELS), 1))
+
+        buckets = []
+        for bucket_start, bucket_end in zip(edges, edges[1:]):
+            counts = [series[judgment].total(bucket_start, bucket_end) for judgment in judgments]
+            buckets.append((bucket_start, bucket_end, counts))
+        maximum = max([sum(counts) for _, _, counts in buckets] + [1])
+
+        scale = (bottom - top) / maximum
+        for bucket_start, bucket_end, counts in buckets:
+            x0 = max(self._x(bucket_start, start, end), left)
+            x1 = min(self._x(bucket_end, start, end), right) - 1
+            if x1 <= x0:
+                continue
+            y = bottom
+            for judgment, count in zip(judgments, counts):
+                if count:
+                    height = count * scale
+                    self.plot_items.get('rectangle', (x0, y - height, x1, y),
+                                        fill=JUDGMENT_COLORS.get(judgment, OTHER_COLOR), outline='')
+                    y -= height
+
+        self.draw_value_axis(maximum)
+        self.draw_legend([(f"{judgment}（{unit}別）" if i == 0 else judgment, JUDGMENT_COLORS.get(judgment, OTHER_COLOR))
+                          for i, judgment in enumerate(judgments)])
+
+    def draw_replacements(self, start, end):
+        """生産グループ別の電磁弁交換数（移動合計）を折れ線で表示"""
+        left, top, right, bottom = self._plot_box()
+        series = self.data['replacements']
+        groups = sorted(series, key=lambda group: (group is None, group))
+        lines = {group: lttb(rolling_points(series[group], start, end), int(right - left))
+                 for group in groups}
+        maximum = max([count for points in lines.values() for _, count in points] + [1])
+
+        scale = (bottom - top) / maximum
+        legend = []
+        for i, group in enumerate(groups):
+            color = GROUP_COLORS[i % len(GROUP_COLORS)]
+            coords = []
+            for day, count in lines[group]:
+                coords += (self._x(day + 0.5, start, end), bottom - count * scale)
+            if len(coords) >= 4:
+                self.plot_items.get('line', coords, fill=color, width=2)
+            legend.append((f"グループ{group}", color))
+
+        self.draw_value_axis(maximum)
+        self.draw_legend(legend)
+
+    def draw_timeline(self, start, end):
+        """機械ごとの行に、区間ごとの最も重い判定の色を表示（電磁弁交換は枠線付き）"""
+        left, top, right, bottom = self._plot_box()
+        machines = self.data['machines']
+        # 記録1件ごとのデータなのでタイムラインを表示するときだけ読む
+        events = self.result_cache.get('trend_events', ('maintenance_records',),
+                                       lambda: self._query(machine_events))
+        row_height = max(min((bottom - top) / max(len(machines), 1), 18), TIMELINE_MIN_ROW)
+        visible = int((bottom - top) // row_height)
+        self.row_offset = min(self.row_offset, max(len(machines) - visible, 0))
+
+        cells = max(int((right - left) // TIMELINE_CELL_PIXELS), 1)
+        cell_width = (right - left) / cells
+        for row, (db_id, machine_number) in enumerate(machines[self.row_offset:self.row_offset + visible]):
+            y = top + row * row_height
+            if row_height >= 10:
+                self.axis_items.get('text', (left - 6, y + row_height / 2), text=machine_number, anchor='e',
+                                    fill='#374151', font=('Segoe UI', 8))
+            for cell, (severity, replaced) in bin_events(events.get(db_id, []), start, end, cells).items():
+                x = left + cell * cell_width
+                self.plot_items.get('rectangle', (x, y + 1, x + max(cell_width - 1, 2), y + row_height - 1),
+                                    fill=SEVERITY_COLORS[severity], outline='#0f172a' if replaced else '')
+
+        self.draw_legend([(judgment, JUDGMENT_COLORS[judgment]) for judgment in JUDGMENTS]
+                         + [("枠線: 電磁弁交換", '#ffffff')])
+        if len(machines) > visible:
+            self.axis_items.get('text', (right, 13), anchor='e', fill='#64748b', font=('Segoe UI', 8),
+                                text=f"{self.row_offset + 1}〜{self.row_offset + visible} / {len(machines)}台"
+                                     "（Shift+ホイールでスクロール）")